@@ -13,6 +13,7 @@ packages = [
     "kofoto.commandline",
     "kofoto.gkofoto",
     "kofoto.output",
+    "kofoto.web",
     ]
 data_files = [
     ("share/gkofoto/glade", ["src/gkofoto/glade/gkofoto.glade"]),
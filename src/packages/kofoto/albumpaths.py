@@ -0,0 +1,206 @@
+"""Implementation of the AlbumPathIndex class."""
+
+__all__ = ["AlbumPathIndex", "DEFAULT_MAX_PATHS_PER_ALBUM"]
+
+from collections import deque
+
+# Maximum number of alternative paths remembered for an album.
+DEFAULT_MAX_PATHS_PER_ALBUM = 5
+
+class AlbumPathIndex:
+    """An index of paths from a root album to all albums reachable
+    from it.
+
+    The album graph is traversed breadth-first using
+    Album.getAlbumChildren, so images are never loaded and each
+    album's children are fetched only once. Paths are stored
+    compactly as parent pointers into a path table, which means that
+    paths sharing a prefix share storage. For each album, at most
+    maxPathsPerAlbum paths are kept, shorter paths ranked before
+    longer ones. Paths visiting an album twice (i.e. cycles in the
+    album graph) are never recorded.
+    """
+
+    def __init__(self, root, maxPathsPerAlbum=DEFAULT_MAX_PATHS_PER_ALBUM):
+        """Constructor.
+
+        Arguments:
+
+        root             -- The Album instance to start the traversal at.
+        maxPathsPerAlbum -- Maximum number of paths to keep per album.
+        """
+        assert maxPathsPerAlbum > 0
+        self.__maxPathsPerAlbum = maxPathsPerAlbum
+
+        # The path table. A path ID is an index into these lists.
+        self.__pathAlbum = []  # Path ID --> last album in the path.
+        self.__pathParent = [] # Path ID --> path ID of the prefix, or None.
+        self.__pathLength = [] # Path ID --> number of albums in the path.
+
+        self.__albumPaths = {}    # Album --> ranked list of path IDs.
+        self.__albumChildren = {} # Album --> list of album children.
+        self.__childPositions = {} # (Parent, child) --> position.
+        self.__albums = []        # Reachable albums in traversal order.
+
+        self.__build(root)
+
+
+    def __contains__(self, album):
+        return album in self.__albumPaths
+
+
+    def __len__(self):
+        return len(self.__albums)
+
+
+    def getAlbums(self):
+        """Get the albums reachable from the root album.
+
+        Returns a list of Album instances in breadth-first order.
+        """
+        return self.__albums
+
+
+    def getPaths(self, album):
+        """Get paths from the root album to an album.
+
+        Returns a list of paths, where a path is a list of Album
+        instances starting with the root album and ending with the
+        given album. Shorter paths come first. If the album isn't
+        reachable from the root, an empty list is returned.
+        """
+        return [self.__getPath(x) for x in self.__albumPaths.get(album, [])]
+
+
+    def getAlbumChildren(self, album):
+        """Get the album children of an album.
+
+        Returns a list of Album instances.
+        """
+        if album not in self.__albumChildren:
+            self.__fetchAlbumChildren(album)
+        return self.__albumChildren[album]
+
+
+    def getDescendants(self, album):
+        """Get an album and all albums reachable from it.
+
+        Returns an iterable returning Album instances.
+        """
+        visited = set([album])
+        queue = deque([album])
+        while queue:
+            x = queue.popleft()
+            yield x
+            for child in self.getAlbumChildren(x):
+                if child not in visited:
+                    visited.add(child)
+                    queue.append(child)
+
+
+    def getSiblings(self, parent, album):
+        """Get the previous and next album siblings of an album.
+
+        Returns a tuple (previous, next) of Album instances, where
+        previous and/or next are None if there is no such sibling.
+        """
+        children = self.getAlbumChildren(parent)
+        position = self.__childPositions[(parent, album)]
+        if position > 0:
+            prevsibling = children[position - 1]
+        else:
+            prevsibling = None
+        if position < len(children) - 1:
+            nextsibling = children[position + 1]
+        else:
+            nextsibling = None
+        return prevsibling, nextsibling
+
+
+    ##############################
+    # Internal methods.
+
+    def __build(self, root):
+        """Traverse the album graph and build the index."""
+        self.__albumPaths[root] = [self.__newPath(root, None)]
+        self.__albums.append(root)
+        propagated = set()
+        queue = deque([root])
+        queued = set([root])
+        while queue:
+            album = queue.popleft()
+            queued.discard(album)
+            children = self.getAlbumChildren(album)
+            for pathid in self.__albumPaths[album]:
+                if pathid in propagated:
+                    continue
+                propagated.add(pathid)
+                for child in children:
+                    if self.__pathContains(pathid, child):
+                        continue
+                    if self.__addPath(child, pathid) and child not in queued:
+                        queue.append(child)
+                        queued.add(child)
+
+
+    def __fetchAlbumChildren(self, album):
+        """Fetch and remember the album children of an album."""
+        # Remember the first position of each child, like list.index.
+        children = list(album.getAlbumChildren())
+        for position in range(len(children) - 1, -1, -1):
+            self.__childPositions[(album, children[position])] = position
+        self.__albumChildren[album] = children
+
+
+    def __newPath(self, album, parentpathid):
+        """Create a new path in the path table and return its ID."""
+        if parentpathid is None:
+            length = 1
+        else:
+            length = self.__pathLength[parentpathid] + 1
+        self.__pathAlbum.append(album)
+        self.__pathParent.append(parentpathid)
+        self.__pathLength.append(length)
+        return len(self.__pathAlbum) - 1
+
+
+    def __addPath(self, album, parentpathid):
+        """Add a path to an album, extending a given parent path.
+
+        Returns True if the path was kept, otherwise False.
+        """
+        length = self.__pathLength[parentpathid] + 1
+        if album in self.__albumPaths:
+            paths = self.__albumPaths[album]
+        else:
+            paths = self.__albumPaths[album] = []
+            self.__albums.append(album)
+        if (len(paths) >= self.__maxPathsPerAlbum and
+            length >= self.__pathLength[paths[-1]]):
+            return False
+        pathid = self.__newPath(album, parentpathid)
+        position = len(paths)
+        while position > 0 and self.__pathLength[paths[position - 1]] > length:
+            position -= 1
+        paths.insert(position, pathid)
+        del paths[self.__maxPathsPerAlbum:]
+        return True
+
+
+    def __pathContains(self, pathid, album):
+        """Check whether a path visits an album."""
+        while pathid is not None:
+            if self.__pathAlbum[pathid] == album:
+                return True
+            pathid = self.__pathParent[pathid]
+        return False
+
+
+    def __getPath(self, pathid):
+        """Get a path as a list of Album instances."""
+        path = []
+        while pathid is not None:
+            path.append(self.__pathAlbum[pathid])
+            pathid = self.__pathParent[pathid]
+        path.reverse()
+        return path
@@ -0,0 +1,266 @@
+"""Implementation of the AssetPublisher class."""
+
+__all__ = [
+    "AssetPublisher",
+    "DEFAULT_PUBLISH_MODE",
+    "DEFAULT_PUBLISH_THREADS",
+    "PUBLISH_MODES",
+    "PublishModeError",
+    ]
+
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import threading
+from Queue import Queue
+from kofoto.common import KofotoError, symlink_or_copy_file
+
+# Ways of publishing a file in the generated directory:
+#
+# symlink  -- Create a symbolic link to the source (copy if unsupported).
+# hardlink -- Create a hard link to the source (copy if unsupported).
+# reflink  -- Clone the source with copy-on-write (copy if unsupported).
+# copy     -- Copy the source.
+PUBLISH_MODES = ["symlink", "hardlink", "reflink", "copy"]
+DEFAULT_PUBLISH_MODE = "symlink"
+
+# Number of threads doing the file system work.
+DEFAULT_PUBLISH_THREADS = 4
+
+# The FICLONE ioctl request (Linux), used for reflinks.
+_FICLONE = 0x40049409
+
+class PublishModeError(KofotoError):
+    """No such publish mode."""
+    pass
+
+
+class AssetPublisher:
+    """Publish files (typically images) in a generated directory.
+
+    Files are published asynchronously by a pool of worker threads;
+    call finish to wait for all pending work. A destination that
+    already is identical to its source is left untouched. In the
+    copying modes (copy and reflink), files with identical contents
+    are only stored once: later duplicates are hard linked to the
+    first copy.
+    """
+
+    def __init__(self, mode=DEFAULT_PUBLISH_MODE,
+                 nthreads=DEFAULT_PUBLISH_THREADS):
+        """Constructor.
+
+        Arguments:
+
+        mode     -- One of the modes in PUBLISH_MODES.
+        nthreads -- Number of worker threads. If 0, files are
+                    published synchronously.
+        """
+        if mode not in PUBLISH_MODES:
+            raise PublishModeError(mode)
+        self.__mode = mode
+        self.__copying = mode in ["copy", "reflink"]
+        self.__lock = threading.Lock()
+        self.__published = {} # (Size, content hash) --> destination.
+        self.__duplicates = [] # List of (first destination, destination).
+        self.__excInfo = None
+        self.__nskipped = 0
+        self.__queue = Queue()
+        self.__threads = []
+        for unused in range(nthreads):
+            thread = threading.Thread(target=self.__worker)
+            thread.setDaemon(True)
+            thread.start()
+            self.__threads.append(thread)
+
+
+    def getMode(self):
+        """Get the publish mode."""
+        return self.__mode
+
+
+    def getNumberOfSkippedFiles(self):
+        """Get the number of files that already were up to date."""
+        return self.__nskipped
+
+
+    def publish(self, source, destination):
+        """Publish a file.
+
+        The parent directory of the destination must exist.
+
+        Arguments:
+
+        source      -- Location of the file to publish.
+        destination -- Location in the generated directory.
+        """
+        if self.__threads:
+            self.__queue.put((source, destination))
+        else:
+            self.__publish(source, destination)
+
+
+    def finish(self):
+        """Wait for all published files to be written.
+
+        If publishing of a file failed, the first error is raised
+        here.
+        """
+        self.__queue.join()
+        for unused in self.__threads:
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        if self.__excInfo:
+            excInfo = self.__excInfo
+            self.__excInfo = None
+            raise excInfo[0], excInfo[1], excInfo[2]
+        for first, destination in self.__duplicates:
+            _unlink(destination)
+            _linkOrCopy(first, destination)
+        self.__duplicates = []
+
+
+    ##############################
+    # Internal methods.
+
+    def __worker(self):
+        """Worker thread main loop."""
+        while True:
+            item = self.__queue.get()
+            try:
+                if item is None:
+                    return
+                try:
+                    self.__publish(*item)
+                except Exception:
+                    # Record any failure, so that the thread survives
+                    # and finish can raise it.
+                    self.__lock.acquire()
+                    try:
+                        if not self.__excInfo:
+                            self.__excInfo = sys.exc_info()
+                    finally:
+                        self.__lock.release()
+            finally:
+                self.__queue.task_done()
+
+
+    def __publish(self, source, destination):
+        """Publish a file synchronously."""
+        if self.__isUpToDate(source, destination):
+            self.__lock.acquire()
+            try:
+                self.__nskipped += 1
+            finally:
+                self.__lock.release()
+            return
+        if self.__mode == "symlink":
+            symlink_or_copy_file(source, destination)
+            return
+        if self.__copying:
+            key = (os.path.getsize(source), _computeHash(source))
+            self.__lock.acquire()
+            try:
+                if key in self.__published:
+                    self.__duplicates.append(
+                        (self.__published[key], destination))
+                    return
+                self.__published[key] = destination
+            finally:
+                self.__lock.release()
+        _unlink(destination)
+        if self.__mode == "hardlink":
+            _linkOrCopy(source, destination)
+        elif self.__mode == "reflink":
+            _reflinkOrCopy(source, destination)
+        else:
+            shutil.copy2(source, destination)
+
+
+    def __isUpToDate(self, source, destination):
+        """Check whether a destination already is identical to a source."""
+        if self.__mode == "symlink":
+            try:
+                return os.readlink(destination) == source
+            except (AttributeError, OSError):
+                return False
+        try:
+            deststat = os.lstat(destination)
+        except OSError:
+            return False
+        sourcestat = os.stat(source)
+        # Hard links share the source's status and copies preserve
+        # it, so this works for all other modes.
+        return (deststat.st_size == sourcestat.st_size and
+                int(deststat.st_mtime) == int(sourcestat.st_mtime))
+
+
+######################################################################
+
+def _computeHash(filename):
+    """Internal helper function."""
+    m = hashlib.md5()
+    f = open(filename, "rb")
+    try:
+        while True:
+            data = f.read(2**16)
+            if not data:
+                break
+            m.update(data)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+
+def _unlink(filename):
+    """Internal helper function."""
+    try:
+        os.unlink(filename)
+    except OSError:
+        pass
+
+
+def _linkOrCopy(source, destination):
+    """Internal helper function."""
+    try:
+        os.link(source, destination)
+    except AttributeError:
+        # The platform doesn't support hard links.
+        shutil.copy2(source, destination)
+    except OSError, e:
+        if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+            raise
+        shutil.copy2(source, destination)
+
+
+def _reflinkOrCopy(source, destination):
+    """Internal helper function."""
+    try:
+        import fcntl
+    except ImportError:
+        # Not a Unix platform.
+        shutil.copy2(source, destination)
+        return
+    src = open(source, "rb")
+    try:
+        dst = open(destination, "wb")
+        try:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+                cloned = True
+            except IOError:
+                # Unsupported by the platform or file system, or the
+                # files are on different file systems.
+                cloned = False
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    if cloned:
+        shutil.copystat(source, destination)
+    else:
+        shutil.copy2(source, destination)
@@ -0,0 +1,134 @@
+"""Implementation of the CategoryIndex class."""
+
+__all__ = ["CategoryIndex"]
+
+import re
+
+class CategoryIndex:
+    """An index for finding categories by text.
+
+    The index maps trigrams (substrings of length three) of lowercased
+    category tags and descriptions to category IDs, so that the
+    categories containing a text can be found without looking at all
+    categories. The result of the last search is remembered, so that a
+    search for a text that contains the previous text (typically when
+    the user types another character) only has to look at the previous
+    matches.
+    """
+
+    def __init__(self, categories=None):
+        """Constructor.
+
+        Arguments:
+
+        categories -- An iterable of (category ID, tag, description)
+                      tuples to add to the index.
+        """
+        self.categories = {} # catid --> (tag, description)
+        self.lowered = {} # catid --> (lowered tag, lowered description)
+        self.trigrams = {} # trigram --> set of catids
+        self.lastText = None
+        self.lastMatches = None
+        if categories:
+            for catid, tag, description in categories:
+                self.add(catid, tag, description)
+
+    def __contains__(self, catid):
+        return catid in self.categories
+
+    def __len__(self):
+        return len(self.categories)
+
+    def add(self, catid, tag, description):
+        """Add a category to the index.
+
+        If the category already is in the index, it is replaced."""
+        if catid in self.categories:
+            self.remove(catid)
+        self.categories[catid] = (tag, description)
+        lowered = (tag.lower(), description.lower())
+        self.lowered[catid] = lowered
+        for trigram in _trigrams(lowered):
+            self.trigrams.setdefault(trigram, set()).add(catid)
+        self.lastText = None
+
+    def get(self, catid):
+        """Get the tag and description of a category as a tuple."""
+        return self.categories[catid]
+
+    def remove(self, catid):
+        """Remove a category from the index."""
+        for trigram in _trigrams(self.lowered[catid]):
+            catids = self.trigrams[trigram]
+            catids.discard(catid)
+            if not catids:
+                del self.trigrams[trigram]
+        del self.categories[catid]
+        del self.lowered[catid]
+        self.lastText = None
+
+    def search(self, text):
+        """Find categories whose tag or description case
+        insensitively contains a text.
+
+        Returns a list of category IDs, best matches first: exact
+        matches, then prefix matches, then matches at the start of a
+        word, then other matches. Matches of equal rank are ordered by
+        description and tag.
+        """
+        text = text.lower()
+        if self.lastText is not None and self.lastText in text:
+            candidates = self.lastMatches
+        else:
+            candidates = self._getCandidates(text)
+        lowered = self.lowered
+        matches = [x for x in candidates
+                   if text in lowered[x][0] or text in lowered[x][1]]
+        self.lastText = text
+        self.lastMatches = matches
+        wordStart = re.compile(r"\b%s" % re.escape(text), re.UNICODE)
+        def rank(catid):
+            tag, description = lowered[catid]
+            if text == tag or text == description:
+                quality = 0
+            elif tag.startswith(text) or description.startswith(text):
+                quality = 1
+            elif wordStart.search(description) or wordStart.search(tag):
+                quality = 2
+            else:
+                quality = 3
+            tag, description = self.categories[catid]
+            return (quality, description, tag, catid)
+        return sorted(matches, key=rank)
+
+    def update(self, catid, tag, description):
+        """Update the tag and description of a category."""
+        self.add(catid, tag, description)
+
+    ##############################
+    # Internal methods.
+
+    def _getCandidates(self, text):
+        if len(text) < 3:
+            return self.categories.keys()
+        catidSets = []
+        for trigram in _trigrams((text,)):
+            catids = self.trigrams.get(trigram)
+            if not catids:
+                return []
+            catidSets.append(catids)
+        catidSets.sort(key=len)
+        candidates = set(catidSets[0])
+        for catids in catidSets[1:]:
+            candidates &= catids
+            if not candidates:
+                break
+        return candidates
+
+
+def _trigrams(strings):
+    result = set()
+    for s in strings:
+        for i in range(len(s) - 2):
+            result.add(s[i:i + 3])
+    return result
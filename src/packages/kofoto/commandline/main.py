@@ -19,11 +19,15 @@ from kofoto.clientutils import \
     group_image_versions, \
     walk_files
 from kofoto.albumtype import AlbumType
+from kofoto.assetpublisher import DEFAULT_PUBLISH_MODE, PUBLISH_MODES
+from kofoto.commandline.server import \
+    CommandServer, ServerNotRunningError, getSocketLocation, sendCommand
 from kofoto.config import DEFAULT_CONFIGFILE_LOCATION
 from kofoto.imageversiontype import ImageVersionType
 from kofoto.search import \
     BadTokenError, ParseError, Parser, UnterminatedStringError
 from kofoto.shelf import \
+    DEFAULT_EXIF_IMPORT_THREADS, \
     computeImageHash, \
     makeValidTag
 from kofoto.shelfexceptions import \
@@ -56,6 +60,12 @@ from kofoto.shelfexceptions import \
 
 PRINT_ALBUMS_INDENT = 4
 
+# Number of commands to execute between commits in the batch command.
+DEFAULT_COMMIT_INTERVAL = 1000
+
+# Number of search results to print at a time.
+SEARCH_OUTPUT_CHUNK_SIZE = 1000
+
 ######################################################################
 ### Exceptions.
 
@@ -67,9 +77,14 @@ class ArgumentError(Exception):
 ### Help text data.
 
 optionDefinitionList = [
+    ("    --commit-interval N",
+     "Commit changes to the database every N commands when executing a batch"
+     " of commands. Default: %d." % DEFAULT_COMMIT_INTERVAL),
     ("    --configfile FILE",
      "Use configuration file FILE instead of the default (%s)." % (
          DEFAULT_CONFIGFILE_LOCATION)),
+    ("    --count",
+     "Print the number of search results instead of the results."),
     ("    --database FILE",
      "Use the metadata database FILE instead of the default (specified in the"
      " configuration file)."),
@@ -98,18 +113,39 @@ optionDefinitionList = [
     ("    --include-primary",
      "Include all primary image versions for images matching a search"
      " expression."),
+    ("    --limit N",
+     "Print at most N search results."),
     ("    --no-act",
      "Do everything which is supposed to be done, but don't commit any changes"
      " to the database."),
     ("-0, --null",
      "Use null characters instead of newlines when printing image version"
-     " locations. This is mainly useful in combination with \"xargs"
-     " --null\"."),
+     " locations and when reading a batch of commands. This is mainly useful"
+     " in combination with \"xargs --null\"."),
+    ("    --only-missing",
+     "Skip images that already have attributes read from EXIF information"
+     " when rereading EXIF information."),
     ("    --position POSITION",
      "Add/register to position POSITION. Default: last."),
+    ("    --repair",
+     "Repair the problems found when checking the integrity of the metadata"
+     " database."),
+    ("    --publish-mode PUBLISHMODE",
+     "Use PUBLISHMODE to put images in the output directory when generating"
+     " output. Default: %s." % DEFAULT_PUBLISH_MODE),
+    ("    --search-index",
+     "Also write a search index of the images and a search page (in the"
+     " @search subdirectory) when generating output."),
+    ("    --threads THREADS",
+     "Use THREADS threads to read image files when rereading EXIF"
+     " information and to check the metadata database when checking"
+     " integrity. Default: %d." % DEFAULT_EXIF_IMPORT_THREADS),
     ("-t, --type TYPE",
      "Use album type TYPE when creating an album or output type TYPE when"
      " generating output."),
+    ("    --unsorted",
+     "Print search results in the order they are found instead of sorted by"
+     " location (or ID). This is faster for large results."),
     ("-v, --verbose",
       "Be verbose (and slower)."),
     ("    --version",
@@ -137,7 +173,8 @@ albumAndImageCommandsDefinitionList = [
      " versions can be printed by supplying one or several of the options"
      " --include-all, --include-important, --include-original and"
      " --include-other. (If no --include-* option is supplied,"
-     " --include-primary is assumed.)"),
+     " --include-primary is assumed.) The number of results can be limited"
+     " with --limit, and --count prints the number of results instead."),
     ("set-attribute ATTRIBUTE VALUE OBJECT [OBJECT ...]",
      "Set ATTRIBUTE to VALUE for the given objects."),
     ]
@@ -197,8 +234,11 @@ imageversionCommandsDefinitionList = [
      " non-image."),
     ("make-primary IMAGEVERSION [IMAGEVERSION ...]",
      "Make an image version the primary version."),
-    ("reread-exif IMAGEVERSION [IMAGEVERSION ...]",
-     "Reread EXIF information for the given image versions."),
+    ("reread-exif [IMAGEVERSION ...]",
+     "Reread EXIF information for the given image versions (default: all"
+     " image versions). Files whose EXIF information can't be read are"
+     " reported and skipped. If --only-missing is given, images that already"
+     " have attributes read from EXIF information are skipped."),
     ("set-imageversion-comment VALUE IMAGEVERSION [IMAGEVERSION ...]",
      "Set comment of the given image versions."),
     ("set-imageversion-image IMAGE IMAGEVERSION [IMAGEVERSION ...]",
@@ -231,10 +271,30 @@ categoryCommandsDefinitionList = [
     ]
 
 miscellaneousCommandsDefinitionList = [
+    ("batch [FILE]",
+     "Execute commands read from FILE (default: standard input), one per line"
+     " and with parameters quoted like in a shell, in a single process."
+     " Empty lines and lines starting with # are ignored. Changes are"
+     " committed every N commands (see --commit-interval). Execution stops at"
+     " the first failing command. If -v/--verbose is given, the execution"
+     " time of each command is printed."),
+    ("check-integrity",
+     "Check the integrity of the metadata database and print the problems"
+     " found, for instance references to nonexistent objects, gaps in album"
+     " member positions and loops in the categories. The checks are run in"
+     " parallel (see --threads). If --repair is given, the problems are also"
+     " repaired."),
     ("clean-cache",
      "Clean up the image cache (remove left-over generated images)."),
     ("print-statistics",
      "Print some statistics about the database."),
+    ("serve",
+     "Run a command server that keeps the metadata database open until"
+     " interrupted. While the server is running, kofoto sends commands for"
+     " the same metadata database to the server instead of opening the"
+     " database itself, which makes each command start much faster. The"
+     " database is only locked while the server runs a command, so other"
+     " programs can use it in between."),
     ]
 
 parameterSemanticsDefinitionList = [
@@ -272,6 +332,13 @@ parameterSemanticsDefinitionList = [
     ("POSITION",
      "An integer specifying an index into an album's children. 0 is the first"
      " position, 1 is the second, and so on."),
+    ("PUBLISHMODE",
+     "\"symlink\" (symbolic links to the image cache), \"hardlink\" (hard"
+     " links to the image cache), \"reflink\" (copy-on-write clones of the"
+     " image cache files) or \"copy\" (copies of the image cache files)."
+     " Modes other than symlink fall back to copying when unsupported by the"
+     " file system. In the copying modes, identical images are only stored"
+     " once and files that are already up to date are not copied again."),
     ("SEARCHEXPRESSION",
      "A search expression."
      " See http://kofoto.rosdahl.net/trac/wiki/SearchExpressions for more"
@@ -495,17 +562,31 @@ class CommandlineClientEnvironment(ClientEnvironment):
 
     def __init__(self):
         ClientEnvironment.__init__(self)
-        # Defaults:
+        self.resetOptions()
+
+
+    def resetOptions(self):
+        """Set the attributes controlled by options to their defaults."""
+        self.commitInterval = DEFAULT_COMMIT_INTERVAL
+        self.count = False
+        self.gencharenc = "utf-8"
         self.identifyByPath = False
         self.includeAll = False
         self.includeImportant = False
         self.includeOriginal = False
         self.includeOther = False
         self.includePrimary = False
+        self.limit = None
         self.noAct = False
         self.useNullCharacters = False
+        self.onlyMissing = False
         self.position = -1
         self.printIDs = False
+        self.publishmode = DEFAULT_PUBLISH_MODE
+        self.repair = False
+        self.searchindex = False
+        self.sorted = True
+        self.threads = DEFAULT_EXIF_IMPORT_THREADS
         self.type = None
         self.verbose = False
 
@@ -545,6 +626,93 @@ def cmdAddCategory(env, args):
         sloppyGetObject(env, arg).addCategory(category)
 
 
+def cmdBatch(env, args):
+    """Handler for the batch command."""
+    if len(args) > 1:
+        raise ArgumentError
+    if args:
+        encoding = env.localeEncoding
+        fp = codecs.open(args[0], "r", encoding)
+    else:
+        # Standard input has already been wrapped in a decoding reader
+        # by main (or is the command server's reader), so lines are
+        # Unicode strings in both cases.
+        encoding = get_file_encoding(sys.__stdin__)
+        fp = sys.stdin
+    try:
+        try:
+            if env.useNullCharacters:
+                lines = fp.read().split(u"\0")
+            else:
+                lines = fp
+            batchHelper(env, lines)
+        except UnicodeDecodeError:
+            env.errexit("Could not decode the commands as %s.\n" % encoding)
+    finally:
+        if args:
+            fp.close()
+
+
+def batchHelper(env, lines):
+    """Helper function for cmdBatch."""
+    import shlex
+    batchStart = time.time()
+    nexecuted = 0
+    nuncommitted = 0
+    for linenumber, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith(u"#"):
+            continue
+        try:
+            args = [x.decode("utf-8")
+                    for x in shlex.split(line.encode("utf-8"))]
+        except ValueError, e:
+            env.errexit("Line %d: %s.\n" % (linenumber + 1, e))
+        if args[0] not in commandTable or args[0] in ["batch", "serve"]:
+            env.errexit("Line %d: Unknown command \"%s\".\n" % (
+                linenumber + 1, args[0]))
+        start = time.time()
+        try:
+            status = executeCommand(env, args)
+        except SystemExit, e:
+            status = e.code
+        if status != 0:
+            env.errexit("Line %d: Command failed: %s\n" % (
+                linenumber + 1, line))
+        nexecuted += 1
+        if env.verbose:
+            env.out("Line %d (%s): %.1f ms\n" % (
+                linenumber + 1, args[0], 1000 * (time.time() - start)))
+        nuncommitted += 1
+        if nuncommitted >= env.commitInterval and not env.noAct:
+            env.shelf.checkpoint()
+            nuncommitted = 0
+    if env.verbose:
+        elapsed = time.time() - batchStart
+        env.out("Executed %d commands in %.2f seconds.\n" % (
+            nexecuted, elapsed))
+
+
+def cmdCheckIntegrity(env, args):
+    """Handler for the check-integrity command."""
+    if len(args) != 0:
+        raise ArgumentError
+    if env.repair:
+        result = env.shelf.repairIntegrity()
+    else:
+        result = env.shelf.checkIntegrity(env.threads)
+    nviolations = 0
+    for check, violations in result:
+        for violation in violations:
+            env.out("%s\n" % check.formatViolation(violation))
+        nviolations += len(violations)
+    if env.repair:
+        env.out("Repaired %d problems.\n" % nviolations)
+    elif nviolations > 0:
+        env.errexit(
+            "Found %d problems. Use --repair to repair them.\n" % nviolations)
+
+
 def cmdCleanCache(env, args):
     """Handler for the clean-cache command."""
     if env.noAct:
@@ -740,6 +908,7 @@ def cmdInspectPath(env, args):
     if len(args) < 1:
         raise ArgumentError
     import Image as PILImage
+    import kofoto.exifthumbsupport
     for filepath in walk_files(args):
         try:
             imageversion = env.shelf.getImageVersionByHash(
@@ -991,10 +1160,40 @@ def cmdRenameCategory(env, args):
 
 def cmdRereadExif(env, args):
     """Handler for the reread-exif command."""
-    if len(args) == 0:
+    if args:
+        imageversions = [sloppyGetImageVersion(env, x) for x in args]
+    else:
+        imageversions = None
+    failed = env.shelf.importExifTags(
+        imageversions, True, env.onlyMissing, env.threads)
+    for location in failed:
+        env.err("Failed to import EXIF information from \"%s\".\n" % (
+            location))
+
+
+def cmdServe(env, args):
+    """Handler for the serve command."""
+    if len(args) != 0:
         raise ArgumentError
-    for iv in args:
-        sloppyGetImageVersion(env, iv).importExifTags(True)
+    import signal
+    location = getSocketLocation(env.shelfLocation)
+    server = CommandServer(
+        location, lambda *handlerArgs: serveCommand(env, *handlerArgs))
+    # Stop cleanly on SIGTERM too.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    printOutput("Serving commands on \"%s\".\n" % location)
+    # Let other processes use the shelf between commands.
+    env.shelf.suspend()
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+    try:
+        env.shelf.resume()
+    except ShelfLockedError:
+        # Every command has already been committed, so there is
+        # nothing left for the caller to commit.
+        sys.exit(0)
 
 
 def cmdSearch(env, args):
@@ -1002,34 +1201,43 @@ def cmdSearch(env, args):
     if len(args) != 1:
         raise ArgumentError
     parser = Parser(env.shelf)
-    objects = env.shelf.search(parser.parse(args[0]))
-    objects = [x for x in objects if not x.isAlbum()]
-    ivs = []
-    for o in objects:
-        for iv in o.getImageVersions():
-            ivs.append(iv)
+    searchtree = parser.parse(args[0])
     if env.printIDs:
-        ids = set()
-        for iv in ivs:
-            ids.add(iv.getImage().getId())
-        output = [str(x) for x in ids]
+        if env.count:
+            env.out("%d\n" % env.shelf.countImageIds(searchtree, env.limit))
+            return
+        output = env.shelf.searchImageIds(searchtree, env.sorted, env.limit)
     else:
-        output = []
-        for iv in ivs:
-            t = iv.getType()
-            if (env.includeAll or
-                (env.includeImportant and t == ImageVersionType.Important) or
-                (env.includeOriginal and t == ImageVersionType.Original) or
-                (env.includeOther and t == ImageVersionType.Other) or
-                (env.includePrimary and iv.isPrimary())):
-                output.append(iv.getLocation())
-        output.sort()
-    if output:
-        if env.useNullCharacters:
-            terminator = u"\0"
+        if env.includeAll:
+            ivtypes = None
         else:
-            terminator = u"\n"
-        env.out(u"%s%s" % (terminator.join(output), terminator))
+            ivtypes = []
+            if env.includeImportant:
+                ivtypes.append(ImageVersionType.Important)
+            if env.includeOriginal:
+                ivtypes.append(ImageVersionType.Original)
+            if env.includeOther:
+                ivtypes.append(ImageVersionType.Other)
+        if env.count:
+            env.out("%d\n" % env.shelf.countImageVersionLocations(
+                searchtree, ivtypes, env.includePrimary, env.limit))
+            return
+        output = env.shelf.searchImageVersionLocations(
+            searchtree, ivtypes, env.includePrimary, env.sorted, env.limit)
+    if env.useNullCharacters:
+        terminator = u"\0"
+    else:
+        terminator = u"\n"
+    # Print the results in chunks to avoid flushing (or, in a command
+    # server, sending a message) for every line.
+    lines = []
+    for x in output:
+        lines.append(u"%s%s" % (x, terminator))
+        if len(lines) == SEARCH_OUTPUT_CHUNK_SIZE:
+            env.out(u"".join(lines))
+            lines = []
+    if lines:
+        env.out(u"".join(lines))
 
 
 def cmdSetAttribute(env, args):
@@ -1144,6 +1352,8 @@ def cmdUpdateLocations(env, args):
 commandTable = {
     "add": cmdAdd,
     "add-category": cmdAddCategory,
+    "batch": cmdBatch,
+    "check-integrity": cmdCheckIntegrity,
     "clean-cache": cmdCleanCache,
     "connect-category": cmdConnectCategory,
     "create-album": cmdCreateAlbum,
@@ -1173,6 +1383,7 @@ commandTable = {
     "rename-category": cmdRenameCategory,
     "reread-exif": cmdRereadExif,
     "search": cmdSearch,
+    "serve": cmdServe,
     "set-attribute": cmdSetAttribute,
     "set-category-description": cmdSetCategoryDescription,
     "set-imageversion-comment": cmdSetImageVersionComment,
@@ -1201,11 +1412,77 @@ def main(argv):
     sys.stdout = codecs.getwriter(get_file_encoding(sys.stdout))(sys.stdout)
     sys.stderr = codecs.getwriter(get_file_encoding(sys.stderr))(sys.stderr)
 
+    configFileLocation, shelfLocation, args = parseOptions(env, argv[1:])
+
+    if len(args) == 0:
+        printErrorAndExit(
+            "No command given. See \"kofoto --help\" for help.\n")
+
+    try:
+        env.setup(configFileLocation, shelfLocation)
+    except ClientEnvironmentError, e:
+        printErrorAndExit(e[0])
+
+    if not args[0] in commandTable:
+        printErrorAndExit(
+            "Unknown command \"%s\". See \"kofoto --help\" for help.\n" % (
+            args[0]))
+
+    if args[0] != "serve":
+        try:
+            sys.exit(sendCommand(
+                getSocketLocation(env.shelfLocation), os.getcwdu(), argv[1:],
+                sys.stdin, sys.stdout, sys.stderr))
+        except ServerNotRunningError:
+            pass
+
+    try:
+        if env.shelf.isUpgradable():
+            printNotice(
+                "Upgrading %s to new database format...\n" % env.shelfLocation)
+            if not env.shelf.tryUpgrade():
+                printErrorAndExit(
+                    "Failed to upgrade metadata database format.\n")
+        env.shelf.begin()
+    except ShelfNotFoundError, x:
+        printErrorAndExit("Could not open metadata database \"%s\".\n" % (
+            env.shelfLocation))
+    except ShelfLockedError, x:
+        printErrorAndExit(
+            "Could not open metadata database \"%s\".\n" % env.shelfLocation +
+            "Another process is locking it.\n")
+    except UnsupportedShelfError, filename:
+        printErrorAndExit(
+            "Could not read metadata database file %s (too new database"
+            " format?).\n" % filename)
+
+    status = runCommand(env, args)
+    if status == 0 and not env.noAct:
+        env.shelf.commit()
+    else:
+        env.shelf.rollback()
+    sys.exit(status)
+
+
+def parseOptions(env, argv):
+    """Parse commandline options.
+
+    Arguments:
+
+    env  -- A CommandlineClientEnvironment instance, whose attributes
+            are set according to the options.
+    argv -- A list of arguments, not including the program name.
+
+    Returns a tuple of the configuration file location, the shelf
+    location (None for defaults) and the remaining arguments.
+    """
     try:
         optlist, args = getopt.gnu_getopt(
-            argv[1:],
+            argv,
             "0ht:v",
-            ["configfile=",
+            ["commit-interval=",
+             "configfile=",
+             "count",
              "database=",
              "gencharenc=",
              "help",
@@ -1217,27 +1494,42 @@ def main(argv):
              "include-original",
              "include-other",
              "include-primary",
+             "limit=",
              "no-act",
              "null",
+             "only-missing",
              "position=",
+             "publish-mode=",
+             "repair",
+             "search-index",
+             "threads=",
              "type=",
+             "unsorted",
              "verbose",
              "version"])
     except getopt.GetoptError:
         printErrorAndExit("Unknown option. See \"kofoto --help\" for help.\n")
 
-    # Other defaults:
     shelfLocation = None
     configFileLocation = None
-    genCharEnc = "utf-8"
 
     for opt, optarg in optlist:
-        if opt == "--configfile":
+        if opt == "--commit-interval":
+            try:
+                env.commitInterval = int(optarg)
+                if env.commitInterval < 1:
+                    raise ValueError
+            except ValueError:
+                printErrorAndExit("Invalid commit interval: \"%s\"\n" % (
+                    optarg))
+        elif opt == "--configfile":
             configFileLocation = expanduser(optarg)
+        elif opt == "--count":
+            env.count = True
         elif opt == "--database":
             shelfLocation = optarg
         elif opt == "--gencharenc":
-            genCharEnc = str(optarg)
+            env.gencharenc = str(optarg)
         elif opt in ("-h", "--help"):
             displayHelp()
             sys.exit(0)
@@ -1257,12 +1549,19 @@ def main(argv):
             env.includeOther = True
         elif opt == "--include-primary":
             env.includePrimary = True
+        elif opt == "--limit":
+            try:
+                env.limit = int(optarg)
+                if env.limit < 0:
+                    raise ValueError
+            except ValueError:
+                printErrorAndExit("Invalid limit: \"%s\"\n" % optarg)
         elif opt == "--no-act":
-            printNotice(
-                "no-act: No changes will be commited to the database!\n")
             env.noAct = True
         elif opt in ("-0", "--null"):
             env.useNullCharacters = True
+        elif opt == "--only-missing":
+            env.onlyMissing = True
         elif opt == "--position":
             if optarg == "last":
                 env.position = -1
@@ -1271,8 +1570,26 @@ def main(argv):
                     env.position = int(optarg)
                 except ValueError:
                     printErrorAndExit("Invalid position: \"%s\"\n" % optarg)
+        elif opt == "--publish-mode":
+            if optarg not in PUBLISH_MODES:
+                printErrorAndExit("Invalid publish mode: \"%s\"\n" % optarg)
+            env.publishmode = str(optarg)
+        elif opt == "--repair":
+            env.repair = True
+        elif opt == "--search-index":
+            env.searchindex = True
+        elif opt == "--threads":
+            try:
+                env.threads = int(optarg)
+                if env.threads < 0:
+                    raise ValueError
+            except ValueError:
+                printErrorAndExit("Invalid number of threads: \"%s\"\n" % (
+                    optarg))
         elif opt in ("-t", "--type"):
             env.type = optarg
+        elif opt == "--unsorted":
+            env.sorted = False
         elif opt in ("-v", "--verbose"):
             env.verbose = True
         elif opt == "--version":
@@ -1283,41 +1600,41 @@ def main(argv):
             or env.includeOther or env.includePrimary):
         env.includePrimary = True
 
-    if len(args) == 0:
-        printErrorAndExit(
-            "No command given. See \"kofoto --help\" for help.\n")
+    return configFileLocation, shelfLocation, args
 
-    try:
-        env.setup(configFileLocation, shelfLocation)
-    except ClientEnvironmentError, e:
-        printErrorAndExit(e[0])
 
-    if not args[0] in commandTable:
-        printErrorAndExit(
-            "Unknown command \"%s\". See \"kofoto --help\" for help.\n" % (
-            args[0]))
+def runCommand(env, args):
+    """Run a command in the current shelf transaction.
 
+    The caller should commit the transaction if the command succeeded
+    and env.noAct is false, and otherwise roll it back.
+
+    Arguments:
+
+    env  -- A set up CommandlineClientEnvironment instance.
+    args -- The command name and its parameters.
+
+    Returns the exit status.
+    """
+    if env.noAct:
+        printNotice("no-act: No changes will be commited to the database!\n")
+    status = executeCommand(env, args)
+    if status == 0 and env.noAct:
+        printOutput("no-act: All changes to the database have been revoked!\n")
+    return status
+
+
+def executeCommand(env, args):
+    """Execute a command and print an error message if it fails.
+
+    Arguments:
+
+    env  -- A set up CommandlineClientEnvironment instance.
+    args -- The command name and its parameters.
+
+    Returns the exit status.
+    """
     try:
-        if env.shelf.isUpgradable():
-            printNotice(
-                "Upgrading %s to new database format...\n" % env.shelfLocation)
-            if not env.shelf.tryUpgrade():
-                printErrorAndExit(
-                    "Failed to upgrade metadata database format.\n")
-        env.shelf.begin()
-    except ShelfNotFoundError, x:
-        printErrorAndExit("Could not open metadata database \"%s\".\n" % (
-            env.shelfLocation))
-    except ShelfLockedError, x:
-        printErrorAndExit(
-            "Could not open metadata database \"%s\".\n" % env.shelfLocation +
-            "Another process is locking it.\n")
-    except UnsupportedShelfError, filename:
-        printErrorAndExit(
-            "Could not read metadata database file %s (too new database"
-            " format?).\n" % filename)
-    try:
-        env.gencharenc = genCharEnc
         env.out = printOutput
         env.err = printError
         env.errexit = printErrorAndExit
@@ -1337,13 +1654,7 @@ def main(argv):
         env.imagesizelimits = imgsizes
 
         commandTable[args[0]](env, args[1:])
-        if env.noAct:
-            env.shelf.rollback()
-            printOutput(
-                "no-act: All changes to the database have been revoked!\n")
-        else:
-            env.shelf.commit()
-        sys.exit(0)
+        return 0
     except ArgumentError:
         printErrorAndExit(
             "Bad arguments to command. See \"kofoto --help\" for help.\n")
@@ -1405,5 +1716,49 @@ def main(argv):
         else:
             errstr = e.strerror
         printError("%s.\n" % errstr)
-    env.shelf.rollback()
-    sys.exit(1)
+    return 1
+
+
+def serveCommand(env, cwd, argv, stdin, stdout, stderr):
+    """Run a command received by the command server.
+
+    The shelf is only locked while the command runs. The command's
+    changes are committed (without flushing the shelf's caches) if it
+    succeeded, and otherwise rolled back.
+
+    Returns the exit status.
+    """
+    try:
+        env.shelf.resume()
+    except ShelfLockedError:
+        stderr.write(
+            "Could not open metadata database \"%s\".\n" % env.shelfLocation +
+            "Another process is locking it.\n")
+        return 1
+    savedStreams = (sys.stdin, sys.stdout, sys.stderr)
+    savedCwd = os.getcwdu()
+    sys.stdin = stdin
+    sys.stdout = stdout
+    sys.stderr = stderr
+    status = 1
+    try:
+        try:
+            os.chdir(cwd)
+            env.resetOptions()
+            args = parseOptions(env, argv)[2]
+            if not args or args[0] not in commandTable or args[0] == "serve":
+                printErrorAndExit("Bad command for the command server.\n")
+            status = runCommand(env, args)
+        except SystemExit, e:
+            status = e.code
+        except Exception:
+            import traceback
+            traceback.print_exc()
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = savedStreams
+        os.chdir(savedCwd)
+        if status == 0 and not env.noAct:
+            env.shelf.suspend()
+        else:
+            env.shelf.rollback()
+    return status
@@ -0,0 +1,232 @@
+"""Command server for the Kofoto commandline client.
+
+A command server keeps a shelf open between commands, so that the
+cost of starting the client, reading the configuration and opening
+the shelf is only paid once. Clients send commands to the server over
+a Unix domain socket located next to the shelf.
+
+A connection carries one command. The client sends a request message
+and the server answers with output messages followed by an exit
+status message. Each message consists of a one-character type, a
+four-byte big-endian length and UTF-8 encoded data:
+
+q -- Request: the current directory and the arguments, separated by
+     null characters.
+o -- Text written to standard output.
+e -- Text written to standard error.
+i -- From the server: request for a line of standard input (no data).
+     From the client: the line (empty at end of file).
+x -- Exit status (a decimal number).
+"""
+
+__all__ = [
+    "CommandServer",
+    "ServerNotRunningError",
+    "getSocketLocation",
+    "sendCommand",
+]
+
+import errno
+import os
+import struct
+from kofoto.common import KofotoError
+
+class ServerNotRunningError(KofotoError):
+    """No command server is running."""
+    pass
+
+
+def getSocketLocation(shelfLocation):
+    """Get the location of the socket of a shelf's command server."""
+    return shelfLocation + ".socket"
+
+
+def sendCommand(location, cwd, args, stdin, stdout, stderr):
+    """Run a command in a command server.
+
+    Arguments:
+
+    location -- Location of the server's socket.
+    cwd      -- Directory to run the command in (a Unicode string).
+    args     -- Commandline arguments (options and command) as
+                Unicode strings.
+    stdin    -- File object to read the command's standard input from.
+    stdout   -- File object to write the command's standard output to.
+    stderr   -- File object to write the command's standard error to.
+
+    Returns the command's exit status. If no server is running,
+    ServerNotRunningError is raised.
+    """
+    if not os.path.exists(location):
+        # Avoid importing socket, which is slow, in the common case.
+        raise ServerNotRunningError(location)
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(location)
+        except socket.error, e:
+            if e.args[0] in [errno.ENOENT, errno.ECONNREFUSED]:
+                raise ServerNotRunningError(location)
+            raise
+        _writeMessage(sock, "q", u"\0".join([cwd] + list(args)))
+        fp = sock.makefile("rb")
+        while True:
+            message = _readMessage(fp)
+            if message is None:
+                # The server went away.
+                return 1
+            mtype, data = message
+            if mtype == "o":
+                stdout.write(data)
+                stdout.flush()
+            elif mtype == "e":
+                stderr.write(data)
+            elif mtype == "i":
+                _writeMessage(sock, "i", stdin.readline())
+            elif mtype == "x":
+                return int(data)
+    finally:
+        sock.close()
+
+
+class CommandServer:
+    """A server running commands received over a Unix domain socket.
+
+    Commands are run one at a time, in the order they are received.
+    """
+
+    def __init__(self, location, handler):
+        """Constructor.
+
+        Arguments:
+
+        location -- Location of the socket.
+        handler  -- A function taking a directory, a list of
+                    arguments and three file objects for standard
+                    input, standard output and standard error, running
+                    the command and returning its exit status.
+        """
+        self.__location = location
+        self.__handler = handler
+
+
+    def serveForever(self):
+        """Serve commands until interrupted.
+
+        The socket is removed when the server stops.
+        """
+        import socket
+        if os.path.exists(self.__location):
+            # Left-over socket from a server that didn't exit cleanly.
+            os.unlink(self.__location)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            oldUmask = os.umask(077)
+            try:
+                sock.bind(self.__location)
+            finally:
+                os.umask(oldUmask)
+            try:
+                sock.listen(5)
+                while True:
+                    connection = sock.accept()[0]
+                    try:
+                        try:
+                            self.__serve(connection)
+                        except socket.error:
+                            # The client went away.
+                            pass
+                    finally:
+                        connection.close()
+            finally:
+                os.unlink(self.__location)
+        finally:
+            sock.close()
+
+
+    ##############################
+    # Internal methods.
+
+    def __serve(self, connection):
+        """Serve a command on a connection."""
+        fp = connection.makefile("rb")
+        message = _readMessage(fp)
+        if message is None or message[0] != "q":
+            return
+        arguments = message[1].split(u"\0")
+        status = self.__handler(
+            arguments[0],
+            arguments[1:],
+            _MessageReader(connection, fp),
+            _MessageWriter(connection, "o"),
+            _MessageWriter(connection, "e"))
+        _writeMessage(connection, "x", unicode(status))
+
+
+class _MessageReader:
+    """File object reading text from the client, one line at a time."""
+
+    def __init__(self, connection, fp):
+        self.connection = connection
+        self.fp = fp
+        self.eof = False
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def read(self):
+        return u"".join(self)
+
+    def readline(self):
+        if self.eof:
+            return u""
+        _writeMessage(self.connection, "i", "")
+        message = _readMessage(self.fp)
+        if message is None or message[0] != "i":
+            raise EOFError
+        line = message[1]
+        if not line:
+            self.eof = True
+        return line
+
+
+class _MessageWriter:
+    """File object sending written text as messages."""
+
+    def __init__(self, connection, mtype):
+        self.connection = connection
+        self.mtype = mtype
+
+    def write(self, data):
+        _writeMessage(self.connection, self.mtype, data)
+
+    def flush(self):
+        pass
+
+
+######################################################################
+
+def _writeMessage(sock, mtype, data):
+    """Internal helper function."""
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    sock.sendall(mtype + struct.pack(">L", len(data)) + data)
+
+
+def _readMessage(fp):
+    """Internal helper function.
+
+    Returns a (type, data) tuple, or None at end of file."""
+    header = fp.read(5)
+    if len(header) < 5:
+        return None
+    length = struct.unpack(">L", header[1:])[0]
+    data = fp.read(length)
+    if len(data) < length:
+        return None
+    return (header[0], data.decode("utf-8"))
@@ -194,6 +194,19 @@ open_command = gimp-remote --new %%(locations)s
 rotate_right_command = jpegtran -rotate 90 -perfect -copy all -outfile "%%(location)s" "%%(location)s"
 rotate_left_command = jpegtran -rotate 270 -perfect -copy all -outfile "%%(location)s" "%%(location)s"
 
+# Maximum size (in megabytes) of decoded images kept in memory for
+# quick viewing, or "auto" to use a share of the available memory.
+memory_cache_size_limit = auto
+
+# Maximum total size (in megabytes) of the scaled images gkofoto
+# stores in the "pixbufs" subdirectory of the image cache for quicker
+# viewing. 0 disables storing.
+disk_cache_size_limit = 200
+
+# Maximum number of images to preload ahead when quickly browsing
+# through images. The more images, the more memory is used.
+preload_window_size = 8
+
 ######################################################################
 ## Configuration for the default output module "woolly".
 [woolly]
@@ -0,0 +1,241 @@
+"""Fast reading of EXIF tags.
+
+This module reads the same tags as kofoto.EXIF.process_file (without
+maker note details), but the EXIF data is loaded into memory with a
+single read (or memory-mapped, for TIFF files) and decoded with
+struct.unpack_from instead of seeking and reading the file for every
+integer. A whitelist of tag names can be given, in which case only
+those tags are decoded and IFDs that can't contain them are skipped.
+
+Uncompressed TIFF thumbnails and maker notes are not decoded.
+"""
+
+__all__ = ["readExifTags"]
+
+import mmap
+import struct
+from kofoto.EXIF import \
+    EXIF_TAGS, FIELD_TYPES, GPS_TAGS, IFD_Tag, IGNORE_TAGS, Ratio
+
+# Number of JPEG segments to look at before giving up finding the EXIF
+# segment.
+MAX_JPEG_SEGMENTS = 32
+
+# Tags pointing to sub-IFDs.
+_EXIF_OFFSET_TAG = 0x8769
+_GPS_INFO_TAG = 0x8825
+
+# Struct format characters for integers of a given size and
+# signedness.
+_INTEGER_FORMATS = {
+    (1, False): "B",
+    (1, True): "b",
+    (2, False): "H",
+    (2, True): "h",
+    (4, False): "L",
+    (4, True): "l",
+    }
+
+_SIGNED_FIELD_TYPES = (6, 8, 9, 10)
+_RATIO_FIELD_TYPES = (5, 10)
+
+def readExifTags(fp, tagNames=None):
+    """Read EXIF tags from an image file.
+
+    Arguments:
+
+    fp       -- A file object opened in binary mode, positioned at the
+                start of a JPEG or TIFF file.
+    tagNames -- An iterable of tag names (e.g. "EXIF DateTimeOriginal"
+                or "JPEGThumbnail") to read, or None to read all tags.
+
+    Returns a dictionary mapping tag names to kofoto.EXIF.IFD_Tag
+    instances (and "JPEGThumbnail" to a string), like
+    kofoto.EXIF.process_file. Files without EXIF data give an empty
+    dictionary. Corrupt EXIF data raises struct.error or ValueError.
+    """
+
+    if tagNames is not None:
+        tagNames = set(tagNames)
+    head = fp.read(4)
+    if head in ("II*\x00", "MM\x00*"):
+        fp.seek(0)
+        data = _mapFile(fp)
+        try:
+            return _Decoder(data, 0, tagNames).decode()
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    elif head[:2] == "\xFF\xD8":
+        data = _readJpegExifSegment(fp, head[2:])
+        if data is None:
+            return {}
+        # The TIFF header follows "Exif\0\0".
+        return _Decoder(data, 6, tagNames).decode()
+    else:
+        return {}
+
+
+class _Decoder:
+    def __init__(self, data, base, tagNames):
+        self.data = data
+        self.base = base
+        self.tagNames = tagNames
+        if data[base:base + 1] == "I":
+            self.endian = "<"
+        else:
+            self.endian = ">"
+        self.tags = {}
+
+    def decode(self):
+        ifdNumber = 0
+        ifd = self.unpack("L", 4)[0]
+        visited = set()
+        while ifd and ifd not in visited:
+            visited.add(ifd)
+            if ifdNumber == 0:
+                ifdName = "Image"
+            elif ifdNumber == 1:
+                ifdName = "Thumbnail"
+            else:
+                ifdName = "IFD %d" % ifdNumber
+            pointers = self.decodeIFD(ifd, ifdName, EXIF_TAGS)
+            if _EXIF_OFFSET_TAG in pointers and self.wantsIFD("EXIF"):
+                self.decodeIFD(pointers[_EXIF_OFFSET_TAG], "EXIF", EXIF_TAGS)
+            if _GPS_INFO_TAG in pointers and self.wantsIFD("GPS"):
+                self.decodeIFD(pointers[_GPS_INFO_TAG], "GPS", GPS_TAGS)
+            if ifdNumber == 0 and not self.wantsIFD("Thumbnail"):
+                # The remaining IFDs are thumbnail IFDs.
+                break
+            entries = self.unpack("H", ifd)[0]
+            ifd = self.unpack("L", ifd + 2 + 12 * entries)[0]
+            ifdNumber += 1
+        self.extractJpegThumbnail()
+        return self.tags
+
+    def decodeIFD(self, ifd, ifdName, tagDict):
+        # Returns a dictionary mapping sub-IFD pointer tags to offsets.
+        pointers = {}
+        entries = self.unpack("H", ifd)[0]
+        for i in range(entries):
+            entry = ifd + 2 + 12 * i
+            tag, fieldType, count = self.unpack("HHL", entry)
+            if tag in IGNORE_TAGS:
+                continue
+            tagEntry = tagDict.get(tag)
+            if tagEntry:
+                tagName = "%s %s" % (ifdName, tagEntry[0])
+            else:
+                tagName = "%s Tag 0x%04X" % (ifdName, tag)
+            isPointer = tag in (_EXIF_OFFSET_TAG, _GPS_INFO_TAG)
+            if not (isPointer or self.wantsTag(tagName)):
+                continue
+            if not 0 < fieldType < len(FIELD_TYPES):
+                raise ValueError(
+                    "unknown type %d in tag 0x%04X" % (fieldType, tag))
+            typeLength = FIELD_TYPES[fieldType][0]
+            offset = entry + 8
+            if count * typeLength > 4:
+                offset = self.unpack("L", offset)[0]
+            values = self.decodeValues(fieldType, count, offset)
+            if isPointer and values:
+                pointers[tag] = values[0]
+                if not self.wantsTag(tagName):
+                    continue
+            if count == 1 and fieldType != 2:
+                printable = str(values[0])
+            else:
+                printable = str(values)
+            if tagEntry and len(tagEntry) != 1:
+                if callable(tagEntry[1]):
+                    try:
+                        printable = tagEntry[1](values)
+                    except:
+                        # Same work-around as in EXIF.dump_IFD.
+                        continue
+                else:
+                    printable = "".join(
+                        [tagEntry[1].get(x, repr(x)) for x in values])
+            self.tags[tagName] = IFD_Tag(
+                printable, tag, fieldType, values, offset,
+                count * typeLength)
+        return pointers
+
+    def decodeValues(self, fieldType, count, offset):
+        if fieldType == 2:
+            # Null-terminated ASCII string.
+            start = self.base + offset
+            return self.data[start:start + count].strip().replace("\x00", "")
+        signed = fieldType in _SIGNED_FIELD_TYPES
+        if fieldType in _RATIO_FIELD_TYPES:
+            numbers = self.unpack(
+                _INTEGER_FORMATS[(4, signed)] * (2 * count), offset)
+            return [Ratio(numbers[2 * i], numbers[2 * i + 1])
+                    for i in range(count)]
+        typeLength = FIELD_TYPES[fieldType][0]
+        return list(self.unpack(
+            _INTEGER_FORMATS[(typeLength, signed)] * count, offset))
+
+    def extractJpegThumbnail(self):
+        if not self.wantsTag("JPEGThumbnail"):
+            return
+        offsetTag = self.tags.get("Thumbnail JPEGInterchangeFormat")
+        lengthTag = self.tags.get("Thumbnail JPEGInterchangeFormatLength")
+        if offsetTag and lengthTag:
+            start = self.base + offsetTag.values[0]
+            self.tags["JPEGThumbnail"] = \
+                self.data[start:start + lengthTag.values[0]]
+        if self.tagNames is not None:
+            for tagName in ["Thumbnail JPEGInterchangeFormat",
+                            "Thumbnail JPEGInterchangeFormatLength"]:
+                if tagName not in self.tagNames:
+                    self.tags.pop(tagName, None)
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from(
+            self.endian + fmt, self.data, self.base + offset)
+
+    def wantsIFD(self, ifdName):
+        if self.tagNames is None:
+            return True
+        prefix = ifdName + " "
+        for tagName in self.tagNames:
+            if tagName.startswith(prefix):
+                return True
+        return ifdName == "Thumbnail" and "JPEGThumbnail" in self.tagNames
+
+    def wantsTag(self, tagName):
+        if self.tagNames is None or tagName in self.tagNames:
+            return True
+        # The thumbnail is located by two tags in the thumbnail IFD.
+        return ("JPEGThumbnail" in self.tagNames and
+                tagName.startswith("Thumbnail JPEGInterchangeFormat"))
+
+
+def _mapFile(fp):
+    try:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        # Not a real file, or an empty file.
+        return fp.read()
+
+
+def _readJpegExifSegment(fp, firstMarker):
+    # Returns the contents of the APP1 segment containing EXIF data,
+    # or None.
+    marker = firstMarker + fp.read(2)
+    for i in range(MAX_JPEG_SEGMENTS):
+        if len(marker) < 4 or marker[0] != "\xFF":
+            return None
+        if marker[1] in ("\xD9", "\xDA"):
+            # End of image or start of scan; no more metadata.
+            return None
+        length = struct.unpack(">H", marker[2:4])[0]
+        if marker[1] == "\xE1":
+            segment = fp.read(length - 2)
+            if segment[:6] == "Exif\x00\x00":
+                return segment
+        else:
+            fp.seek(length - 2, 1)
+        marker = fp.read(4)
+    return None
@@ -14,15 +14,13 @@ class AlbumMembers(ObjectCollection):
     def loadAlbum(self, album):
         env.debug("Loading album: " + album.getTag())
         self.__album = album
-        self._loadObjectList(album.getChildren())
+        self._loadObjectIds([x.getId() for x in album.getChildren()])
 
     def isReorderable(self):
         return self.__album and self.__album.isMutable()
 
     def isMutable(self):
-        return (self.__album and
-                self.__album.isMutable() and
-                not self.isLoading())
+        return self.__album and self.__album.isMutable()
 
     def getContainer(self):
         return self.__album
@@ -52,7 +50,7 @@ class AlbumMembers(ObjectCollection):
         self.__album.setChildren(currentChildren[:insertLocation] +
                                  newObjects +
                                  currentChildren[insertLocation:])
-        self._insertObjectList(newObjects, insertLocation)
+        self._insertObjectIds([x.getId() for x in newObjects], insertLocation)
         if albumCopied:
             # TODO: Don't reload the whole tree.
             env.mainwindow.reloadAlbumTree()
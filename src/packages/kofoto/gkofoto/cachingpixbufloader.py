@@ -1,6 +1,11 @@
 """This module contains the CachingPixbufLoader class."""
 
-__all__ = ["CachingPixbufLoader"]
+__all__ = [
+    "CachingPixbufLoader",
+    "DEFAULT_BYTE_LIMIT",
+    "DEFAULT_DECODING_THREADS",
+    "DEFAULT_DISK_CACHE_BYTE_LIMIT",
+    ]
 
 import gc
 import os
@@ -9,11 +14,37 @@ if __name__ == "__main__":
     import pygtk
     pygtk.require("2.0")
 import gobject
+from kofoto.gkofoto.pixbufdecoder import PixbufDecoder, make_pixbuf
+from kofoto.gkofoto.pixbufdiskcache import PixbufDiskCache
 from kofoto.gkofoto.pixbufloader import PixbufLoader, get_pixbuf_size
 from kofoto.gkofoto.pseudothread import PseudoThread
 from kofoto.iodict import InsertionOrderedDict
 from kofoto.rectangle import Rectangle
 
+# Default maximum total size (in bytes) of the disk cache.
+DEFAULT_DISK_CACHE_BYTE_LIMIT = 200 * 2**20
+
+# Default number of threads that decode images.
+DEFAULT_DECODING_THREADS = 2
+
+# Interval (in milliseconds) between checks for decoded images.
+DECODER_POLL_INTERVAL = 20
+
+# Default size (in bytes) of the memory cache.
+DEFAULT_BYTE_LIMIT = 80 * 2**20
+
+# Estimated number of bytes per pixel of a pixbuf that is being
+# loaded (RGB rows padded to four bytes or RGBA).
+ESTIMATED_BYTES_PER_PIXEL = 4
+
+# In adaptive mode: the share of the available system memory to use
+# for the memory cache, limits of the cache size and the minimum
+# number of seconds between reevaluations of the limit.
+ADAPTIVE_MEMORY_SHARE = 0.25
+ADAPTIVE_MIN_BYTE_LIMIT = 32 * 2**20
+ADAPTIVE_MAX_BYTE_LIMIT = 1024 * 2**20
+ADAPTIVE_INTERVAL = 10
+
 class _RequestStateBase(object):
     def __init__(self, request):
         self._request = request
@@ -21,15 +52,24 @@ class _RequestStateBase(object):
     def add_callback(self, load_callback, error_callback):
         self._request._callbacks.append((load_callback, error_callback))
 
-    def get_number_of_loaded_pixels(self):
-        if self._request._loaded_bytes == 0:
+    def get_number_of_resident_bytes(self):
+        req = self._request
+        if req._pixbuf is not None:
+            return req._pixbuf.get_rowstride() * req._pixbuf.get_height()
+        elif req._loaded_bytes == 0:
             return 0
         else:
+            # The pixbuf is being loaded, so estimate its size from
+            # the share of the file that has been read.
             return (
-                float(self._request._size_to_load[0]) *
-                self._request._size_to_load[1] *
-                self._request._loaded_bytes /
-                self._request._available_bytes)
+                ESTIMATED_BYTES_PER_PIXEL *
+                float(req._size_to_load[0]) *
+                req._size_to_load[1] *
+                req._loaded_bytes /
+                req._available_bytes)
+
+    def is_decoding(self):
+        return False
 
     def is_finished(self):
         raise NotImplementedError
@@ -38,7 +78,7 @@ class _RequestStateBase(object):
         return 0
 
 class _RequestStateInitial(_RequestStateBase):
-    def get_number_of_loaded_pixels(self):
+    def get_number_of_resident_bytes(self):
         return 0
 
     def is_finished(self):
@@ -48,20 +88,62 @@ class _RequestStateInitial(_RequestStateBase):
         req = self._request
         try:
             stat = os.stat(req._path)
-            # TODO: Look for image in diskcache here and load the
-            # cached image instead (if cached image mtime <= original
-            # image mtime?).
         except OSError:
             req._state = _RequestStateError(req)
-        else:
-            req._mtime = stat.st_mtime
+            return 0
+        req._mtime = stat.st_mtime
+        cached_path = req._lookup_disk_cache()
+        if cached_path is not None:
+            try:
+                req._available_bytes = os.path.getsize(cached_path)
+            except OSError:
+                # Removed by someone else after the lookup.
+                cached_path = None
+        if cached_path is None:
+            req._cached_path = None
             req._available_bytes = stat.st_size
+            source_path = req._path
+            source_size_limit = req._size_limit
+        else:
+            req._cached_path = cached_path
+            source_path = cached_path
+            source_size_limit = None
+        if req._cpb_loader._decoder is None:
             req._state = _RequestStateWaitingForSize(req)
-            req._pb_loader.prepare(req._path, req._size_limit)
+            req._pb_loader.prepare(source_path, source_size_limit)
+        else:
+            req._state = _RequestStateDecoding(req)
+            req._cpb_loader._submit_decoding(
+                req, source_path, source_size_limit)
         return 0
 
+class _RequestStateDecoding(_RequestStateBase):
+    def get_number_of_resident_bytes(self):
+        return 0
+
+    def is_decoding(self):
+        return True
+
+    def is_finished(self):
+        return False
+
+    def decoding_finished(self, result):
+        req = self._request
+        if result is None:
+            return req._fail()
+        (original_size, size, data) = result
+        if req._cached_path is None:
+            req._original_size = original_size
+        req._size_to_load = size
+        req._loaded_bytes = req._available_bytes
+        req._pixbuf = make_pixbuf(size, data)
+        req._state = _RequestStateFinished(req)
+        # This state's own byte count is always 0, so ask the request
+        # (now in the finished state) for the real size.
+        return req.get_number_of_resident_bytes()
+
 class _RequestStateWaitingForSize(_RequestStateBase):
-    def get_number_of_loaded_pixels(self):
+    def get_number_of_resident_bytes(self):
         return 0
 
     def is_finished(self):
@@ -74,7 +156,12 @@ class _RequestStateWaitingForSize(_RequestStateBase):
         original_size = req._pb_loader.get_original_size()
         if original_size is not None:
             req._state = _RequestStateLoading(req)
-            req._original_size = original_size
+            if req._cached_path is None:
+                req._original_size = original_size
+            else:
+                # The size of the original image was set when the
+                # cached image was found.
+                original_size = req._original_size
             if req._size_limit is None:
                 req._size_to_load = original_size
             else:
@@ -82,7 +169,7 @@ class _RequestStateWaitingForSize(_RequestStateBase):
                     req._size_limit)
         elif loaded_bytes == 0:
             # Could not parse image size.
-            req._state = _RequestStateError(req)
+            return req._fail()
         return 0
 
 class _RequestStateLoading(_RequestStateBase):
@@ -91,6 +178,7 @@ class _RequestStateLoading(_RequestStateBase):
 
     def load_some_more(self):
         req = self._request
+        reported_bytes = self.get_number_of_resident_bytes()
         loaded_bytes = req._pb_loader.load_some_more()
         if req._unreported_bytes > 0:
             loaded_bytes += req._unreported_bytes
@@ -100,31 +188,30 @@ class _RequestStateLoading(_RequestStateBase):
             # Here it would be possible to check mtime again and
             # reload the image if mtime has changed. We decided to
             # ignore this right now because of implementation
-            # difficulties (for example, a negative number of pixels
+            # difficulties (for example, a negative number of bytes
             # (watch out so it isn't 0!) must be reported back to
             # req._cpb_loader in some way).
 
             req._pixbuf = req._pb_loader.get_pixbuf()
             if req._pixbuf is None:
-                req._state = _RequestStateError(req)
+                return req._fail()
             else:
                 req._state = _RequestStateFinished(req)
-        return (
-            (float(loaded_bytes) / req._available_bytes) *
-            req._size_to_load[0] * req._size_to_load[1])
+        # The estimate is replaced by the real size when the pixbuf
+        # has been loaded.
+        return self.get_number_of_resident_bytes() - reported_bytes
 
 class _RequestStateFinished(_RequestStateBase):
     def __init__(self, request):
         _RequestStateBase.__init__(self, request)
+        request._cpb_loader._request_finished(request)
         for (load_cb, _) in request._callbacks:
             if request._cpb_loader._debug_level > 0:
                 print "%.3f callback(%s, %s)" % (
                     time.time(), request._path, request._size_limit)
             load_cb(request._pixbuf, request._original_size)
         request._callbacks = []
-        # TODO: Store in disk cache here if
-        # self._request._persistence_size_limit isn't None and we
-        # didn't load the image from the cache.
+        request._store_in_disk_cache()
 
     def add_callback(self, load_callback, _):
         req = self._request
@@ -172,6 +259,8 @@ class _Request(object):
         self._original_size = None
         self._size_to_load = None
         self._mtime = None
+        self._cached_path = None # Path to the image in the disk cache.
+        self._skip_disk_cache = False
         self._pb_loader = PixbufLoader()
         self._state = _RequestStateInitial(self)
 
@@ -190,8 +279,11 @@ class _Request(object):
         self._pb_loader.cancel()
         del self._state # Break cycle.
 
-    def get_number_of_loaded_pixels(self):
-        return self._state.get_number_of_loaded_pixels()
+    def decoding_finished(self, result):
+        return self._state.decoding_finished(result)
+
+    def get_number_of_resident_bytes(self):
+        return self._state.get_number_of_resident_bytes()
 
     def has_changed_on_disk(self):
         if self._mtime is None:
@@ -203,6 +295,9 @@ class _Request(object):
             except OSError:
                 return True
 
+    def is_decoding(self):
+        return self._state.is_decoding()
+
     def is_finished(self):
         return self._state.is_finished()
 
@@ -215,6 +310,69 @@ class _Request(object):
         except ValueError:
             pass
 
+    def _fail(self):
+        """Handle a failed load.
+
+        If the image was loaded from the disk cache, the cached image
+        is removed and the original image is loaded instead.
+        Otherwise, the request enters the error state.
+
+        Returns the (non-positive) number of bytes to report back to
+        the CachingPixbufLoader.
+        """
+        if self._cached_path is None:
+            self._state = _RequestStateError(self)
+            return 0
+        resident_bytes = self.get_number_of_resident_bytes()
+        self._cpb_loader._disk_cache.remove(
+            self._path, self._mtime, self._get_cached_size())
+        self._pb_loader.cancel()
+        self._pb_loader = PixbufLoader()
+        self._cached_path = None
+        self._skip_disk_cache = True
+        self._unreported_bytes = 0
+        self._loaded_bytes = 0
+        self._original_size = None
+        self._size_to_load = None
+        self._state = _RequestStateInitial(self)
+        return -resident_bytes
+
+    def _get_cached_size(self):
+        available_size = self._cpb_loader._available_size.get(self._path)
+        if available_size is None:
+            return None
+        return tuple(available_size.downscaled_to(self._size_limit))
+
+    def _uses_disk_cache(self):
+        return (
+            self._cpb_loader._disk_cache is not None and
+            self._persistence_size_limit is not None and
+            self._size_limit is not None)
+
+    def _lookup_disk_cache(self):
+        if self._skip_disk_cache or not self._uses_disk_cache():
+            return None
+        size = self._get_cached_size()
+        if size is None:
+            return None
+        cached_path = self._cpb_loader._disk_cache.lookup(
+            self._path, self._mtime, size)
+        if cached_path is not None:
+            self._original_size = tuple(
+                self._cpb_loader._available_size[self._path])
+        return cached_path
+
+    def _store_in_disk_cache(self):
+        if self._cached_path is not None or not self._uses_disk_cache():
+            return
+        size = tuple(self._size_to_load)
+        if (self._pixbuf.get_width(), self._pixbuf.get_height()) != size:
+            # PixbufLoader enforces a minimum size, so the pixbuf
+            # doesn't have the size that a lookup would ask for.
+            return
+        self._cpb_loader._disk_cache.store(
+            self._path, self._mtime, self._pixbuf)
+
     def _print_state(self, verbose):
         print "        state:                 ", self._state.__class__.__name__
         print "        path:                  ", self._path
@@ -229,6 +387,7 @@ class _Request(object):
             print "        original size:         ", self._original_size
             print "        size to load:          ", self._size_to_load
             print "        mtime:                 ", self._mtime
+            print "        cached path:           ", self._cached_path
             print "        pb loader:             ", self._pb_loader
 
 class CachingPixbufLoader(object):
@@ -247,34 +406,70 @@ class CachingPixbufLoader(object):
     new. Load requests have higher priority than preload requests.
     Load requests are never forgotten.
 
+    If a cache directory is given, scaled pixbufs of requests with a
+    persistence size limit are also stored on disk (in the background)
+    and are found there when no pixbuf is cached in memory. The cache
+    directory must not be used by anyone else, since the least recently
+    used files in it are removed.
+
     Preload requests are also asynchronous. A preload request is used
     to hint the loader to load a pixbuf into the cache. New preload
     requests have higher priority than old. Load requests have higher
     priority than preload requests. Old preload requests may be
     ignored (and the cached pixbuf thrown away) if the cache limits
     are exceeded.
+
+    The memory cache limit is a number of bytes, and the real size of
+    each pixbuf (rowstride times height) is counted. In adaptive mode,
+    the limit follows the amount of available system memory.
     """
 
-    def __init__(self, pixel_limit=10**7, cache_directory=None):
+    def __init__(self, byte_limit=DEFAULT_BYTE_LIMIT, cache_directory=None,
+                 disk_cache_byte_limit=DEFAULT_DISK_CACHE_BYTE_LIMIT,
+                 decoding_threads=DEFAULT_DECODING_THREADS):
         """Constructor.
 
         Arguments:
 
-        pixel_limit  -- The number of pixels to keep in the memory
+        byte_limit   -- The number of bytes to keep in the memory
                         cache.
         cache_directory
                      -- Path to the disk cache directory. If None, no
                         images will be cached on disk.
+        disk_cache_byte_limit
+                     -- Maximum total size (in bytes) of the files in
+                        the disk cache directory.
+        decoding_threads
+                     -- Number of threads that decode images. If 0,
+                        images are decoded incrementally in the GTK
+                        main loop instead.
         """
 
-        self._pixel_limit = pixel_limit
+        self._byte_limit = byte_limit
+        self._adaptive = False
+        self._adaptive_time = None # Time of the latest reevaluation.
         self._cache_directory = cache_directory
+        if cache_directory is None:
+            self._disk_cache = None
+        else:
+            self._disk_cache = PixbufDiskCache(
+                cache_directory, disk_cache_byte_limit)
+        if decoding_threads > 0:
+            self._decoder = PixbufDecoder(decoding_threads)
+        else:
+            self._decoder = None
+        self._decoder_poll_tag = None
         self._load_thread = PseudoThread(self._load_loop())
         self._debug_level = 0
 
-        # Cached value of the sum of loaded pixels of all requests in
-        # the queue.
-        self._pixels_in_cache = 0.0
+        # Cached value of the sum of resident bytes of all requests
+        # in the queue.
+        self._bytes_in_cache = 0.0
+
+        # Statistics.
+        self._nr_of_hits = 0
+        self._nr_of_misses = 0
+        self._nr_of_evictions = 0
 
         # Whether the load loop should reevaluate which request to
         # work on.
@@ -287,10 +482,16 @@ class CachingPixbufLoader(object):
         # instances. Newest requests are first and oldest are last.
         self._request_queue = InsertionOrderedDict()
 
-        # List of _Request instances. Always a subset of
-        # self._request_queue.values() (except order). Newest requests
-        # are last and oldest are first.
-        self._load_queue = []
+        # Maps (path, (width_limit, height_limit)) to unfinished
+        # _Request instances that have been requested with load.
+        # Always a subset of self._request_queue (except order).
+        # Newest requests are last and oldest are first.
+        self._load_queue = InsertionOrderedDict()
+
+        # Maps (path, (width_limit, height_limit)) to unfinished
+        # _Request instances. Always a subset of self._request_queue,
+        # in the same order.
+        self._unfinished_requests = InsertionOrderedDict()
 
         # Maps path to set(_Request)
         self._path_to_requests = {}
@@ -311,20 +512,77 @@ class CachingPixbufLoader(object):
 
         (path, size_limit, load_callback, error_callback) = handle
         key = (path, size_limit)
-        if key in self._request_queue:
-            request = self._request_queue[key]
-            try:
-                self._load_queue.remove(request)
-            except ValueError:
-                # Nothing to do.
-                return
+        if key in self._load_queue:
+            request = self._load_queue.pop(key)
             request.remove_callback(load_callback, error_callback)
             self._load_loop_reeval = True
 
-    def get_pixel_limit(self):
-        """Get cache size limit."""
+    def get_disk_cache_byte_limit(self):
+        """Get disk cache size limit, or None if there is no disk
+        cache."""
 
-        return self._pixel_limit
+        if self._disk_cache is None:
+            return None
+        else:
+            return self._disk_cache.get_byte_limit()
+
+    def get_byte_limit(self):
+        """Get memory cache size limit."""
+
+        return self._byte_limit
+
+    def get_statistics(self):
+        """Get statistics about the memory cache.
+
+        Returns a dictionary with the following keys:
+
+        hits           -- Number of loads that found a loaded pixbuf
+                          in the cache.
+        misses         -- Number of loads that didn't.
+        hit_rate       -- hits / (hits + misses), or None if there
+                          have been no loads.
+        evictions      -- Number of requests removed from the cache
+                          to stay within the limit.
+        resident_bytes -- Current size of the cache.
+        byte_limit     -- Current size limit of the cache.
+        adaptive       -- Whether the size limit is adaptive.
+        requests       -- Number of requests in the cache.
+        """
+
+        loads = self._nr_of_hits + self._nr_of_misses
+        if loads == 0:
+            hit_rate = None
+        else:
+            hit_rate = float(self._nr_of_hits) / loads
+        return {
+            "adaptive": self._adaptive,
+            "byte_limit": self._byte_limit,
+            "evictions": self._nr_of_evictions,
+            "hit_rate": hit_rate,
+            "hits": self._nr_of_hits,
+            "misses": self._nr_of_misses,
+            "requests": len(self._request_queue),
+            "resident_bytes": int(self._bytes_in_cache),
+            }
+
+    def is_adaptive(self):
+        """Check whether the memory cache size limit is adaptive."""
+
+        return self._adaptive
+
+    def is_cached(self, path, size_limit):
+        """Check whether a pixbuf is loaded and kept in the cache.
+
+        Arguments:
+
+        path         -- Path to the image file.
+        size_limit   -- Size limit as given to load/preload.
+        """
+
+        if size_limit is not None:
+            size_limit = self._calculate_size_limit(path, tuple(size_limit))
+        request = self._request_queue.get((path, size_limit))
+        return request is not None and request.is_finished()
 
     def load(self, path, size_limit, load_callback,
              error_callback=None, persistence_size_limit=None):
@@ -357,7 +615,8 @@ class CachingPixbufLoader(object):
                         be None if size_limit is None. Must be equal
                         to or greater than max(size_limit[0],
                         size_limit[1]). If None, the disk cache will
-                        not be used.
+                        not be used. Images that are not scaled down
+                        are never stored in the disk cache.
 
         The method returns a handle that can be passed to cancel_load.
         """
@@ -377,13 +636,17 @@ class CachingPixbufLoader(object):
         if key in self._request_queue:
             # Just move it to the front.
             request = self._request_queue[key]
-            self._request_queue.insert_first(key, request)
+            self._insert_request_first(key, request)
         else:
             # Let preload create the request.
             self.preload(path, size_limit, persistence_size_limit)
             request = self._request_queue[key]
-        if request not in self._load_queue:
-            self._load_queue.append(request)
+        if request.is_finished():
+            self._nr_of_hits += 1
+        else:
+            self._nr_of_misses += 1
+        if not (request.is_finished() or key in self._load_queue):
+            self._load_queue.insert_last(key, request)
             self._load_loop_reeval = True
 
         # It's okay to wait until now to add the callback, since any
@@ -435,19 +698,52 @@ class CachingPixbufLoader(object):
             request = _Request(self, path, size_limit, persistence_size_limit)
             request_set = self._path_to_requests.setdefault(path, set())
             request_set.add(request)
-        self._request_queue.insert_first(key, request)
+        self._insert_request_first(key, request)
         self._load_loop_reeval = True
         self._load_thread.start()
 
-    def set_pixel_limit(self, pixel_limit):
-        """Set cache size limit.
+    def set_disk_cache_byte_limit(self, byte_limit):
+        """Set disk cache size limit.
+
+        If there is no disk cache, nothing will happen.
 
         Arguments:
 
-        pixel_limit -- The number of pixels to keep in the cache.
+        byte_limit -- The number of bytes to keep in the disk cache.
         """
 
-        self._pixel_limit = pixel_limit
+        if self._disk_cache is not None:
+            self._disk_cache.set_byte_limit(byte_limit)
+
+    def set_adaptive(self, adaptive):
+        """Set whether the memory cache size limit should be adaptive.
+
+        In adaptive mode, the limit is regularly set to a share of the
+        available system memory (including the memory used by the
+        cache itself). If the available memory can't be determined,
+        the limit is left unchanged.
+
+        Arguments:
+
+        adaptive -- Whether the limit should be adaptive.
+        """
+
+        self._adaptive = adaptive
+        self._adaptive_time = None
+        self._prune_queue()
+
+    def set_byte_limit(self, byte_limit):
+        """Set memory cache size limit.
+
+        This turns off adaptive mode.
+
+        Arguments:
+
+        byte_limit -- The number of bytes to keep in the cache.
+        """
+
+        self._adaptive = False
+        self._byte_limit = byte_limit
         self._prune_queue()
 
     def unload(self, path, size_limit):
@@ -466,10 +762,11 @@ class CachingPixbufLoader(object):
         if self._debug_level > 0:
             print "%.3f unload(%s, %s)" % (time.time(), path, size_limit)
 
+        if size_limit is not None:
+            size_limit = self._calculate_size_limit(path, tuple(size_limit))
         key = (path, size_limit)
         if key in self._request_queue:
-            request = self._request_queue[key]
-            if request not in self._load_queue:
+            if key not in self._load_queue:
                 self._remove_request(key)
 
     def unload_all(self, path):
@@ -490,7 +787,7 @@ class CachingPixbufLoader(object):
         if path not in self._path_to_requests:
             return
         for request in self._path_to_requests[path].copy():
-            if request not in self._load_queue:
+            if request.key not in self._load_queue:
                 self._remove_request(request.key)
 
     def _calculate_size_limit(self, path, size_limit):
@@ -515,28 +812,30 @@ class CachingPixbufLoader(object):
             request = None
             self._load_loop_reeval = False
             found_a_load = False
-            while len(self._load_queue) > 0:
-                if self._load_queue[0].is_finished():
-                    # The load request has finished, so remove it.
-                    del self._load_queue[0]
-                else:
-                    request = self._load_queue[0]
-                    found_a_load = True
-                    break
-            if request is None:
-                # No loads. Find a preload, if any.
-                for req in self._request_queue.itervalues():
-                    if not req.is_finished():
+            if self._decoder is None or not self._decoder.is_full():
+                # Requests that are being decoded need no more work
+                # here. There are never more of them than decoding
+                # threads, so skipping them is cheap.
+                for req in self._load_queue.itervalues():
+                    if not req.is_decoding():
                         request = req
+                        found_a_load = True
                         break
+                if request is None:
+                    # No loads. Find a preload, if any.
+                    for req in self._unfinished_requests.itervalues():
+                        if not req.is_decoding():
+                            request = req
+                            break
             if request is None:
                 # The request queue needs to be pruned now since there
                 # may be old load requests that now are finished but
-                # could not be removed before.
+                # could not be pruned before.
                 self._prune_queue()
 
-                # No loads or preloads left. Pause until
-                # self._load_thread.start() is called.
+                # No loads or preloads left (or all decoding threads
+                # are busy). Pause until self._load_thread.start() is
+                # called.
                 if self._debug_level > 1:
                     print
                     print "LOAD LOOP FINISHED:"
@@ -551,25 +850,45 @@ class CachingPixbufLoader(object):
                 else:
                     priority = gobject.PRIORITY_DEFAULT_IDLE
                 self._load_thread.set_priority(priority)
-                while not (self._load_loop_reeval or request.is_finished()):
-                    loaded_pixels = request.load_some_more()
-                    self._pixels_in_cache += loaded_pixels
+                while not (self._load_loop_reeval or
+                           request.is_finished() or
+                           request.is_decoding()):
+                    self._bytes_in_cache += request.load_some_more()
                     self._prune_queue()
                     yield True
             # Now it's time to reevaluate which request to work on.
 
+    def _poll_decoder(self):
+        for (request, result) in self._decoder.get_finished():
+            if self._request_queue.get(request.key) is not request:
+                # The request was removed while being decoded.
+                continue
+            self._bytes_in_cache += request.decoding_finished(result)
+        self._prune_queue()
+        # Let the load loop submit more work.
+        self._load_thread.start()
+        if self._decoder.get_number_of_jobs() == 0:
+            self._decoder_poll_tag = None
+            return False
+        else:
+            return True
+
     def _print_state(self, verbose=False):
         print "------------------------------------------------------------------"
-        print "Pixel limit:", self._pixel_limit
+        print "Byte limit:", self._byte_limit
+        print "Adaptive:", self._adaptive
         print "Cache directory:", self._cache_directory
-        print "Pixels in cache:", self._pixels_in_cache
+        print "Bytes in cache:", self._bytes_in_cache
+        print "Hits:", self._nr_of_hits
+        print "Misses:", self._nr_of_misses
+        print "Evictions:", self._nr_of_evictions
         print "Request queue:"
         for (key, request) in self._request_queue.iteritems():
             print "    Key:", key
             print "    Request:"
             request._print_state(verbose)
         print "Load queue:"
-        for request in self._load_queue:
+        for request in self._load_queue.itervalues():
             print "    Request:"
             request._print_state(verbose)
         print "Path to requests:"
@@ -578,39 +897,73 @@ class CachingPixbufLoader(object):
             print "    Requests:", requests
 
     def _prune_queue(self):
-        if self._pixels_in_cache <= self._pixel_limit:
+        if self._adaptive:
+            self._update_adaptive_byte_limit()
+        if self._bytes_in_cache <= self._byte_limit:
             return
         requests_to_prune = []
-        load_requests = set(self._load_queue)
-        pixels_after_pruning = self._pixels_in_cache
+        bytes_after_pruning = self._bytes_in_cache
         for (key, request) in self._request_queue.reviteritems():
-            if pixels_after_pruning <= self._pixel_limit:
+            if bytes_after_pruning <= self._byte_limit:
                 # Enough pruning.
                 break
-            if request not in load_requests:
+            if key not in self._load_queue:
                 requests_to_prune.append((key, request))
-                pixels_after_pruning -= request.get_number_of_loaded_pixels()
+                bytes_after_pruning -= request.get_number_of_resident_bytes()
         if len(requests_to_prune) > 0:
             self._load_loop_reeval = True
             for (key, request) in requests_to_prune:
                 if self._debug_level > 1:
                     print "PRUNING", key
                 self._remove_request(key)
+                self._nr_of_evictions += 1
             gc.collect()
 
+    def _request_finished(self, request):
+        key = request.key
+        if key in self._load_queue:
+            del self._load_queue[key]
+        if key in self._unfinished_requests:
+            del self._unfinished_requests[key]
+
+    def _update_adaptive_byte_limit(self):
+        now = time.time()
+        if (self._adaptive_time is not None and
+            now - self._adaptive_time < ADAPTIVE_INTERVAL):
+            return
+        self._adaptive_time = now
+        available = get_available_memory()
+        if available is None:
+            return
+        limit = ADAPTIVE_MEMORY_SHARE * (available + self._bytes_in_cache)
+        self._byte_limit = int(min(
+            max(limit, ADAPTIVE_MIN_BYTE_LIMIT), ADAPTIVE_MAX_BYTE_LIMIT))
+
+    def _submit_decoding(self, request, path, size_limit):
+        self._decoder.submit(request, path, size_limit)
+        if self._decoder_poll_tag is None:
+            self._decoder_poll_tag = gobject.timeout_add(
+                DECODER_POLL_INTERVAL, self._poll_decoder)
+
+    def _insert_request_first(self, key, request):
+        self._request_queue.insert_first(key, request)
+        if not request.is_finished():
+            self._unfinished_requests.insert_first(key, request)
+
     def _remove_erroneous_request(self, key):
         self._remove_request(key)
 
     def _remove_request(self, key):
         assert key in self._request_queue
         request = self._request_queue[key]
-        self._pixels_in_cache -= request.get_number_of_loaded_pixels()
+        self._bytes_in_cache -= request.get_number_of_resident_bytes()
         request.cancel()
-        try:
-            self._load_queue.remove(request)
-        except ValueError:
-            # OK, it wasn't a load.
-            pass
+        # The load loop may be working on the removed request.
+        self._load_loop_reeval = True
+        if key in self._load_queue:
+            del self._load_queue[key]
+        if key in self._unfinished_requests:
+            del self._unfinished_requests[key]
         del self._request_queue[key]
         path = key[0]
         request_set = self._path_to_requests[path]
@@ -620,6 +973,36 @@ class CachingPixbufLoader(object):
 
 ######################################################################
 
+def get_available_memory():
+    """Get the amount of available system memory.
+
+    Returns the number of bytes, or None if unknown.
+    """
+
+    try:
+        meminfo = open("/proc/meminfo")
+        try:
+            fields = {}
+            for line in meminfo:
+                parts = line.split()
+                if len(parts) >= 2:
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+        finally:
+            meminfo.close()
+        if "MemAvailable" in fields:
+            return fields["MemAvailable"]
+        else:
+            # Older Linux kernels.
+            return (
+                fields["MemFree"] + fields.get("Buffers", 0) +
+                fields.get("Cached", 0))
+    except (IOError, KeyError, ValueError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
 def main(argv):
     import gtk
 
@@ -629,9 +1012,10 @@ def main(argv):
     def pixbuf_error_cb():
         print "Error while loading pixbuf."
 
+    gobject.threads_init()
     loader = CachingPixbufLoader()
     loader._debug_level = 2
-    loader.set_pixel_limit(10000000000)
+    loader.set_byte_limit(10000000000)
     print "INITIAL:"
     loader._print_state(False)
 
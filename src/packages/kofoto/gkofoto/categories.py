@@ -1,6 +1,5 @@
 import gobject
 import gtk
-import re
 
 from kofoto.gkofoto.environment import env
 from kofoto.gkofoto.categorydialog import CategoryDialog
@@ -23,6 +22,13 @@ class Categories:
         self.__qsSelectedPath = None
         self._menubarOids = None
         self.__selectedCategoriesIds  = {}
+        # Number of selected objects, number of selected objects in
+        # each category and the multiset of object IDs (object ID -->
+        # number of selected rows) that the counts are based on. The
+        # latter is None when the counts have to be recomputed.
+        self.__nrSelectedObjects = 0
+        self.__nrSelectedObjectsInCategory = {}
+        self.__countedObjectIds = None
         self.__categoryModel = gtk.TreeStore(gobject.TYPE_INT,      # CATEGORY_ID
                                              gobject.TYPE_STRING,   # DESCRIPTION
                                              gobject.TYPE_BOOLEAN,  # CONNECTED
@@ -36,6 +42,7 @@ class Categories:
         self.__categoryView.set_model(self.__categoryModel)
         self.__categoryView.connect("focus-in-event", self._categoryViewFocusInEvent_cb)
         self.__categoryView.connect("focus-out-event", self._categoryViewFocusOutEvent_cb)
+        self.__categoryView.connect("test-expand-row", self._testExpandRow_cb)
 
         # Create toggle column
         toggleRenderer = gtk.CellRendererToggle()
@@ -162,14 +169,18 @@ class Categories:
         self.__categoryView.connect("row-activated", self._rowActivated_cb)
         env.widgets["categorySearchButton"].connect('clicked', self._executeQuery_cb)
 
+        env.shelf.registerModificationCallback(self._shelfModified_cb)
+
         self.loadCategoryTree()
 
 
+    # Only the root categories are loaded here. Child rows are loaded
+    # when their parent row is expanded.
     def loadCategoryTree(self):
         self.__categoryModel.clear()
         env.shelf.flushCategoryCache()
         for category in self.__sortCategories(env.shelf.getRootCategories()):
-            self.__loadCategorySubTree(None, category)
+            self.__insertCategoryRow(None, category)
         if self.__objectCollection is not None:
             self.objectSelectionChanged()
 
@@ -181,6 +192,7 @@ class Categories:
         self.objectSelectionChanged()
 
     def objectSelectionChanged(self, unused=None):
+        self.__updateSelectedObjectCounts()
         self.__updateToggleColumn()
         self.__updateQSToggleColumn()
         self.__updateContextMenu()
@@ -196,6 +208,11 @@ class Categories:
         if query:
             self.__mainWindow.loadQuery(query)
 
+    def _shelfModified_cb(self, modified):
+        if modified:
+            # Categories of the selected objects may have changed.
+            self.__countedObjectIds = None
+
     def _categoryViewFocusInEvent_cb(self, widget, event):
         self._menubarOids = []
         for widgetName, function in [
@@ -216,6 +233,10 @@ class Categories:
         for (widget, oid) in self._menubarOids:
             widget.disconnect(oid)
 
+    def _testExpandRow_cb(self, treeView, iterator, path):
+        self.__loadChildRows(iterator)
+        return False
+
     def _categorySelectionChanged_cb(self, selection):
         selectedCategoryRows = []
         selection = self.__categoryView.get_selection()
@@ -245,6 +266,7 @@ class Categories:
     def _connectionToggled_cb(self, renderer, path):
         categoryRow = self.__categoryModel[path]
         category = env.shelf.getCategory(categoryRow[self.__COLUMN_CATEGORY_ID])
+        countedObjectIds = self.__countedObjectIds
         if categoryRow[self.__COLUMN_INCONSISTENT] \
                or not categoryRow[self.__COLUMN_CONNECTED]:
             for obj in self.__objectCollection.getObjectSelection().getSelectedObjects():
@@ -255,11 +277,13 @@ class Categories:
                     pass
             categoryRow[self.__COLUMN_INCONSISTENT] = False
             categoryRow[self.__COLUMN_CONNECTED] = True
+            self.__setSelectedObjectCount(category.getId(), True, countedObjectIds)
         else:
             for obj in self.__objectCollection.getObjectSelection().getSelectedObjects():
                 obj.removeCategory(category)
             categoryRow[self.__COLUMN_CONNECTED] = False
             categoryRow[self.__COLUMN_INCONSISTENT] = False
+            self.__setSelectedObjectCount(category.getId(), False, countedObjectIds)
         self.__updateToggleColumn()
         self.__updateQSToggleColumn()
 
@@ -333,7 +357,7 @@ class Categories:
 
     def _createRootCategoryHelper(self, tag, desc):
         category = env.shelf.createCategory(tag, desc)
-        self.__loadCategorySubTree(None, category)
+        self.__insertChildRow(None, category)
 
     def _createChildCategory_cb(self, item, data):
         dialog = CategoryDialog("Create subcategory")
@@ -360,7 +384,6 @@ class Categories:
                     # updated.
                     self.__disconnectChild(child.getId(), categoryId)
                 env.shelf.deleteCategory(categoryId)
-                env.shelf.flushCategoryCache()
                 self.__forEachCategoryRow(
                     self.__deleteCategoriesHelper, categoryId)
         dialog.destroy()
@@ -384,8 +407,7 @@ class Categories:
         category = env.shelf.getCategory(categoryId)
         category.setTag(tag)
         category.setDescription(desc)
-        env.shelf.flushCategoryCache()
-        self.__forEachCategoryRow(self.__updatePropertiesFromShelf, categoryId)
+        self.__updatePropertiesFromShelf(categoryId)
 
     def _selectionFunction_cb(self, path, b):
         return not self.__ignoreSelectEvent
@@ -412,10 +434,7 @@ class Categories:
         if text == "":
             return
 
-        regexp = re.compile(".*%s.*" % re.escape(text.lower()))
-        categories = sorted(
-            env.shelf.getMatchingCategories(regexp),
-            cmp=self.__compareCategories)
+        categories = env.shelf.getCategoriesContainingText(text)
         exactMatches = []
         for category in categories:
             iterator = self.__categoryQSModel.append()
@@ -440,6 +459,7 @@ class Categories:
         categoryRow = self.__categoryQSModel[path]
         category = env.shelf.getCategory(
             categoryRow[self.__COLUMN_CATEGORY_ID])
+        countedObjectIds = self.__countedObjectIds
         if categoryRow[self.__COLUMN_INCONSISTENT] \
                or not categoryRow[self.__COLUMN_CONNECTED]:
             for obj in self.__objectCollection.getObjectSelection().getSelectedObjects():
@@ -450,11 +470,13 @@ class Categories:
                     pass
             categoryRow[self.__COLUMN_INCONSISTENT] = False
             categoryRow[self.__COLUMN_CONNECTED] = True
+            self.__setSelectedObjectCount(category.getId(), True, countedObjectIds)
         else:
             for obj in self.__objectCollection.getObjectSelection().getSelectedObjects():
                 obj.removeCategory(category)
             categoryRow[self.__COLUMN_CONNECTED] = False
             categoryRow[self.__COLUMN_INCONSISTENT] = False
+            self.__setSelectedObjectCount(category.getId(), False, countedObjectIds)
         self.__updateToggleColumn()
         self.__expandAndCollapseRows(
             env.widgets["autoExpand"].get_active(),
@@ -482,20 +504,65 @@ class Categories:
     __COLUMN_CONNECTED    = 2
     __COLUMN_INCONSISTENT = 3
 
-    def __loadCategorySubTree(self, parent, category):
-        # TODO Do we have to use iterators here or can we use pygtks simplified syntax?
-        iterator = self.__categoryModel.iter_children(parent)
-        while (iterator != None and
-               self.__categoryModel.get_value(iterator, self.__COLUMN_DESCRIPTION) <
-                   category.getDescription()):
-            iterator = self.__categoryModel.iter_next(iterator)
-        iterator = self.__categoryModel.insert_before(parent, iterator)
+    # Category ID of the placeholder row that is added to rows whose
+    # children haven't been loaded, so that they can be expanded.
+    __PLACEHOLDER_ID = -1
+
+    def __insertCategoryRow(self, parent, category, position=-1):
+        iterator = self.__categoryModel.insert(parent, position)
         self.__categoryModel.set_value(iterator, self.__COLUMN_CATEGORY_ID, category.getId())
         self.__categoryModel.set_value(iterator, self.__COLUMN_DESCRIPTION, category.getDescription())
-        self.__categoryModel.set_value(iterator, self.__COLUMN_CONNECTED, False)
-        self.__categoryModel.set_value(iterator, self.__COLUMN_INCONSISTENT, False)
+        self.__updateToggleColumnHelper(
+            self.__categoryModel[self.__categoryModel.get_path(iterator)],
+            (self.__nrSelectedObjects, self.__nrSelectedObjectsInCategory))
+        for unused in category.getChildren():
+            self.__appendPlaceholderRow(iterator)
+            break
+
+    def __appendPlaceholderRow(self, parent):
+        iterator = self.__categoryModel.append(parent)
+        self.__categoryModel.set_value(
+            iterator, self.__COLUMN_CATEGORY_ID, self.__PLACEHOLDER_ID)
+
+    def __hasPlaceholderRow(self, iterator):
+        child = self.__categoryModel.iter_children(iterator)
+        return (child is not None and
+                self.__categoryModel.get_value(child, self.__COLUMN_CATEGORY_ID)
+                    == self.__PLACEHOLDER_ID)
+
+    def __loadChildRows(self, iterator):
+        if not self.__hasPlaceholderRow(iterator):
+            # Already loaded.
+            return
+        placeholder = self.__categoryModel.iter_children(iterator)
+        category = env.shelf.getCategory(
+            self.__categoryModel.get_value(iterator, self.__COLUMN_CATEGORY_ID))
         for child in self.__sortCategories(category.getChildren()):
-            self.__loadCategorySubTree(iterator, child)
+            self.__insertCategoryRow(iterator, child)
+        self.__categoryModel.remove(placeholder)
+
+    # Insert a row for a category that has been connected to the
+    # category of a parent row (or has become a root category if
+    # parent is None).
+    def __insertChildRow(self, parent, category):
+        if self.__hasPlaceholderRow(parent):
+            # The child row will be loaded when the parent is expanded.
+            return
+        if parent is None or self.__categoryModel.iter_has_child(parent):
+            position = self.__getSortedChildIds(parent).index(category.getId())
+            self.__insertCategoryRow(parent, category, position)
+        else:
+            # The parent didn't have any children before.
+            self.__appendPlaceholderRow(parent)
+
+    def __getSortedChildIds(self, parent):
+        if parent is None:
+            categories = env.shelf.getRootCategories()
+        else:
+            category = env.shelf.getCategory(
+                self.__categoryModel.get_value(parent, self.__COLUMN_CATEGORY_ID))
+            categories = category.getChildren()
+        return [x.getId() for x in self.__sortCategories(categories)]
 
     def __buildQueryFromSelection(self):
         if env.widgets["categoriesOr"].get_active():
@@ -537,36 +604,64 @@ class Categories:
         propertiesItem.set_sensitive(propertiesItemSensitive)
         env.widgets["menubarProperties"].set_sensitive(propertiesItemSensitive)
 
+    # Find out how many of the selected objects are connected to each
+    # category. Only objects that have been added to or removed from
+    # the selection since the last time are queried, unless the shelf
+    # has been modified.
+    def __updateSelectedObjectCounts(self):
+        objectIds = {}
+        for obj in self.__objectCollection.getObjectSelection().getMap().itervalues():
+            objectIds[obj.getId()] = objectIds.get(obj.getId(), 0) + 1
+        countedObjectIds = self.__countedObjectIds
+        if countedObjectIds is None:
+            countedObjectIds = {}
+            nrSelectedObjectsInCategory = {}
+        else:
+            nrSelectedObjectsInCategory = self.__nrSelectedObjectsInCategory
+        # Group changed object IDs by the change in number of rows.
+        changedObjectIds = {}
+        for objectId in set(objectIds) | set(countedObjectIds):
+            delta = objectIds.get(objectId, 0) - countedObjectIds.get(objectId, 0)
+            if delta != 0:
+                changedObjectIds.setdefault(delta, []).append(objectId)
+        if sum([len(x) for x in changedObjectIds.itervalues()]) > len(objectIds):
+            # Cheaper to start over.
+            nrSelectedObjectsInCategory = {}
+            changedObjectIds = {}
+            for (objectId, nrOfRows) in objectIds.iteritems():
+                changedObjectIds.setdefault(nrOfRows, []).append(objectId)
+        for (delta, ids) in changedObjectIds.iteritems():
+            counts = env.shelf.getCategoryCounts(ids)
+            for (categoryId, count) in counts.iteritems():
+                count = nrSelectedObjectsInCategory.get(categoryId, 0) + delta * count
+                if count == 0:
+                    del nrSelectedObjectsInCategory[categoryId]
+                else:
+                    nrSelectedObjectsInCategory[categoryId] = count
+        self.__nrSelectedObjects = sum(objectIds.itervalues())
+        self.__nrSelectedObjectsInCategory = nrSelectedObjectsInCategory
+        self.__countedObjectIds = objectIds
+
+    # Called when all selected objects have been connected to or
+    # disconnected from a category.
+    def __setSelectedObjectCount(self, categoryId, connected, countedObjectIds):
+        if connected:
+            self.__nrSelectedObjectsInCategory[categoryId] = self.__nrSelectedObjects
+        elif categoryId in self.__nrSelectedObjectsInCategory:
+            del self.__nrSelectedObjectsInCategory[categoryId]
+        # The counts are still valid even though the shelf has been
+        # modified.
+        self.__countedObjectIds = countedObjectIds
+
     def __updateToggleColumn(self):
-        # find out which categories are connected, not connected or
-        # partitionally connected to selected objects
-        nrSelectedObjectsInCategory = {}
-        nrSelectedObjects = 0
-        for obj in self.__objectCollection.getObjectSelection().getSelectedObjects():
-            nrSelectedObjects += 1
-            for category in obj.getCategories():
-                categoryId = category.getId()
-                try:
-                    nrSelectedObjectsInCategory[categoryId] += 1
-                except KeyError:
-                    nrSelectedObjectsInCategory[categoryId] = 1
-        self.__forEachCategoryRow(self.__updateToggleColumnHelper,
-                                  (nrSelectedObjects, nrSelectedObjectsInCategory))
+        self.__forEachCategoryRow(
+            self.__updateToggleColumnHelper,
+            (self.__nrSelectedObjects, self.__nrSelectedObjectsInCategory))
 
     def __updateQSToggleColumn(self):
-        selectedObjects = \
-            self.__objectCollection.getObjectSelection().getSelectedObjects()
-        nrSelectedObjectsInCategory = {}
-        nrSelectedObjects = 0
-        for obj in selectedObjects:
-            nrSelectedObjects += 1
-            for category in obj.getCategories():
-                catid = category.getId()
-                nrSelectedObjectsInCategory.setdefault(catid, 0)
-                nrSelectedObjectsInCategory[catid] += 1
         self.__forEachCategoryRow(
             self.__updateToggleColumnHelper,
-            (nrSelectedObjects, nrSelectedObjectsInCategory),
+            (self.__nrSelectedObjects, self.__nrSelectedObjectsInCategory),
             self.__categoryQSModel)
 
     def __updateToggleColumnHelper(self, categoryRow, args):
@@ -592,14 +687,20 @@ class Categories:
         if not categoryRows:
             categoryRows = self.__categoryModel
         for categoryRow in categoryRows:
+            if categoryRow[self.__COLUMN_CATEGORY_ID] == self.__PLACEHOLDER_ID:
+                continue
             function(categoryRow, data)
             self.__forEachCategoryRow(function, data, categoryRow.iterchildren())
 
     def __expandAndCollapseRows(self, autoExpand, autoCollapse, categoryRows=None):
         if categoryRows is None:
             categoryRows = self.__categoryModel
+            if autoExpand:
+                self.__loadRowsOfConnectedCategories()
         someRowsExpanded = False
         for categoryRow in categoryRows:
+            if categoryRow[self.__COLUMN_CATEGORY_ID] == self.__PLACEHOLDER_ID:
+                continue
             expandThisRow = False
             # Expand all rows that are selected or has expanded childs
             childRowsExpanded = self.__expandAndCollapseRows(autoExpand,
@@ -622,13 +723,31 @@ class Categories:
                 self.__categoryView.collapse_row(categoryRow.path)
         return someRowsExpanded
 
+    # Load the rows leading to categories connected to the selected
+    # objects, so that they can be expanded.
+    def __loadRowsOfConnectedCategories(self, categoryRows=None, ancestorIds=None):
+        if ancestorIds is None:
+            ancestorIds = set()
+            for categoryId in self.__nrSelectedObjectsInCategory:
+                category = env.shelf.getCategory(categoryId)
+                for ancestor in category.getParents(recursive=True):
+                    ancestorIds.add(ancestor.getId())
+        if not ancestorIds:
+            return
+        if categoryRows is None:
+            categoryRows = self.__categoryModel
+        for categoryRow in categoryRows:
+            if categoryRow[self.__COLUMN_CATEGORY_ID] in ancestorIds:
+                self.__loadChildRows(categoryRow.iter)
+                self.__loadRowsOfConnectedCategories(
+                    categoryRow.iterchildren(), ancestorIds)
+
     def __connectChildToCategory(self, childId, parentId):
         try:
             # Update shelf
             childCategory = env.shelf.getCategory(childId)
             parentCategory = env.shelf.getCategory(parentId)
             parentCategory.connectChild(childCategory)
-            env.shelf.flushCategoryCache()
             # Update widget modell
             # If we reload the whole category tree from the shelf, we would lose
             # the widgets information about current selected categories,
@@ -644,8 +763,8 @@ class Categories:
     def __connectChildToCategoryHelper(self, parentId, childCategory, categoryRows):
         for categoryRow in categoryRows:
             if categoryRow[self.__COLUMN_CATEGORY_ID] == parentId:
-                self.__loadCategorySubTree(categoryRow.iter, childCategory)
-            else:
+                self.__insertChildRow(categoryRow.iter, childCategory)
+            elif categoryRow[self.__COLUMN_CATEGORY_ID] != self.__PLACEHOLDER_ID:
                 self.__connectChildToCategoryHelper(parentId, childCategory, categoryRow.iterchildren())
 
     def __disconnectChild(self, childId, parentId):
@@ -657,7 +776,6 @@ class Categories:
         else:
             alreadyWasRootCategory = False
         parentCategory.disconnectChild(childCategory)
-        env.shelf.flushCategoryCache()
         # Update widget modell.
         # If we reload the whole category tree from the shelf, we would lose
         # the widgets information about current selected categories,
@@ -670,7 +788,7 @@ class Categories:
         if not alreadyWasRootCategory:
             for c in env.shelf.getRootCategories():
                 if c.getId() == childCategory.getId():
-                    self.__loadCategorySubTree(None, childCategory)
+                    self.__insertChildRow(None, childCategory)
                     break
 
     def __disconnectChildHelper(self, wantedChildId, wantedParentId,
@@ -681,10 +799,30 @@ class Categories:
                 self.__categoryModel.remove(categoryRow.iter)
             self.__disconnectChildHelper(wantedChildId, wantedParentId, cid, categoryRow.iterchildren())
 
-    def __updatePropertiesFromShelf(self, categoryRow, categoryId):
+    def __updatePropertiesFromShelf(self, categoryId):
+        iterators = []
+        self.__forEachCategoryRow(
+            self.__findCategoryRowsHelper, (categoryId, iterators))
+        category = env.shelf.getCategory(categoryId)
+        model = self.__categoryModel
+        for iterator in iterators:
+            model.set_value(
+                iterator, self.__COLUMN_DESCRIPTION, category.getDescription())
+            # Move the row to its new sorted position among its siblings.
+            parent = model.iter_parent(iterator)
+            oldPosition = model.get_path(iterator)[-1]
+            newPosition = self.__getSortedChildIds(parent).index(categoryId)
+            if newPosition > oldPosition:
+                model.move_after(
+                    iterator, model.iter_nth_child(parent, newPosition))
+            elif newPosition < oldPosition:
+                model.move_before(
+                    iterator, model.iter_nth_child(parent, newPosition))
+
+    def __findCategoryRowsHelper(self, categoryRow, args):
+        (categoryId, iterators) = args
         if categoryRow[self.__COLUMN_CATEGORY_ID] == categoryId:
-            category = env.shelf.getCategory(categoryId)
-            categoryRow[self.__COLUMN_DESCRIPTION] = category.getDescription()
+            iterators.append(categoryRow.iter)
 
     def __sortCategories(self, categoryIter):
         categories = sorted(categoryIter, cmp=self.__compareCategories)
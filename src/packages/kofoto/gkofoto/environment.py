@@ -15,7 +15,10 @@ from kofoto.gkofoto import crashdialog
 sys.excepthook = crashdialog.show
 
 from kofoto.clientenvironment import ClientEnvironment, ClientEnvironmentError
-from kofoto.gkofoto.cachingpixbufloader import CachingPixbufLoader
+from kofoto.gkofoto.cachingpixbufloader import \
+    CachingPixbufLoader, DEFAULT_DISK_CACHE_BYTE_LIMIT
+from kofoto.gkofoto.thumbnailloader import ThumbnailLoader
+from kofoto.gkofoto.preloadscheduler import DEFAULT_MAX_WINDOW_SIZE
 
 class WidgetsWrapper:
     def __init__(self):
@@ -44,8 +47,8 @@ class Environment(ClientEnvironment):
         self.widgets = None
         self.rotateRightCommand = None
         self.rotateLeftCommand = None
-        self.pixbufLoader = CachingPixbufLoader()
-        self.pixbufLoader.set_pixel_limit(2 * 10**7) # TODO: Make configurable.
+        self.pixbufLoader = None
+        self.thumbnailLoader = None
         self.fullScreenKeyAssignmentMap = {} # keysym --> category tag
 
     def setup(self, bindir, isDebug=False, configFileLocation=None,
@@ -73,6 +76,55 @@ class Environment(ClientEnvironment):
             "gkofoto", "rotate_right_command", True)
         self.rotateLeftCommand = self.config.get(
             "gkofoto", "rotate_left_command", True)
+        if self.config.has_option("gkofoto", "disk_cache_size_limit"):
+            try:
+                diskCacheLimit = 2**20 * self.config.getint(
+                    "gkofoto", "disk_cache_size_limit")
+            except ValueError:
+                self.startupNotices += [
+                    "Bad configuration value for disk_cache_size_limit"
+                    " in gkofoto section: %s.\n" % self.config.get(
+                        "gkofoto", "disk_cache_size_limit")]
+                return False
+        else:
+            diskCacheLimit = DEFAULT_DISK_CACHE_BYTE_LIMIT
+        if diskCacheLimit > 0:
+            # Use a directory of our own since the disk cache removes
+            # files in it.
+            diskCacheDirectory = self.imageCache.pixbufCacheLocation
+        else:
+            diskCacheDirectory = None
+        self.pixbufLoader = CachingPixbufLoader(
+            cache_directory=diskCacheDirectory,
+            disk_cache_byte_limit=diskCacheLimit)
+        if self.config.has_option("gkofoto", "memory_cache_size_limit"):
+            memoryCacheLimit = self.config.get(
+                "gkofoto", "memory_cache_size_limit").strip()
+        else:
+            memoryCacheLimit = "auto"
+        if memoryCacheLimit == "auto":
+            self.pixbufLoader.set_adaptive(True)
+        else:
+            try:
+                self.pixbufLoader.set_byte_limit(
+                    2**20 * int(memoryCacheLimit))
+            except ValueError:
+                self.startupNotices += [
+                    "Bad configuration value for memory_cache_size_limit"
+                    " in gkofoto section: %s.\n" % memoryCacheLimit]
+                return False
+        if self.config.has_option("gkofoto", "preload_window_size"):
+            try:
+                self.preloadWindowSize = self.config.getint(
+                    "gkofoto", "preload_window_size")
+            except ValueError:
+                self.startupNotices += [
+                    "Bad configuration value for preload_window_size"
+                    " in gkofoto section: %s.\n" % self.config.get(
+                        "gkofoto", "preload_window_size")]
+                return False
+        else:
+            self.preloadWindowSize = DEFAULT_MAX_WINDOW_SIZE
 
         # Case 1: Running from normal UNIX or Windows non-py2exe installation.
         dataDir = os.path.join(bindir, "..", "share", "gkofoto")
@@ -86,9 +138,16 @@ class Environment(ClientEnvironment):
         self.gladeFile = os.path.join(dataDir, "glade", "gkofoto.glade")
         self.albumIconFileName = os.path.join(self.iconDir, "album.png")
         self.albumIconPixbuf = gdk.pixbuf_new_from_file(self.albumIconFileName)
-        self.loadingPixbuf = self.albumIconPixbuf # TODO: create another icon with a hour-glass or something
+        # A transparent placeholder of thumbnail size, so that rows
+        # keep their height when the real thumbnail arrives.
+        self.loadingPixbuf = gdk.Pixbuf(
+            gdk.COLORSPACE_RGB, True, 8,
+            self.thumbnailSize[0], self.thumbnailSize[1])
+        self.loadingPixbuf.fill(0)
         self.unknownImageIconFileName = os.path.join(self.iconDir, "unknownimage.png")
         self.unknownImageIconPixbuf = gdk.pixbuf_new_from_file(self.unknownImageIconFileName)
+        self.thumbnailLoader = ThumbnailLoader(
+            self.imageCache, self.thumbnailSize)
         from kofoto.gkofoto.clipboard import Clipboard
         self.clipboard = Clipboard()
 
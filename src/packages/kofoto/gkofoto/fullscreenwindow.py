@@ -4,10 +4,10 @@ __all__ = ["FullScreenWindow"]
 
 import gtk
 import gobject
-import re
 import string
 from kofoto.gkofoto.imageview import ImageView
 from kofoto.gkofoto.environment import env
+from kofoto.gkofoto.preloadscheduler import PreloadScheduler
 from kofoto.shelf import CategoryDoesNotExistError
 from kofoto.common import html_escape
 
@@ -30,7 +30,8 @@ class FullScreenWindow(gtk.Window):
         self._current_index = current_index
         self._object_selection = object_selection
         self._latest_handle = None
-        self._latest_size = (0, 0)
+        self._preload_scheduler = PreloadScheduler(
+            max_window_size=env.preloadWindowSize)
         self._selected_category_tag = None
         self._last_selected_category_tag = None
         self._show_image_categories = True
@@ -122,6 +123,7 @@ class FullScreenWindow(gtk.Window):
         """Destroy the widget."""
 
         self._maybe_cancel_load()
+        self._preload_scheduler.unload_all(env.pixbufLoader)
 
         if self._object_selection:
             index = min(self._current_index, len(self._image_versions) - 1)
@@ -170,9 +172,8 @@ class FullScreenWindow(gtk.Window):
 
     def _category_entry_changed_cb(self, widget):
         text = self._category_entry.get_text().decode("utf-8")
-        regexp = re.compile(".*%s.*" % re.escape(text.lower()))
         if text != "":
-            categories = list(env.shelf.getMatchingCategories(regexp))
+            categories = env.shelf.getCategoriesContainingText(text)
         else:
             categories = []
         exact_match = None
@@ -235,15 +236,14 @@ class FullScreenWindow(gtk.Window):
     def _get_image_async_cb(self, size):
         path = self._image_versions[self._current_index].getLocation()
         self._maybe_cancel_load()
+        self._record_load(path, size)
         self._latest_handle = env.pixbufLoader.load(
             path,
             size,
             self._image_view.set_from_pixbuf,
-            self._image_view.set_error)
-        if size != self._latest_size:
-            self._unload(self._latest_size)
+            self._image_view.set_error,
+            self._get_persistence_size_limit(size))
         self._preload(size)
-        self._latest_size = size
 
     def _goto(self, new_index):
         if new_index < 0:
@@ -254,6 +254,7 @@ class FullScreenWindow(gtk.Window):
             self._display_end_screen()
         else:
             self._current_index = new_index
+            self._preload_scheduler.navigated_to(new_index)
             self._display_image()
 
     def _hide_cursor(self):
@@ -365,17 +366,28 @@ class FullScreenWindow(gtk.Window):
         self._latest_handle = None
 
     def _preload(self, size):
-        self._preload_or_unload(size, True)
-
-    def _preload_or_unload(self, size, preload):
-        index = self._current_index
-        for x in [index + 2, index - 1, index + 1]:
-            if self._is_valid_index(x):
-                location = self._image_versions[x].getLocation()
-                if preload:
-                    env.pixbufLoader.preload(location, size)
-                else:
-                    env.pixbufLoader.unload(location, size)
+        # Preloads outside the new window (for instance in the old
+        # direction or the old size) are unloaded by the scheduler.
+        indexes = self._preload_scheduler.get_indexes(
+            self._current_index, len(self._image_versions))
+        self._preload_scheduler.update_preloads(
+            env.pixbufLoader,
+            [self._image_versions[x].getLocation() for x in indexes],
+            size,
+            self._get_persistence_size_limit(size),
+            self._image_versions[self._current_index].getLocation())
+
+    def _record_load(self, path, size):
+        scheduler = self._preload_scheduler
+        scheduler.record_load(env.pixbufLoader.is_cached(path, size))
+        env.debug("preload statistics: %s" % scheduler.get_statistics())
+
+    def _get_persistence_size_limit(self, size):
+        # Store scaled images in the disk cache.
+        if size is None:
+            return None
+        else:
+            return max(size)
 
     def _toggle_categorization_form(self):
         if not self._image_view.props.visible:
@@ -411,9 +423,6 @@ class FullScreenWindow(gtk.Window):
             self._key_assignment_hbox.show_all()
             self._key_assignment_entry.grab_focus()
 
-    def _unload(self, size):
-        self._preload_or_unload(size, False)
-
     def _update_image_categories_label(self):
         image = self._image_versions[self._current_index].getImage()
         categories = image.getCategories()
@@ -3,6 +3,7 @@ import os
 import re
 from kofoto.gkofoto.environment import env
 from kofoto import generate
+from kofoto.assetpublisher import DEFAULT_PUBLISH_MODE
 from kofoto import shelfexceptions
 
 class GenerateHTMLDialog:
@@ -85,6 +86,8 @@ class GenerateHTMLDialog:
         imgsizes = sorted(
             imgsizesset, cmp=lambda x, y: cmp(x[0] * x[1], y[0] * y[1]))
         env.imagesizelimits = imgsizes
+        env.publishmode = DEFAULT_PUBLISH_MODE
+        env.searchindex = False
 
         try:
             generator = generate.Generator(u"woolly", env)
@@ -663,6 +663,7 @@ if __name__ == "__main__":
 
     env.iconDir = "%s/../../../gkofoto/icons" % os.path.dirname(sys.argv[0])
 
+    gobject.threads_init()
     caching_pixbuf_loader = CachingPixbufLoader()
 
     class State:
@@ -0,0 +1,308 @@
+"""This module contains the LazyObjectModel class."""
+
+__all__ = ["LazyObjectModel"]
+
+import gtk
+
+# Number of rows to load at a time.
+BATCH_SIZE = 200
+
+class LazyObjectModel(gtk.GenericTreeModel):
+    """A list model whose rows are loaded on demand.
+
+    The model is backed by a list of keys (typically object IDs). The
+    values of a row are not loaded until some value (other than the
+    key) is read, for instance when the row is rendered by a view.
+    Rows are then loaded in batches by a row loader function, so that
+    the cost of creating the model is independent of the number of
+    rows and the cost of displaying it is proportional to the number
+    of displayed rows.
+
+    Some columns (typically thumbnails) may be loaded separately on
+    demand by column functions, so that they are only loaded for rows
+    where the column actually is read.
+
+    Rows with the same key share values.
+    """
+
+    def __init__(self, column_types, key_column, keys, row_loader,
+                 column_functions=None, column_loader=None):
+        """Constructor.
+
+        Arguments:
+
+        column_types     -- A list of column types.
+        key_column       -- The number of the column that contains the
+                            keys.
+        keys             -- A list of keys, one for each row.
+        row_loader       -- A function taking a list of keys and
+                            returning a dictionary mapping each key to
+                            a list of column values.
+        column_functions -- A dictionary mapping column numbers to
+                            functions taking a row number and a key and
+                            returning the value of the column. The
+                            function is called the first time the
+                            value is read. Values returned by
+                            row_loader for these columns are ignored.
+        column_loader    -- A function taking a column number and a
+                            list of keys and returning a dictionary
+                            mapping each key to the value of the
+                            column, or None if the column can't be
+                            loaded separately. Used by
+                            get_column_values.
+        """
+
+        gtk.GenericTreeModel.__init__(self)
+        self._column_types = column_types
+        self._key_column = key_column
+        self._keys = list(keys)
+        self._row_loader = row_loader
+        self._column_loader = column_loader
+        self._rows = {} # key --> list of values
+        self._column_values = {} # column --> key --> value
+        self._column_functions = {}
+        if column_functions:
+            for column, function in column_functions.iteritems():
+                self._column_functions[column] = function
+                self._column_values[column] = {}
+        # Row references are row numbers. Keep them alive here, since
+        # the model doesn't leak references to them.
+        self._rowrefs = range(len(self._keys))
+        self.set_property("leak-references", False)
+
+    def __delitem__(self, path):
+        """Remove a row."""
+
+        rownr = _row_number(path)
+        if not 0 <= rownr < len(self._keys):
+            raise IndexError(rownr)
+        del self._keys[rownr]
+        self.row_deleted((rownr,))
+
+    def get_column_values(self, column):
+        """Get the values of a column for all rows.
+
+        Values of rows that haven't been loaded are fetched by the
+        column loader if possible, which is much cheaper than loading
+        the rows.
+
+        Returns a list of values, one for each row.
+        """
+
+        if column == self._key_column:
+            return list(self._keys)
+        if column in self._column_values:
+            return [self.get_row_value(x, column)
+                    for x in range(len(self._keys))]
+        fetched = {}
+        if self._column_loader is not None:
+            missing = list(set(
+                [x for x in self._keys if x not in self._rows]))
+            if missing:
+                fetched = self._column_loader(column, missing)
+                if fetched is None:
+                    fetched = {}
+        values = []
+        for rownr, key in enumerate(self._keys):
+            if key in fetched:
+                values.append(fetched[key])
+            else:
+                values.append(self._get_row(rownr)[column])
+        return values
+
+    def get_keys(self):
+        """Get the list of keys.
+
+        The list must not be modified.
+        """
+
+        return self._keys
+
+    def get_row_value(self, rownr, column):
+        """Get the value of a column of a row.
+
+        Unlike get_value, the value is returned as stored, without
+        conversion to the column type.
+        """
+
+        return self.on_get_value(rownr, column)
+
+    def insert_keys(self, position, keys):
+        """Insert rows.
+
+        Arguments:
+
+        position -- The number of the row to insert the rows before,
+                    or None to insert them last.
+        keys     -- The keys of the new rows.
+        """
+
+        if position is None or position > len(self._keys):
+            position = len(self._keys)
+        self._keys[position:position] = keys
+        self._extend_rowrefs()
+        for rownr in range(position, position + len(keys)):
+            self.row_inserted((rownr,), self.get_iter((rownr,)))
+
+    def move_after(self, iterator, position):
+        """Move a row after another row.
+
+        Arguments:
+
+        iterator -- An iterator pointing to the row to move.
+        position -- An iterator pointing to the row to move it after,
+                    or None to move the row first.
+        """
+
+        if position is None:
+            target = 0
+        else:
+            target = self.get_user_data(position) + 1
+        self._move(self.get_user_data(iterator), target)
+
+    def move_before(self, iterator, position):
+        """Move a row before another row.
+
+        Arguments:
+
+        iterator -- An iterator pointing to the row to move.
+        position -- An iterator pointing to the row to move it before,
+                    or None to move the row last.
+        """
+
+        if position is None:
+            target = len(self._keys)
+        else:
+            target = self.get_user_data(position)
+        self._move(self.get_user_data(iterator), target)
+
+    def remove(self, iterator):
+        """Remove a row."""
+
+        del self[(self.get_user_data(iterator),)]
+
+    def set_value(self, iterator, column, value):
+        """Set the value of a column.
+
+        Since rows with the same key share values, the value is set
+        for all rows with the same key.
+        """
+
+        rownr = self.get_user_data(iterator)
+        key = self._keys[rownr]
+        assert column != self._key_column
+        if column in self._column_values:
+            self._column_values[column][key] = value
+        else:
+            self._get_row(rownr)[column] = value
+        self.row_changed((rownr,), iterator)
+
+    ##############################
+    # GenericTreeModel interface.
+
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY
+
+    def on_get_n_columns(self):
+        return len(self._column_types)
+
+    def on_get_column_type(self, index):
+        return self._column_types[index]
+
+    def on_get_iter(self, path):
+        rownr = path[0]
+        if rownr < len(self._keys):
+            return self._rowrefs[rownr]
+        else:
+            return None
+
+    def on_get_path(self, rowref):
+        return (rowref,)
+
+    def on_get_value(self, rowref, column):
+        key = self._keys[rowref]
+        if column == self._key_column:
+            return key
+        values = self._column_values.get(column)
+        if values is not None:
+            if key not in values:
+                values[key] = self._column_functions[column](rowref, key)
+            return values[key]
+        return self._get_row(rowref)[column]
+
+    def on_iter_next(self, rowref):
+        rownr = rowref + 1
+        if rownr < len(self._keys):
+            return self._rowrefs[rownr]
+        else:
+            return None
+
+    def on_iter_children(self, parent):
+        if parent is None and self._keys:
+            return self._rowrefs[0]
+        else:
+            return None
+
+    def on_iter_has_child(self, rowref):
+        return False
+
+    def on_iter_n_children(self, rowref):
+        if rowref is None:
+            return len(self._keys)
+        else:
+            return 0
+
+    def on_iter_nth_child(self, parent, n):
+        if parent is None and n < len(self._keys):
+            return self._rowrefs[n]
+        else:
+            return None
+
+    def on_iter_parent(self, child):
+        return None
+
+    ##############################
+    # Internal methods.
+
+    def _extend_rowrefs(self):
+        if len(self._rowrefs) < len(self._keys):
+            self._rowrefs.extend(
+                range(len(self._rowrefs), len(self._keys)))
+
+    def _get_row(self, rownr):
+        key = self._keys[rownr]
+        row = self._rows.get(key)
+        if row is None:
+            self._load_rows(rownr)
+            row = self._rows[key]
+        return row
+
+    def _load_rows(self, rownr):
+        # Load the row and the following unloaded rows, since they
+        # probably will be displayed too.
+        keys = []
+        seen = set()
+        for key in self._keys[rownr:rownr + BATCH_SIZE]:
+            if key not in self._rows and key not in seen:
+                keys.append(key)
+                seen.add(key)
+        self._rows.update(self._row_loader(keys))
+
+    def _move(self, source, target):
+        if target > source:
+            target -= 1
+        if target == source:
+            return
+        key = self._keys.pop(source)
+        self._keys.insert(target, key)
+        new_order = range(len(self._keys))
+        moved = new_order.pop(source)
+        new_order.insert(target, moved)
+        self.rows_reordered(None, None, new_order)
+
+
+def _row_number(path):
+    if isinstance(path, tuple):
+        return path[0]
+    else:
+        return path
@@ -1,6 +1,7 @@
 import codecs
 import os
 import sys
+import gobject
 from kofoto.clientutils import expanduser, get_file_encoding
 from kofoto.config import DEFAULT_CONFIGFILE_LOCATION
 from kofoto.gkofoto.environment import env
@@ -71,6 +72,11 @@ def main(bindir, argv):
     if sys.platform == "win32":
         setupWindowsEnvironment()
 
+    # The image decoding and thumbnail threads started by env.setup
+    # only get to run while the main loop releases the global
+    # interpreter lock, which it only does after threads_init. (They
+    # don't call GTK, so gtk.gdk.threads_init isn't needed.)
+    gobject.threads_init()
     setupOk = env.setup(
         bindir, options.debug, options.configfile, options.database)
     env.controller = Controller()
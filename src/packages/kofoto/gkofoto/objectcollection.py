@@ -4,7 +4,6 @@ import gobject
 import gc
 import subprocess
 from kofoto.shelfexceptions import BadAlbumTagError
-from kofoto.timer import Timer
 from kofoto.gkofoto.environment import env
 from kofoto.gkofoto.objectselection import ObjectSelection
 from kofoto.gkofoto.albumdialog import AlbumDialog
@@ -15,7 +14,7 @@ from kofoto.gkofoto.registerimageversionsdialog import \
 from kofoto.gkofoto.duplicateandopenimagedialog import \
     DuplicateAndOpenImageDialog
 from kofoto.gkofoto.fullscreenwindow import FullScreenWindow
-from kofoto.gkofoto.pseudothread import PseudoThread
+from kofoto.gkofoto.lazyobjectmodel import LazyObjectModel
 
 class ObjectCollection(object):
 
@@ -25,7 +24,6 @@ class ObjectCollection(object):
     def __init__(self):
         env.debug("Init ObjectCollection")
         self.__objectSelection = ObjectSelection(self)
-        self.__insertionPseudoThread = None
         self.__registeredViews = []
         self.__disabledFields = set()
         self.__rowInsertedCallbacks = []
@@ -47,7 +45,7 @@ class ObjectCollection(object):
             }
         for name in env.shelf.getAllAttributeNames():
             self.__addAttribute(name)
-        self.__treeModel = gtk.ListStore(*self.__columnsType)
+        self.__treeModel = self.__createTreeModel([])
         self.__frozen = False
         self.__nrOfAlbums = 0
         self.__nrOfImages = 0
@@ -64,12 +62,13 @@ class ObjectCollection(object):
 
     # Return true if objects may be added and removed from the collection.
     def isMutable(self):
-        return not self.isLoading()
+        return True
 
-    # Return true if object collection has not finished loading.
+    # Return true if object collection has not finished loading. Rows
+    # are loaded on demand by the tree model, so this is never the
+    # case.
     def isLoading(self):
-        ipt = self.__insertionPseudoThread
-        return ipt and ipt.is_running()
+        return False
 
     def getCutLabel(self):
         return "Cut reference"
@@ -169,9 +168,9 @@ class ObjectCollection(object):
         env.debug("Clearing object collection")
         if freeze:
             self._freezeViews()
-        if self.isLoading():
-            self.__loadingFinished()
-        self.__treeModel.clear()
+        env.thumbnailLoader.cancel(self)
+        env.thumbnailLoader.set_urgent_key_function(self, None)
+        self._setTreeModel(self.__createTreeModel([]))
         gc.collect()
         self.__nrOfAlbums = 0
         self.__nrOfImages = 0
@@ -275,94 +274,105 @@ class ObjectCollection(object):
     def _getRegisteredViews(self):
         return self.__registeredViews
 
-    def _loadObjectList(self, objectList):
+    def _loadObjectIds(self, objectIds):
         env.enter("Object collection loading objects.")
         self._freezeViews()
         self.clear(False)
-        self._insertObjectList(objectList)
+        objectIds = list(objectIds)
+        self._setTreeModel(self.__createTreeModel(objectIds))
+        self.__countObjects(objectIds)
+        self.__loadingFinished()
         self._thawViews()
         env.exit("Object collection loading objects. (albums=" + str(self.__nrOfAlbums) + " images=" + str(self.__nrOfImages) + ")")
 
-    def _insertObjectList(self, objectList, location=None):
+    def _insertObjectIds(self, objectIds, location=None):
         # location = None means insert last, otherwise insert before
         # location.
         #
         # Note that this method does NOT update objectSelection.
 
-        if location == None:
-            location = len(self.__treeModel)
-        self.__insertionPseudoThread = PseudoThread(
-            self.__insertionWorker(objectList, location))
-        self.__insertionPseudoThread.start()
-
-    def __insertionWorker(self, objectList, location):
-        timer = Timer()
-        for obj in objectList:
-            self._freezeViews()
-
-#            self.__treeModel.insert(location)
-# Work-around for bug 171027 in PyGTK 2.6.1:
-            if location >= len(self.__treeModel):
-                iterator = self.__treeModel.append()
-            else:
-                iterator = self.__treeModel.insert_before(
-                    self.__treeModel[location].iter)
-# End work-around.
+        objectIds = list(objectIds)
+        self.__treeModel.insert_keys(location, objectIds)
+        self.signalRowInserted()
+        self.__countObjects(objectIds)
+        self.__loadingFinished()
 
-            self.__treeModel.set_value(iterator, self.COLUMN_OBJECT_ID, obj.getId())
+    # Called when the tree model has been replaced. Subclasses that
+    # wrap the tree model should override this method.
+    def _setTreeModel(self, model):
+        self.__treeModel = model
+
+    def __createTreeModel(self, objectIds):
+        return LazyObjectModel(
+            self.__columnsType,
+            self.COLUMN_OBJECT_ID,
+            objectIds,
+            self.__loadRows,
+            {self.COLUMN_THUMBNAIL: self.__getThumbnail},
+            self.__loadColumn)
+
+    def __loadRows(self, objectIds):
+        objects = env.shelf.getObjects(objectIds)
+        images = [x for x in objects if not x.isAlbum()]
+        env.shelf.preloadAttributes(objects)
+        env.shelf.preloadPrimaryVersions(images)
+        versionCounts = env.shelf.getImageVersionCounts(images)
+        rows = {}
+        for obj in objects:
+            row = [None] * len(self.__columnsType)
+            row[self.COLUMN_VALID_LOCATION] = False
+            row[self.COLUMN_VALID_CHECKSUM] = False
+            row[self.COLUMN_ROW_EDITABLE] = True
+            row[self.COLUMN_OBJECT_ID] = obj.getId()
             if obj.isAlbum():
-                self.__treeModel.set_value(iterator, self.COLUMN_IS_ALBUM, True)
-                self.__treeModel.set_value(iterator, self.COLUMN_ALBUM_TAG, obj.getTag())
-                self.__treeModel.set_value(iterator, self.COLUMN_LOCATION, None)
-                self.__treeModel.set_value(iterator, self.COLUMN_IMAGE_VERSIONS, "")
-                self.__nrOfAlbums += 1
+                row[self.COLUMN_IS_ALBUM] = True
+                row[self.COLUMN_ALBUM_TAG] = obj.getTag()
+                row[self.COLUMN_IMAGE_VERSIONS] = ""
             else:
                 if obj.getPrimaryVersion():
-                    ivlocation = obj.getPrimaryVersion().getLocation()
-                else:
-                    ivlocation = None
-                imageVersions = list(obj.getImageVersions())
-                if len(imageVersions) > 1:
-                    imageVersionsText = str(len(imageVersions))
-                else:
-                    imageVersionsText = ""
-                self.__treeModel.set_value(iterator, self.COLUMN_IS_ALBUM, False)
-                self.__treeModel.set_value(iterator, self.COLUMN_ALBUM_TAG, None)
-                self.__treeModel.set_value(iterator, self.COLUMN_LOCATION, ivlocation)
-                self.__treeModel.set_value(iterator, self.COLUMN_IMAGE_VERSIONS, imageVersionsText)
-                self.__nrOfImages += 1
+                    row[self.COLUMN_LOCATION] = \
+                        obj.getPrimaryVersion().getLocation()
+                row[self.COLUMN_IS_ALBUM] = False
+                row[self.COLUMN_IMAGE_VERSIONS] = \
+                    self.__imageVersionsText(versionCounts[obj.getId()])
                 # TODO Set COLUMN_VALID_LOCATION and COLUMN_VALID_CHECKSUM
             for attribute, value in obj.getAttributeMap().iteritems():
                 if "@" + attribute in self.__objectMetadataMap:
                     column = self.__objectMetadataMap["@" + attribute][self.COLUMN_NR]
-                    self.__treeModel.set_value(iterator, column, value)
-            self.__treeModel.set_value(iterator, self.COLUMN_ROW_EDITABLE, True)
-            self._thawViews()
-            self.signalRowInserted()
-            self.__loadThumbnail(self.__treeModel, iterator)
-            location += 1
-            self.__updateObjectCount(True)
-            if timer.get() > 0.05:
-                yield True
-                timer.reset()
+                    row[column] = value
+            rows[obj.getId()] = row
+        return rows
+
+    # Called by the tree model to fetch the values of a column for
+    # many rows at once, e.g. when sorting. Only attribute columns can
+    # be fetched without loading whole rows.
+    def __loadColumn(self, column, objectIds):
+        for (name, metadata) in self.__objectMetadataMap.iteritems():
+            if name.startswith("@") and metadata[self.COLUMN_NR] == column:
+                return env.shelf.getAttributeValues(name[1:], objectIds)
+        return None
+
+    def __imageVersionsText(self, nrOfImageVersions):
+        if nrOfImageVersions > 1:
+            return str(nrOfImageVersions)
+        else:
+            return ""
 
+    def __countObjects(self, objectIds):
+        albumIds = set(env.shelf.getAllAlbumIds())
+        nrOfAlbums = len([x for x in objectIds if x in albumIds])
+        self.__nrOfAlbums += nrOfAlbums
+        self.__nrOfImages += len(objectIds) - nrOfAlbums
         self._handleNrOfObjectsUpdate()
-        self.__loadingFinished()
-        yield False
 
     def __loadingFinished(self):
-        self.__updateObjectCount(False)
+        self.__updateObjectCount()
         for view in self.__registeredViews:
             view.loadingFinished()
-        self.__insertionPseudoThread.stop()
-        self.__insertionPseudoThread = None
 
-    def __updateObjectCount(self, loadingInProgress):
+    def __updateObjectCount(self):
         env.widgets["statusbarLoadedObjects"].pop(1)
-        if loadingInProgress:
-            text = "%d objects (and counting...)" % len(self.__treeModel)
-        else:
-            text = "%d objects" % len(self.__treeModel)
+        text = "%d objects" % len(self.__treeModel)
         env.widgets["statusbarLoadedObjects"].push(1, text)
 
     def _handleNrOfObjectsUpdate(self):
@@ -444,12 +454,9 @@ class ObjectCollection(object):
         model = self.getUnsortedModel()
         for (rowNr, obj) in self.__objectSelection.getMap().iteritems():
             if not obj.isAlbum():
-                self.__loadThumbnail(model, model.get_iter(rowNr))
-                imageVersions = list(obj.getImageVersions())
-                if len(imageVersions) > 1:
-                    imageVersionsText = str(len(imageVersions))
-                else:
-                    imageVersionsText = ""
+                self.__reloadThumbnail(rowNr)
+                imageVersionsText = self.__imageVersionsText(
+                    len(list(obj.getImageVersions())))
                 model.set_value(model.get_iter(rowNr), self.COLUMN_IMAGE_VERSIONS, imageVersionsText)
 
     def createAlbumChild(self, *unused):
@@ -574,8 +581,7 @@ class ObjectCollection(object):
                     dialog.destroy()
                 else:
                     imageversion.contentChanged()
-                    model = self.getUnsortedModel()
-                    self.__loadThumbnail(model, model.get_iter(rowNr))
+                    self.__reloadThumbnail(rowNr)
         self.reloadSingleObjectView()
 
     def rotateImageLeft(self, widget, *unused):
@@ -651,21 +657,63 @@ class ObjectCollection(object):
                                                 name)
         self.__columnsType.append(gobject.TYPE_STRING)
 
-    def __loadThumbnail(self, model, iterator):
-        objectId = model.get_value(iterator, self.COLUMN_OBJECT_ID)
+    # Called by the tree model the first time the thumbnail of a row
+    # is needed, i.e. when the row is rendered.
+    def __getThumbnail(self, rowNr, objectId):
         obj = env.shelf.getObject(objectId)
         if obj.isAlbum():
-            pixbuf = env.albumIconPixbuf
+            return env.albumIconPixbuf
         elif not obj.getPrimaryVersion():
-            pixbuf = env.unknownImageIconPixbuf
+            return env.unknownImageIconPixbuf
         else:
-            try:
-                thumbnailLocation = env.imageCache.get(
-                    obj.getPrimaryVersion(),
-                    env.thumbnailSize[0],
-                    env.thumbnailSize[1])[0]
-                pixbuf = gtk.gdk.pixbuf_new_from_file(thumbnailLocation)
-                # TODO Set and use COLUMN_VALID_LOCATION and COLUMN_VALID_CHECKSUM
-            except IOError:
-                pixbuf = env.unknownImageIconPixbuf
-        model.set_value(iterator, self.COLUMN_THUMBNAIL, pixbuf)
+            # The thumbnail is loaded in the background. Until it
+            # arrives, the row shows a placeholder.
+            env.thumbnailLoader.set_urgent_key_function(
+                self, self.__getUrgentThumbnailKeys)
+            env.thumbnailLoader.load(
+                self,
+                objectId,
+                obj.getPrimaryVersion(),
+                lambda pixbuf: self.__setThumbnail(objectId, rowNr, pixbuf),
+                lambda: self.__setThumbnail(
+                    objectId, rowNr, env.unknownImageIconPixbuf))
+            # TODO Set and use COLUMN_VALID_LOCATION and COLUMN_VALID_CHECKSUM
+            return env.loadingPixbuf
+
+    def __reloadThumbnail(self, rowNr):
+        # The old thumbnail is shown until the new one arrives.
+        model = self.__treeModel
+        pixbuf = self.__getThumbnail(
+            rowNr, model[rowNr][self.COLUMN_OBJECT_ID])
+        if pixbuf is not env.loadingPixbuf:
+            model.set_value(
+                model.get_iter(rowNr), self.COLUMN_THUMBNAIL, pixbuf)
+
+    def __setThumbnail(self, objectId, rowNrHint, pixbuf):
+        model = self.__treeModel
+        if (rowNrHint < len(model) and
+            model[rowNrHint][self.COLUMN_OBJECT_ID] == objectId):
+            rowNrs = [rowNrHint]
+        else:
+            # Rows have been inserted or removed since the thumbnail
+            # was requested, so search for the object's rows.
+            rowNrs = [rowNr
+                      for (rowNr, key) in enumerate(model.get_keys())
+                      if key == objectId]
+        for rowNr in rowNrs:
+            model.set_value(model.get_iter(rowNr), self.COLUMN_THUMBNAIL, pixbuf)
+
+    def __getUrgentThumbnailKeys(self):
+        # Thumbnails of visible rows are loaded first, then those of
+        # selected rows.
+        model = self.__treeModel
+        for view in self.__registeredViews:
+            visibleRange = view.getVisibleRowRange()
+            if visibleRange is None:
+                continue
+            first, last = visibleRange
+            for rowNr in xrange(first, min(last + 1, len(model))):
+                unsortedRowNr = self.convertToUnsortedRowNr(rowNr)
+                yield model[unsortedRowNr][self.COLUMN_OBJECT_ID]
+        for obj in self.__objectSelection.getMap().itervalues():
+            yield obj.getId()
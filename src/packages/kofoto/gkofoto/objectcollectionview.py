@@ -120,6 +120,12 @@ class ObjectCollectionView:
     def loadingFinished(self):
         self._updateContextMenu()
 
+    # Return a tuple (first, last) of the numbers of the rows (in the
+    # collection's model) that currently are visible, or None if
+    # unknown.
+    def getVisibleRowRange(self):
+        return None
+
     def _mouse_button_pressed(self, widget, event):
         widget.grab_focus()
         if event.button == 3:
@@ -62,7 +62,7 @@ class ObjectSelection:
     def getMap(self):
         return self.__selectedObjects
 
-    def getImageFilenamesToPreload(self):
+    def getImageFilenamesToPreload(self, preloadScheduler):
         oc = self.__objectCollection
         model = oc.getModel()
         if len(self) == 0:
@@ -71,14 +71,13 @@ class ObjectSelection:
             rowNumbers = sorted(self)
             rowNr = rowNumbers[0]
         filenames = []
-        for x in [rowNr - 2, rowNr + 2, rowNr - 1, rowNr + 1]: # TODO: Make configurable.
-            if 0 <= x < len(model):
-                ux = oc.convertToUnsortedRowNr(x)
-                obj = self.__getObject(ux)
-                if not obj.isAlbum():
-                    imageversion = obj.getPrimaryVersion()
-                    if imageversion:
-                        filenames.append(imageversion.getLocation())
+        for x in preloadScheduler.get_indexes(rowNr, len(model)):
+            ux = oc.convertToUnsortedRowNr(x)
+            obj = self.__getObject(ux)
+            if not obj.isAlbum():
+                imageversion = obj.getPrimaryVersion()
+                if imageversion:
+                    filenames.append(imageversion.getLocation())
         env.debug("filenames to preload: %s" % str(filenames))
         return filenames
 
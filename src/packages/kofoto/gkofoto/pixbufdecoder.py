@@ -0,0 +1,137 @@
+"""This module contains the PixbufDecoder class."""
+
+__all__ = ["PixbufDecoder"]
+
+import threading
+from Queue import Queue, Empty
+import gtk
+import Image as PILImage
+import kofoto.exifthumbsupport # Registers the EXIFTHUMB format.
+from kofoto.rectangle import Rectangle
+
+class PixbufDecoder(object):
+    """Decode and scale images in a pool of worker threads.
+
+    Images are decoded with PIL, which releases the global
+    interpreter lock while decoding and resampling, so several images
+    can be decoded in parallel without blocking the GTK main loop. The
+    decoded pixels are returned as raw RGB buffers, and pixbufs are
+    only created (by make_pixbuf) in the thread that collects the
+    results, which should be the main thread.
+
+    Jobs are started in the order they are submitted. To keep the
+    caller in control of priorities, the caller should only submit
+    jobs while is_full returns false.
+    """
+
+    def __init__(self, nthreads):
+        """Constructor.
+
+        Arguments:
+
+        nthreads     -- Number of worker threads.
+        """
+
+        self._nthreads = nthreads
+        self._jobs = Queue()
+        self._results = Queue()
+        self._nr_of_jobs = 0
+        for unused in range(nthreads):
+            thread = threading.Thread(target=self._worker)
+            thread.setDaemon(True)
+            thread.start()
+
+    def get_finished(self):
+        """Get finished jobs.
+
+        Returns a list of tuples (token, result), where token is the
+        token passed to submit and result is a tuple (original_size,
+        size, data) or None on error. original_size and size are
+        tuples (width, height) and data is the RGB data of the
+        decoded image.
+        """
+
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except Empty:
+                break
+        self._nr_of_jobs -= len(finished)
+        return finished
+
+    def get_number_of_jobs(self):
+        """Get the number of submitted jobs that haven't been
+        collected by get_finished."""
+
+        return self._nr_of_jobs
+
+    def is_full(self):
+        """Check whether all worker threads are busy."""
+
+        return self._nr_of_jobs >= self._nthreads
+
+    def submit(self, token, path, size_limit):
+        """Submit a decoding job.
+
+        Arguments:
+
+        token        -- An object identifying the job.
+        path         -- A path to the image.
+        size_limit   -- A tuple (width, height) with the size limit of
+                        the decoded image, or None. If None, the
+                        image is decoded in full size.
+        """
+
+        self._nr_of_jobs += 1
+        self._jobs.put((token, path, size_limit))
+
+    def _worker(self):
+        while True:
+            token, path, size_limit = self._jobs.get()
+            try:
+                result = decode_image(path, size_limit)
+            except:
+                # PIL raises various exceptions for unreadable or
+                # broken images. Report them all as errors instead of
+                # killing the thread.
+                result = None
+            self._results.put((token, result))
+
+######################################################################
+
+def decode_image(path, size_limit):
+    """Decode and scale an image.
+
+    Arguments:
+
+    path         -- A path to the image.
+    size_limit   -- A tuple (width, height) with the size limit of the
+                    decoded image, or None.
+
+    Returns a tuple (original_size, size, data), where data is the RGB
+    data of the decoded image.
+    """
+
+    image = PILImage.open(path)
+    original_size = image.size
+    if size_limit is None or Rectangle(*original_size).fits_within(size_limit):
+        size = original_size
+    else:
+        size = tuple(Rectangle(*original_size).downscaled_to(size_limit))
+        # Let the JPEG decoder do most of the downscaling, which is
+        # much faster than decoding the whole image.
+        image.draft("RGB", size)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if image.size != size:
+        image = image.resize(size, PILImage.ANTIALIAS)
+    return (original_size, size, image.tostring())
+
+
+def make_pixbuf(size, data):
+    """Create a pixbuf from RGB data returned by decode_image."""
+
+    return gtk.gdk.pixbuf_new_from_data(
+        data, gtk.gdk.COLORSPACE_RGB, False, 8, size[0], size[1],
+        3 * size[0])
@@ -0,0 +1,216 @@
+"""This module contains the PixbufDiskCache class."""
+
+__all__ = ["PixbufDiskCache"]
+
+import os
+import re
+import threading
+from Queue import Queue
+import Image as PILImage
+from kofoto.imagecache import ImageCache
+
+# Names of the files written by PixbufDiskCache (see
+# ImageCache.getCachedImagePath). Only such files are pruned.
+_CACHED_IMAGE_REGEXP = re.compile(r".*-\d+x\d+-up-\d+\.jpg$")
+
+class PixbufDiskCache(object):
+    """A disk cache of scaled pixbufs.
+
+    Pixbufs are stored as JPEGs in a directory that uses the same
+    layout and file names as kofoto.imagecache.ImageCache. Since the
+    modification time of the original image is part of the file name,
+    a cached image is never used after the original has changed. The
+    directory must not be shared with an ImageCache, since files in it
+    are removed when the cache is pruned.
+
+    Pixbufs are written in a background thread. Files are written to a
+    temporary name and then renamed, so a partly written file is never
+    found by lookup. When the total size of the cached images exceeds
+    the byte limit, the least recently used images are removed.
+    """
+
+    def __init__(self, cache_directory, byte_limit):
+        """Constructor.
+
+        Arguments:
+
+        cache_directory -- Path to the cache directory.
+        byte_limit      -- Maximum total size (in bytes) of the cached
+                           images.
+        """
+        self._image_cache = ImageCache(cache_directory)
+        self._cache_directory = cache_directory
+        self._byte_limit = byte_limit
+        self._used_bytes = None # Unknown until the directory is scanned.
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def get_byte_limit(self):
+        """Get the maximum total size of the cache."""
+
+        return self._byte_limit
+
+    def set_byte_limit(self, byte_limit):
+        """Set the maximum total size of the cache.
+
+        Arguments:
+
+        byte_limit -- The limit in bytes.
+        """
+
+        self._byte_limit = byte_limit
+        self._queue.put(("prune",))
+
+    def lookup(self, path, mtime, size):
+        """Look up a cached image.
+
+        Arguments:
+
+        path  -- Path to the original image.
+        mtime -- Modification time of the original image.
+        size  -- A tuple (width, height) of the wanted cached image.
+
+        Returns the path to the cached image or None if there is no
+        such image.
+        """
+
+        cached_path = self._get_cached_path(path, mtime, size)
+        if os.path.exists(cached_path):
+            self._queue.put(("touch", cached_path))
+            return cached_path
+        else:
+            return None
+
+    def remove(self, path, mtime, size):
+        """Remove a cached image, for instance if it turned out to be
+        corrupt.
+
+        Arguments:
+
+        path  -- Path to the original image.
+        mtime -- Modification time of the original image.
+        size  -- A tuple (width, height) of the cached image.
+        """
+
+        self._queue.put(
+            ("remove", self._get_cached_path(path, mtime, size)))
+
+    def store(self, path, mtime, pixbuf):
+        """Store a pixbuf in the cache asynchronously.
+
+        Arguments:
+
+        path   -- Path to the original image.
+        mtime  -- Modification time of the original image.
+        pixbuf -- The (scaled) pixbuf to store.
+        """
+
+        size = (pixbuf.get_width(), pixbuf.get_height())
+        if pixbuf.get_has_alpha():
+            mode = "RGBA"
+        else:
+            mode = "RGB"
+        # Copy the pixels here, since pixbufs should only be touched
+        # in the main thread.
+        self._queue.put((
+            "store",
+            self._get_cached_path(path, mtime, size),
+            mode,
+            size,
+            pixbuf.get_rowstride(),
+            pixbuf.get_pixels()))
+
+    def wait(self):
+        """Wait until all pending writes have finished."""
+
+        self._queue.join()
+
+    def _get_cached_path(self, path, mtime, size):
+        return self._image_cache.getCachedImagePath(
+            path, mtime, size[0], size[1], "up")
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                try:
+                    getattr(self, "_do_" + job[0])(*job[1:])
+                except (IOError, OSError):
+                    # The disk cache is only an optimization, so
+                    # ignore failures.
+                    pass
+            finally:
+                self._queue.task_done()
+
+    def _do_touch(self, cached_path):
+        os.utime(cached_path, None)
+
+    def _do_remove(self, cached_path):
+        size = os.path.getsize(cached_path)
+        os.unlink(cached_path)
+        if self._used_bytes is not None:
+            self._used_bytes -= size
+
+    def _do_store(self, cached_path, mode, size, rowstride, pixels):
+        directory = os.path.dirname(cached_path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        image = PILImage.frombuffer(
+            mode, size, pixels, "raw", mode, rowstride, 1)
+        if mode != "RGB":
+            image = image.convert("RGB")
+        temp_path = "%s.%d.tmp" % (cached_path, os.getpid())
+        try:
+            image.save(temp_path, "JPEG", quality=90)
+            try:
+                os.rename(temp_path, cached_path)
+            except OSError:
+                # The destination exists on a platform where rename
+                # doesn't replace files.
+                os.unlink(temp_path)
+                return
+        except:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        if self._used_bytes is not None:
+            self._used_bytes += os.path.getsize(cached_path)
+        self._do_prune()
+
+    def _do_prune(self):
+        if self._used_bytes is not None and self._used_bytes <= self._byte_limit:
+            return
+        files = []
+        self._used_bytes = 0
+        for dirpath, _, filenames in os.walk(self._cache_directory):
+            for filename in filenames:
+                if not _CACHED_IMAGE_REGEXP.match(filename):
+                    continue
+                filepath = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, filepath))
+                self._used_bytes += stat.st_size
+        if self._used_bytes <= self._byte_limit:
+            return
+        # Remove the least recently used files until the cache is
+        # well below the limit, so that pruning doesn't happen on
+        # every store.
+        files.sort()
+        target = 0.9 * self._byte_limit
+        for (_, size, filepath) in files:
+            if self._used_bytes <= target:
+                break
+            try:
+                os.unlink(filepath)
+            except OSError:
+                continue
+            self._used_bytes -= size
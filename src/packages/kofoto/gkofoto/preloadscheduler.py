@@ -0,0 +1,225 @@
+"""This module contains the PreloadScheduler class."""
+
+__all__ = ["PreloadScheduler", "DEFAULT_MAX_WINDOW_SIZE"]
+
+import time
+
+# Default number of images to preload ahead when navigation is slow
+# or its direction is unknown.
+DEFAULT_MIN_WINDOW_SIZE = 2
+
+# Default maximum number of images to preload ahead.
+DEFAULT_MAX_WINDOW_SIZE = 8
+
+# Number of seconds of navigation at the current speed to preload
+# ahead. Should roughly match the time it takes to load an image.
+LOOKAHEAD_TIME = 1.0
+
+# Weight of the latest step when updating the average step interval.
+SPEED_SMOOTHING = 0.5
+
+# Steps longer than this are jumps (e.g. to the first or last image)
+# and don't count as navigation in a direction.
+MAX_STEP_LENGTH = 3
+
+# Pauses longer than this (in seconds) reset the navigation speed.
+MAX_STEP_INTERVAL = 5.0
+
+class PreloadScheduler(object):
+    """Decide which images to preload when navigating through a list.
+
+    The scheduler tracks the direction and speed of navigation and
+    preloads a window of images ahead in the direction of travel. The
+    faster the navigation, the larger the window (up to a maximum).
+    One image behind is also preloaded, so that turning back is
+    quick. When direction is unknown, the minimum window is used in
+    both directions.
+
+    Preloads that fall out of the window are unloaded from the pixbuf
+    loader, so that they don't compete with images that are about to
+    be displayed.
+    """
+
+    def __init__(self, min_window_size=DEFAULT_MIN_WINDOW_SIZE,
+                 max_window_size=DEFAULT_MAX_WINDOW_SIZE):
+        """Constructor.
+
+        Arguments:
+
+        min_window_size -- Number of images to preload ahead when
+                           navigating slowly.
+        max_window_size -- Maximum number of images to preload ahead.
+        """
+
+        self._min_window_size = min_window_size
+        self._max_window_size = max(min_window_size, max_window_size)
+        self._index = None
+        self._direction = 0
+        self._step_interval = None # Average seconds between steps.
+        self._step_time = None
+        self._step_pending = False
+        self._preloaded = [] # List of (location, size_limit).
+        self._nr_of_steps = 0
+        self._nr_of_hits = 0
+
+    def get_direction(self):
+        """Get the current navigation direction (1, -1 or 0)."""
+
+        return self._direction
+
+    def get_indexes(self, index, count):
+        """Get indexes of images to preload.
+
+        Arguments:
+
+        index -- The index of the displayed image.
+        count -- The number of images in the list.
+
+        Returns a list of indexes. The most important index is last,
+        since newer preloads have higher priority in
+        CachingPixbufLoader.
+        """
+
+        window = self.get_window_size()
+        if self._direction == 0:
+            ahead = [index + i for i in range(1, window + 1)]
+            behind = [index - i for i in range(1, window + 1)]
+            indexes = []
+            for (a, b) in zip(ahead, behind):
+                indexes[:0] = [b, a]
+        else:
+            step = self._direction
+            indexes = [index - step]
+            for i in range(window, 0, -1):
+                indexes.append(index + i * step)
+        return [x for x in indexes if 0 <= x < count]
+
+    def get_statistics(self):
+        """Get preload statistics.
+
+        Returns a dictionary with the following keys:
+
+        steps       -- Number of navigation steps that displayed an
+                       image.
+        hits        -- Number of those steps where the image already
+                       was loaded.
+        hit_rate    -- hits / steps, or None if there have been no
+                       steps.
+        direction   -- The current direction.
+        window_size -- The current window size.
+        """
+
+        if self._nr_of_steps == 0:
+            hit_rate = None
+        else:
+            hit_rate = float(self._nr_of_hits) / self._nr_of_steps
+        return {
+            "direction": self._direction,
+            "hit_rate": hit_rate,
+            "hits": self._nr_of_hits,
+            "steps": self._nr_of_steps,
+            "window_size": self.get_window_size(),
+            }
+
+    def get_window_size(self):
+        """Get the number of images to preload ahead."""
+
+        if self._direction == 0 or self._step_interval is None:
+            return self._min_window_size
+        steps_per_lookahead = int(round(LOOKAHEAD_TIME / self._step_interval))
+        return max(
+            self._min_window_size,
+            min(self._max_window_size, steps_per_lookahead))
+
+    def navigated_to(self, index, now=None):
+        """Tell the scheduler that an image is about to be displayed.
+
+        Arguments:
+
+        index -- The index of the image.
+        now   -- The current time (used for testing).
+        """
+
+        if now is None:
+            now = time.time()
+        previous_index = self._index
+        previous_time = self._step_time
+        self._index = index
+        self._step_time = now
+        if previous_index is None or index == previous_index:
+            return
+        self._step_pending = True
+        step = index - previous_index
+        interval = now - previous_time
+        if abs(step) > MAX_STEP_LENGTH or interval > MAX_STEP_INTERVAL:
+            # A jump or a pause; start over.
+            self._direction = 0
+            self._step_interval = None
+            return
+        if step > 0:
+            direction = 1
+        else:
+            direction = -1
+        interval /= abs(step)
+        if direction != self._direction or self._step_interval is None:
+            self._direction = direction
+            self._step_interval = interval
+        else:
+            self._step_interval = (
+                SPEED_SMOOTHING * interval +
+                (1 - SPEED_SMOOTHING) * self._step_interval)
+
+    def record_load(self, hit):
+        """Record whether a displayed image already was loaded.
+
+        Only the first load after each navigation step is counted.
+
+        Arguments:
+
+        hit -- Whether the image was found in the cache.
+        """
+
+        if not self._step_pending:
+            return
+        self._step_pending = False
+        self._nr_of_steps += 1
+        if hit:
+            self._nr_of_hits += 1
+
+    def unload_all(self, pixbuf_loader):
+        """Unload all preloads made by update_preloads.
+
+        Arguments:
+
+        pixbuf_loader -- A CachingPixbufLoader instance.
+        """
+
+        self.update_preloads(pixbuf_loader, [], None)
+
+    def update_preloads(self, pixbuf_loader, locations, size_limit,
+                        persistence_size_limit=None, current_location=None):
+        """Preload images and unload stale preloads.
+
+        Arguments:
+
+        pixbuf_loader -- A CachingPixbufLoader instance.
+        locations     -- Locations of images to preload, least
+                         important first (e.g. as ordered by
+                         get_indexes).
+        size_limit    -- Size limit to preload the images in.
+        persistence_size_limit
+                      -- Passed on to the pixbuf loader.
+        current_location
+                      -- Location of the displayed image, which is
+                         never unloaded (it was typically preloaded
+                         before navigating to it).
+        """
+
+        wanted = [(location, size_limit) for location in locations]
+        for (location, size) in self._preloaded:
+            if (location, size) not in wanted and location != current_location:
+                pixbuf_loader.unload(location, size)
+        for location in locations:
+            pixbuf_loader.preload(
+                location, size_limit, persistence_size_limit)
+        self._preloaded = wanted
@@ -15,7 +15,7 @@ class SearchResult(SortableObjectCollection):
 
     def loadQuery(self, query):
         parser = Parser(env.shelf)
-        self._loadObjectList(env.shelf.search(parser.parse(query)))
+        self._loadObjectIds(env.shelf.searchObjectIds(parser.parse(query)))
 
 ######################################################################
 ### Private functions and datastructures
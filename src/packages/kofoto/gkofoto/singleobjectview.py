@@ -3,6 +3,7 @@ from kofoto.gkofoto.environment import env
 from kofoto.gkofoto.imageview import ImageView
 from kofoto.gkofoto.objectcollectionview import ObjectCollectionView
 from kofoto.gkofoto.imageversionslist import ImageVersionsList
+from kofoto.gkofoto.preloadscheduler import PreloadScheduler
 
 def _make_callback_wrapper(fn):
     def f(*unused):
@@ -58,7 +59,8 @@ class SingleObjectView(ObjectCollectionView, gtk.HPaned):
         self.__selectedRowNr = None
         self.__currentImageLocation = None
         self.__latestLoadPixbufHandle = None
-        self.__latestSize = (0, 0)
+        self.__preloadScheduler = PreloadScheduler(
+            max_window_size=env.preloadWindowSize)
 
     def showDetailsPane(self):
         self.__imageVersionsFrame.show()
@@ -89,6 +91,7 @@ class SingleObjectView(ObjectCollectionView, gtk.HPaned):
                     # Exactly one object selected
                     self.__selectedRowNr = objectSelection.getLowestSelectedRowNr()
                 self.__loadedObject = objectSelection[self.__selectedRowNr]
+                self.__preloadScheduler.navigated_to(self.__selectedRowNr)
             self.__loadObject(self.__loadedObject)
             enablePreviousButton = (self.__selectedRowNr > 0)
             env.widgets["previousButton"].set_sensitive(enablePreviousButton)
@@ -135,15 +138,17 @@ class SingleObjectView(ObjectCollectionView, gtk.HPaned):
     def __loadPixbuf_cb(self, size_limit):
         if self.__latestLoadPixbufHandle is not None:
             env.pixbufLoader.cancel_load(self.__latestLoadPixbufHandle)
+        self.__preloadScheduler.record_load(env.pixbufLoader.is_cached(
+            self.__currentImageLocation, size_limit))
+        env.debug("preload statistics: %s" % (
+            self.__preloadScheduler.get_statistics(),))
         self.__latestLoadPixbufHandle = env.pixbufLoader.load(
             self.__currentImageLocation,
             size_limit,
             self.__imageView.set_from_pixbuf,
-            self.__imageView.set_error)
-        if size_limit != self.__latestSize:
-            self._unloadImages(self.__latestSize)
+            self.__imageView.set_error,
+            self.__getPersistenceSizeLimit(size_limit))
         self._preloadImages(size_limit)
-        self.__latestSize = size_limit
 
     def _reloadSingleObjectView(self):
         self.reload()
@@ -218,18 +223,23 @@ class SingleObjectView(ObjectCollectionView, gtk.HPaned):
         objectSelection.setSelection([self.__selectedRowNr + direction])
 
     def _preloadImages(self, size):
-        self._preloadOrUnloadImages(size, True)
-
-    def _preloadOrUnloadImages(self, size, preload):
+        # Preloads outside the new window (for instance in the old
+        # direction or the old size) are unloaded by the scheduler.
         objectSelection = self._objectCollection.getObjectSelection()
-        for location in objectSelection.getImageFilenamesToPreload():
-            if preload:
-                env.pixbufLoader.preload(location, size)
-            else:
-                env.pixbufLoader.unload(location, size)
-
-    def _unloadImages(self, size):
-        self._preloadOrUnloadImages(size, False)
+        self.__preloadScheduler.update_preloads(
+            env.pixbufLoader,
+            objectSelection.getImageFilenamesToPreload(
+                self.__preloadScheduler),
+            size,
+            self.__getPersistenceSizeLimit(size),
+            self.__currentImageLocation)
+
+    def __getPersistenceSizeLimit(self, size):
+        # Store scaled images in the disk cache.
+        if size is None:
+            return None
+        else:
+            return max(size)
 
     def _hasFocus(self):
         return True
@@ -1,19 +1,7 @@
 import gtk
 from kofoto.gkofoto.environment import env
-from kofoto.gkofoto.mysortedmodel import MySortedModel
 from kofoto.gkofoto.objectcollection import ObjectCollection
-
-def attributeSortFunc(model, iterA, iterB, column):
-    valueA = model.get_value(iterA, column)
-    valueB = model.get_value(iterB, column)
-    try:
-        result = cmp(float(valueA), float(valueB))
-    except (ValueError, TypeError):
-        result = cmp(valueA, valueB)
-    if result == 0:
-        result = cmp(model.get_value(iterA, ObjectCollection.COLUMN_OBJECT_ID),
-                     model.get_value(iterB, ObjectCollection.COLUMN_OBJECT_ID))
-    return result
+from kofoto.gkofoto.sortedobjectmodel import SortedObjectModel
 
 class SortableObjectCollection(ObjectCollection):
 
@@ -24,7 +12,7 @@ class SortableObjectCollection(ObjectCollection):
         ObjectCollection.__init__(self)
         self.__sortOrder = None
         self.__sortColumnName = None
-        self.__sortedTreeModel = MySortedModel(self.getUnsortedModel())
+        self.__sortedTreeModel = SortedObjectModel(self.getUnsortedModel())
         self.setSortOrder(order=gtk.SORT_ASCENDING)
         self.setSortColumnName(columnName=env.defaultSortColumn)
 
@@ -40,11 +28,17 @@ class SortableObjectCollection(ObjectCollection):
     def getUnsortedModel(self):
         return ObjectCollection.getModel(self)
 
+    def _setTreeModel(self, model):
+        ObjectCollection._setTreeModel(self, model)
+        self.__sortedTreeModel.detach()
+        self.__sortedTreeModel = SortedObjectModel(model)
+        self.__configureSortedModel(self.__sortColumnName, self.__sortOrder)
+
     def convertToUnsortedRowNr(self, rowNr):
         return self.__sortedTreeModel.convert_path_to_child_path(rowNr)[0]
 
     def convertFromUnsortedRowNr(self, unsortedRowNr):
-        return self.__sortedTreeModel. convert_child_path_to_path(unsortedRowNr)[0]
+        return self.__sortedTreeModel.convert_child_path_to_path(unsortedRowNr)[0]
 
     def getSortOrder(self):
         return self.__sortOrder
@@ -93,10 +87,4 @@ class SortableObjectCollection(ObjectCollection):
             if not sortColumnName in metaDataMap:
                 sortColumnName = u"id"
             sortColumnNr = metaDataMap[sortColumnName][self.COLUMN_NR]
-            model = self.getModel()
-            model.set_sort_column_id(sortColumnNr, self.__sortOrder)
-            # It is important that the attributeSortFunc is not an class member method,
-            # otherwise we are leaking memmory.
-            model.set_sort_func(sortColumnNr,
-                                attributeSortFunc,
-                                sortColumnNr)
+            self.getModel().set_sort_column_id(sortColumnNr, sortOrder)
@@ -0,0 +1,311 @@
+"""This module contains the SortedObjectModel class."""
+
+__all__ = ["SortedObjectModel", "make_sort_key"]
+
+import bisect
+import gtk
+
+def make_sort_key(value):
+    """Make a sort key for a column value.
+
+    Missing values sort first, then numbers (and strings that can be
+    parsed as numbers) in numerical order, then other strings (such as
+    dates and times in ISO format) in lexical order.
+    """
+
+    if value is None:
+        return (0,)
+    try:
+        number = float(value)
+        if number == number: # Not NaN.
+            return (1, number)
+    except (ValueError, TypeError):
+        pass
+    return (2, value)
+
+class SortedObjectModel(gtk.GenericTreeModel):
+    """A sorted view of a LazyObjectModel.
+
+    The sort key of each row is computed once from the values of the
+    sort column, which are fetched for all rows with a single call to
+    the child model's get_column_values, and the order is then found
+    by a single key-based sort. Rows that are inserted or changed
+    later are moved to their sorted position without resorting the
+    other rows.
+
+    The map from child rows to sorted positions is only rebuilt when
+    it's needed, so appending many rows to the child model is cheap.
+    Inserting or deleting a row before other rows renumbers the
+    following child rows, though, which takes time proportional to the
+    number of rows. Inserting many rows in the middle of a large child
+    model is therefore quadratic; replace the model instead.
+
+    The child model's rows must not be reordered.
+    """
+
+    def __init__(self, child_model):
+        """Constructor.
+
+        Arguments:
+
+        child_model -- A LazyObjectModel instance.
+        """
+
+        gtk.GenericTreeModel.__init__(self)
+        self._child = child_model
+        self._sort_column = None
+        self._sort_order = gtk.SORT_ASCENDING
+        # The order is kept ascending; for descending order, paths are
+        # mirrored.
+        nrows = len(child_model)
+        self._order = range(nrows) # index --> child row number
+        # child row number --> index, or None if it must be rebuilt
+        self._positions = range(nrows)
+        self._sort_keys = None # index --> sort key, or None if unsorted
+        # Row references are paths. Keep them alive here, since the
+        # model doesn't leak references to them.
+        self._rowrefs = range(nrows)
+        self.set_property("leak-references", False)
+        self._handler_ids = [
+            child_model.connect("row-changed", self._on_row_changed),
+            child_model.connect("row-deleted", self._on_row_deleted),
+            child_model.connect("row-inserted", self._on_row_inserted),
+            ]
+
+    def __getitem__(self, path):
+        """Get a row of the child model."""
+
+        return self._child[self.convert_path_to_child_path(path)]
+
+    def __delitem__(self, path):
+        """Remove a row from the child model."""
+
+        del self._child[self.convert_path_to_child_path(path)]
+
+    def convert_child_path_to_path(self, child_path):
+        """Convert a child model path to a path in this model."""
+
+        rownr = _row_number(child_path)
+        positions = self._get_positions()
+        if not 0 <= rownr < len(positions):
+            raise IndexError(rownr)
+        return (self._mirror(positions[rownr]),)
+
+    def convert_path_to_child_path(self, path):
+        """Convert a path in this model to a child model path."""
+
+        rownr = _row_number(path)
+        if not 0 <= rownr < len(self._order):
+            raise IndexError(rownr)
+        return (self._order[self._mirror(rownr)],)
+
+    def detach(self):
+        """Disconnect the model from the child model.
+
+        Should be called when the model is no longer used, since the
+        child model's signal handlers otherwise keep it alive.
+        """
+
+        for handler_id in self._handler_ids:
+            self._child.disconnect(handler_id)
+        self._handler_ids = []
+
+    def get_sort_column_id(self):
+        """Get the sort column and order as a tuple."""
+
+        return (self._sort_column, self._sort_order)
+
+    def set_sort_column_id(self, column, order):
+        """Set the sort column and order.
+
+        Arguments:
+
+        column -- The column number, or None for the child order.
+        order  -- gtk.SORT_ASCENDING or gtk.SORT_DESCENDING.
+        """
+
+        if (column, order) == (self._sort_column, self._sort_order):
+            return
+        old_child_rownrs = self._get_child_rownrs()
+        if column != self._sort_column:
+            self._sort_column = column
+            self._sort()
+        self._sort_order = order
+        new_child_rownrs = self._get_child_rownrs()
+        if new_child_rownrs != old_child_rownrs:
+            old_paths = {}
+            for path, rownr in enumerate(old_child_rownrs):
+                old_paths[rownr] = path
+            self.rows_reordered(
+                None, None, [old_paths[x] for x in new_child_rownrs])
+
+    def set_value(self, iterator, column, value):
+        """Set the value of a column in the child model."""
+
+        child_path = self.convert_path_to_child_path(self.get_path(iterator))
+        self._child.set_value(self._child.get_iter(child_path), column, value)
+
+    ##############################
+    # GenericTreeModel interface.
+
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY
+
+    def on_get_n_columns(self):
+        return self._child.get_n_columns()
+
+    def on_get_column_type(self, index):
+        return self._child.get_column_type(index)
+
+    def on_get_iter(self, path):
+        rownr = path[0]
+        if rownr < len(self._order):
+            return self._rowrefs[rownr]
+        else:
+            return None
+
+    def on_get_path(self, rowref):
+        return (rowref,)
+
+    def on_get_value(self, rowref, column):
+        return self._child.get_row_value(
+            self._order[self._mirror(rowref)], column)
+
+    def on_iter_next(self, rowref):
+        rownr = rowref + 1
+        if rownr < len(self._order):
+            return self._rowrefs[rownr]
+        else:
+            return None
+
+    def on_iter_children(self, parent):
+        if parent is None and self._order:
+            return self._rowrefs[0]
+        else:
+            return None
+
+    def on_iter_has_child(self, rowref):
+        return False
+
+    def on_iter_n_children(self, rowref):
+        if rowref is None:
+            return len(self._order)
+        else:
+            return 0
+
+    def on_iter_nth_child(self, parent, n):
+        if parent is None and n < len(self._order):
+            return self._rowrefs[n]
+        else:
+            return None
+
+    def on_iter_parent(self, child):
+        return None
+
+    ##############################
+    # Child model signal handlers.
+
+    def _on_row_changed(self, unused, child_path, unused2):
+        rownr = child_path[0]
+        index = self._get_positions()[rownr]
+        if self._sort_keys is not None:
+            key = self._get_sort_key(rownr)
+            if key != self._sort_keys[index]:
+                old_path = self._mirror(index)
+                del self._order[index]
+                del self._sort_keys[index]
+                index = bisect.bisect_right(self._sort_keys, key)
+                self._order.insert(index, rownr)
+                self._sort_keys.insert(index, key)
+                self._positions = None
+                new_path = self._mirror(index)
+                if new_path != old_path:
+                    new_order = range(len(self._order))
+                    del new_order[old_path]
+                    new_order.insert(new_path, old_path)
+                    self.rows_reordered(None, None, new_order)
+        path = (self._mirror(index),)
+        self.row_changed(path, self.get_iter(path))
+
+    def _on_row_deleted(self, unused, child_path):
+        rownr = child_path[0]
+        index = self._get_positions()[rownr]
+        path = (self._mirror(index),)
+        del self._order[index]
+        if self._sort_keys is not None:
+            del self._sort_keys[index]
+        self._order = [x - (x > rownr) for x in self._order]
+        self._positions = None
+        self.row_deleted(path)
+
+    def _on_row_inserted(self, unused, child_path, unused2):
+        rownr = child_path[0]
+        if rownr < len(self._order):
+            # Renumber the following rows.
+            self._order = [x + (x >= rownr) for x in self._order]
+        if self._sort_keys is None:
+            index = rownr
+        else:
+            key = self._get_sort_key(rownr)
+            index = bisect.bisect_right(self._sort_keys, key)
+            self._sort_keys.insert(index, key)
+        self._order.insert(index, rownr)
+        self._positions = None
+        if len(self._rowrefs) < len(self._order):
+            self._rowrefs.extend(
+                range(len(self._rowrefs), len(self._order)))
+        path = (self._mirror(index),)
+        self.row_inserted(path, self.get_iter(path))
+
+    ##############################
+    # Internal methods.
+
+    def _get_child_rownrs(self):
+        if self._sort_order == gtk.SORT_DESCENDING:
+            return self._order[::-1]
+        else:
+            return list(self._order)
+
+    def _get_sort_key(self, rownr):
+        # The child key (object ID) breaks ties.
+        return (
+            make_sort_key(self._child.get_row_value(rownr, self._sort_column)),
+            self._child.get_keys()[rownr])
+
+    def _mirror(self, index):
+        # Convert between indexes in the ascending order and paths.
+        if self._sort_order == gtk.SORT_DESCENDING:
+            return len(self._order) - 1 - index
+        else:
+            return index
+
+    def _sort(self):
+        nrows = len(self._child)
+        if self._sort_column is None:
+            self._order = range(nrows)
+            self._sort_keys = None
+        else:
+            values = self._child.get_column_values(self._sort_column)
+            keys = self._child.get_keys()
+            sort_keys = [(make_sort_key(value), key)
+                         for (value, key) in zip(values, keys)]
+            order = range(nrows)
+            order.sort(key=sort_keys.__getitem__)
+            self._order = order
+            self._sort_keys = [sort_keys[x] for x in order]
+        self._positions = None
+
+    def _get_positions(self):
+        if self._positions is None:
+            positions = [0] * len(self._order)
+            for index, rownr in enumerate(self._order):
+                positions[rownr] = index
+            self._positions = positions
+        return self._positions
+
+
+def _row_number(path):
+    if isinstance(path, tuple):
+        return path[0]
+    else:
+        return path
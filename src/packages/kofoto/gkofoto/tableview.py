@@ -6,6 +6,13 @@ from kofoto.gkofoto.objectcollectionview import ObjectCollectionView
 from kofoto.gkofoto.objectcollection import ObjectCollection
 from kofoto.gkofoto.menuhandler import MenuGroup
 
+# Width (in pixels) of text columns when created. The user may resize
+# them.
+DEFAULT_TEXT_COLUMN_WIDTH = 120
+
+# Horizontal space (in pixels) around thumbnails.
+COLUMN_PADDING = 4
+
 class TableView(ObjectCollectionView):
 
 ###############################################################################
@@ -16,6 +23,9 @@ class TableView(ObjectCollectionView):
         ObjectCollectionView.__init__(self, env.widgets["tableView"])
         selection = self._viewWidget.get_selection()
         selection.set_mode(gtk.SELECTION_MULTIPLE)
+        # Don't let the view measure every row, since that would make
+        # the model load all rows.
+        self._viewWidget.set_fixed_height_mode(True)
         self.__viewGroup = None
         self.__selectionLocked = False
         self._viewWidget.connect("drag_data_received", self._onDragDataReceived)
@@ -66,6 +76,12 @@ class TableView(ObjectCollectionView):
                 if columnName in self.__userChosenColumns:
                     self.__createColumn(columnName, objectMetadataMap, self.__userChosenColumns[columnName])
 
+    def getVisibleRowRange(self):
+        visibleRange = self._viewWidget.get_visible_range()
+        if visibleRange is None:
+            return None
+        return (visibleRange[0][0], visibleRange[1][0])
+
     def _showHelper(self):
         env.enter("TableView.showHelper()")
         env.widgets["tableViewScroll"].show()
@@ -120,6 +136,10 @@ class TableView(ObjectCollectionView):
 
     def _thawHelper(self):
         env.enter("TableView.thawHelper()")
+        # The object collection replaces its model when loading objects.
+        model = self._objectCollection.getModel()
+        if self._viewWidget.get_model() is not model:
+            self._viewWidget.set_model(model)
         self._initDragAndDrop()
         self._connect(
             self._viewWidget, "focus-in-event", self._treeViewFocusInEvent)
@@ -273,7 +293,7 @@ class TableView(ObjectCollectionView):
                 # method as for example the album class has.
                 container = self._objectCollection.getContainer()
                 children = list(container.getChildren())
-                sourceRow = model[sourceRowNumber]
+                sourceIter = model.get_iter(sourceRowNumber)
                 targetIter = model.get_iter(targetPath)
                 objectSelection = self._objectCollection.getObjectSelection()
                 if (dropPosition == gtk.TREE_VIEW_DROP_INTO_OR_BEFORE
@@ -281,17 +301,14 @@ class TableView(ObjectCollectionView):
                     container.setChildren(self.__moveListItem(children,
                                                               sourceRowNumber,
                                                               targetPath[0]))
-                    model.insert_before(sibling=targetIter, row=sourceRow)
-                    self._objectCollection.signalRowInserted()
-                    model.remove(sourceRow.iter)
+                    model.move_before(sourceIter, targetIter)
                     # TODO update the album tree widget?
                 elif (dropPosition == gtk.TREE_VIEW_DROP_INTO_OR_AFTER
                       or dropPosition == gtk.TREE_VIEW_DROP_AFTER):
                     container.setChildren(self.__moveListItem(children,
                                                               sourceRowNumber,
                                                               targetPath[0] + 1))
-                    model.insert_after(sibling=targetIter, row=sourceRow)
-                    model.remove(sourceRow.iter)
+                    model.move_after(sourceIter, targetIter)
                     # TODO update the album tree widget?
                 objectSelection.setSelection([targetPath[0]])
                 # I've experienced that the drag-data-delete signal isn't
@@ -339,7 +356,11 @@ class TableView(ObjectCollectionView):
         (objtype, column, editedCallback, editedCallbackData) = objectMetadataMap[columnName]
         if objtype == gtk.gdk.Pixbuf:
             renderer = gtk.CellRendererPixbuf()
+            # All rows must have the same height in fixed height mode.
+            renderer.set_fixed_size(*env.thumbnailSize)
             column = gtk.TreeViewColumn(columnName, renderer, pixbuf=column)
+            column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+            column.set_fixed_width(env.thumbnailSize[0] + 2 * COLUMN_PADDING)
             env.debug("Created a PixBuf column for " + columnName)
         elif objtype == gobject.TYPE_STRING or objtype == gobject.TYPE_INT:
             renderer = gtk.CellRendererText()
@@ -348,6 +369,8 @@ class TableView(ObjectCollectionView):
                                         text=column,
                                         editable=ObjectCollection.COLUMN_ROW_EDITABLE)
             column.set_resizable(True)
+            column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+            column.set_fixed_width(DEFAULT_TEXT_COLUMN_WIDTH)
             if editedCallback:
                 cid = renderer.connect("edited",
                                        editedCallback,
@@ -0,0 +1,262 @@
+"""This module contains the ThumbnailLoader class."""
+
+__all__ = ["ThumbnailLoader"]
+
+import sys
+import threading
+from Queue import Queue, Empty
+from collections import deque
+import gobject
+import gtk
+from kofoto.timer import Timer
+
+# Number of worker threads that create thumbnails in the image cache.
+DEFAULT_NUMBER_OF_THREADS = 2
+
+# Interval (in milliseconds) between checks for finished thumbnails.
+POLL_INTERVAL = 50
+
+# Maximum time (in seconds) to spend delivering thumbnails in each
+# poll.
+MAX_DELIVERY_TIME = 0.03
+
+class _Request(object):
+    def __init__(self, owner, key, parameters, load_callback, error_callback):
+        self.owner = owner
+        self.key = key
+        self.parameters = parameters
+        self.load_callback = load_callback
+        self.error_callback = error_callback
+        self.cancelled = False
+        self.dispatched = False
+
+
+class ThumbnailLoader(object):
+    """Load thumbnails in the background.
+
+    Thumbnails are created (or found) in the image cache by a pool of
+    worker threads. The resulting pixbufs are created and delivered
+    to the callbacks in the GTK main loop, so callbacks may safely
+    touch widgets and models.
+
+    Requests are made on behalf of an owner (typically an object
+    collection), which may tell which requests are most urgent (for
+    instance those for currently visible rows) and may cancel all its
+    requests (for instance when the user navigates elsewhere).
+    """
+
+    def __init__(self, image_cache, thumbnail_size,
+                 nthreads=DEFAULT_NUMBER_OF_THREADS):
+        """Constructor.
+
+        Arguments:
+
+        image_cache    -- A kofoto.imagecache.ImageCache instance.
+        thumbnail_size -- Tuple of width limit and height limit.
+        nthreads       -- Number of worker threads.
+        """
+        self._image_cache = image_cache
+        self._thumbnail_size = thumbnail_size
+        self._nthreads = nthreads
+        self._pending = deque()
+        self._pending_by_owner = {} # owner --> key --> list of _Request
+        self._urgent_key_functions = {} # owner --> function
+        self._nr_of_dispatched = 0
+        self._work_queue = Queue()
+        self._result_queue = Queue()
+        self._poll_source = None
+        self._threads = []
+        for unused in range(nthreads):
+            thread = threading.Thread(target=self._worker)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def load(self, owner, key, imageversion, load_callback,
+             error_callback=None):
+        """Request a thumbnail.
+
+        Arguments:
+
+        owner          -- The owner of the request.
+        key            -- A key identifying the request for the owner.
+                          Several requests may have the same key.
+        imageversion   -- A kofoto.shelf.ImageVersion instance.
+        load_callback  -- A function taking a pixbuf, called when the
+                          thumbnail has been loaded.
+        error_callback -- A function taking no arguments, called if
+                          the thumbnail could not be loaded.
+
+        The callbacks are never called from within this method and
+        never called at all if the request is cancelled.
+        """
+        # The shelf may only be accessed from the main thread, so the
+        # image parameters are looked up here.
+        try:
+            parameters = self._image_cache.getParameters(imageversion)
+        except (IOError, OSError):
+            parameters = None
+        request = _Request(
+            owner, key, parameters, load_callback, error_callback)
+        self._pending.append(request)
+        self._pending_by_owner.setdefault(owner, {}).setdefault(
+            key, []).append(request)
+        self._start_polling()
+
+
+    def set_urgent_key_function(self, owner, function):
+        """Set a function that tells which requests are most urgent.
+
+        Arguments:
+
+        owner    -- The owner of the requests.
+        function -- A function taking no arguments that returns an
+                    iterable of keys (as passed to load) whose requests
+                    should be handled before other requests, or None to
+                    remove the function.
+        """
+        if function is None:
+            if owner in self._urgent_key_functions:
+                del self._urgent_key_functions[owner]
+        else:
+            self._urgent_key_functions[owner] = function
+
+
+    def cancel(self, owner, key=None):
+        """Cancel requests.
+
+        Arguments:
+
+        owner -- The owner of the requests.
+        key   -- If given, only cancel requests with this key.
+        """
+        keys = self._pending_by_owner.get(owner)
+        if not keys:
+            return
+        if key is None:
+            for requests in keys.itervalues():
+                for request in requests:
+                    request.cancelled = True
+            del self._pending_by_owner[owner]
+        elif key in keys:
+            for request in keys[key]:
+                request.cancelled = True
+            del keys[key]
+
+
+    def cancel_all(self):
+        """Cancel all requests."""
+        for owner in self._pending_by_owner.keys():
+            self.cancel(owner)
+
+
+    ##############################
+    # Internal methods.
+
+    def _worker(self):
+        """Worker thread main loop."""
+        while True:
+            request = self._work_queue.get()
+            if request.cancelled:
+                self._result_queue.put((request, None))
+                continue
+            try:
+                if request.parameters is None:
+                    raise OSError("missing image")
+                path = self._image_cache.getByParameters(
+                    request.parameters, *self._thumbnail_size)[0]
+            except (IOError, OSError):
+                path = None
+            except:
+                # Don't let an unexpected error kill the thread; just
+                # report the thumbnail as unloadable.
+                sys.excepthook(*sys.exc_info())
+                path = None
+            self._result_queue.put((request, path))
+
+
+    def _start_polling(self):
+        if self._poll_source is None:
+            self._poll_source = gobject.timeout_add(POLL_INTERVAL, self._poll)
+        self._dispatch()
+
+
+    def _poll(self):
+        timer = Timer()
+        while timer.get() < MAX_DELIVERY_TIME:
+            try:
+                request, path = self._result_queue.get_nowait()
+            except Empty:
+                break
+            self._nr_of_dispatched -= 1
+            self._deliver(request, path)
+        self._dispatch()
+        if self._nr_of_dispatched == 0 and not self._pending:
+            self._poll_source = None
+            return False
+        return True
+
+
+    def _deliver(self, request, path):
+        if request.cancelled:
+            return
+        self._forget(request)
+        pixbuf = None
+        if path is not None:
+            try:
+                pixbuf = gtk.gdk.pixbuf_new_from_file(path)
+            except gobject.GError:
+                pass
+        if pixbuf is not None:
+            request.load_callback(pixbuf)
+        elif request.error_callback is not None:
+            request.error_callback()
+
+
+    def _dispatch(self):
+        """Hand pending requests to the worker threads.
+
+        Only a few requests are handed over at a time so that urgent
+        requests don't have to wait for a long queue of other
+        requests.
+        """
+        free = 2 * self._nthreads - self._nr_of_dispatched
+        if free <= 0 or not self._pending:
+            return
+        for owner, function in self._urgent_key_functions.items():
+            keys = self._pending_by_owner.get(owner)
+            if not keys:
+                continue
+            for key in function():
+                for request in keys.get(key, []):
+                    if not request.dispatched:
+                        self._dispatch_request(request)
+                        free -= 1
+                        if free == 0:
+                            return
+        while free > 0 and self._pending:
+            request = self._pending.popleft()
+            if not request.cancelled and not request.dispatched:
+                self._dispatch_request(request)
+                free -= 1
+
+
+    def _dispatch_request(self, request):
+        request.dispatched = True
+        self._nr_of_dispatched += 1
+        self._work_queue.put(request)
+
+
+    def _forget(self, request):
+        keys = self._pending_by_owner.get(request.owner)
+        if keys is None:
+            return
+        requests = keys.get(request.key)
+        if requests is None:
+            return
+        requests.remove(request)
+        if not requests:
+            del keys[request.key]
+            if not keys:
+                del self._pending_by_owner[request.owner]
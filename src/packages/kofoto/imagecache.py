@@ -3,7 +3,7 @@
 __all__ = ["ImageCache"]
 
 import os
-import Image as PILImage
+import thread
 from kofoto.rectangle import Rectangle
 
 class ImageCache:
@@ -19,16 +19,25 @@ class ImageCache:
         self.cacheLocation = cacheLocation
         self.useOrientation = useOrientation
 
+        # Directory of gkofoto's pixbuf disk cache, which prunes
+        # itself.
+        self.pixbufCacheLocation = os.path.join(cacheLocation, "pixbufs")
+
 
     def cleanup(self):
         """Clean up the cache.
 
         All cached images whose original images no longer exist in the
-        filesystem will be removed.
+        filesystem will be removed. The pixbuf cache directory is left
+        alone.
         """
 
+        pixbufCachePrefix = os.path.join(self.pixbufCacheLocation, "")
         for dirpath, dirnames, filenames in os.walk(self.cacheLocation,
                                                     topdown=False):
+            if (dirpath == self.pixbufCacheLocation or
+                dirpath.startswith(pixbufCachePrefix)):
+                continue
             realdir = dirpath[len(self.cacheLocation):]
             for filename in filenames:
                 a = os.path.splitext(filename)[0].split("-")
@@ -45,9 +54,12 @@ class ImageCache:
                         pass
                 os.unlink(os.path.join(dirpath, filename))
             for dirname in dirnames:
+                path = os.path.join(dirpath, dirname)
+                if path == self.pixbufCacheLocation:
+                    continue
                 # Remove directories if they are empty.
                 try:
-                    os.rmdir(os.path.join(dirpath, dirname))
+                    os.rmdir(path)
                 except OSError:
                     pass
 
@@ -69,9 +81,27 @@ class ImageCache:
 
         Returns a tuple of file path, width and height.
         """
+        return self.getByParameters(
+            self.getParameters(imageversionOrLocation),
+            widthlimit,
+            heightlimit)
+
+
+    def getParameters(self, imageversionOrLocation):
+        """Get the parameters of an image that the cache needs.
+
+        This method and getByParameters together do the same as get,
+        but only this method may access the shelf (if passed an image
+        version). getByParameters can therefore be called in another
+        thread.
+
+        Returns an opaque object to pass to getByParameters.
+        """
         if isinstance(imageversionOrLocation, basestring):
             location = imageversionOrLocation
             mtime = os.path.getmtime(location)
+            import Image as PILImage
+            import kofoto.exifthumbsupport
             width, height = PILImage.open(location).size
             orientation = "up"
         else:
@@ -86,6 +116,22 @@ class ImageCache:
                     orientation = "up"
             else:
                 orientation = "up"
+        return (location, mtime, width, height, orientation)
+
+
+    def getByParameters(self, parameters, widthlimit, heightlimit):
+        """Get a file path to a cached image and the cached image's
+        size.
+
+        Arguments:
+
+        parameters  -- Parameters returned by getParameters.
+        widthlimit  -- Width limit of the cached image.
+        heightlimit -- Height limit of the cached image.
+
+        Returns a tuple of file path, width and height.
+        """
+        location, mtime, width, height, orientation = parameters
         return self._get(
             location, mtime, width, height, widthlimit, heightlimit,
             orientation)
@@ -102,7 +148,7 @@ class ImageCache:
             w, h = h, w
 
         # Check whether a cached version already exists.
-        path = self._getCachedImagePath(location, mtime, w, h, orientation)
+        path = self.getCachedImagePath(location, mtime, w, h, orientation)
         if os.path.exists(path):
             return path, w, h
 
@@ -110,7 +156,14 @@ class ImageCache:
         # one.
         directory, _ = os.path.split(path)
         if not os.path.isdir(directory):
-            os.makedirs(directory)
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another thread may have created it.
+                if not os.path.isdir(directory):
+                    raise
+        import Image as PILImage
+        import kofoto.exifthumbsupport
         pilimg = PILImage.open(location)
         if not pilimg.mode in ("L", "RGB", "CMYK"):
             pilimg = pilimg.convert("RGB")
@@ -127,13 +180,33 @@ class ImageCache:
                 pilimg = pilimg.rotate(180)
             elif orientation == "left":
                 pilimg = pilimg.rotate(270)
-        pilimg.save(path, "JPEG")
+        # Save to a temporary file first so that other threads never
+        # see a partially written image.
+        tmppath = "%s.%d-%d.tmp" % (path, os.getpid(), thread.get_ident())
+        try:
+            pilimg.save(tmppath, "JPEG")
+            os.rename(tmppath, path)
+        except:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+            raise
         return path, w, h
 
 
-    def _getCachedImagePath(self, location, mtime, width, height,
-                            orientation):
-        """Internal helper method."""
+    def getCachedImagePath(self, location, mtime, width, height,
+                           orientation):
+        """Get the path to a cached image.
+
+        The cached image doesn't necessarily exist.
+
+        Arguments:
+
+        location    -- Location of the original image.
+        mtime       -- Modification time of the original image.
+        width       -- Width of the cached image.
+        height      -- Height of the cached image.
+        orientation -- Orientation of the cached image.
+        """
         drive, drivelessPath = os.path.splitdrive(location)
         directory, filename = os.path.split(drivelessPath[1:])
         if drive:
@@ -0,0 +1,473 @@
+"""Checking and repairing the integrity of a shelf.
+
+Each check is an SQL query selecting the rows that violate a rule of
+the schema in kofoto.shelfschema. The queries are anti-joins against
+primary keys and indexed columns, so shelves of any size can be
+checked without reading whole tables into memory.
+"""
+
+__all__ = [
+    "DEFAULT_INTEGRITY_CHECK_THREADS",
+    "IntegrityCheck",
+    "findViolations",
+    "findViolationsInParallel",
+    "integrityChecks",
+    "repairViolations",
+    ]
+
+import threading
+from Queue import Queue
+import sqlite3 as sql
+from kofoto.shelfexceptions import ShelfLockedError
+
+# Number of connections checking a shelf in parallel.
+DEFAULT_INTEGRITY_CHECK_THREADS = 4
+
+class IntegrityCheck:
+    """An integrity check of a shelf."""
+
+    def __init__(self, name, message, query, repairStatements=()):
+        """Constructor.
+
+        Arguments:
+
+        name             -- A short name of the check.
+        message          -- A format string describing a violation. It
+                            is formatted with a row selected by query.
+        query            -- An SQL query selecting the violations.
+        repairStatements -- A list of SQL statements that repair the
+                            violations.
+        """
+        self.name = name
+        self.message = message
+        self.query = query
+        self.repairStatements = repairStatements
+
+
+    def findViolations(self, connection):
+        """Find violations.
+
+        Returns a list of the rows selected by the query.
+        """
+        cursor = connection.cursor()
+        cursor.execute(self.query)
+        return list(cursor)
+
+
+    def formatViolation(self, violation):
+        """Get a description of a violation."""
+        return self.message % tuple(violation)
+
+
+    def repair(self, connection):
+        """Repair the violations."""
+        cursor = connection.cursor()
+        for statement in self.repairStatements:
+            cursor.execute(statement)
+
+
+class _MemberPositionCheck(IntegrityCheck):
+    """Check that the members of an album have positions 0, 1, 2, ..."""
+
+    def __init__(self):
+        IntegrityCheck.__init__(
+            self,
+            "member-positions",
+            "Album %d has gaps in its member positions.",
+            " select distinct m.album"
+            " from   member as m"
+            " where  m.position < 0 or"
+            "        (m.position > 0 and"
+            "         not exists (select 1"
+            "                     from   member as m2"
+            "                     where  m2.album = m.album and"
+            "                            m2.position = m.position - 1))")
+
+
+    def repair(self, connection):
+        cursor = connection.cursor()
+        for (albumid,) in self.findViolations(connection):
+            cursor.execute(
+                " select object"
+                " from   member"
+                " where  album = ?"
+                " order by position",
+                (albumid,))
+            objids = [objid for (objid,) in cursor]
+            cursor.execute(
+                " delete from member"
+                " where  album = ?",
+                (albumid,))
+            cursor.executemany(
+                " insert into member (album, position, object)"
+                " values (?, ?, ?)",
+                [(albumid, position, objid)
+                 for position, objid in enumerate(objids)])
+
+
+class _CategoryCycleCheck(IntegrityCheck):
+    """Check that the category graph has no cycles."""
+
+    def __init__(self):
+        IntegrityCheck.__init__(
+            self,
+            "category-cycles",
+            "Category %d is its own descendant.",
+            _CATEGORY_REACHABILITY +
+            " select category"
+            " from   reachable"
+            " where  category = descendant")
+
+
+    def repair(self, connection):
+        cursor = connection.cursor()
+        while True:
+            # Disconnect the most recently connected child closing a
+            # cycle until there are no cycles left.
+            cursor.execute(
+                _CATEGORY_REACHABILITY +
+                " select max(cc.rowid)"
+                " from   category_child as cc, reachable as r"
+                " where  r.category = cc.child and"
+                "        r.descendant = cc.parent")
+            rowid = cursor.fetchone()[0]
+            if rowid is None:
+                return
+            cursor.execute(
+                " delete from category_child"
+                " where  rowid = ?",
+                (rowid,))
+
+
+_PRIMARY_VERSION_VIOLATIONS = (
+    " select i.id, i.primary_version"
+    " from   image as i"
+    "        left join image_version as iv on iv.id = i.primary_version"
+    " where  (iv.id is null and i.primary_version is not null) or"
+    "        iv.image != i.id or"
+    "        (i.primary_version is null and"
+    "         exists (select 1"
+    "                 from   image_version as iv2"
+    "                 where  iv2.image = i.id))")
+
+_CATEGORY_REACHABILITY = (
+    " with recursive reachable (category, descendant) as ("
+    "     select parent, child"
+    "     from   category_child"
+    "     union"
+    "     select r.category, cc.child"
+    "     from   reachable as r, category_child as cc"
+    "     where  cc.parent = r.descendant)")
+
+# The checks, in the order they are repaired. Repairs may introduce
+# violations of later checks (for instance, deleting objects leaves
+# dangling members), but not of earlier ones.
+integrityChecks = [
+    IntegrityCheck(
+        "album-object",
+        "Album %d has no object.",
+        " select a.id"
+        " from   album as a left join object as o on o.id = a.id"
+        " where  o.id is null",
+        [" insert into object (id)"
+         " select a.id"
+         " from   album as a left join object as o on o.id = a.id"
+         " where  o.id is null"]),
+    IntegrityCheck(
+        "image-object",
+        "Image %d has no object.",
+        " select i.id"
+        " from   image as i left join object as o on o.id = i.id"
+        " where  o.id is null",
+        [" insert into object (id)"
+         " select i.id"
+         " from   image as i left join object as o on o.id = i.id"
+         " where  o.id is null"]),
+    IntegrityCheck(
+        "image-version-image",
+        "Image version %d belongs to nonexistent image %d.",
+        " select iv.id, iv.image"
+        " from   image_version as iv left join image as i on i.id = iv.image"
+        " where  i.id is null",
+        # Recreate the images so that the image versions are kept.
+        [" insert or ignore into object (id)"
+         " select distinct iv.image"
+         " from   image_version as iv left join image as i on i.id = iv.image"
+         " where  i.id is null",
+         " insert into image (id, primary_version)"
+         " select iv.image, max(iv.id)"
+         " from   image_version as iv left join image as i on i.id = iv.image"
+         " where  i.id is null"
+         " group by iv.image"]),
+    IntegrityCheck(
+        "orphaned-object",
+        "Object %d is neither an album nor an image.",
+        " select o.id"
+        " from   object as o left join album as a on a.id = o.id"
+        "                    left join image as i on i.id = o.id"
+        " where  a.id is null and i.id is null",
+        [" delete from object"
+         " where  id in (select o.id"
+         "               from   object as o"
+         "                      left join album as a on a.id = o.id"
+         "                      left join image as i on i.id = o.id"
+         "               where  a.id is null and i.id is null)"]),
+    IntegrityCheck(
+        "primary-version",
+        "Image %d has bad primary version %s.",
+        _PRIMARY_VERSION_VIOLATIONS,
+        # Like Image._makeNewPrimaryVersion, choose the last version.
+        [" update image"
+         " set    primary_version = (select max(iv.id)"
+         "                           from   image_version as iv"
+         "                           where  iv.image = image.id)"
+         " where  id in (select id from (%s))" % (
+             _PRIMARY_VERSION_VIOLATIONS)]),
+    IntegrityCheck(
+        "member-album",
+        "Position %d of nonexistent album %d has object %d.",
+        " select m.position, m.album, m.object"
+        " from   member as m left join album as a on a.id = m.album"
+        " where  a.id is null",
+        [" delete from member"
+         " where  album in (select m.album"
+         "                  from   member as m"
+         "                         left join album as a on a.id = m.album"
+         "                  where  a.id is null)"]),
+    IntegrityCheck(
+        "member-object",
+        "Position %d of album %d has nonexistent object %d.",
+        " select m.position, m.album, m.object"
+        " from   member as m left join object as o on o.id = m.object"
+        " where  o.id is null",
+        [" delete from member"
+         " where  object in (select m.object"
+         "                   from   member as m"
+         "                          left join object as o on o.id = m.object"
+         "                   where  o.id is null)"]),
+    IntegrityCheck(
+        "attribute-object",
+        "Attribute \"%s\" belongs to nonexistent object %d.",
+        " select a.name, a.object"
+        " from   attribute as a left join object as o on o.id = a.object"
+        " where  o.id is null",
+        [" delete from attribute"
+         " where  object in (select a.object"
+         "                   from   attribute as a"
+         "                          left join object as o on o.id = a.object"
+         "                   where  o.id is null)"]),
+    IntegrityCheck(
+        "object-category-object",
+        "Category %d is added to nonexistent object %d.",
+        " select oc.category, oc.object"
+        " from   object_category as oc"
+        "        left join object as o on o.id = oc.object"
+        " where  o.id is null",
+        [" delete from object_category"
+         " where  object in (select oc.object"
+         "                   from   object_category as oc"
+         "                          left join object as o on o.id = oc.object"
+         "                   where  o.id is null)"]),
+    IntegrityCheck(
+        "object-category-category",
+        "Nonexistent category %d is added to object %d.",
+        " select oc.category, oc.object"
+        " from   object_category as oc"
+        "        left join category as c on c.id = oc.category"
+        " where  c.id is null",
+        [" delete from object_category"
+         " where  category in (select oc.category"
+         "                     from   object_category as oc"
+         "                            left join category as c"
+         "                            on c.id = oc.category"
+         "                     where  c.id is null)"]),
+    IntegrityCheck(
+        "category-child-parent",
+        "Nonexistent category %d has child category %d.",
+        " select cc.parent, cc.child"
+        " from   category_child as cc"
+        "        left join category as c on c.id = cc.parent"
+        " where  c.id is null",
+        [" delete from category_child"
+         " where  parent in (select cc.parent"
+         "                   from   category_child as cc"
+         "                          left join category as c"
+         "                          on c.id = cc.parent"
+         "                   where  c.id is null)"]),
+    IntegrityCheck(
+        "category-child-child",
+        "Category %d has nonexistent child category %d.",
+        " select cc.parent, cc.child"
+        " from   category_child as cc"
+        "        left join category as c on c.id = cc.child"
+        " where  c.id is null",
+        [" delete from category_child"
+         " where  child in (select cc.child"
+         "                  from   category_child as cc"
+         "                         left join category as c"
+         "                         on c.id = cc.child"
+         "                  where  c.id is null)"]),
+    _CategoryCycleCheck(),
+    _MemberPositionCheck(),
+    IntegrityCheck(
+        "attribute-lcvalue",
+        "Lowercased value of attribute \"%s\" of object %d is stale.",
+        " select name, object"
+        " from   attribute"
+        " where  lcvalue != pylower(value)",
+        [" update attribute"
+         " set    lcvalue = pylower(value)"
+         " where  lcvalue != pylower(value)"]),
+    ]
+
+def findViolations(connection, checks=None):
+    """Check the integrity of a shelf.
+
+    Arguments:
+
+    connection -- A connection to the shelf database.
+    checks     -- A list of IntegrityCheck instances, or None for all
+                  checks in integrityChecks.
+
+    Returns a list of (IntegrityCheck instance, violations) tuples for
+    the failed checks, where violations is a list of rows that can be
+    formatted with IntegrityCheck.formatViolation.
+    """
+    if checks is None:
+        checks = integrityChecks
+    _prepareConnection(connection)
+    result = []
+    for check in checks:
+        violations = check.findViolations(connection)
+        if violations:
+            result.append((check, violations))
+    return result
+
+
+def findViolationsInParallel(
+        location, nthreads=DEFAULT_INTEGRITY_CHECK_THREADS, checks=None):
+    """Check the integrity of a shelf using several read-only connections.
+
+    The shelf must not be locked exclusively by another connection.
+
+    Arguments:
+
+    location -- The location of the shelf database.
+    nthreads -- Number of worker threads, each with its own
+                connection. If 0, the checks are run synchronously.
+    checks   -- A list of IntegrityCheck instances, or None for all
+                checks in integrityChecks.
+
+    Returns the same as findViolations.
+    """
+    if checks is None:
+        checks = integrityChecks
+    jobQueue = Queue()
+    resultQueue = Queue()
+    for job in enumerate(checks):
+        jobQueue.put(job)
+    if nthreads == 0:
+        jobQueue.put(None)
+        _checkWorker(location, jobQueue, resultQueue)
+    else:
+        for unused in range(nthreads):
+            jobQueue.put(None)
+            thread = threading.Thread(
+                target=_checkWorker, args=(location, jobQueue, resultQueue))
+            thread.setDaemon(True)
+            thread.start()
+    results = [None] * len(checks)
+    error = None
+    for unused in checks:
+        index, violations = resultQueue.get()
+        if isinstance(violations, Exception):
+            error = violations
+        else:
+            results[index] = violations
+    if error is not None:
+        raise error
+    return [(x, y) for (x, y) in zip(checks, results) if y]
+
+
+def repairViolations(connection, checks=None):
+    """Repair the integrity of a shelf.
+
+    The repairs are made in the current transaction of the connection,
+    which the caller should commit.
+
+    Arguments:
+
+    connection -- A connection to the shelf database.
+    checks     -- A list of IntegrityCheck instances, or None for all
+                  checks in integrityChecks.
+
+    Returns the violations found before they were repaired, in the
+    same format as findViolations.
+    """
+    if checks is None:
+        checks = integrityChecks
+    _prepareConnection(connection)
+    result = []
+    for check in checks:
+        violations = check.findViolations(connection)
+        if violations:
+            check.repair(connection)
+            result.append((check, violations))
+    return result
+
+######################################################################
+
+def _prepareConnection(connection):
+    """Internal helper function."""
+    # Attribute values are lowercased by Python when stored, which
+    # differs from SQLite's lower() for non-ASCII characters.
+    connection.create_function("pylower", 1, _lower)
+
+
+def _lower(value):
+    """Internal helper function."""
+    if value is None:
+        return None
+    return value.lower()
+
+
+def _checkWorker(location, jobQueue, resultQueue):
+    """Worker thread main loop of findViolationsInParallel.
+
+    Every job gets a result, which is an exception if the check failed
+    or the shelf could not be opened, so that the caller never waits
+    for a result that won't come.
+    """
+    connection = None
+    error = None
+    try:
+        try:
+            connection = sql.connect(location)
+            connection.execute("pragma query_only = 1")
+            _prepareConnection(connection)
+        except Exception, e:
+            error = _translateError(location, e)
+        while True:
+            job = jobQueue.get()
+            if job is None:
+                return
+            index, check = job
+            if error is not None:
+                violations = error
+            else:
+                try:
+                    violations = check.findViolations(connection)
+                except Exception, e:
+                    violations = _translateError(location, e)
+            resultQueue.put((index, violations))
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+def _translateError(location, e):
+    """Internal helper function."""
+    if isinstance(e, sql.OperationalError) and "locked" in str(e):
+        return ShelfLockedError(location)
+    else:
+        return e
@@ -0,0 +1,168 @@
+"""Writing of EXIF and IPTC metadata to JPEG files.
+
+EXIF information is stored in an APP1 segment and IPTC information
+(IIM datasets) in a Photoshop APP13 segment. This module creates such
+segments and inserts them into JPEG data without decoding the image,
+so no external tools are needed.
+"""
+
+__all__ = [
+    "IPTC_CAPTION",
+    "IPTC_COPYRIGHT_NOTICE",
+    "IPTC_HEADLINE",
+    "makeExifSegment",
+    "makeIptcSegment",
+    "readMetadataSegments",
+    "replaceMetadataSegments",
+    ]
+
+import struct
+
+# IIM dataset numbers in the application record (record 2).
+IPTC_HEADLINE = 105
+IPTC_COPYRIGHT_NOTICE = 116
+IPTC_CAPTION = 120
+
+_SOI = "\xFF\xD8"
+_APP0 = "\xFF\xE0"
+_APP1 = "\xFF\xE1"
+_APP13 = "\xFF\xED"
+_EXIF_HEADER = "Exif\x00\x00"
+_PHOTOSHOP_HEADER = "Photoshop 3.0\x00"
+_IPTC_RESOURCE_ID = 0x0404
+
+# EXIF tag number and type of IFD0 DateTime.
+_DATETIME_TAG = 0x0132
+_ASCII_TYPE = 2
+
+def makeExifSegment(dateTime):
+    """Create an EXIF APP1 segment.
+
+    Arguments:
+
+    dateTime -- The value of the DateTime tag, an ASCII string in the
+                format "YYYY:MM:DD HH:MM:SS".
+
+    Returns the segment (including marker and length) as a string.
+    """
+    value = str(dateTime) + "\x00"
+    ifdOffset = 8
+    valueOffset = ifdOffset + 2 + 12 + 4
+    tiff = (
+        "MM\x00\x2A" + struct.pack(">L", ifdOffset) +
+        struct.pack(">H", 1) +
+        struct.pack(
+            ">HHLL", _DATETIME_TAG, _ASCII_TYPE, len(value), valueOffset) +
+        struct.pack(">L", 0) +
+        value)
+    return _makeSegment(_APP1, _EXIF_HEADER + tiff)
+
+
+def makeIptcSegment(datasets):
+    """Create a Photoshop APP13 segment containing IPTC datasets.
+
+    Arguments:
+
+    datasets -- A list of (dataset number, value) tuples, where the
+                dataset number is one of the IPTC_* constants (or
+                another dataset in the application record) and the
+                value is a Unicode string. The values are stored UTF-8
+                encoded.
+
+    Returns the segment (including marker and length) as a string.
+    """
+    # Coded character set (1:90) UTF-8.
+    iim = [_makeIptcDataset(1, 90, "\x1B%G")]
+    iim.append(_makeIptcDataset(2, 0, "\x00\x04")) # Record version.
+    for dataset, value in datasets:
+        iim.append(_makeIptcDataset(2, dataset, value.encode("utf-8")))
+    data = "".join(iim)
+    resource = (
+        "8BIM" +
+        struct.pack(">H", _IPTC_RESOURCE_ID) +
+        "\x00\x00" + # Empty name, padded to even length.
+        struct.pack(">L", len(data)) +
+        data)
+    if len(data) % 2 == 1:
+        resource += "\x00"
+    return _makeSegment(_APP13, _PHOTOSHOP_HEADER + resource)
+
+
+def readMetadataSegments(fp):
+    """Read the EXIF and IPTC segments of a JPEG file.
+
+    Arguments:
+
+    fp -- A file object opened in binary mode, positioned at the start
+          of a JPEG file.
+
+    Only the headers of the file are read. Returns a list of the
+    segments (including marker and length) as strings, in file order.
+    """
+    if fp.read(2) != _SOI:
+        return []
+    segments = []
+    while True:
+        header = fp.read(4)
+        if len(header) < 4 or header[0] != "\xFF" or header[1] in "\xD9\xDA":
+            # End of file, corrupt data, end of image or start of scan.
+            return segments
+        length = struct.unpack(">H", header[2:])[0]
+        data = fp.read(length - 2)
+        if _isMetadataSegment(header[:2], data):
+            segments.append(header + data)
+
+
+def replaceMetadataSegments(data, segments):
+    """Replace the EXIF and IPTC segments of JPEG data.
+
+    Arguments:
+
+    data     -- The contents of a JPEG file.
+    segments -- A list of new segments, e.g. created by makeExifSegment
+                and makeIptcSegment.
+
+    Existing EXIF and IPTC segments are removed and the new segments
+    are inserted after any JFIF segment. Returns the new contents.
+    """
+    if data[:2] != _SOI:
+        raise ValueError("not a JPEG file")
+    pos = 2
+    head = []
+    tail = []
+    while pos + 4 <= len(data):
+        marker = data[pos:pos + 2]
+        if marker[0] != "\xFF" or marker[1] in "\xD9\xDA":
+            break
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        end = pos + 2 + length
+        segment = data[pos:end]
+        if not _isMetadataSegment(marker, segment[4:]):
+            if marker == _APP0 and not tail:
+                head.append(segment)
+            else:
+                tail.append(segment)
+        pos = end
+    return "".join([_SOI] + head + list(segments) + tail + [data[pos:]])
+
+
+######################################################################
+
+def _isMetadataSegment(marker, data):
+    """Internal helper function."""
+    return ((marker == _APP1 and data.startswith(_EXIF_HEADER)) or
+            (marker == _APP13 and data.startswith(_PHOTOSHOP_HEADER)))
+
+
+def _makeSegment(marker, data):
+    """Internal helper function."""
+    if len(data) + 2 > 0xFFFF:
+        raise ValueError("too much metadata for a JPEG segment")
+    return marker + struct.pack(">H", len(data) + 2) + data
+
+
+def _makeIptcDataset(record, dataset, value):
+    """Internal helper function."""
+    if len(value) > 0x7FFF:
+        raise ValueError("too long IPTC value")
+    return struct.pack(">BBBH", 0x1C, record, dataset, len(value)) + value
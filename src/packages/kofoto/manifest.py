@@ -0,0 +1,479 @@
+"""Manifests of generated directories and incremental uploads.
+
+A manifest lists the files in a generated directory together with
+their MD5 checksums. It is stored in the directory (as
+MANIFEST_FILENAME) when output is generated. When the directory is
+uploaded, the manifest is compared with the manifest of the last
+successful upload, which is stored in the target, and only files
+whose contents have changed are transferred.
+
+Checksums from an earlier manifest are reused for files whose size
+and modification time haven't changed, so updating the manifest of a
+large directory only costs a stat call per file. (Files modified in
+the same second as the manifest was created are checksummed again,
+since they may have been modified again within that second.)
+
+Symbolic links pointing inside the directory are listed (and
+uploaded) as links. Other symbolic links are listed as the files they
+point to.
+"""
+
+__all__ = [
+    "LocalDirectoryTransport",
+    "MANIFEST_FILENAME",
+    "RsyncTransport",
+    "TransportError",
+    "compareManifests",
+    "formatManifest",
+    "getTransport",
+    "parseManifest",
+    "scanDirectory",
+    "syncDirectory",
+    "updateManifest",
+    ]
+
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from kofoto.common import KofotoError
+
+MANIFEST_FILENAME = ".kofoto-manifest"
+
+# Block size used when computing checksums.
+HASH_BLOCK_SIZE = 2**16
+
+class TransportError(KofotoError):
+    """Transferring files to an upload target failed."""
+    pass
+
+
+def scanDirectory(directory, previous=None, knownHashes=None):
+    """Create a manifest of the files in a directory.
+
+    Arguments:
+
+    directory   -- The directory.
+    previous    -- An earlier manifest of the directory, or None.
+                   Checksums of files with unchanged size and
+                   modification time are taken from it.
+    knownHashes -- A dictionary mapping locations (relative to the
+                   directory) of files whose checksums already are
+                   known to the MD5 checksums (in hex format), or None.
+
+    Returns the manifest: a dictionary mapping locations relative to
+    the directory ("/"-separated byte strings) to entries. An entry is
+    a tuple ("f", checksum, size, modification time) for a file or
+    ("l", target) for a symbolic link inside the directory.
+    """
+    if previous is None:
+        previous = {}
+    known = {}
+    if knownHashes:
+        for path, digest in knownHashes.items():
+            known[_toManifestPath(path)] = digest
+    directory = _encodePath(directory).rstrip(os.sep) or os.sep
+    realdir = os.path.realpath(directory)
+    now = int(time.time())
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in dirnames + filenames:
+            location = os.path.join(dirpath, name)
+            path = _toManifestPath(location[len(directory):].lstrip(os.sep))
+            if path in [MANIFEST_FILENAME, _TEMPORARY_MANIFEST_FILENAME]:
+                continue
+            if os.path.islink(location):
+                target = os.readlink(location)
+                if (not os.path.isabs(target) and
+                    _isInside(os.path.realpath(location), realdir)):
+                    manifest[path] = ("l", target)
+                    continue
+            try:
+                st = os.stat(location)
+            except OSError:
+                # Dangling symbolic link.
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            size = st.st_size
+            mtime = int(st.st_mtime)
+            old = previous.get(path)
+            if path in known:
+                digest = known[path]
+            elif old and old[0] == "f" and old[2:] == (size, mtime):
+                digest = old[1]
+            else:
+                digest = _computeHash(location)
+            if mtime >= now:
+                # Don't trust the modification time next time.
+                mtime = -1
+            manifest[path] = ("f", digest, size, mtime)
+    return manifest
+
+
+def updateManifest(directory, knownHashes=None):
+    """Update the manifest stored in a directory.
+
+    See scanDirectory for a description of the arguments.
+
+    Returns the new manifest.
+    """
+    location = os.path.join(_encodePath(directory), MANIFEST_FILENAME)
+    try:
+        f = open(location, "rb")
+        try:
+            previous = parseManifest(f.read())
+        finally:
+            f.close()
+    except IOError:
+        previous = {}
+    manifest = scanDirectory(directory, previous, knownHashes)
+    _writeFileAtomically(location, formatManifest(manifest))
+    return manifest
+
+
+def parseManifest(data):
+    """Parse a manifest written by formatManifest.
+
+    Returns the manifest.
+    """
+    manifest = {}
+    for line in data.splitlines():
+        fields = line.split("\t")
+        if fields[0] == "f" and len(fields) == 5:
+            manifest[fields[4]] = (
+                "f", fields[1], int(fields[2]), int(fields[3]))
+        elif fields[0] == "l" and len(fields) == 3:
+            manifest[fields[2]] = ("l", fields[1])
+        else:
+            raise ValueError("bad manifest line: %r" % line)
+    return manifest
+
+
+def formatManifest(manifest):
+    """Format a manifest as a string."""
+    lines = []
+    for path in sorted(manifest):
+        entry = manifest[path]
+        if entry[0] == "f":
+            lines.append("f\t%s\t%d\t%d\t%s\n" % (entry[1:] + (path,)))
+        else:
+            lines.append("l\t%s\t%s\n" % (entry[1], path))
+    return "".join(lines)
+
+
+def compareManifests(manifest, synced):
+    """Compare a manifest with the manifest of an earlier upload.
+
+    Returns a tuple of a sorted list of paths that are new or whose
+    contents have changed and a sorted list of paths that only are
+    in the earlier manifest.
+    """
+    changed = []
+    for path in sorted(manifest):
+        old = synced.get(path)
+        if old is None or old[:2] != manifest[path][:2]:
+            changed.append(path)
+    removed = sorted([x for x in synced if x not in manifest])
+    return changed, removed
+
+
+def syncDirectory(source, transport, delete=False, dryRun=False):
+    """Upload the changes in a directory since the last upload.
+
+    Arguments:
+
+    source    -- The directory to upload.
+    transport -- A transport instance (see getTransport) for the
+                 target.
+    delete    -- Iff true, files that have been removed from the
+                 directory since the last upload are deleted in the
+                 target.
+    dryRun    -- Iff true, nothing is transferred.
+
+    The manifest of the directory is updated and then written to the
+    target last, so an interrupted upload is resumed the next time.
+
+    Returns a tuple of the manifest, a list of paths of transferred
+    files and a list of paths of files that were removed from the
+    directory (and deleted in the target if delete is true).
+    """
+    manifest = updateManifest(source)
+    data = transport.readFile(MANIFEST_FILENAME)
+    if data is None:
+        synced = {}
+    else:
+        synced = parseManifest(data)
+    changed, removed = compareManifests(manifest, synced)
+    if dryRun:
+        return manifest, changed, removed
+    transport.putFiles(
+        _encodePath(source), [(x, manifest[x]) for x in changed])
+    uploaded = manifest.copy()
+    if delete:
+        transport.deleteFiles(removed)
+    else:
+        # The files are still in the target.
+        for path in removed:
+            uploaded[path] = synced[path]
+    transport.writeFile(MANIFEST_FILENAME, formatManifest(uploaded))
+    return manifest, changed, removed
+
+
+def getTransport(destination):
+    """Get a transport for an upload target.
+
+    A destination of the form HOST:DIRECTORY is uploaded to with
+    rsync (over ssh); anything else is a local directory.
+    """
+    head = destination.split("/")[0]
+    if ":" in head and not os.path.splitdrive(destination)[0]:
+        return RsyncTransport(destination)
+    else:
+        return LocalDirectoryTransport(destination)
+
+
+class LocalDirectoryTransport:
+    """Transport copying files to a local directory."""
+
+    def __init__(self, directory):
+        """Constructor.
+
+        Arguments:
+
+        directory -- The target directory. It is created if needed.
+        """
+        self.directory = _encodePath(directory)
+
+
+    def readFile(self, path):
+        """Read a file in the target.
+
+        Returns the contents, or None if the file doesn't exist.
+        """
+        try:
+            f = open(self.__getLocation(path), "rb")
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise TransportError(str(e))
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+
+    def writeFile(self, path, data):
+        """Write a file in the target."""
+        location = self.__getLocation(path)
+        try:
+            _makeParentDirectory(location)
+            _writeFileAtomically(location, data)
+        except EnvironmentError, e:
+            raise TransportError(str(e))
+
+
+    def putFiles(self, source, entries):
+        """Transfer files to the target.
+
+        Arguments:
+
+        source  -- The source directory.
+        entries -- A list of (path, manifest entry) tuples.
+        """
+        for path, entry in entries:
+            location = self.__getLocation(path)
+            try:
+                _makeParentDirectory(location)
+                _unlink(location)
+                if entry[0] == "l":
+                    os.symlink(entry[1], location)
+                else:
+                    shutil.copy2(
+                        os.path.join(source, *path.split("/")), location)
+            except EnvironmentError, e:
+                raise TransportError(str(e))
+
+
+    def deleteFiles(self, paths):
+        """Delete files in the target."""
+        for path in paths:
+            _unlink(self.__getLocation(path))
+
+
+    ##############################
+    # Internal methods.
+
+    def __getLocation(self, path):
+        """Internal helper method."""
+        return os.path.join(self.directory, *path.split("/"))
+
+
+class RsyncTransport:
+    """Transport copying files to a remote directory with rsync."""
+
+    def __init__(self, destination):
+        """Constructor.
+
+        Arguments:
+
+        destination -- The target in the form HOST:DIRECTORY.
+        """
+        destination = _encodePath(destination)
+        self.host, self.directory = destination.split(":", 1)
+        self.destination = destination.rstrip("/") + "/"
+
+
+    def readFile(self, path):
+        """Read a file in the target.
+
+        Returns the contents, or None if the file doesn't exist.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            location = os.path.join(tmpdir, "file")
+            try:
+                process = subprocess.Popen(
+                    ["rsync", "-q", self.destination + path, location],
+                    stderr=subprocess.PIPE)
+            except OSError, e:
+                raise TransportError("rsync: %s" % e)
+            process.communicate()
+            if not os.path.exists(location):
+                return None
+            f = open(location, "rb")
+            try:
+                return f.read()
+            finally:
+                f.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def writeFile(self, path, data):
+        """Write a file in the target."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            location = os.path.join(tmpdir, "file")
+            f = open(location, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            self.__run(["rsync", "-q", location, self.destination + path])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def putFiles(self, source, entries):
+        """Transfer files to the target.
+
+        Arguments:
+
+        source  -- The source directory.
+        entries -- A list of (path, manifest entry) tuples.
+        """
+        if not entries:
+            return
+        self.__run(
+            ["rsync", "-az", "--copy-unsafe-links", "--from0",
+             "--files-from=-", source.rstrip(os.sep) + os.sep,
+             self.destination],
+            "".join(["%s\0" % x for (x, _) in entries]))
+
+
+    def deleteFiles(self, paths):
+        """Delete files in the target."""
+        if not paths:
+            return
+        self.__run(
+            ["ssh", self.host,
+             "cd %s && xargs -0 rm -f --" % _shellQuote(self.directory)],
+            "".join(["%s\0" % x for x in paths]))
+
+
+    ##############################
+    # Internal methods.
+
+    def __run(self, command, stdin=None):
+        """Internal helper method."""
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        except OSError, e:
+            raise TransportError("%s: %s" % (command[0], e))
+        process.communicate(stdin)
+        if process.returncode != 0:
+            raise TransportError(
+                "%s exited with status %d" % (command[0], process.returncode))
+
+
+######################################################################
+
+_TEMPORARY_MANIFEST_FILENAME = MANIFEST_FILENAME + ".tmp"
+
+def _computeHash(filename):
+    """Internal helper function."""
+    m = hashlib.md5()
+    f = open(filename, "rb")
+    try:
+        while True:
+            data = f.read(HASH_BLOCK_SIZE)
+            if not data:
+                break
+            m.update(data)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+
+def _encodePath(path):
+    """Internal helper function."""
+    if isinstance(path, unicode):
+        return path.encode(sys.getfilesystemencoding())
+    return path
+
+
+def _isInside(location, directory):
+    """Internal helper function."""
+    return location.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _makeParentDirectory(location):
+    """Internal helper function."""
+    parent = os.path.dirname(location)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+
+
+def _shellQuote(s):
+    """Internal helper function."""
+    return "'%s'" % s.replace("'", "'\\''")
+
+
+def _toManifestPath(path):
+    """Internal helper function."""
+    return "/".join(_encodePath(path).split(os.sep))
+
+
+def _unlink(location):
+    """Internal helper function."""
+    try:
+        os.unlink(location)
+    except OSError:
+        pass
+
+
+def _writeFileAtomically(location, data):
+    """Internal helper function."""
+    tmplocation = location + ".tmp"
+    f = open(tmplocation, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmplocation, location)
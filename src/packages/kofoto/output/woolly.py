@@ -5,6 +5,7 @@
 import os
 import re
 from kofoto.outputengine import OutputEngine
+from kofoto.outputtemplate import OutputTemplate
 
 css = u'''
 html {
@@ -329,11 +330,36 @@ class OutputGenerator(OutputEngine):
         except ValueError:
             pass
 
+        # Templates are compiled once and fields that are constant for
+        # the whole generation run are bound in advance.
+        self.albumTemplate = OutputTemplate(album_template).bind(
+            charenc=character_encoding)
+        self.thumbnailsFrameTemplate = OutputTemplate(
+            thumbnails_frame_template).bind(charenc=character_encoding)
+        self.thumbnailsFrameEntryTemplate = OutputTemplate(
+            thumbnails_frame_entry_template)
+        self.subalbumEntryTemplate = OutputTemplate(subalbum_entry_template)
+        self.imageEntryTemplate = OutputTemplate(image_entry_template)
+        self.imageFramesetTemplate = OutputTemplate(
+            image_frameset_template).bind(
+                charenc=character_encoding,
+                thumbnailsframewidth=env.thumbnailsizelimit[0] + 70)
+        self.imageFrameTemplate = OutputTemplate(image_frame_template).bind(
+            charenc=character_encoding)
+
+        # Fragments shared by all pages of the album currently being
+        # generated. Flushed in generateAlbum.
+        self.__albumFragments = {}
+
 
     def preGeneration(self, unused):
         """Method called before generation of the output."""
         self.iconsdir = "@icons"
         self.makeDirectory(self.iconsdir)
+        self.subalbumEntryTemplate = self.subalbumEntryTemplate.bind(
+            iconsdir=self.iconsdir)
+        self.imageFrameTemplate = self.imageFrameTemplate.bind(
+            iconsdir="../" + self.iconsdir)
 
 
     def postGeneration(self, root):
@@ -378,13 +404,43 @@ class OutputGenerator(OutputEngine):
         subalbums -- Album children of the album.
         images    -- Image children of the album.
         """
+        self.__albumFragments = {}
+        thumbwlim, thumbhlim = self.env.thumbnailsizelimit
+
+        # ------------------------------------------------------------
+        # Look up thumbnails, which are the same for all size limits.
+        # ------------------------------------------------------------
+
+        subalbumInfo = []
+        for subalbum in subalbums:
+            frontimage = self._getFrontImage(subalbum)
+            if frontimage:
+                thumbimgref, thumbwidth, thumbheight = \
+                    self.getImageReference(frontimage, thumbwlim, thumbhlim)
+            else:
+                thumbimgref = "%s/%s" % (self.iconsdir, "1x1.png")
+                thumbwidth = thumbwlim
+                thumbheight = 3 * thumbwlim // 4
+            subalbumInfo.append(self.subalbumEntryTemplate.bind(
+                thumbheight=thumbheight,
+                thumbheight_minus_6=thumbheight - 6,
+                thumbimgref=thumbimgref,
+                thumbwidth=thumbwidth,
+                thumbwidth_minus_6=thumbwidth - 6,
+                title=subalbum.getAttribute(u"title") or subalbum.getTag()))
+        thumbimgrefs = [
+            self.getImageReference(x, thumbwlim, thumbhlim)[0]
+            for x in images]
+
         # ------------------------------------------------------------
         # Create album overview pages, one per size limit.
         # ------------------------------------------------------------
 
         self.makeDirectory(str(album.getId()))
+        desc = album.getAttribute(u"description") or u""
+        title = album.getAttribute(u"title") or album.getTag()
         for wlim, hlim in self.env.imagesizelimits:
-            pathtext = self._generatePathText(wlim, hlim, paths, "")
+            pathtext = self._getPathText(wlim, hlim, paths, "")
 
             # Create uplink.
             if len(paths[0]) > 1:
@@ -397,40 +453,17 @@ class OutputGenerator(OutputEngine):
 
             # Create text for subalbum entries.
             if subalbums:
-                number = 0
                 subalbumtextElements = ["<tr>\n"]
-                for subalbum in subalbums:
+                for number, subalbum in enumerate(subalbums):
                     if number != 0 and number % 3 == 0:
                         subalbumtextElements.append("</tr>\n<tr>\n")
-
-                    frontimage = self._getFrontImage(subalbum)
-                    if frontimage:
-                        thumbimgref, thumbwidth, thumbheight = \
-                            self.getImageReference(
-                                frontimage,
-                                self.env.thumbnailsizelimit[0],
-                                self.env.thumbnailsizelimit[1])
-                    else:
-                        thumbimgref = "%s/%s" % (self.iconsdir, "1x1.png")
-                        thumbwidth = self.env.thumbnailsizelimit[0]
-                        thumbheight = 3 * self.env.thumbnailsizelimit[0] // 4
-
-                    title = (subalbum.getAttribute(u"title") or
-                             subalbum.getTag())
-                    subalbumtextElements.append(subalbum_entry_template % {
-                        "iconsdir": self.iconsdir,
-                        "htmlref": "%s-%dx%d.html" % (
-                            subalbum.getTag(),
-                            wlim,
-                            hlim),
-                        "thumbheight": thumbheight,
-                        "thumbheight_minus_6": thumbheight - 6,
-                        "thumbimgref": thumbimgref,
-                        "thumbwidth": thumbwidth,
-                        "thumbwidth_minus_6": thumbwidth - 6,
-                        "title": title,
-                        })
-                    number += 1
+                    subalbumtextElements.append(
+                        subalbumInfo[number].render({
+                            "htmlref": "%s-%dx%d.html" % (
+                                subalbum.getTag(),
+                                wlim,
+                                hlim),
+                            }))
                 subalbumtextElements.append("</tr>\n")
                 subalbumtext = "".join(subalbumtextElements)
             else:
@@ -438,49 +471,37 @@ class OutputGenerator(OutputEngine):
 
             # Create text for image entries.
             if images:
-                number = 0
                 imagetextElements = ["<tr>\n"]
-                for image in images:
+                for number in range(len(images)):
                     if number != 0 and number % 3 == 0:
                         imagetextElements.append("</tr>\n<tr>\n")
-                    imagetextElements.append(image_entry_template % {
+                    imagetextElements.append(self.imageEntryTemplate.render({
                         "frameref": "%s/%s-%dx%d-frame.html" % (
                             album.getId(),
                             number,
                             wlim,
                             hlim),
-                        "thumbimgref": self.getImageReference(
-                            image,
-                            self.env.thumbnailsizelimit[0],
-                            self.env.thumbnailsizelimit[1])[0],
-                        })
-                    number += 1
+                        "thumbimgref": thumbimgrefs[number],
+                        }))
                 imagetextElements.append("</tr>\n")
                 imagetext = "".join(imagetextElements)
             else:
                 imagetext = ""
 
             # Album overview.
-            desc = album.getAttribute(u"description") or u""
-            title = album.getAttribute(u"title") or album.getTag()
-
             filename = "%s-%dx%d.html" % (album.getTag(), wlim, hlim)
             self.writeFile(
                 filename,
-                album_template % {
-                    "charenc": self.charEnc,
+                self.albumTemplate.render({
                     "description": desc,
                     "imageentries": imagetext,
                     "paths": pathtext,
                     "subalbumentries": subalbumtext,
-                    "thishref": filename,
                     "title": title,
                     "uplink": uplink,
-                },
+                    }),
                 self.charEnc)
-            self._maybeMakeUTF8Symlink("%s-%dx%d.html" % (album.getTag(),
-                                                          wlim,
-                                                          hlim))
+            self._maybeMakeUTF8Symlink(filename)
 
         # ------------------------------------------------------------
         # Create image thumbnails frame, one per size limit.
@@ -489,34 +510,28 @@ class OutputGenerator(OutputEngine):
         for wlim, hlim in self.env.imagesizelimits:
             # Create text for image thumbnails frame.
             thumbnailsframeElements = []
-            number = 0
-            for image in images:
+            for number in range(len(images)):
                 thumbnailsframeElements.append(
-                    thumbnails_frame_entry_template % {
+                    self.thumbnailsFrameEntryTemplate.render({
                         "htmlref": "%s-%dx%d.html" % (
                             number,
                             wlim,
                             hlim),
                         "number": number,
-                        "thumbimgref": "../" + self.getImageReference(
-                            image,
-                            self.env.thumbnailsizelimit[0],
-                            self.env.thumbnailsizelimit[1])[0],
-                        })
-                number += 1
+                        "thumbimgref": "../" + thumbimgrefs[number],
+                        }))
             thumbnailstext = "\n".join(thumbnailsframeElements)
 
             # Image thumbnails frame.
+            filename = os.path.join(
+                str(album.getId()), "thumbnails-%dx%d.html" % (wlim, hlim))
             self.writeFile(
-                os.path.join(str(album.getId()),
-                             "thumbnails-%dx%d.html" % (wlim, hlim)),
-                thumbnails_frame_template % {
-                    "charenc": self.charEnc,
-                    "entries": thumbnailstext},
+                filename,
+                self.thumbnailsFrameTemplate.render({
+                    "entries": thumbnailstext,
+                    }),
                 self.charEnc)
-            self._maybeMakeUTF8Symlink(
-                os.path.join(str(album.getId()),
-                             "thumbnails-%dx%d.html" % (wlim, hlim)))
+            self._maybeMakeUTF8Symlink(filename)
 
         # ------------------------------------------------------------
         # Create album symlink to default size limit.
@@ -542,16 +557,16 @@ class OutputGenerator(OutputEngine):
         paths     -- A list of lists of Album instances.
         """
         # ------------------------------------------------------------
-        # Create image frameset and image fram, one per size limit.
+        # Create image frameset and image frame, one per size limit.
         # ------------------------------------------------------------
 
-        for limnumber, (wlim, hlim) in enumerate(self.env.imagesizelimits):
-            pathtext = self._generatePathText(wlim, hlim, paths, "../")
-            uplink = \
-                '<link rel="up" href="../%s-%dx%d.html" target="_top" />' % (
-                    paths[0][-1].getTag(),
-                    wlim,
-                    hlim)
+        title = image.getAttribute(u"title") or u""
+        infotext = self._generateInfoText(image)
+        sizelimits = self.env.imagesizelimits
+
+        for limnumber, (wlim, hlim) in enumerate(sizelimits):
+            framesetTemplate, frameTemplate = self._getImageTemplates(
+                wlim, hlim, paths)
 
             if number > 0:
                 previoustext = (
@@ -595,99 +610,40 @@ class OutputGenerator(OutputEngine):
                     ' src="../%s/smaller.png" alt="Smaller image" /></a>' % (
                         "%s-%dx%d-frame.html" % (
                             number,
-                            self.env.imagesizelimits[limnumber - 1][0],
-                            self.env.imagesizelimits[limnumber - 1][1]),
+                            sizelimits[limnumber - 1][0],
+                            sizelimits[limnumber - 1][1]),
                         self.iconsdir))
-
             else:
                 smallertext = (
                     '<img class="icon" src="../%s/nosmaller.png"'
                     ' alt="No smaller image available" />' % self.iconsdir)
 
-            if limnumber < len(self.env.imagesizelimits) - 1:
+            if limnumber < len(sizelimits) - 1:
                 largertext = (
                     '<a href="%s" target="_top"><img class="icon"'
                     ' src="../%s/larger.png" alt="Larger image" /></a>' % (
                         "%s-%dx%d-frame.html" % (
                             number,
-                            self.env.imagesizelimits[limnumber + 1][0],
-                            self.env.imagesizelimits[limnumber + 1][1]),
+                            sizelimits[limnumber + 1][0],
+                            sizelimits[limnumber + 1][1]),
                         self.iconsdir))
             else:
                 largertext = (
                     '<img class="icon" src="../%s/nolarger.png"'
                     ' alt="No larger image available" />' % self.iconsdir)
 
-            desc = (
-                image.getAttribute(u"description") or
-                image.getAttribute(u"title") or
-                u"")
-            title = image.getAttribute(u"title") or u""
-
-            imageCategories = list(image.getCategories())
-            infotextElements = []
-            if desc:
-                descElement = desc
-            else:
-                if self.autoImageDescTemplate:
-                    catdict = {}
-                    for tag in self.autoImageDescTags:
-                        catlist = []
-                        cat = self.env.shelf.getCategoryByTag(tag)
-                        for imgcat in imageCategories:
-                            if cat.isParentOf(imgcat, True):
-                                catlist.append(imgcat)
-                        catdict[tag] = ", ".join(
-                            [x.getDescription() for x in catlist])
-                    descElement = self.autoImageDescTemplate % catdict
-                else:
-                    descElement = ""
-            infotextElements.append("<p>%s</p>\n" % descElement)
-            infotextElements.append(
-                '<table border="0" cellpadding="0" cellspacing="0"'
-                ' width="100%">\n<tr>')
-            firstrow = True
-            for dispcat in self.displayCategories:
-                matching = [x.getDescription()
-                            for x in imageCategories
-                            if dispcat.isParentOf(x, True)]
-                if matching:
-                    matching.sort()
-                    if firstrow:
-                        firstrow = False
-                    else:
-                        infotextElements.append("<td></td></tr>\n<tr>")
-                    infotextElements.append(
-                        '<td align="left"><small><b>%s</b>:'
-                        ' %s</small></td>' % (
-                            dispcat.getDescription(),
-                            ", ".join(matching)))
-            infotextElements.append('</td><td align="right">')
-            timestamp = image.getAttribute(u"captured")
-            if timestamp:
-                infotextElements.append(
-                    "<small>%s</small><br />" % timestamp)
-            infotextElements.append("</td></tr></table>")
-            infotext = "".join(infotextElements)
-
             self.writeFile(
                 os.path.join(
                     str(album.getId()),
                     "%s-%dx%d-frame.html" % (number, wlim, hlim)),
-                image_frameset_template % {
+                framesetTemplate.render({
                     "albumtitle": title,
-                    "charenc": self.charEnc,
                     "imageframeref": "%s-%dx%d.html" % (
                         number,
                         wlim,
                         hlim),
                     "imagenumber": number,
-                    "thumbnailsframeref": "thumbnails-%dx%d.html" % (
-                        wlim, hlim),
-                    "thumbnailsframewidth": \
-                        self.env.thumbnailsizelimit[0] + 70,
-                    "uplink": uplink,
-                    },
+                    }),
                 self.charEnc)
 
             imgref, imgwidth, imgheight = self.getImageReference(
@@ -695,29 +651,122 @@ class OutputGenerator(OutputEngine):
             self.writeFile(
                 os.path.join(str(album.getId()),
                              "%s-%dx%d.html" % (number, wlim, hlim)),
-                image_frame_template % {
+                frameTemplate.render({
                     "cache_previous_image": cpi_text,
                     "cache_next_image": cni_text,
-                    "charenc": self.charEnc,
-                    "iconsdir": "../" + self.iconsdir,
                     "imgheight": imgheight,
-                    "imgid": image.getId(),
-                    "imgmaxwidth": wlim,
                     "imgref": "../" + imgref,
                     "imgwidth": imgwidth,
                     "info": infotext,
                     "larger": largertext,
                     "next": nexttext,
                     "nextlink": nextlink,
-                    "paths": pathtext,
                     "previous": previoustext,
                     "smaller": smallertext,
                     "thumbnailsanchor": str(number),
                     "title": title,
-                    },
+                    }),
                 self.charEnc)
 
 
+    def getImagePageReference(self, album, image, number):
+        """Get a href to the page of an image in an album."""
+        return "%s/%s-%dx%d-frame.html" % (
+            album.getId(),
+            number,
+            self.env.defaultsizelimit[0],
+            self.env.defaultsizelimit[1])
+
+
+    def _getImageTemplates(self, wlim, hlim, paths):
+        """Internal helper method.
+
+        Returns the image frameset and image frame templates for the
+        current album and a size limit, with the fields that are the
+        same for all images in the album bound.
+        """
+        key = ("image templates", wlim, hlim)
+        if key not in self.__albumFragments:
+            uplink = \
+                '<link rel="up" href="../%s-%dx%d.html" target="_top" />' % (
+                    paths[0][-1].getTag(),
+                    wlim,
+                    hlim)
+            self.__albumFragments[key] = (
+                self.imageFramesetTemplate.bind(
+                    thumbnailsframeref="thumbnails-%dx%d.html" % (wlim, hlim),
+                    uplink=uplink),
+                self.imageFrameTemplate.bind(
+                    paths=self._getPathText(wlim, hlim, paths, "../")))
+        return self.__albumFragments[key]
+
+
+    def _generateInfoText(self, image):
+        """Internal helper method."""
+        desc = (
+            image.getAttribute(u"description") or
+            image.getAttribute(u"title") or
+            u"")
+        imageCategories = list(image.getCategories())
+        infotextElements = []
+        if desc:
+            descElement = desc
+        else:
+            if self.autoImageDescTemplate:
+                catdict = {}
+                for tag in self.autoImageDescTags:
+                    catlist = []
+                    cat = self.env.shelf.getCategoryByTag(tag)
+                    for imgcat in imageCategories:
+                        if cat.isParentOf(imgcat, True):
+                            catlist.append(imgcat)
+                    catdict[tag] = ", ".join(
+                        [x.getDescription() for x in catlist])
+                descElement = self.autoImageDescTemplate % catdict
+            else:
+                descElement = ""
+        infotextElements.append("<p>%s</p>\n" % descElement)
+        infotextElements.append(
+            '<table border="0" cellpadding="0" cellspacing="0"'
+            ' width="100%">\n<tr>')
+        firstrow = True
+        for dispcat in self.displayCategories:
+            matching = [x.getDescription()
+                        for x in imageCategories
+                        if dispcat.isParentOf(x, True)]
+            if matching:
+                matching.sort()
+                if firstrow:
+                    firstrow = False
+                else:
+                    infotextElements.append("<td></td></tr>\n<tr>")
+                infotextElements.append(
+                    '<td align="left"><small><b>%s</b>:'
+                    ' %s</small></td>' % (
+                        dispcat.getDescription(),
+                        ", ".join(matching)))
+        infotextElements.append('</td><td align="right">')
+        timestamp = image.getAttribute(u"captured")
+        if timestamp:
+            infotextElements.append(
+                "<small>%s</small><br />" % timestamp)
+        infotextElements.append("</td></tr></table>")
+        return "".join(infotextElements)
+
+
+    def _getPathText(self, wlim, hlim, paths, pathprefix):
+        """Internal helper method.
+
+        Returns the path text for the current album, generating it
+        only once per size limit and path prefix.
+        """
+        key = ("path text", wlim, hlim, pathprefix)
+        if key not in self.__albumFragments:
+            self.__albumFragments[key] = self._generatePathText(
+                wlim, hlim, paths, pathprefix)
+        return self.__albumFragments[key]
+
+
     def _generatePathText(self, wlim, hlim, paths, pathprefix):
         """Internal helper method."""
 
@@ -747,15 +796,13 @@ class OutputGenerator(OutputEngine):
             if len(path) == 1:
                 prevalbumtext = ""
             else:
-                parent = path[-2]
-                this = path[-1]
-                children = list(parent.getAlbumChildren())
-                thispos = children.index(this)
-                if thispos == 0:
+                prevsibling, nextsibling = self.albumPathIndex.getSiblings(
+                    path[-2], path[-1])
+                if prevsibling is None:
                     # No previous sibling.
                     prevalbumtext = ""
                 else:
-                    sibling = children[thispos - 1]
+                    sibling = prevsibling
                     title = (sibling.getAttribute(u"title") or
                              sibling.getTag())
                     prevalbumtext = (
@@ -772,11 +819,11 @@ class OutputGenerator(OutputEngine):
                             "pathprefix": pathprefix,
                             "title": title.replace(" ", "&nbsp;")
                             })
-                if thispos == len(children) - 1:
+                if nextsibling is None:
                     # No next sibling.
                     nextalbumtext = ""
                 else:
-                    sibling = children[thispos + 1]
+                    sibling = nextsibling
                     title = (sibling.getAttribute(u"title") or
                              sibling.getTag())
                     nextalbumtext = (
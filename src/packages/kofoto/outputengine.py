@@ -2,11 +2,18 @@
 
 __all__ = ["OutputEngine"]
 
-import codecs
+import hashlib
 import os
 import re
 import time
+from kofoto.albumpaths import AlbumPathIndex
+from kofoto.assetpublisher import AssetPublisher
 from kofoto.common import symlink_or_copy_file
+from kofoto.manifest import updateManifest
+from kofoto.searchindex import SEARCH_INDEX_DIRECTORY, generateSearchIndex
+
+# Buffer size used when writing generated files.
+WRITE_BUFFER_SIZE = 2**16
 
 class OutputEngine:
     """An abstract base class for output generators of an album tree."""
@@ -18,8 +25,12 @@ class OutputEngine:
             ' target="_top">Kofoto</a> %s.' %
             time.strftime("%Y-%m-%d %H:%M:%S"))
         self.generatedFiles = set()
+        self.albumPathIndex = None
         self.__dest = None
         self.__imgrefMap = None
+        self.__publisher = None
+        self.__imagePages = None
+        self.__writtenHashes = None
 
 
     def preGeneration(self, root):
@@ -58,6 +69,22 @@ class OutputEngine:
         raise NotImplementedError
 
 
+    def getImagePageReference(self, album, image, number):
+        """Get a href (relative to the generated directory) to the
+        page of an image in an album.
+
+        Arguments:
+
+        album     -- The parent album of the image.
+        image     -- The Image instance.
+        number    -- The image's index in the album's image list.
+
+        Returns None if the output has no image pages, in which case
+        the image isn't included in the search index.
+        """
+        return None
+
+
     def getImageReference(self, image, widthlimit, heightlimit):
         """Get a href to an image of given limits."""
 
@@ -117,7 +144,7 @@ class OutputEngine:
                 os.makedirs(os.path.dirname(imgloc))
             except OSError:
                 pass
-            symlink_or_copy_file(imgabsloc, imgloc)
+            self.__publisher.publish(imgabsloc, imgloc)
             self.__imgrefMap[key] = (
                 "/".join(htmlimgloc.split(os.sep)),
                 width,
@@ -141,11 +168,20 @@ class OutputEngine:
         path = os.path.join(self.__dest, filename)
         if binary:
             assert isinstance(text, str)
-            f = open(path, "wb")
+            data = text
         else:
             assert isinstance(text, unicode)
-            f = codecs.open(path, "w", encoding)
-        f.write(text)
+            data = text.encode(encoding)
+        # Remember the checksum so that the file doesn't have to be
+        # read again when the manifest is updated.
+        self.__writtenHashes[filename] = hashlib.md5(data).hexdigest()
+        # Encode the whole text first and write it with a single call
+        # instead of going through a codecs stream writer.
+        f = open(path, "wb", WRITE_BUFFER_SIZE)
+        try:
+            f.write(data)
+        finally:
+            f.close()
 
 
     def symlinkFile(self, source, destination):
@@ -174,14 +210,14 @@ class OutputEngine:
         root      -- Album to generate.
         subalbums -- If false, generate all descendants of the root.
                      Otherwise a list of Album instances to generate.
-        """
 
-        def addDescendants(albumset, album):
-            """Internal helper function."""
-            if not album in albumset:
-                albumset.add(album)
-                for child in album.getAlbumChildren():
-                    addDescendants(albumset, child)
+        Images are published in the generated directory according to
+        env.publishmode (see kofoto.assetpublisher). If
+        env.searchindex is true, a search index of the generated
+        images is also written (see kofoto.searchindex). Finally, the
+        manifest of the generated directory used for incremental
+        uploads is updated (see kofoto.manifest).
+        """
 
         self.__dest = dest
         try:
@@ -189,23 +225,28 @@ class OutputEngine:
         except OSError:
             pass
         self.__imgrefMap = {}
+        self.__publisher = AssetPublisher(self.env.publishmode)
+        self.__imagePages = {}
+        self.__writtenHashes = {}
 
         self.env.out("Calculating album paths...\n")
-        albummap = _findAlbumPaths(root)
+        self.albumPathIndex = AlbumPathIndex(root)
 
         albumsToGenerate = set()
         if subalbums:
             for subalbum in subalbums:
-                addDescendants(albumsToGenerate, subalbum)
+                albumsToGenerate.update(
+                    self.albumPathIndex.getDescendants(subalbum))
             for subalbum in subalbums:
                 albumsToGenerate |= set(subalbum.getAlbumParents())
         else:
-            albumsToGenerate |= set(albummap.keys())
+            albumsToGenerate.update(self.albumPathIndex.getAlbums())
 
         self.preGeneration(root)
         i = 1
-        items = sorted(albummap.iteritems(), key=lambda x: x[0].getTag())
-        for album, paths in items:
+        albums = sorted(
+            self.albumPathIndex.getAlbums(), key=lambda x: x.getTag())
+        for album in albums:
             if album in albumsToGenerate:
                 nchildren = len(list(album.getChildren()))
                 if nchildren == 1:
@@ -218,8 +259,19 @@ class OutputEngine:
                     len(albumsToGenerate),
                     childrentext))
                 i += 1
-                self._generateAlbumHelper(album, paths)
+                self._generateAlbumHelper(
+                    album, self.albumPathIndex.getPaths(album))
         self.postGeneration(root)
+        if self.env.searchindex:
+            self.env.out("Generating search index...\n")
+            self.makeDirectory(SEARCH_INDEX_DIRECTORY)
+            generateSearchIndex(
+                self.env.shelf, self.__imagePages, self._writeSearchIndexFile)
+        if self.env.verbose:
+            self.env.out("Waiting for images to be published...\n")
+        self.__publisher.finish()
+        self.env.out("Updating manifest...\n")
+        updateManifest(self.__dest, self.__writtenHashes)
 
 
     def _generateAlbumHelper(self, album, paths):
@@ -244,31 +296,14 @@ class OutputEngine:
                         child.getId(),
                         album.getTag()))
             self.generateImage(album, child, imagechildren, ix, paths)
+            if child.getId() not in self.__imagePages:
+                reference = self.getImagePageReference(album, child, ix)
+                if reference is not None:
+                    self.__imagePages[child.getId()] = reference
 
 
-######################################################################
-
-def _findAlbumPaths(startalbum):
-    """Traverse all albums reachable from a given album and find
-    possible paths to the albums.
-
-    The traversal is started at startalbum. The return value is a
-    mapping where each key is an Album instance and the associated
-    value is a list of paths, where a path is a list of Album
-    instances.
-    """
-    def helper(album, path):
+    def _writeSearchIndexFile(self, filename, text):
         """Internal helper function."""
-        if album in path:
-            # Already visited album, so break recursion here.
-            return
-        path = path[:] + [album]
-        if not album in albummap:
-            albummap[album] = []
-        albummap[album].append(path)
-        for child in album.getChildren():
-            if child.isAlbum():
-                helper(child, path)
-    albummap = {}
-    helper(startalbum, [])
-    return albummap
+        self.writeFile(
+            os.path.join(SEARCH_INDEX_DIRECTORY, filename), text, "utf-8")
+
@@ -0,0 +1,117 @@
+"""Implementation of the OutputTemplate class."""
+
+__all__ = ["OutputTemplate"]
+
+import re
+
+_fieldRegexp = re.compile(r"%(?:(%)|\(([^)]*)\)([-#0 +]*\d*(?:\.\d+)?[a-zA-Z]))")
+
+class OutputTemplate:
+    """A compiled %-style template with named fields.
+
+    A template is parsed once into literal text and fields. Fields
+    whose values are the same for a whole generation run (e.g. the
+    character encoding) or for a group of pages (e.g. the path table
+    of an album) can be substituted in advance with bind, which
+    returns a new, smaller template. Rendering a template only
+    formats the remaining fields.
+
+    Example usage:
+
+    >>> t = OutputTemplate(u"<p>%(a)s, %(b)s: 100%%</p>")
+    >>> tb = t.bind(a=u"foo")
+    >>> tb.render({"b": u"bar"})
+    u'<p>foo, bar: 100%</p>'
+    """
+
+    def __init__(self, text, _parts=None):
+        """Constructor.
+
+        Arguments:
+
+        text -- The template text, using %(name)s-style fields.
+        """
+        if _parts is None:
+            _parts = []
+            pos = 0
+            for m in _fieldRegexp.finditer(text):
+                _parts.append(text[pos:m.start()])
+                if m.group(1):
+                    _parts[-1] += "%"
+                else:
+                    _parts.append((m.group(2), "%" + m.group(3)))
+                pos = m.end()
+            _parts.append(text[pos:])
+        self.__parts = _mergeLiterals(_parts)
+        self.__fields = set(
+            [x[0] for x in self.__parts if isinstance(x, tuple)])
+        self.__format = "".join([_formatPart(x) for x in self.__parts])
+        if self.__fields:
+            self.__text = None
+        else:
+            self.__text = self.__format % ()
+
+
+    def getFields(self):
+        """Get the names of the fields that remain to be substituted.
+
+        Returns a set of strings.
+        """
+        return self.__fields
+
+
+    def bind(self, values=None, **kwargs):
+        """Substitute some of the fields in advance.
+
+        Arguments:
+
+        values -- A mapping from field names to values.
+
+        Field values may also be given as keyword arguments. Returns a
+        new OutputTemplate instance.
+        """
+        if values:
+            kwargs.update(values)
+        parts = []
+        for part in self.__parts:
+            if isinstance(part, tuple) and part[0] in kwargs:
+                parts.append(part[1] % kwargs[part[0]])
+            else:
+                parts.append(part)
+        return OutputTemplate(None, parts)
+
+
+    def render(self, values):
+        """Substitute all remaining fields and return the text.
+
+        Arguments:
+
+        values -- A mapping from field names to values.
+        """
+        if self.__text is None:
+            return self.__format % values
+        else:
+            return self.__text
+
+
+######################################################################
+
+def _mergeLiterals(parts):
+    """Internal helper function."""
+    result = []
+    for part in parts:
+        if (not isinstance(part, tuple) and result and
+            not isinstance(result[-1], tuple)):
+            result[-1] += part
+        else:
+            result.append(part)
+    return result
+
+
+def _formatPart(part):
+    """Internal helper function."""
+    if isinstance(part, tuple):
+        name, conversion = part
+        return "%%(%s)%s" % (name, conversion[1:])
+    else:
+        return part.replace("%", "%%")
@@ -0,0 +1,330 @@
+"""Generation of static search indexes for generated output.
+
+A search index is a directory of JSON files that lets a client-side
+script filter the images of a generated album tree without a server:
+
+index.json      -- An object with the keys "version", "shards" (a list
+                   of {"file": ..., "first": ..., "last": ...,
+                   "count": ...} objects, where first and last are the
+                   first and last image IDs in the shard) and
+                   "categories" (an object mapping category IDs to
+                   [tag, description, [parent IDs]]).
+images-N.json   -- A list of [image ID, captured, title, [category
+                   IDs], page reference] entries, sorted by image ID.
+search.js       -- A small client-side script using the index.
+search.html     -- A search page using search.js.
+
+Page references are relative to the root of the generated directory.
+"""
+
+__all__ = [
+    "DEFAULT_SHARD_SIZE",
+    "SEARCH_INDEX_DIRECTORY",
+    "SEARCH_INDEX_VERSION",
+    "generateSearchIndex",
+    "toJSON",
+    ]
+
+import re
+
+# Directory (in the generated directory) containing the search index.
+SEARCH_INDEX_DIRECTORY = "@search"
+
+# Format version of index.json.
+SEARCH_INDEX_VERSION = 1
+
+# Maximum number of images per shard.
+DEFAULT_SHARD_SIZE = 5000
+
+search_js = u'''// Kofoto search index client.
+var kofotoSearch = {
+    root: "../",
+    index: null,
+    shards: [],
+
+    load: function (url, callback) {
+        var request = new XMLHttpRequest();
+        request.onreadystatechange = function () {
+            if (request.readyState == 4) {
+                callback(JSON.parse(request.responseText));
+            }
+        };
+        request.open("GET", url, true);
+        request.send(null);
+    },
+
+    init: function (callback) {
+        var self = this;
+        self.load("index.json", function (index) {
+            var remaining = index.shards.length;
+            self.index = index;
+            if (remaining == 0) {
+                callback();
+            }
+            for (var i = 0; i < index.shards.length; i++) {
+                (function (i) {
+                    self.load(index.shards[i].file, function (entries) {
+                        self.shards[i] = entries;
+                        remaining--;
+                        if (remaining == 0) {
+                            callback();
+                        }
+                    });
+                })(i);
+            }
+        });
+    },
+
+    // Return IDs of the categories matching a word, including their
+    // descendants.
+    matchingCategories: function (word) {
+        var cats = this.index.categories;
+        var result = {};
+        var changed = true;
+        for (var id in cats) {
+            if (cats[id][0].toLowerCase() == word ||
+                cats[id][1].toLowerCase() == word) {
+                result[id] = true;
+            }
+        }
+        while (changed) {
+            changed = false;
+            for (var id in cats) {
+                if (!result[id]) {
+                    for (var j = 0; j < cats[id][2].length; j++) {
+                        if (result[cats[id][2][j]]) {
+                            result[id] = true;
+                            changed = true;
+                            break;
+                        }
+                    }
+                }
+            }
+        }
+        return result;
+    },
+
+    // Return entries matching all words, where a word matches the
+    // title, the capture time or a category.
+    search: function (text) {
+        var words = text.toLowerCase().split(/\\s+/);
+        var matchers = [];
+        var result = [];
+        for (var i = 0; i < words.length; i++) {
+            if (words[i]) {
+                matchers.push(
+                    [words[i], this.matchingCategories(words[i])]);
+            }
+        }
+        for (var i = 0; i < this.shards.length; i++) {
+            var entries = this.shards[i];
+            for (var j = 0; j < entries.length; j++) {
+                var e = entries[j];
+                var ok = true;
+                for (var k = 0; ok && k < matchers.length; k++) {
+                    var word = matchers[k][0];
+                    var cats = matchers[k][1];
+                    ok = ((e[1] && e[1].indexOf(word) == 0) ||
+                          (e[2] && e[2].toLowerCase().indexOf(word) >= 0));
+                    for (var m = 0; !ok && m < e[3].length; m++) {
+                        ok = cats[e[3][m]];
+                    }
+                }
+                if (ok) {
+                    result.push(e);
+                }
+            }
+        }
+        return result;
+    },
+
+    // Escape a value for inclusion in HTML text or attribute values.
+    escape: function (value) {
+        return String(value)
+            .replace(/&/g, "&amp;")
+            .replace(/</g, "&lt;")
+            .replace(/>/g, "&gt;")
+            .replace(/"/g, "&quot;");
+    }
+};
+'''
+
+search_html = u'''<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"
+"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
+<title>Search</title>
+<script type="text/javascript" src="search.js"></script>
+<script type="text/javascript">
+function update() {
+    var entries = kofotoSearch.search(
+        document.getElementById("query").value);
+    var lines = ["<p>" + entries.length + " images</p><ul>"];
+    for (var i = 0; i < entries.length && i < 500; i++) {
+        var e = entries[i];
+        lines.push(
+            '<li><a href="' + kofotoSearch.escape(kofotoSearch.root + e[4]) +
+            '">' + kofotoSearch.escape(e[2] || e[0]) + "</a> " +
+            kofotoSearch.escape(e[1] || "") + "</li>");
+    }
+    lines.push("</ul>");
+    document.getElementById("result").innerHTML = lines.join("\\n");
+}
+window.onload = function () {
+    kofotoSearch.init(function () {
+        document.getElementById("query").disabled = false;
+    });
+};
+</script>
+</head>
+<body>
+<p><input id="query" type="text" size="40" disabled="disabled"
+ onkeyup="update()" /></p>
+<div id="result"></div>
+</body>
+</html>
+'''
+
+######################################################################
+
+def generateSearchIndex(shelf, imagePages, writeFile,
+                        shardsize=DEFAULT_SHARD_SIZE):
+    """Generate a search index.
+
+    The images are read from the shelf in a single pass and written
+    shard by shard, so only one shard is kept in memory.
+
+    Arguments:
+
+    shelf      -- The Shelf instance.
+    imagePages -- A mapping from IDs of images to include to page
+                  references.
+    writeFile  -- A function taking a filename (relative to
+                  SEARCH_INDEX_DIRECTORY) and a unicode text, which
+                  writes the text to the file.
+    shardsize  -- Maximum number of images per shard.
+
+    Returns the number of indexed images.
+    """
+    shards = []
+    entries = []
+
+    def writeShard():
+        """Internal helper function."""
+        filename = "images-%d.json" % len(shards)
+        writeFile(filename, toJSON(entries))
+        shards.append({
+            "count": len(entries),
+            "file": filename,
+            "first": entries[0][0],
+            "last": entries[-1][0],
+            })
+
+    nimages = 0
+    for imageid, captured, title, catids in shelf.getImageIndexEntries():
+        if imageid not in imagePages:
+            continue
+        entries.append(
+            [imageid, captured, title, catids, imagePages[imageid]])
+        nimages += 1
+        if len(entries) == shardsize:
+            writeShard()
+            entries = []
+    if entries:
+        writeShard()
+
+    categories = {}
+    queue = list(shelf.getRootCategories())
+    while queue:
+        category = queue.pop()
+        if category.getId() in categories:
+            continue
+        categories[category.getId()] = [
+            category.getTag(),
+            category.getDescription(),
+            sorted([x.getId() for x in category.getParents()])]
+        queue.extend(category.getChildren())
+
+    writeFile("index.json", toJSON({
+        "categories": categories,
+        "shards": shards,
+        "version": SEARCH_INDEX_VERSION,
+        }))
+    writeFile("search.js", search_js)
+    writeFile("search.html", search_html)
+    return nimages
+
+
+def toJSON(value):
+    """Convert a value to compact JSON text.
+
+    Supported values are None, booleans, integers, strings, lists,
+    tuples and dictionaries. Dictionary keys are converted to
+    strings and sorted. Control characters and non-ASCII characters
+    are escaped, so the returned unicode string only contains ASCII
+    characters.
+
+    >>> toJSON({"a": [1, None, u"\\xe5\\"x"], 2: True})
+    u'{"2":true,"a":[1,null,"\\\\u00e5\\\\"x"]}'
+    """
+    parts = []
+    _encode(value, parts)
+    return u"".join(parts)
+
+
+######################################################################
+
+_jsonEscapeRegexp = re.compile(u'[\\\\"\\x00-\\x1f]|[^\\x00-\\x7e]')
+
+def _jsonEscape(m):
+    """Internal helper function."""
+    char = m.group(0)
+    if char == u"\\":
+        return u"\\\\"
+    elif char == u'"':
+        return u'\\"'
+    else:
+        code = ord(char)
+        if code > 0xffff:
+            # Encode as a UTF-16 surrogate pair.
+            code -= 0x10000
+            return u"\\u%04x\\u%04x" % (
+                0xd800 + (code >> 10), 0xdc00 + (code & 0x3ff))
+        else:
+            return u"\\u%04x" % code
+
+
+def _encode(value, parts):
+    """Internal helper function."""
+    if value is None:
+        parts.append(u"null")
+    elif value is True:
+        parts.append(u"true")
+    elif value is False:
+        parts.append(u"false")
+    elif isinstance(value, (int, long)):
+        parts.append(unicode(value))
+    elif isinstance(value, basestring):
+        parts.append(u'"%s"' % _jsonEscapeRegexp.sub(
+            _jsonEscape, unicode(value)))
+    elif isinstance(value, (list, tuple)):
+        parts.append(u"[")
+        for i, x in enumerate(value):
+            if i > 0:
+                parts.append(u",")
+            _encode(x, parts)
+        parts.append(u"]")
+    elif isinstance(value, dict):
+        parts.append(u"{")
+        items = sorted([(unicode(k), v) for (k, v) in value.iteritems()])
+        for i, (key, x) in enumerate(items):
+            if i > 0:
+                parts.append(u",")
+            _encode(key, parts)
+            parts.append(u":")
+            _encode(x, parts)
+        parts.append(u"}")
+    else:
+        raise TypeError("Cannot convert %r to JSON" % (value,))
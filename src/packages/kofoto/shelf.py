@@ -4,6 +4,7 @@
 ### Public names.
 
 __all__ = [
+    "DEFAULT_EXIF_IMPORT_THREADS",
     "Shelf",
     "computeImageHash",
     "makeValidTag",
@@ -18,12 +19,14 @@ import hashlib
 import os
 import re
 import threading
+from Queue import Queue, Empty
 import sqlite3 as sql
 from kofoto.dag import DAG, LoopError
 from kofoto.cachedobject import CachedObject
+from kofoto.categoryindex import CategoryIndex
 from kofoto.albumtype import AlbumType
 from kofoto.imageversiontype import ImageVersionType
-import kofoto.exifthumbsupport
+from kofoto import integrity
 from kofoto import shelfupgrade
 from kofoto import shelfschema
 from kofoto.shelfexceptions import \
@@ -66,6 +69,48 @@ warnings.filterwarnings(
 _ROOT_ALBUM_ID = 0
 _SHELF_FORMAT_VERSION = 3
 
+# SQLite's default limit of the number of parameters in a statement is
+# 999.
+_MAX_SQL_PARAMETERS = 500
+
+# EXIF tags read when importing EXIF information.
+_IMPORTED_EXIF_TAGS = [
+    "EXIF DateTimeDigitized",
+    "EXIF DateTimeOriginal",
+    "EXIF ExposureBiasValue",
+    "EXIF ExposureProgram",
+    "EXIF ExposureTime",
+    "EXIF FNumber",
+    "EXIF Flash",
+    "EXIF FocalLength",
+    "EXIF ISOSpeedRatings",
+    "Image DateTime",
+    "Image Make",
+    "Image Model",
+    "Image Orientation",
+    ]
+
+# Attributes set from EXIF tags.
+_EXIF_ATTRIBUTES = [
+    u"cameramake",
+    u"cameramodel",
+    u"captured",
+    u"exposurebias",
+    u"exposureprogram",
+    u"exposuretime",
+    u"flash",
+    u"fnumber",
+    u"focallength",
+    u"iso",
+    u"orientation",
+    ]
+
+# Number of attribute rows to insert at a time in Shelf.importExifTags.
+_EXIF_IMPORT_BATCH_SIZE = 5000
+
+# Number of threads parsing files in Shelf.importExifTags.
+DEFAULT_EXIF_IMPORT_THREADS = 4
+
 
 ######################################################################
 ### Public functions.
@@ -149,6 +194,8 @@ class Shelf:
         self.modificationCallbacks = []
         self.connection = None
         self.categorydag = None
+        self.categoryindex = None
+        self.suspendedDataVersion = None
 
 
     def create(self):
@@ -185,8 +232,14 @@ class Shelf:
         return shelfupgrade.tryUpgrade(self.location, _SHELF_FORMAT_VERSION)
 
 
-    def begin(self):
-        """Begin working with the shelf."""
+    def begin(self, readOnly=False):
+        """Begin working with the shelf.
+
+        If readOnly is true, the shelf is opened for reading only.
+        Other processes may then read the shelf at the same time, but
+        no one can write to it until the work is committed or rolled
+        back, so the shelf is seen as a consistent snapshot.
+        """
         assert not self.inTransaction
         self.transactionLock.acquire()
         self.inTransaction = True
@@ -194,12 +247,18 @@ class Shelf:
             raise ShelfNotFoundError(self.location)
         try:
             self.connection = sql.connect(self.location)
-            cursor = self.connection.execute("BEGIN EXCLUSIVE")
+            if readOnly:
+                self.connection.execute("pragma query_only = 1")
+                self.connection.execute("BEGIN")
+            else:
+                self.connection.execute("BEGIN EXCLUSIVE")
         except sql.OperationalError:
             raise ShelfLockedError(self.location)
         except sql.DatabaseError:
             raise ShelfNotFoundError(self.location)
         self.categorydag = CachedObject(_createCategoryDAG, (self.connection,))
+        self.categoryindex = CachedObject(
+            _createCategoryIndex, (self.connection,))
         try:
             self._openShelf() # Starts the SQLite transaction.
         except:
@@ -222,6 +281,59 @@ class Shelf:
             self.transactionLock.release()
 
 
+    def checkpoint(self):
+        """Commit the work on the shelf and continue working with it.
+
+        This is equivalent to calling commit and then begin, except
+        that the caches are kept, which makes this much cheaper for
+        long-running clients."""
+        assert self.inTransaction
+        self.connection.commit()
+        self._unsetModified()
+        try:
+            self.connection.execute("BEGIN EXCLUSIVE")
+        except sql.OperationalError:
+            # Someone else got the lock in between.
+            self.rollback()
+            raise ShelfLockedError(self.location)
+
+
+    def suspend(self):
+        """Commit the work on the shelf and let other processes use it
+        until resume is called.
+
+        The caches are kept, so resuming is cheap if no other process
+        has modified the shelf in between."""
+        assert self.inTransaction
+        try:
+            self.connection.commit()
+            self.suspendedDataVersion = self._getDataVersion()
+        finally:
+            self._unsetModified()
+            self.inTransaction = False
+            self.transactionLock.release()
+
+
+    def resume(self):
+        """Continue working with the shelf after suspend or rollback.
+
+        The caches are flushed if another process has modified the
+        shelf in between. If another process is locking the shelf,
+        ShelfLockedError is raised and the shelf is still suspended."""
+        assert not self.inTransaction
+        self.transactionLock.acquire()
+        try:
+            self.connection.execute("BEGIN EXCLUSIVE")
+        except sql.OperationalError:
+            self.transactionLock.release()
+            raise ShelfLockedError(self.location)
+        self.inTransaction = True
+        if self._getDataVersion() != self.suspendedDataVersion:
+            self.flushCategoryCache()
+            self.flushObjectCache()
+            self.flushImageVersionCache()
+
+
     def rollback(self):
         """Abort the work on the shelf.
 
@@ -265,6 +377,7 @@ class Shelf:
         """Flush the category cache."""
         assert self.inTransaction
         self.categorydag.invalidate()
+        self.categoryindex.invalidate()
         self.categorycache = {}
 
 
@@ -318,6 +431,58 @@ class Shelf:
             }
 
 
+    def checkIntegrity(
+            self, nthreads=integrity.DEFAULT_INTEGRITY_CHECK_THREADS):
+        """Check the integrity of the metadata database.
+
+        Arguments:
+
+        nthreads -- Number of read-only connections checking the
+                    database in parallel. If 0, or if the shelf has
+                    uncommitted changes, the checks are run on the
+                    shelf's own connection.
+
+        Returns a list of (IntegrityCheck instance, violations) tuples
+        as described in kofoto.integrity.findViolations.
+        """
+        assert self.inTransaction
+        if nthreads == 0 or self.modified:
+            return integrity.findViolations(self.connection)
+        # Hold a shared lock instead of the exclusive one while
+        # checking, which lets the other connections read but still
+        # keeps everyone else from writing.
+        self.connection.commit()
+        try:
+            self.connection.execute("BEGIN")
+            self.connection.execute("select version from dbinfo").fetchall()
+            return integrity.findViolationsInParallel(
+                self.location, nthreads)
+        finally:
+            self.connection.commit()
+            try:
+                self.connection.execute("BEGIN EXCLUSIVE")
+            except sql.OperationalError:
+                # Someone else got the lock in between.
+                self.rollback()
+                raise ShelfLockedError(self.location)
+
+
+    def repairIntegrity(self):
+        """Repair the integrity of the metadata database.
+
+        Returns the violations found before they were repaired, in the
+        same format as Shelf.checkIntegrity.
+        """
+        assert self.inTransaction
+        violations = integrity.repairViolations(self.connection)
+        if violations:
+            self.flushCategoryCache()
+            self.flushObjectCache()
+            self.flushImageVersionCache()
+            self._setModified()
+        return violations
+
+
     def createAlbum(self, tag, albumtype=AlbumType.Plain):
         """Create an empty, orphaned album.
 
@@ -415,6 +580,22 @@ class Shelf:
                 yield self._albumFactory(albumid, tag, albumtype)
 
 
+    def getAllAlbumIds(self):
+        """Get the IDs of all albums in the shelf (unsorted).
+
+        This is much cheaper than getAllAlbums when only the IDs are
+        needed.
+
+        Returns an iterable returning the album IDs."""
+        assert self.inTransaction
+        cursor = self.connection.cursor()
+        cursor.execute(
+            " select id"
+            " from   album")
+        for (albumid,) in cursor:
+            yield albumid
+
+
     def getAllImages(self):
         """Get all images in the shelf (unsorted).
 
@@ -453,6 +634,40 @@ class Shelf:
                     width, height, comment)
 
 
+    def getImageIndexEntries(self):
+        """Get searchable information about all images in the shelf.
+
+        The information is fetched in a single pass over the database
+        without creating Image instances.
+
+        Returns an iterable returning tuples (imageid, captured,
+        title, categoryids) sorted by image ID, where captured and
+        title are unicode strings or None and categoryids is a list
+        of IDs of categories directly associated with the image."""
+        assert self.inTransaction
+        cursor = self.connection.cursor()
+        cursor.execute(
+            " select    i.id, ac.value, at.value, oc.category"
+            " from      image as i"
+            " left join attribute as ac"
+            " on        ac.object = i.id and ac.name = 'captured'"
+            " left join attribute as at"
+            " on        at.object = i.id and at.name = 'title'"
+            " left join object_category as oc"
+            " on        oc.object = i.id"
+            " order by  i.id, oc.category")
+        entry = None
+        for (imageid, captured, title, catid) in cursor:
+            if entry is None or entry[0] != imageid:
+                if entry is not None:
+                    yield entry
+                entry = (imageid, captured, title, [])
+            if catid is not None:
+                entry[3].append(catid)
+        if entry is not None:
+            yield entry
+
+
     def getImageVersionsInDirectory(self, directory):
         """Get all image versions that are expected to be in a given
         directory (unsorted).
@@ -573,6 +788,7 @@ class Shelf:
         assert ivtype in ImageVersionType
         assert self.inTransaction
         import Image as PILImage
+        import kofoto.exifthumbsupport
         try:
             pilimg = PILImage.open(location)
             if not pilimg.mode in ("L", "RGB", "CMYK"):
@@ -771,6 +987,42 @@ class Shelf:
                 raise ObjectDoesNotExistError(objid)
 
 
+    def getObjects(self, objids):
+        """Get the objects for given object IDs.
+
+        This is much faster than calling getObject for each ID since
+        objects that are not cached are fetched in a few queries.
+
+        Returns a list of objects in the same order as objids.
+        """
+        assert self.inTransaction
+        missing = list(set(
+            [x for x in objids if x not in self.objectcache]))
+        cursor = self.connection.cursor()
+        for chunk in _chunks(missing):
+            cursor.execute(
+                " select id, primary_version"
+                " from   image"
+                " where  id in (%s)" % _placeholders(chunk),
+                chunk)
+            for imageid, primary_version_id in cursor:
+                self._imageFactory(imageid, primary_version_id)
+            cursor.execute(
+                " select id, tag, type"
+                " from   album"
+                " where  id in (%s)" % _placeholders(chunk),
+                chunk)
+            for albumid, tag, albumtype in cursor:
+                albumtype = _albumTypeIdentifierToType(albumtype)
+                self._albumFactory(albumid, tag, albumtype)
+        objects = []
+        for objid in objids:
+            if objid not in self.objectcache:
+                raise ObjectDoesNotExistError(objid)
+            objects.append(self.objectcache[objid])
+        return objects
+
+
     def deleteObject(self, objid):
         """Get the object for a given object ID."""
         assert self.inTransaction
@@ -810,6 +1062,7 @@ class Shelf:
                 " values (?, ?)",
                 (tag, desc))
             self.categorydag.get().add(cursor.lastrowid)
+            self.categoryindex.get().add(cursor.lastrowid, tag, desc)
             self._setModified()
             return self.getCategory(cursor.lastrowid)
         except sql.IntegrityError:
@@ -855,6 +1108,9 @@ class Shelf:
         catdag = self.categorydag.get()
         if catid in catdag:
             catdag.remove(catid)
+        catindex = self.categoryindex.get()
+        if catid in catindex:
+            catindex.remove(catid)
         if catid in self.categorycache:
             del self.categorycache[catid]
         self._setModified()
@@ -923,6 +1179,30 @@ class Shelf:
                 yield category
 
 
+    def getCategoriesContainingText(self, text):
+        """Get the categories whose tag or description case
+        insensitively contains a given text.
+
+        This is much faster than getMatchingCategories, since an
+        in-memory index is used. Successive calls with a growing text
+        (e.g. when the user types) only look at the previous matches.
+
+        Returns a list of Category instances, best matches first:
+        exact matches, then prefix matches, then matches at the start
+        of a word, then other matches."""
+        assert self.inTransaction
+        catindex = self.categoryindex.get()
+        result = []
+        for catid in catindex.search(text):
+            category = self.categorycache.get(catid)
+            if category is None:
+                tag, desc = catindex.get(catid)
+                category = Category(self, catid, tag, desc)
+                self.categorycache[catid] = category
+            result.append(category)
+        return result
+
+
     def search(self, searchtree):
         """Search for objects matching a search node tree.
 
@@ -936,6 +1216,292 @@ class Shelf:
         for (objid,) in cursor:
             yield self.getObject(objid)
 
+
+    def searchObjectIds(self, searchtree):
+        """Search for objects matching a search node tree.
+
+        This is like search, but much faster for large results since
+        no objects are created.
+
+        Returns an iterable returning the object IDs."""
+        assert self.inTransaction
+        cursor = self.connection.cursor()
+        cursor.execute(searchtree.getQuery())
+        for (objid,) in cursor:
+            yield objid
+
+
+    def searchImageVersionLocations(self, searchtree, ivtypes=None,
+                                    includePrimary=False, ordered=False,
+                                    limit=None):
+        """Search for image versions of images matching a search node
+        tree.
+
+        The filtering is done by the database, so no objects are
+        created and the result is returned while it is being read.
+
+        Arguments:
+
+        searchtree     -- A search node tree.
+        ivtypes        -- An iterable of ImageVersionType alternatives
+                          to include, or None for all image versions.
+        includePrimary -- Iff true, primary image versions are also
+                          included.
+        ordered        -- Iff true, the locations are returned in
+                          order of directory and filename.
+        limit          -- Maximum number of locations to return, or
+                          None for no limit.
+
+        Returns an iterable returning the image version locations."""
+        assert self.inTransaction
+        query, parameters = self._getImageVersionSearchQuery(
+            searchtree, "iv.directory, iv.filename", ivtypes, includePrimary,
+            ordered and "iv.directory, iv.filename", limit)
+        cursor = self.connection.cursor()
+        cursor.execute(query, parameters)
+        for (directory, filename) in cursor:
+            yield os.path.join(directory, filename)
+
+
+    def countImageVersionLocations(self, searchtree, ivtypes=None,
+                                   includePrimary=False, limit=None):
+        """Count the image versions that searchImageVersionLocations
+        would return.
+
+        Returns the number of image versions."""
+        assert self.inTransaction
+        query, parameters = self._getImageVersionSearchQuery(
+            searchtree, "iv.id", ivtypes, includePrimary, None, limit)
+        cursor = self.connection.cursor()
+        cursor.execute("select count(*) from (%s)" % query, parameters)
+        return cursor.fetchone()[0]
+
+
+    def searchImageIds(self, searchtree, ordered=False, limit=None):
+        """Search for images (that have image versions) matching a
+        search node tree.
+
+        Arguments:
+
+        searchtree -- A search node tree.
+        ordered    -- Iff true, the IDs are returned in ascending order.
+        limit      -- Maximum number of IDs to return, or None for no
+                      limit.
+
+        Returns an iterable returning the image IDs."""
+        assert self.inTransaction
+        query, parameters = self._getImageVersionSearchQuery(
+            searchtree, "distinct iv.image", None, False,
+            ordered and "iv.image", limit)
+        cursor = self.connection.cursor()
+        cursor.execute(query, parameters)
+        for (imageid,) in cursor:
+            yield imageid
+
+
+    def countImageIds(self, searchtree, limit=None):
+        """Count the image IDs that searchImageIds would return.
+
+        Returns the number of images."""
+        assert self.inTransaction
+        query, parameters = self._getImageVersionSearchQuery(
+            searchtree, "distinct iv.image", None, False, None, limit)
+        cursor = self.connection.cursor()
+        cursor.execute("select count(*) from (%s)" % query, parameters)
+        return cursor.fetchone()[0]
+
+
+    def getCategoryCounts(self, objids):
+        """Get the number of objects in each category for some
+        objects.
+
+        Returns a dictionary mapping category ID to the number of the
+        given objects that are connected to the category. Categories
+        connected to none of the objects are not included."""
+        assert self.inTransaction
+        counts = {}
+        cursor = self.connection.cursor()
+        for chunk in _chunks(list(objids)):
+            cursor.execute(
+                " select   category, count(*)"
+                " from     object_category"
+                " where    object in (%s)"
+                " group by category" % _placeholders(chunk),
+                chunk)
+            for catid, count in cursor:
+                counts[catid] = counts.get(catid, 0) + count
+        return counts
+
+
+    def getImageVersionCounts(self, images):
+        """Get the number of image versions of some images.
+
+        Returns a dictionary mapping image ID to number of image
+        versions. Images without versions are included with count 0."""
+        assert self.inTransaction
+        imageids = [x.getId() for x in images]
+        counts = dict.fromkeys(imageids, 0)
+        cursor = self.connection.cursor()
+        for chunk in _chunks(imageids):
+            cursor.execute(
+                " select   image, count(*)"
+                " from     image_version"
+                " where    image in (%s)"
+                " group by image" % _placeholders(chunk),
+                chunk)
+            for imageid, count in cursor:
+                counts[imageid] = count
+        return counts
+
+
+    def getAttributeValues(self, name, objids):
+        """Get the values of an attribute for some objects.
+
+        Returns a dictionary mapping object ID to attribute value.
+        Objects without the attribute are included with value None."""
+        assert self.inTransaction
+        values = dict.fromkeys(objids)
+        cursor = self.connection.cursor()
+        for chunk in _chunks(list(objids)):
+            cursor.execute(
+                " select object, value"
+                " from   attribute"
+                " where  name = ? and object in (%s)" % _placeholders(chunk),
+                [name] + chunk)
+            for objid, value in cursor:
+                values[objid] = value
+        return values
+
+
+    def importExifTags(self, imageversions, overwrite, onlyMissing=False,
+                       nthreads=DEFAULT_EXIF_IMPORT_THREADS):
+        """Read known EXIF tags of many image versions and add them as
+        attributes of their images.
+
+        This is equivalent to calling ImageVersion.importExifTags for
+        each image version, but the files are parsed by a pool of
+        worker threads and the attributes are inserted in large
+        batches.
+
+        Arguments:
+
+        imageversions -- An iterable of ImageVersion instances, or
+                         None for all image versions in the shelf.
+        overwrite     -- Iff true, existing attributes will be
+                         overwritten.
+        onlyMissing   -- Iff true, images that already have some
+                         attribute read from EXIF tags are skipped.
+        nthreads      -- Number of worker threads. If 0, the files are
+                         parsed synchronously.
+
+        Returns a list of locations of image versions whose EXIF
+        information couldn't be read.
+        """
+        assert self.inTransaction
+        cursor = self.connection.cursor()
+        if imageversions is None:
+            cursor.execute(
+                " select image, directory, filename"
+                " from   image_version")
+            jobs = [(imageid, os.path.join(directory, filename))
+                    for (imageid, directory, filename) in cursor]
+        else:
+            jobs = [(x.imageid, x.getLocation()) for x in imageversions]
+        if onlyMissing:
+            cursor.execute(
+                " select distinct object"
+                " from   attribute"
+                " where  name in (%s)" % _placeholders(_EXIF_ATTRIBUTES),
+                _EXIF_ATTRIBUTES)
+            present = set([objid for (objid,) in cursor])
+            jobs = [x for x in jobs if x[0] not in present]
+
+        failed = []
+        imageids = set()
+        rows = {True: [], False: []} # overwrite --> list of rows
+        nrows = 0
+        for imageid, location, attributes in _readExifAttributesInParallel(
+                jobs, nthreads):
+            if attributes is None:
+                failed.append(location)
+                continue
+            imageids.add(imageid)
+            for name, value in attributes:
+                # The capture time is always overwritten, like in
+                # ImageVersion.importExifTags.
+                rows[overwrite or name == u"captured"].append(
+                    (imageid, name, value, value.lower()))
+                nrows += 1
+            if nrows >= _EXIF_IMPORT_BATCH_SIZE:
+                self._insertAttributes(rows)
+                rows = {True: [], False: []}
+                nrows = 0
+        self._insertAttributes(rows)
+
+        # Cached attributes of the images are stale now.
+        for imageid in imageids:
+            if imageid in self.objectcache:
+                image = self.objectcache[imageid]
+                image.attributes = {}
+                image.allAttributesFetched = False
+        if imageids:
+            self._setModified()
+        return failed
+
+
+    def preloadAttributes(self, objects):
+        """Fetch all attributes of some objects in a few queries.
+
+        Subsequent calls to getAttribute and getAttributeMap for the
+        objects will not have to query the database."""
+        assert self.inTransaction
+        amaps = {}
+        for obj in objects:
+            if not obj.allAttributesFetched:
+                amaps[obj.getId()] = {}
+        objids = amaps.keys()
+        cursor = self.connection.cursor()
+        for chunk in _chunks(objids):
+            cursor.execute(
+                " select object, name, value"
+                " from   attribute"
+                " where  object in (%s)" % _placeholders(chunk),
+                chunk)
+            for objid, name, value in cursor:
+                amaps[objid][name] = value
+        for obj in objects:
+            if obj.getId() in amaps:
+                obj.attributes = amaps[obj.getId()]
+                obj.allAttributesFetched = True
+
+
+    def preloadPrimaryVersions(self, images):
+        """Fetch the primary image versions of some images in a few
+        queries.
+
+        Subsequent calls to getPrimaryVersion for the images will not
+        have to query the database."""
+        assert self.inTransaction
+        ivids = list(set(
+            [x.primary_version_id for x in images
+             if x.primary_version_id is not None and
+                x.primary_version_id not in self.imageversioncache]))
+        cursor = self.connection.cursor()
+        for chunk in _chunks(ivids):
+            cursor.execute(
+                " select id, image, type, hash, directory, filename, mtime,"
+                "        width, height, comment"
+                " from   image_version"
+                " where  id in (%s)" % _placeholders(chunk),
+                chunk)
+            for ivid, imageid, ivtype, ivhash, directory, filename, mtime, \
+                    width, height, comment in cursor:
+                location = os.path.join(directory, filename)
+                ivtype = _imageVersionTypeIdentifierToType(ivtype)
+                self._imageVersionFactory(
+                    ivid, imageid, ivtype, ivhash, location, mtime,
+                    width, height, comment)
+
     ##############################
     # Internal methods.
 
@@ -1045,6 +1611,53 @@ class Shelf:
         return imageversion
 
 
+    def _insertAttributes(self, rows):
+        """Helper method that inserts attributes.
+
+        rows is a dictionary mapping True (overwrite existing
+        attributes) and False (keep existing attributes) to lists of
+        (object ID, name, value, lowercased value) tuples."""
+        cursor = self.connection.cursor()
+        for overwrite, method in [(True, "replace"), (False, "ignore")]:
+            if rows[overwrite]:
+                cursor.executemany(
+                    " insert or " + method + " into attribute"
+                    "     (object, name, value, lcvalue)"
+                    " values"
+                    "     (?, ?, ?, ?)",
+                    rows[overwrite])
+
+
+    def _getImageVersionSearchQuery(self, searchtree, columns, ivtypes,
+                                    includePrimary, orderBy, limit):
+        """Get an SQL query selecting columns from image versions
+        (aliased "iv") of images matching a search node tree.
+
+        Returns a tuple of the query and its parameters."""
+        query = (" select %s"
+                 " from   image_version as iv" % columns)
+        if ivtypes is not None and includePrimary:
+            query += " join image as i on i.id = iv.image"
+        query += " where iv.image in (%s)" % searchtree.getQuery()
+        parameters = []
+        if ivtypes is not None:
+            conditions = []
+            ivtypes = [_imageVersionTypeToIdentifier(x) for x in ivtypes]
+            if ivtypes:
+                conditions.append("iv.type in (%s)" % _placeholders(ivtypes))
+                parameters.extend(ivtypes)
+            if includePrimary:
+                conditions.append("i.primary_version = iv.id")
+            if not conditions:
+                conditions.append("0")
+            query += " and (%s)" % " or ".join(conditions)
+        if orderBy:
+            query += " order by %s" % orderBy
+        if limit is not None:
+            query += " limit %d" % limit
+        return query, parameters
+
+
     def _deleteObjectFromParents(self, objid):
         """Helper method that deletes an object from its parents."""
         cursor = self.connection.cursor()
@@ -1096,6 +1709,12 @@ class Shelf:
         return self.connection
 
 
+    def _getDataVersion(self):
+        """Get a number that changes when another connection modifies
+        the database."""
+        return self.connection.execute("pragma data_version").fetchone()[0]
+
+
     def _getOrphanAlbumsCache(self):
         """Get the cache of the orphaned albums."""
         assert self.inTransaction
@@ -1146,6 +1765,8 @@ class Category:
             " where  id = ?",
             (newtag, self.getId()))
         self.tag = newtag
+        self.shelf.categoryindex.get().update(
+            self.getId(), self.tag, self.description)
         self.shelf._setModified()
 
 
@@ -1163,6 +1784,8 @@ class Category:
             " where  id = ?",
             (newdesc, self.getId()))
         self.description = newdesc
+        self.shelf.categoryindex.get().update(
+            self.getId(), self.tag, self.description)
         self.shelf._setModified()
 
 
@@ -1592,10 +2215,7 @@ class PlainAlbum(Album):
             " where  album = ?"
             " order by position",
             (self.getId(),))
-        self.children = []
-        for (objid,) in cursor:
-            child = self.shelf.getObject(objid)
-            self.children.append(child)
+        self.children = self.shelf.getObjects([x[0] for x in cursor])
         for child in self.children:
             yield child
 
@@ -1867,6 +2487,7 @@ class ImageVersion:
         """
         self.hash = computeImageHash(self.location)
         import Image as PILImage
+        import kofoto.exifthumbsupport
         try:
             pilimg = PILImage.open(self.location)
         except IOError:
@@ -1912,70 +2533,12 @@ class ImageVersion:
 
         Raises kofoto.shelfexceptions.ExifImportError on error.
         """
-        from kofoto import EXIF
         image = self.getImage()
-        fp = open(self.getLocation(), "rb")
-        try:
-            tags = EXIF.process_file(fp, details=False)
-        except: # Work-around for buggy EXIF library.
-            raise ExifImportError(self.getLocation())
-
-        for tag in ["Image DateTime",
-                    "EXIF DateTimeOriginal",
-                    "EXIF DateTimeDigitized"]:
-            value = tags.get(tag)
-            if value and str(value) != "0000:00:00 00:00:00":
-                m = re.match(
-                    r"(\d{4})[:/-](\d{2})[:/-](\d{2}) (\d{2}):(\d{2}):(\d{2})",
-                    str(value))
-                if m:
-                    image.setAttribute(
-                        u"captured",
-                        u"%s-%s-%s %s:%s:%s" % m.groups())
-
-        value = tags.get("EXIF ExposureTime")
-        if value:
-            image.setAttribute(u"exposuretime", unicode(value), overwrite)
-        value = tags.get("EXIF FNumber")
-        if value:
-            image.setAttribute(u"fnumber", unicode(value), overwrite)
-        value = tags.get("EXIF Flash")
-        if value:
-            image.setAttribute(u"flash", unicode(value), overwrite)
-        value = tags.get("EXIF FocalLength")
-        if value:
-            image.setAttribute(u"focallength", unicode(value), overwrite)
-        value = tags.get("Image Make")
-        if value:
-            image.setAttribute(u"cameramake", unicode(value), overwrite)
-        value = tags.get("Image Model")
-        if value:
-            image.setAttribute(u"cameramodel", unicode(value), overwrite)
-        value = tags.get("Image Orientation")
-        if value:
-            try:
-                m = {1: "up",
-                     2: "up",
-                     3: "down",
-                     4: "up",
-                     5: "up",
-                     6: "left",
-                     7: "up",
-                     8: "right",
-                     }
-                image.setAttribute(
-                    u"orientation", unicode(m[value.values[0]]), overwrite)
-            except KeyError:
-                pass
-        value = tags.get("EXIF ExposureProgram")
-        if value:
-            image.setAttribute(u"exposureprogram", unicode(value), overwrite)
-        value = tags.get("EXIF ISOSpeedRatings")
-        if value:
-            image.setAttribute(u"iso", unicode(value), overwrite)
-        value = tags.get("EXIF ExposureBiasValue")
-        if value:
-            image.setAttribute(u"exposurebias", unicode(value), overwrite)
+        for name, value in _readExifAttributes(self.getLocation()):
+            if name == u"captured":
+                image.setAttribute(name, value)
+            else:
+                image.setAttribute(name, value, overwrite)
         self.shelf._setModified()
 
     ##############################
@@ -2178,6 +2741,13 @@ def _albumTypeToIdentifier(atype):
         raise UnknownAlbumTypeError(atype)
 
 
+def _chunks(seq):
+    """Split a list into chunks small enough to be used as parameters
+    of an SQL "in" expression."""
+    for i in range(0, len(seq), _MAX_SQL_PARAMETERS):
+        yield seq[i:i + _MAX_SQL_PARAMETERS]
+
+
 def _createCategoryDAG(connection):
     """Create the category DAG."""
     cursor = connection.cursor()
@@ -2193,6 +2763,147 @@ def _createCategoryDAG(connection):
     return dag
 
 
+def _createCategoryIndex(connection):
+    """Create the category index."""
+    cursor = connection.cursor()
+    cursor.execute(
+        " select id, tag, description"
+        " from   category")
+    return CategoryIndex(cursor)
+
+
+def _placeholders(seq):
+    """Create a parameter list for an SQL "in" expression."""
+    return ",".join(["?"] * len(seq))
+
+
+def _readExifAttributes(location):
+    """Read known EXIF tags of an image file.
+
+    Returns a list of (attribute name, value) tuples.
+
+    Raises kofoto.shelfexceptions.ExifImportError on error.
+    """
+    from kofoto.exifreader import readExifTags
+    fp = open(location, "rb")
+    try:
+        try:
+            tags = readExifTags(fp, _IMPORTED_EXIF_TAGS)
+        except: # Corrupt EXIF data.
+            raise ExifImportError(location)
+    finally:
+        fp.close()
+
+    attributes = []
+    captured = None
+    for tag in ["Image DateTime",
+                "EXIF DateTimeOriginal",
+                "EXIF DateTimeDigitized"]:
+        value = tags.get(tag)
+        if value and str(value) != "0000:00:00 00:00:00":
+            m = re.match(
+                r"(\d{4})[:/-](\d{2})[:/-](\d{2}) (\d{2}):(\d{2}):(\d{2})",
+                str(value))
+            if m:
+                captured = u"%s-%s-%s %s:%s:%s" % m.groups()
+    if captured:
+        attributes.append((u"captured", captured))
+
+    for tag, name in [("EXIF ExposureTime", u"exposuretime"),
+                      ("EXIF FNumber", u"fnumber"),
+                      ("EXIF Flash", u"flash"),
+                      ("EXIF FocalLength", u"focallength"),
+                      ("Image Make", u"cameramake"),
+                      ("Image Model", u"cameramodel")]:
+        value = tags.get(tag)
+        if value:
+            attributes.append((name, unicode(value)))
+    value = tags.get("Image Orientation")
+    if value:
+        try:
+            m = {1: "up",
+                 2: "up",
+                 3: "down",
+                 4: "up",
+                 5: "up",
+                 6: "left",
+                 7: "up",
+                 8: "right",
+                 }
+            attributes.append(
+                (u"orientation", unicode(m[value.values[0]])))
+        except KeyError:
+            pass
+    for tag, name in [("EXIF ExposureProgram", u"exposureprogram"),
+                      ("EXIF ISOSpeedRatings", u"iso"),
+                      ("EXIF ExposureBiasValue", u"exposurebias")]:
+        value = tags.get(tag)
+        if value:
+            attributes.append((name, unicode(value)))
+    return attributes
+
+
+def _readExifAttributesInParallel(jobs, nthreads):
+    """Read known EXIF tags of many image files in worker threads.
+
+    Arguments:
+
+    jobs     -- A list of (image ID, location) tuples.
+    nthreads -- Number of worker threads. If 0, the files are read
+                synchronously.
+
+    Returns an iterable returning (image ID, location, attributes)
+    tuples in the order the files were read, where attributes is a
+    list of (attribute name, value) tuples, or None if the file
+    couldn't be read.
+    """
+    if nthreads == 0:
+        for imageid, location in jobs:
+            yield _readExifAttributesJob(imageid, location)
+        return
+    jobQueue = Queue()
+    resultQueue = Queue()
+    for job in jobs:
+        jobQueue.put(job)
+    for unused in range(nthreads):
+        jobQueue.put(None)
+        thread = threading.Thread(
+            target=_exifWorker, args=(jobQueue, resultQueue))
+        thread.setDaemon(True)
+        thread.start()
+    try:
+        for unused in jobs:
+            yield resultQueue.get()
+    finally:
+        # Stop the workers if the caller gave up early.
+        try:
+            while True:
+                jobQueue.get_nowait()
+        except Empty:
+            pass
+        for unused in range(nthreads):
+            jobQueue.put(None)
+
+
+def _exifWorker(jobQueue, resultQueue):
+    """Worker thread main loop of _readExifAttributesInParallel."""
+    while True:
+        job = jobQueue.get()
+        if job is None:
+            return
+        resultQueue.put(_readExifAttributesJob(*job))
+
+
+def _readExifAttributesJob(imageid, location):
+    """Internal helper function."""
+    try:
+        attributes = _readExifAttributes(location)
+    except Exception:
+        # Unreadable file or unexpected EXIF contents.
+        attributes = None
+    return (imageid, location, attributes)
+
+
 def _imageVersionTypeIdentifierToType(ivtype):
     """Map an image version type identifer string to an ImageVersionType
     alternative.
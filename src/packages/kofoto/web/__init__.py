@@ -0,0 +1 @@
+"""Implementation of the Kofoto web frontend."""
@@ -0,0 +1,349 @@
+"""WSGI application of the Kofoto web frontend.
+
+Each request reads a snapshot of the shelf of its own (see Shelf.begin)
+and releases it before sending the response, so requests can be
+handled concurrently. Images are served with an ETag derived from the
+image version's hash and modification time, so that browsers can
+revalidate their cached images without the image being sent again.
+"""
+
+__all__ = ["WebApplication"]
+
+import cgi
+import mimetypes
+import os
+from email.utils import mktime_tz, parsedate_tz
+from wsgiref.handlers import format_date_time
+from wsgiref.util import FileWrapper, request_uri
+from xml.sax.saxutils import escape, quoteattr
+from kofoto.shelf import Shelf
+from kofoto.shelfexceptions import \
+    AlbumDoesNotExistError, \
+    ImageDoesNotExistError, \
+    ObjectDoesNotExistError, \
+    ShelfLockedError
+
+# Size of the blocks in which files are sent.
+_BLOCK_SIZE = 2**16
+
+_PAGE_HEADER = """\
+<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html
+    PUBLIC "-//W3C//DTD XHTML 1.0 %(dtdName)s//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-%(dtd)s.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<link rel="stylesheet" href="/static/webkofoto.css" type="text/css" />
+</head>
+"""
+
+_FRAMESET = """\
+<frameset cols="30%, *">
+<frame name="treeframe" src="treeframe" />
+<frame name="contentframe" src="contentframe" />
+<noframes>
+This page needs frames. Sorry.
+</noframes>
+</frameset>
+"""
+
+class _HttpError(Exception):
+    """An HTTP error response.
+
+    Exception parameter: HTTP status line.
+    """
+    pass
+
+
+class WebApplication:
+    """A WSGI application for viewing and annotating images in a
+    shelf."""
+
+    def __init__(self, shelfLocation, imageCache, rootAlbumTag=None,
+                 staticLocation=None):
+        """Constructor.
+
+        Arguments:
+
+        shelfLocation  -- Location of the shelf.
+        imageCache     -- A kofoto.imagecache.ImageCache instance.
+        rootAlbumTag   -- Tag of the album shown at the top of the
+                          album tree, or None for the root album.
+        staticLocation -- Directory of files served under /static, or
+                          None.
+        """
+        self.__shelfLocation = shelfLocation
+        self.__imageCache = imageCache
+        self.__rootAlbumTag = rootAlbumTag
+        self.__staticLocation = staticLocation
+        self.__handlers = {
+            "/": self.__index,
+            "/album": self.__album,
+            "/contentframe": self.__contentFrame,
+            "/image": self.__image,
+            "/submitAlbum": self.__submitAlbum,
+            "/treeframe": self.__treeFrame,
+            }
+
+
+    def __call__(self, environ, start_response):
+        """Handle a request."""
+        path = environ.get("PATH_INFO") or "/"
+        try:
+            try:
+                if path.startswith("/static/"):
+                    return self.__static(environ, start_response, path[8:])
+                if path not in self.__handlers:
+                    raise _HttpError("404 Not Found")
+                return self.__handlers[path](environ, start_response)
+            except (KeyError, ValueError):
+                # Missing or malformed parameter.
+                raise _HttpError("400 Bad Request")
+            except (AlbumDoesNotExistError, ImageDoesNotExistError,
+                    ObjectDoesNotExistError):
+                raise _HttpError("404 Not Found")
+            except ShelfLockedError:
+                raise _HttpError("503 Service Unavailable")
+        except _HttpError, e:
+            status = e.args[0]
+            start_response(status, [("Content-Type", "text/plain")])
+            return [status + "\n"]
+
+
+    ##############################
+    # Internal methods.
+
+    def __readShelf(self, function, *args):
+        """Call a function with a shelf opened for reading as the first
+        argument and return its result."""
+        shelf = Shelf(self.__shelfLocation)
+        shelf.begin(readOnly=True)
+        try:
+            return function(shelf, *args)
+        finally:
+            shelf.rollback()
+
+
+    def __getRootAlbum(self, shelf):
+        """Get the album shown at the top of the album tree."""
+        if self.__rootAlbumTag is None:
+            return shelf.getRootAlbum()
+        else:
+            return shelf.getAlbumByTag(self.__rootAlbumTag)
+
+
+    def __index(self, environ, start_response):
+        """Handler for the main frameset."""
+        return _sendPage(start_response, _FRAMESET, frameset=True)
+
+
+    def __treeFrame(self, environ, start_response):
+        """Handler for the album tree frame."""
+        def render(shelf):
+            return u"<ul>\n%s</ul>\n" % _albumTree(
+                self.__getRootAlbum(shelf), 0, [])
+        return _sendPage(start_response, self.__readShelf(render))
+
+
+    def __contentFrame(self, environ, start_response):
+        """Handler for the initial content frame."""
+        return _sendPage(start_response, u"<p>Welcome to Kofoto.</p>\n")
+
+
+    def __album(self, environ, start_response):
+        """Handler for the image descriptions of an album."""
+        albumid = int(_parseQuery(environ)["albumid"])
+        def render(shelf):
+            lines = [
+                u'<form method="post" action="/submitAlbum">\n',
+                u'<input type="hidden" name="origin" value=%s />\n' % (
+                    quoteattr(request_uri(environ).decode("utf-8"))),
+                u'<input type="submit" value="Save" />\n',
+                u"<table>\n"]
+            for image in shelf.getAlbum(albumid).getChildren():
+                if image.isAlbum():
+                    continue
+                description = image.getAttribute(u"description") or u""
+                lines.append(
+                    u"<tr>\n"
+                    u"<td>\n"
+                    u'  <img src="/image?imageid=%d&amp;widthlimit=128&amp;'
+                    u'heightlimit=128" />\n'
+                    u"</td>\n"
+                    u"<td>\n"
+                    u'<textarea cols="40" rows="3" name="description-%d">'
+                    u"%s</textarea>\n"
+                    u"</td>\n"
+                    u"</tr>\n" % (
+                        image.getId(), image.getId(), escape(description)))
+            lines.append(
+                u"</table>\n"
+                u'<input type="submit" value="Save" />\n'
+                u"</form>\n")
+            return u"".join(lines)
+        return _sendPage(start_response, self.__readShelf(render))
+
+
+    def __image(self, environ, start_response):
+        """Handler for a scaled version of an image."""
+        query = _parseQuery(environ)
+        imageid = int(query["imageid"])
+        widthlimit = int(query["widthlimit"])
+        heightlimit = int(query["heightlimit"])
+        def getParameters(shelf):
+            imageversion = shelf.getImage(imageid).getPrimaryVersion()
+            if imageversion is None:
+                raise ImageDoesNotExistError(imageid)
+            return (imageversion.getHash(),
+                    self.__imageCache.getParameters(imageversion))
+        ivhash, parameters = self.__readShelf(getParameters)
+        mtime, orientation = parameters[1], parameters[4]
+        etag = '"%s-%d-%dx%d-%s"' % (
+            ivhash, mtime, widthlimit, heightlimit, orientation)
+        if _isNotModified(environ, etag, mtime):
+            return _sendNotModified(start_response, etag, mtime)
+        try:
+            path = self.__imageCache.getByParameters(
+                parameters, widthlimit, heightlimit)[0]
+        except (IOError, OSError):
+            # The original image is missing or unreadable.
+            raise _HttpError("404 Not Found")
+        return _sendFile(
+            environ, start_response, path, "image/jpeg", etag, mtime)
+
+
+    def __static(self, environ, start_response, name):
+        """Handler for the static files."""
+        if (self.__staticLocation is None or not name or
+                ".." in name.split("/")):
+            raise _HttpError("404 Not Found")
+        path = os.path.join(self.__staticLocation, *name.split("/"))
+        if not os.path.isfile(path):
+            raise _HttpError("404 Not Found")
+        st = os.stat(path)
+        etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+        if _isNotModified(environ, etag, st.st_mtime):
+            return _sendNotModified(start_response, etag, st.st_mtime)
+        contentType = mimetypes.guess_type(path)[0]
+        return _sendFile(
+            environ, start_response, path,
+            contentType or "application/octet-stream", etag, st.st_mtime)
+
+
+    def __submitAlbum(self, environ, start_response):
+        """Handler for saving the image descriptions of an album."""
+        if environ["REQUEST_METHOD"] != "POST":
+            raise _HttpError("405 Method Not Allowed")
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        form = cgi.parse_qs(environ["wsgi.input"].read(length))
+        shelf = Shelf(self.__shelfLocation)
+        shelf.begin()
+        try:
+            for key, values in form.items():
+                if key.startswith("description-"):
+                    objectid = int(key.split("-")[1])
+                    shelf.getObject(objectid).setAttribute(
+                        u"description", values[0].decode("utf-8"))
+        except:
+            shelf.rollback()
+            raise
+        shelf.commit()
+        start_response(
+            "303 See Other",
+            [("Location", form.get("origin", ["/"])[0]),
+             ("Content-Type", "text/plain")])
+        return []
+
+######################################################################
+
+def _parseQuery(environ):
+    """Internal helper function."""
+    return dict([(key, values[0]) for (key, values)
+                 in cgi.parse_qs(environ.get("QUERY_STRING", "")).items()])
+
+
+def _albumTree(album, level, visited):
+    """Internal helper function."""
+    tag = album.getTag()
+    title = album.getAttribute(u"title") or tag
+    indent = u" " * (level + 1)
+    oddeven = ["odd", "even"][level % 2]
+    ret = [
+        u'%s<li class="%s"><a href="/album?albumid=%d"'
+        u' target="contentframe">%s</a>' % (
+            indent, oddeven, album.getId(), escape(title))]
+    if tag in visited:
+        ret.append(u'\n%s<ul><li class="%s">...</li></ul>\n' % (
+            indent, oddeven))
+    else:
+        children = list(album.getAlbumChildren())
+        if children:
+            ret.append(u"\n%s <ul>\n" % indent)
+            for child in children:
+                ret.append(_albumTree(child, level + 1, visited + [tag]))
+            ret.append(u"%s </ul>\n" % indent)
+            ret.append(indent)
+    ret.append(u"</li>\n")
+    return u"".join(ret)
+
+
+def _sendPage(start_response, body, frameset=False):
+    """Internal helper function."""
+    if frameset:
+        header = _PAGE_HEADER % {"dtdName": "Frameset", "dtd": "frameset"}
+        page = header + body + u"</html>\n"
+    else:
+        header = _PAGE_HEADER % {"dtdName": "Strict", "dtd": "strict"}
+        page = header + u"<body>\n" + body + u"</body>\n</html>\n"
+    data = page.encode("utf-8")
+    start_response(
+        "200 OK",
+        [("Content-Type", "application/xhtml+xml; charset=utf-8"),
+         ("Content-Length", str(len(data)))])
+    return [data]
+
+
+def _isNotModified(environ, etag, mtime):
+    """Check whether the client's cached copy of a resource is valid."""
+    ifNoneMatch = environ.get("HTTP_IF_NONE_MATCH")
+    if ifNoneMatch is not None:
+        # If-Modified-Since is ignored when If-None-Match is given.
+        tags = [x.strip() for x in ifNoneMatch.split(",")]
+        return "*" in tags or etag in tags or "W/" + etag in tags
+    ifModifiedSince = environ.get("HTTP_IF_MODIFIED_SINCE")
+    if ifModifiedSince is not None:
+        date = parsedate_tz(ifModifiedSince)
+        return date is not None and mktime_tz(date) >= int(mtime)
+    return False
+
+
+def _sendNotModified(start_response, etag, mtime):
+    """Internal helper function."""
+    start_response(
+        "304 Not Modified",
+        [("ETag", etag),
+         ("Last-Modified", format_date_time(mtime))])
+    return []
+
+
+def _sendFile(environ, start_response, path, contentType, etag, mtime):
+    """Internal helper function."""
+    fp = open(path, "rb")
+    try:
+        size = os.fstat(fp.fileno()).st_size
+        start_response(
+            "200 OK",
+            [("Content-Type", contentType),
+             ("Content-Length", str(size)),
+             ("ETag", etag),
+             ("Last-Modified", format_date_time(mtime))])
+    except:
+        fp.close()
+        raise
+    if environ["REQUEST_METHOD"] == "HEAD":
+        fp.close()
+        return []
+    # Let the server send the file efficiently if it can (for
+    # instance with sendfile).
+    fileWrapper = environ.get("wsgi.file_wrapper", FileWrapper)
+    return fileWrapper(fp, _BLOCK_SIZE)
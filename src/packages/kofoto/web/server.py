@@ -0,0 +1,75 @@
+"""HTTP server for the Kofoto web frontend."""
+
+__all__ = ["DEFAULT_SERVER_THREADS", "ThreadPoolWSGIServer"]
+
+import threading
+from Queue import Queue
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+# Number of threads handling requests in ThreadPoolWSGIServer.
+DEFAULT_SERVER_THREADS = 8
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """A WSGI server handling requests in a pool of worker threads."""
+
+    def __init__(self, address, application,
+                 nthreads=DEFAULT_SERVER_THREADS, verbose=False):
+        """Constructor.
+
+        Arguments:
+
+        address     -- A (host, port) tuple to listen on.
+        application -- The WSGI application.
+        nthreads    -- Number of worker threads.
+        verbose     -- Iff true, requests are logged to standard error.
+        """
+        if verbose:
+            handlerClass = WSGIRequestHandler
+        else:
+            handlerClass = _QuietRequestHandler
+        WSGIServer.__init__(self, address, handlerClass)
+        self.set_app(application)
+        self.__nthreads = nthreads
+        self.__requestQueue = Queue()
+        for unused in range(nthreads):
+            thread = threading.Thread(target=self.__worker)
+            thread.setDaemon(True)
+            thread.start()
+
+
+    def process_request(self, request, clientAddress):
+        """Let a worker thread handle a request."""
+        self.__requestQueue.put((request, clientAddress))
+
+
+    def server_close(self):
+        """Stop the worker threads and close the server socket."""
+        for unused in range(self.__nthreads):
+            self.__requestQueue.put(None)
+        WSGIServer.server_close(self)
+
+
+    ##############################
+    # Internal methods.
+
+    def __worker(self):
+        """Worker thread main loop."""
+        while True:
+            job = self.__requestQueue.get()
+            if job is None:
+                return
+            request, clientAddress = job
+            try:
+                try:
+                    self.finish_request(request, clientAddress)
+                except Exception:
+                    self.handle_error(request, clientAddress)
+            finally:
+                self.close_request(request)
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that doesn't log requests."""
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+
+"""Benchmark of EXIF tag reading.
+
+Reads the EXIF tags of the given images (by default the reference
+pictures) with kofoto.EXIF.process_file and with
+kofoto.exifreader.readExifTags, both for all tags and for the tags
+imported by the shelf, and reports the time per image.
+
+Usage: benchmark_exif.py [-n number of rounds] [image...]
+"""
+
+import getopt
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    sys.path.insert(0, libdir)
+
+from kofoto import EXIF
+from kofoto.exifreader import readExifTags
+from kofoto.shelf import _IMPORTED_EXIF_TAGS
+
+DEFAULT_ROUNDS = 20
+REFERENCE_PICTURES = os.path.join(
+    os.path.dirname(sys.argv[0]), "..", "reference_pictures", "working")
+
+
+def processFile(fp):
+    return EXIF.process_file(fp, details=False)
+
+def readAllTags(fp):
+    return readExifTags(fp)
+
+def readImportedTags(fp):
+    return readExifTags(fp, _IMPORTED_EXIF_TAGS)
+
+
+def timeReader(reader, paths, rounds):
+    start = time.time()
+    for i in range(rounds):
+        for path in paths:
+            fp = open(path, "rb")
+            try:
+                reader(fp)
+            finally:
+                fp.close()
+    return (time.time() - start) / (rounds * len(paths))
+
+
+def main(argv):
+    rounds = DEFAULT_ROUNDS
+    opts, paths = getopt.getopt(argv[1:], "n:")
+    for opt, value in opts:
+        if opt == "-n":
+            rounds = int(value)
+    if not paths:
+        paths = [os.path.join(REFERENCE_PICTURES, x)
+                 for x in sorted(os.listdir(REFERENCE_PICTURES))]
+        paths = [x for x in paths if os.path.isfile(x)]
+    if not paths:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    baseline = timeReader(processFile, paths, rounds)
+    print "%-40s %8.3f ms/image" % ("EXIF.process_file", 1000 * baseline)
+    for name, reader in [("readExifTags, all tags", readAllTags),
+                         ("readExifTags, imported tags", readImportedTags)]:
+        elapsed = timeReader(reader, paths, rounds)
+        print "%-40s %8.3f ms/image (%.1f times faster)" % (
+            name, 1000 * elapsed, baseline / elapsed)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
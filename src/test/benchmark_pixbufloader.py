@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+"""Benchmark of gkofoto's CachingPixbufLoader.
+
+Loads the given images (scaled to fit within 1024x768) through a
+CachingPixbufLoader, first with incremental decoding in the GTK main
+loop and then with decoding threads. For each run, the number of
+loaded images per second and the latency of the main loop (measured
+as the longest delay of a 10 ms timer, i.e. the worst frame time a
+user would notice) are reported.
+
+Usage: benchmark_pixbufloader.py [-t number of threads] image...
+"""
+
+import getopt
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    sys.path.insert(0, libdir)
+
+import pygtk
+pygtk.require("2.0")
+import gobject
+import gtk
+from kofoto.gkofoto.cachingpixbufloader import \
+    CachingPixbufLoader, DEFAULT_DECODING_THREADS
+
+SIZE_LIMIT = (1024, 768)
+TICK_INTERVAL = 10 # Milliseconds.
+
+
+class Run:
+    def __init__(self, paths, decoding_threads):
+        self.paths = paths
+        self.loader = CachingPixbufLoader(
+            byte_limit=10**11, decoding_threads=decoding_threads)
+        self.remaining = len(paths)
+        self.errors = 0
+        self.start_time = None
+        self.elapsed = None
+        self.last_tick = None
+        self.max_tick_delay = 0.0
+
+    def run(self):
+        self.start_time = time.time()
+        self.last_tick = self.start_time
+        gobject.timeout_add(TICK_INTERVAL, self.tick)
+        for path in self.paths:
+            self.loader.load(path, SIZE_LIMIT, self.loaded, self.failed)
+        gtk.main()
+
+    def tick(self):
+        now = time.time()
+        self.max_tick_delay = max(self.max_tick_delay, now - self.last_tick)
+        self.last_tick = now
+        return self.elapsed is None
+
+    def loaded(self, unused1, unused2):
+        self.finished_one()
+
+    def failed(self):
+        self.errors += 1
+        self.finished_one()
+
+    def finished_one(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.elapsed = time.time() - self.start_time
+            gtk.main_quit()
+
+
+def main(argv):
+    threads = DEFAULT_DECODING_THREADS
+    opts, paths = getopt.getopt(argv[1:], "t:")
+    for opt, value in opts:
+        if opt == "-t":
+            threads = int(value)
+    if not paths:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    # Let the decoding threads run while the main loop is idle.
+    gobject.threads_init()
+    for decoding_threads in [0, threads]:
+        run = Run(paths, decoding_threads)
+        run.run()
+        print ("%d decoding threads: %d images (%d errors) in %.2f seconds:"
+               " %.1f images/second, max frame latency %.0f ms" % (
+                   decoding_threads, len(paths), run.errors, run.elapsed,
+                   len(paths) / run.elapsed, 1000 * run.max_tick_delay))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
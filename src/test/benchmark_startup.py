@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+
+"""Benchmark of the startup time of the kofoto commandline client.
+
+Runs some metadata-only commands (which don't need to read any image
+files) against a temporary metadata database and reports the wall
+clock time per invocation. With -i, a report of the time spent
+importing each module (like "python -X importtime" in newer Python
+versions) is printed instead.
+
+Usage: benchmark_startup.py [-n number of rounds] [-i]
+"""
+
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_ROUNDS = 20
+KOFOTO = os.path.realpath(
+    os.path.join(os.path.dirname(sys.argv[0]), "..", "cmdline", "kofoto"))
+PACKAGES = os.path.realpath(
+    os.path.join(os.path.dirname(sys.argv[0]), "..", "packages"))
+
+COMMANDS = [
+    ["get-attribute", "title", "benchmark"],
+    ["get-attributes", "benchmark"],
+    ["print-statistics"],
+    ]
+
+# Run in a separate interpreter, so that no modules are already
+# imported.
+IMPORT_REPORT_PROGRAM = """
+import __builtin__
+import sys
+import time
+sys.path.insert(0, %(packages)r)
+originalImport = __builtin__.__import__
+stack = [[]] # Stack of lists of child import times.
+report = []
+def timedImport(name, *args):
+    if name in sys.modules:
+        return originalImport(name, *args)
+    stack.append([])
+    start = time.time()
+    try:
+        return originalImport(name, *args)
+    finally:
+        elapsed = time.time() - start
+        children = stack.pop()
+        stack[-1].append(elapsed)
+        report.append((elapsed - sum(children), elapsed, len(stack) - 1, name))
+__builtin__.__import__ = timedImport
+import kofoto.commandline.main
+__builtin__.__import__ = originalImport
+print "import time: self [us] | cumulative | imported package"
+for selfTime, cumulative, depth, name in report:
+    print "import time: %%11d | %%10d | %%s%%s" %% (
+        1e6 * selfTime, 1e6 * cumulative, "  " * depth, name)
+"""
+
+
+def run(args):
+    process = subprocess.Popen(
+        [sys.executable] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        sys.stderr.write(output)
+        sys.exit(1)
+    return output
+
+
+def printImportReport():
+    sys.stdout.write(run(
+        ["-c", IMPORT_REPORT_PROGRAM % {"packages": PACKAGES}]))
+
+
+def timeCommands(rounds):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        options = [
+            "--configfile", os.path.join(tmpdir, "config"),
+            "--database", os.path.join(tmpdir, "metadata.db")]
+        run([KOFOTO] + options + ["create-album", "benchmark"])
+        run([KOFOTO] + options +
+            ["set-attribute", "title", "Benchmark", "benchmark"])
+        for command in COMMANDS:
+            start = time.time()
+            for unused in range(rounds):
+                run([KOFOTO] + options + command)
+            elapsed = (time.time() - start) / rounds
+            print "%-40s %8.1f ms" % (" ".join(command), 1000 * elapsed)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main(argv):
+    rounds = DEFAULT_ROUNDS
+    importReport = False
+    opts, args = getopt.getopt(argv[1:], "in:")
+    if args:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    for opt, value in opts:
+        if opt == "-i":
+            importReport = True
+        elif opt == "-n":
+            rounds = int(value)
+    if importReport:
+        printImportReport()
+    else:
+        timeCommands(rounds)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
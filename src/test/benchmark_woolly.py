@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+"""Benchmark of the woolly output module.
+
+Generates a synthetic album tree (by default 10000 images spread over
+a few albums) into a temporary directory and reports the number of
+generated pages per second. No database or real images are needed.
+
+Usage: benchmark_woolly.py [number of images [output directory]]
+
+If an output directory is given, the generated files are kept there.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from ConfigParser import ConfigParser
+
+if __name__ == "__main__":
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    sys.path.insert(0, libdir)
+
+from kofoto.output.woolly import OutputGenerator
+
+IMAGES_PER_ALBUM = 500
+
+
+class FakeImageVersion:
+    def __init__(self, image):
+        self.image = image
+
+    def getHash(self):
+        return "%032x" % self.image.getId()
+
+
+class FakeImage:
+    def __init__(self, imageid):
+        self.imageid = imageid
+        self.attributes = {
+            u"captured": u"2004-%02d-%02d 12:00:%02d" % (
+                imageid % 12 + 1, imageid % 28 + 1, imageid % 60),
+            u"title": u"Image %d" % imageid,
+            }
+        self.version = FakeImageVersion(self)
+
+    def getId(self):
+        return self.imageid
+
+    def isAlbum(self):
+        return False
+
+    def getAttribute(self, name):
+        return self.attributes.get(name)
+
+    def getCategories(self):
+        return []
+
+    def getPrimaryVersion(self):
+        return self.version
+
+
+class FakeAlbum:
+    def __init__(self, albumid, tag):
+        self.albumid = albumid
+        self.tag = tag
+        self.children = []
+        self.parents = []
+
+    def getId(self):
+        return self.albumid
+
+    def getTag(self):
+        return self.tag
+
+    def isAlbum(self):
+        return True
+
+    def getAttribute(self, name):
+        if name == u"title":
+            return u"Album %s" % self.tag
+        return None
+
+    def getChildren(self):
+        return iter(self.children)
+
+    def getAlbumChildren(self):
+        return iter([x for x in self.children if x.isAlbum()])
+
+    def getAlbumParents(self):
+        return iter(self.parents)
+
+
+class FakeImageCache:
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, imageversion, widthlimit, heightlimit):
+        return (self.path, widthlimit, 3 * widthlimit // 4)
+
+
+class FakeEnvironment:
+    def __init__(self, imagepath):
+        self.config = ConfigParser()
+        self.config.add_section("woolly")
+        self.config.set("woolly", "enable_auto_descriptions", "false")
+        self.shelf = None
+        self.imageCache = FakeImageCache(imagepath)
+        self.imagesizelimits = [(640, 480), (1024, 768)]
+        self.defaultsizelimit = (640, 480)
+        self.thumbnailsizelimit = (128, 128)
+        self.publishmode = "symlink"
+        self.searchindex = False
+        self.verbose = False
+
+    def out(self, text):
+        pass
+
+
+def makeAlbumTree(nimages):
+    root = FakeAlbum(1, u"root")
+    nalbums = (nimages + IMAGES_PER_ALBUM - 1) // IMAGES_PER_ALBUM
+    for i in range(nalbums):
+        album = FakeAlbum(i + 2, u"album%d" % i)
+        album.parents.append(root)
+        root.children.append(album)
+        first = i * IMAGES_PER_ALBUM
+        for imageid in range(first, min(first + IMAGES_PER_ALBUM, nimages)):
+            album.children.append(FakeImage(imageid))
+    return root
+
+
+def main(argv):
+    if len(argv) > 1:
+        nimages = int(argv[1])
+    else:
+        nimages = 10000
+    tmpdir = tempfile.mkdtemp(prefix="benchmark_woolly")
+    try:
+        imagepath = os.path.join(tmpdir, "image.jpg")
+        open(imagepath, "wb").close()
+        if len(argv) > 2:
+            dest = argv[2]
+        else:
+            dest = os.path.join(tmpdir, "html")
+        root = makeAlbumTree(nimages)
+        env = FakeEnvironment(imagepath)
+        generator = OutputGenerator(env, "utf-8")
+
+        start = time.time()
+        generator.generate(root, None, dest)
+        elapsed = time.time() - start
+
+        npages = 0
+        for unused1, unused2, filenames in os.walk(dest):
+            npages += len([x for x in filenames if x.endswith(".html")])
+        print "%d images, %d pages in %.2f seconds: %.0f pages/second" % (
+            nimages, npages, elapsed, npages / elapsed)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,217 @@
+"""Minimal stand-ins for gtk and gobject.
+
+They let gkofoto modules be unit tested without a display or PyGTK.
+Call install() before importing any kofoto.gkofoto module, and drive
+idle and timeout handlers with run_main_loop().
+"""
+
+import sys
+import types
+
+######################################################################
+# gobject
+
+PRIORITY_HIGH = -100
+PRIORITY_DEFAULT = 0
+PRIORITY_HIGH_IDLE = 100
+PRIORITY_DEFAULT_IDLE = 200
+
+class GError(Exception):
+    pass
+
+_sources = {} # Tag --> (priority, callback, args).
+_next_tag = [1]
+
+def _add_source(priority, callback, args):
+    tag = _next_tag[0]
+    _next_tag[0] += 1
+    _sources[tag] = (priority, callback, args)
+    return tag
+
+def idle_add(callback, *args, **kwargs):
+    return _add_source(
+        kwargs.get("priority", PRIORITY_DEFAULT_IDLE), callback, args)
+
+def timeout_add(interval, callback, *args, **kwargs):
+    # Timeouts fire as soon as possible.
+    return _add_source(
+        kwargs.get("priority", PRIORITY_DEFAULT), callback, args)
+
+def source_remove(tag):
+    return _sources.pop(tag, None) is not None
+
+def threads_init():
+    pass
+
+def iterate_main_loop(iterations):
+    """Call at most iterations idle and timeout handlers (in priority
+    order).
+
+    Returns true if there are no handlers left."""
+
+    for unused in xrange(iterations):
+        if not _sources:
+            break
+        tag = min(_sources, key=lambda x: (_sources[x][0], x))
+        (_, callback, args) = _sources[tag]
+        if not callback(*args):
+            # The callback may already have removed itself.
+            _sources.pop(tag, None)
+    return not _sources
+
+def run_main_loop(max_iterations=10**6):
+    """Call idle and timeout handlers until there are none left."""
+
+    if not iterate_main_loop(max_iterations):
+        raise AssertionError("The main loop didn't become idle")
+
+def reset_main_loop():
+    """Remove all idle and timeout handlers."""
+
+    _sources.clear()
+
+######################################################################
+# gtk
+
+SORT_ASCENDING = 0
+SORT_DESCENDING = 1
+TREE_MODEL_LIST_ONLY = 2
+
+class Pixbuf(object):
+    def __init__(self, width, height, rowstride):
+        self._width = width
+        self._height = height
+        self._rowstride = rowstride
+
+    def get_has_alpha(self):
+        return False
+
+    def get_height(self):
+        return self._height
+
+    def get_pixels(self):
+        return "\0" * (self._rowstride * self._height)
+
+    def get_rowstride(self):
+        return self._rowstride
+
+    def get_width(self):
+        return self._width
+
+def pixbuf_new_from_data(data, colorspace, has_alpha, bits_per_sample,
+                         width, height, rowstride):
+    return Pixbuf(width, height, rowstride)
+
+class GenericTreeModel(object):
+    """Tree model base class that calls connected signal handlers and
+    records emitted signals in self.signals as (name, args) tuples.
+
+    Row references are used as iterators."""
+
+    def __init__(self):
+        self.signals = []
+        self._properties = {}
+        self._handlers = {} # Handler ID --> (name, callback, args).
+        self._next_handler_id = 1
+
+    def connect(self, name, callback, *args):
+        handler_id = self._next_handler_id
+        self._next_handler_id += 1
+        self._handlers[handler_id] = (name, callback, args)
+        return handler_id
+
+    def disconnect(self, handler_id):
+        del self._handlers[handler_id]
+
+    def set_property(self, name, value):
+        self._properties[name] = value
+
+    def get_iter(self, path):
+        rowref = self.on_get_iter(path)
+        if rowref is None:
+            raise ValueError("invalid path: %r" % (path,))
+        return rowref
+
+    def get_path(self, iterator):
+        return self.on_get_path(iterator)
+
+    def get_user_data(self, iterator):
+        return iterator
+
+    def get_value(self, iterator, column):
+        return self.on_get_value(iterator, column)
+
+    def iter_n_children(self, iterator):
+        return self.on_iter_n_children(iterator)
+
+    def __len__(self):
+        return self.on_iter_n_children(None)
+
+    def row_changed(self, path, iterator):
+        self._emit("row-changed", tuple(path), iterator)
+
+    def row_deleted(self, path):
+        self._emit("row-deleted", tuple(path))
+
+    def row_inserted(self, path, iterator):
+        self._emit("row-inserted", tuple(path), iterator)
+
+    def rows_reordered(self, path, iterator, new_order):
+        self._emit("rows-reordered", path, iterator, list(new_order))
+
+    def _emit(self, name, *args):
+        if name == "rows-reordered":
+            self.signals.append((name, args[2]))
+        else:
+            self.signals.append((name, args[0]))
+        for handler_id in sorted(self._handlers):
+            (handler_name, callback, extra_args) = self._handlers[handler_id]
+            if handler_name == name:
+                callback(self, *(args + extra_args))
+
+######################################################################
+
+def install():
+    """Make the stubs importable as gtk, gobject and pygtk.
+
+    The PIL modules imported by gkofoto are only stubbed if PIL isn't
+    available; no images are decoded with them in the tests."""
+
+    gobject = types.ModuleType("gobject")
+    for name in ["PRIORITY_HIGH", "PRIORITY_DEFAULT", "PRIORITY_HIGH_IDLE",
+                 "PRIORITY_DEFAULT_IDLE", "GError", "idle_add",
+                 "timeout_add", "source_remove", "threads_init"]:
+        setattr(gobject, name, globals()[name])
+    gtk = types.ModuleType("gtk")
+    gtk.gdk = types.ModuleType("gtk.gdk")
+    gtk.gdk.COLORSPACE_RGB = 0
+    gtk.gdk.Pixbuf = Pixbuf
+    gtk.gdk.pixbuf_new_from_data = pixbuf_new_from_data
+    gtk.gdk.threads_init = threads_init
+    for name in ["SORT_ASCENDING", "SORT_DESCENDING", "TREE_MODEL_LIST_ONLY",
+                 "GenericTreeModel"]:
+        setattr(gtk, name, globals()[name])
+    pygtk = types.ModuleType("pygtk")
+    pygtk.require = lambda version: None
+    sys.modules.update({
+        "gobject": gobject,
+        "gtk": gtk,
+        "gtk.gdk": gtk.gdk,
+        "pygtk": pygtk,
+        })
+    try:
+        import Image
+        from PIL import JpegImagePlugin
+    except ImportError:
+        image = types.ModuleType("Image")
+        image.ANTIALIAS = 1
+        image.register_open = lambda *args: None
+        image.register_extension = lambda *args: None
+        pil = types.ModuleType("PIL")
+        pil.JpegImagePlugin = types.ModuleType("PIL.JpegImagePlugin")
+        pil.JpegImagePlugin.JpegImageFile = object
+        sys.modules.update({
+            "Image": image,
+            "PIL": pil,
+            "PIL.JpegImagePlugin": pil.JpegImagePlugin,
+            })
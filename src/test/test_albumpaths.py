@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+from kofoto.albumpaths import AlbumPathIndex
+
+
+class FakeAlbum:
+    def __init__(self, tag):
+        self.tag = tag
+        self.children = []
+        self.fetches = 0
+
+    def getAlbumChildren(self):
+        self.fetches += 1
+        return iter(self.children)
+
+    def __repr__(self):
+        return self.tag
+
+
+def makeAlbums(tags, edges):
+    albums = dict([(x, FakeAlbum(x)) for x in tags])
+    for parent, child in edges:
+        albums[parent].children.append(albums[child])
+    return albums
+
+
+def tags(path):
+    return [x.tag for x in path]
+
+
+class TestAlbumPathIndex(unittest.TestCase):
+    def setUp(self):
+        # root --> a --> c --> d
+        #   \          ^     |
+        #    --> b ---/      |
+        #        ^           |
+        #        \-----------/
+        self.albums = makeAlbums(
+            ["root", "a", "b", "c", "d", "unreachable"],
+            [("root", "a"), ("root", "b"), ("a", "c"), ("b", "c"),
+             ("c", "d"), ("d", "b")])
+        self.index = AlbumPathIndex(self.albums["root"])
+
+    def tearDown(self):
+        del self.index
+        del self.albums
+
+    def test_getAlbums(self):
+        self.assertEqual(
+            tags(self.index.getAlbums()), ["root", "a", "b", "c", "d"])
+        self.assert_(self.albums["d"] in self.index)
+        self.assert_(self.albums["unreachable"] not in self.index)
+        self.assertEqual(len(self.index), 5)
+
+    def test_getPaths(self):
+        self.assertEqual(
+            [tags(x) for x in self.index.getPaths(self.albums["root"])],
+            [["root"]])
+        self.assertEqual(
+            [tags(x) for x in self.index.getPaths(self.albums["c"])],
+            [["root", "a", "c"], ["root", "b", "c"]])
+        self.assertEqual(
+            [tags(x) for x in self.index.getPaths(self.albums["b"])],
+            [["root", "b"], ["root", "a", "c", "d", "b"]])
+        self.assertEqual(
+            self.index.getPaths(self.albums["unreachable"]), [])
+
+    def test_childrenFetchedOnce(self):
+        for album in self.index.getAlbums():
+            self.assertEqual(album.fetches, 1)
+
+    def test_getSiblings(self):
+        root, a, b = [self.albums[x] for x in ["root", "a", "b"]]
+        self.assertEqual(self.index.getSiblings(root, a), (None, b))
+        self.assertEqual(self.index.getSiblings(root, b), (a, None))
+
+    def test_getDescendants(self):
+        self.assertEqual(
+            tags(self.index.getDescendants(self.albums["c"])),
+            ["c", "d", "b"])
+
+    def test_maxPathsPerAlbum(self):
+        # A chain of diamonds gives 2**n distinct paths to the last album.
+        n = 16
+        tagnames = ["root"] + ["%s%d" % (x, i)
+                               for i in range(n)
+                               for x in ["l", "r", "j"]]
+        edges = []
+        previous = "root"
+        for i in range(n):
+            edges += [(previous, "l%d" % i), (previous, "r%d" % i),
+                      ("l%d" % i, "j%d" % i), ("r%d" % i, "j%d" % i)]
+            previous = "j%d" % i
+        albums = makeAlbums(tagnames, edges)
+        index = AlbumPathIndex(albums["root"], maxPathsPerAlbum=3)
+        paths = index.getPaths(albums["j%d" % (n - 1)])
+        self.assertEqual(len(paths), 3)
+        for path in paths:
+            self.assertEqual(len(path), 2 * n + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,7 @@ import os
 import sys
 import unittest
 
-tests = ["dag", "clientutils", "iodict", "searching", "shelf"]
+tests = ["albumpaths", "assetpublisher", "batch", "cachingpixbufloader", "categoryindex", "dag", "clientutils", "commandserver", "exifreader", "imagecache", "integrity", "iodict", "jpegmetadata", "manifest", "outputtemplate", "preloadscheduler", "searchindex", "searching", "shelf", "sortedobjectmodel", "startup", "webapplication"]
 
 cwd = os.getcwd()
 libdir = unicode(os.path.realpath(
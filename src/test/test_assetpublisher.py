@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+from kofoto.assetpublisher import \
+    AssetPublisher, PUBLISH_MODES, PublishModeError
+
+
+def writeFile(path, data):
+    f = open(path, "wb")
+    f.write(data)
+    f.close()
+
+
+def readFile(path):
+    f = open(path, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class TestAssetPublisher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sources = []
+        for i, data in enumerate(["a" * 1000, "b" * 1000, "a" * 1000]):
+            path = os.path.join(self.tmpdir, "source%d" % i)
+            writeFile(path, data)
+            self.sources.append(path)
+        self.dest = os.path.join(self.tmpdir, "dest")
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def publishAll(self, mode):
+        publisher = AssetPublisher(mode)
+        for i, source in enumerate(self.sources):
+            publisher.publish(source, os.path.join(self.dest, "d%d" % i))
+        publisher.finish()
+        return publisher
+
+    def test_modes(self):
+        for mode in PUBLISH_MODES:
+            self.publishAll(mode)
+            for i, source in enumerate(self.sources):
+                destination = os.path.join(self.dest, "d%d" % i)
+                self.assertEqual(readFile(destination), readFile(source))
+                self.assertEqual(
+                    os.path.islink(destination), mode == "symlink")
+
+    def test_dedupe(self):
+        self.publishAll("copy")
+        first = os.stat(os.path.join(self.dest, "d0"))
+        duplicate = os.stat(os.path.join(self.dest, "d2"))
+        self.assertEqual(first.st_ino, duplicate.st_ino)
+        self.assertNotEqual(
+            first.st_ino, os.stat(os.path.join(self.dest, "d1")).st_ino)
+
+    def test_skipUpToDate(self):
+        for mode in PUBLISH_MODES:
+            self.publishAll(mode)
+            publisher = self.publishAll(mode)
+            self.assertEqual(
+                publisher.getNumberOfSkippedFiles(), len(self.sources))
+
+    def test_synchronous(self):
+        publisher = AssetPublisher("copy", 0)
+        destination = os.path.join(self.dest, "d")
+        publisher.publish(self.sources[1], destination)
+        self.assertEqual(readFile(destination), "b" * 1000)
+        publisher.finish()
+
+    def test_errors(self):
+        self.assertRaises(PublishModeError, AssetPublisher, "teleport")
+        publisher = AssetPublisher("copy")
+        publisher.publish(
+            os.path.join(self.tmpdir, "missing"),
+            os.path.join(self.dest, "d"))
+        self.assertRaises(EnvironmentError, publisher.finish)
+        # Other errors are raised by finish too, and don't stop the
+        # worker threads.
+        publisher = AssetPublisher("copy", 1)
+        publisher.publish(None, os.path.join(self.dest, "d"))
+        publisher.publish(
+            self.sources[0], os.path.join(self.dest, "e"))
+        self.assertRaises(TypeError, publisher.finish)
+        assert os.path.exists(os.path.join(self.dest, "e"))
+
+
+if __name__ == "__main__":
+    unittest.main()
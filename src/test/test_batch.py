@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+import kofoto
+
+KOFOTO = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(
+        kofoto.__file__)))),
+    "cmdline", "kofoto")
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.environ["PYTHONIOENCODING"] = "utf-8"
+        self.kofoto([], "create-album", "foo")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def kofoto(self, options, *args, **kwargs):
+        """Run kofoto and return its exit status and output."""
+        process = subprocess.Popen(
+            [sys.executable, KOFOTO,
+             "--configfile", os.path.join(self.tmpdir, "config"),
+             "--database", os.path.join(self.tmpdir, "db")] +
+            options + list(args),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=self.environ)
+        output = process.communicate(kwargs.get("input", ""))[0]
+        return process.returncode, output
+
+    def test_nonAsciiLines(self):
+        status, output = self.kofoto(
+            [], "batch",
+            input="set-attribute title 'R\xc3\xa4ksm\xc3\xb6rg\xc3\xa5s' foo\n")
+        assert status == 0, output
+        status, output = self.kofoto([], "get-attribute", "title", "foo")
+        assert output == "R\xc3\xa4ksm\xc3\xb6rg\xc3\xa5s\n", output
+
+    def test_nonAsciiNullSeparatedLines(self):
+        status, output = self.kofoto(
+            ["-0"], "batch", input="set-attribute title \xc3\xa5 foo\0")
+        assert status == 0, output
+        status, output = self.kofoto([], "get-attribute", "title", "foo")
+        assert output == "\xc3\xa5\n", output
+
+    def test_undecodableInput(self):
+        status, output = self.kofoto(
+            [], "batch", input="set-attribute title \xe5 foo\n")
+        assert status == 1
+        assert "Could not decode the commands" in output, output
+        assert "Traceback" not in output, output
+
+
+if __name__ == "__main__":
+    unittest.main()
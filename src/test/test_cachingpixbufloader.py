@@ -0,0 +1,315 @@
+#! /usr/bin/env python
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+class TestCachingPixbufLoaderStress(unittest.TestCase):
+    """Drive a CachingPixbufLoader with random loads, preloads,
+    cancellations and unloads while decoding finishes (or fails) at
+    random times, and check the consistency of its queues after each
+    step."""
+
+    def setUp(self):
+        gtkstubs.reset_main_loop()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        gtkstubs.reset_main_loop()
+        shutil.rmtree(self.tmpdir)
+
+    def checkInvariants(self, loader):
+        requests = loader._request_queue.items()
+        for (key, request) in requests:
+            self.assertEqual(request.key, key)
+        for (key, request) in loader._load_queue.iteritems():
+            self.assert_(loader._request_queue.get(key) is request)
+            self.assert_(not request.is_finished())
+        self.assertEqual(
+            loader._unfinished_requests.items(),
+            [(key, request) for (key, request) in requests
+             if not request.is_finished()])
+        path_to_requests = {}
+        for (key, request) in requests:
+            path_to_requests.setdefault(key[0], set()).add(request)
+        self.assertEqual(loader._path_to_requests, path_to_requests)
+        resident_bytes = sum(
+            [request.get_number_of_resident_bytes()
+             for (key, request) in requests])
+        self.assertEqual(loader._bytes_in_cache, resident_bytes)
+
+    def test_randomOperations(self):
+        rng = random.Random(4711)
+        loader, paths = makeLoader(self.tmpdir, 30, 300000)
+        loader._decoder = RandomDecoder(2, rng)
+        sizes = [(100, 100), (200, 200), (2000, 2000)]
+        calls = {} # Handle number --> number of callback calls.
+        handles = [] # List of (handle number, handle).
+        exempt = set() # Handle numbers that may lack a callback call.
+
+        def makeCallbacks(number):
+            def loaded(pixbuf, original_size):
+                self.assertEqual(original_size, IMAGE_SIZE)
+                calls[number] += 1
+            def failed():
+                calls[number] += 1
+            return (loaded, failed)
+
+        for i in xrange(5000):
+            op = rng.random()
+            path = rng.choice(paths)
+            size = rng.choice(sizes)
+            if op < 0.35:
+                calls[i] = 0
+                handle = loader.load(path, size, *makeCallbacks(i))
+                handles.append((i, handle))
+            elif op < 0.6:
+                loader.preload(path, size)
+            elif op < 0.7 and handles:
+                (number, handle) = rng.choice(handles)
+                loader.cancel_load(handle)
+                # Cancelling converts all loads of the pixbuf to
+                # preloads.
+                for (number, other) in handles:
+                    if other[:2] == handle[:2]:
+                        exempt.add(number)
+            elif op < 0.8:
+                loader.unload(path, size)
+            elif op < 0.85:
+                loader.unload_all(path)
+            gtkstubs.iterate_main_loop(rng.randrange(5))
+            self.checkInvariants(loader)
+            for number in calls:
+                self.assert_(calls[number] <= 1)
+
+        gtkstubs.run_main_loop()
+        self.checkInvariants(loader)
+        self.assertEqual(len(loader._load_queue), 0)
+        self.assertEqual(len(loader._unfinished_requests), 0)
+        self.assertEqual(loader._decoder.get_number_of_jobs(), 0)
+        for number in calls:
+            if number in exempt:
+                self.assert_(calls[number] <= 1)
+            else:
+                self.assertEqual(calls[number], 1)
+        statistics = loader.get_statistics()
+        self.assert_(0 < statistics["evictions"])
+        self.assert_(
+            0 <= statistics["resident_bytes"] <= statistics["byte_limit"])
+
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+import gtkstubs
+gtkstubs.install()
+from kofoto.gkofoto.cachingpixbufloader import CachingPixbufLoader
+from kofoto.rectangle import Rectangle
+
+# Size of the (fake) images on disk.
+IMAGE_SIZE = (1000, 800)
+
+class FakeDecoder:
+    """A PixbufDecoder that finishes its jobs when they are
+    collected."""
+
+    def __init__(self, nthreads):
+        self.nthreads = nthreads
+        self.jobs = []
+
+    def get_finished(self):
+        finished = []
+        for (token, path, size_limit) in self.jobs:
+            if size_limit is None:
+                size = IMAGE_SIZE
+            else:
+                size = tuple(Rectangle(*IMAGE_SIZE).downscaled_to(size_limit))
+            finished.append((token, (IMAGE_SIZE, size, "")))
+        self.jobs = []
+        return finished
+
+    def get_number_of_jobs(self):
+        return len(self.jobs)
+
+    def is_full(self):
+        return len(self.jobs) >= self.nthreads
+
+    def submit(self, token, path, size_limit):
+        self.jobs.append((token, path, size_limit))
+
+
+class RandomDecoder(FakeDecoder):
+    """A FakeDecoder that finishes a random subset of its jobs when
+    they are collected and fails some of them."""
+
+    def __init__(self, nthreads, rng):
+        FakeDecoder.__init__(self, nthreads)
+        self.rng = rng
+
+    def get_finished(self):
+        jobs = self.jobs
+        self.jobs = []
+        finished = []
+        for job in jobs:
+            if self.rng.random() < 0.5:
+                self.jobs.append(job)
+            else:
+                self.jobs = [job]
+                (token, result) = FakeDecoder.get_finished(self)[0]
+                if self.rng.random() < 0.1:
+                    result = None
+                finished.append((token, result))
+        return finished
+
+
+def makeLoader(directory, nimages, byte_limit):
+    """Create a CachingPixbufLoader decoding with a FakeDecoder and a
+    list of image paths for it."""
+
+    loader = CachingPixbufLoader(byte_limit=byte_limit, decoding_threads=0)
+    loader._decoder = FakeDecoder(2)
+    paths = []
+    for i in range(nimages):
+        path = os.path.join(directory, "%d.jpg" % i)
+        open(path, "w").close()
+        # Avoid reading the image size from the file.
+        loader._available_size[path] = Rectangle(*IMAGE_SIZE)
+        paths.append(path)
+    return loader, paths
+
+
+class TestCachingPixbufLoader(unittest.TestCase):
+    def setUp(self):
+        gtkstubs.reset_main_loop()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        gtkstubs.reset_main_loop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_decodedPixbufsAreCounted(self):
+        pixbuf_bytes = 3 * 100 * 80
+        loader, paths = makeLoader(self.tmpdir, 20, 5 * pixbuf_bytes)
+        loaded = []
+        for path in paths:
+            loader.load(
+                path, (100, 100), lambda pixbuf, size: loaded.append(pixbuf))
+            gtkstubs.run_main_loop()
+            statistics = loader.get_statistics()
+            assert 0 < statistics["resident_bytes"] <= 5 * pixbuf_bytes, \
+                statistics
+        self.assertEqual(len(loaded), 20)
+        statistics = loader.get_statistics()
+        self.assertEqual(statistics["evictions"], 15)
+        self.assertEqual(statistics["requests"], 5)
+        self.assertEqual(statistics["resident_bytes"], 5 * pixbuf_bytes)
+        for path in paths:
+            loader.unload(path, (100, 100))
+        statistics = loader.get_statistics()
+        self.assertEqual(statistics["requests"], 0)
+        self.assertEqual(statistics["resident_bytes"], 0)
+
+
+class TestCachingPixbufLoaderStress(unittest.TestCase):
+    """Drive a CachingPixbufLoader with random loads, preloads,
+    cancellations and unloads while decoding finishes (or fails) at
+    random times, and check the consistency of its queues after each
+    step."""
+
+    def setUp(self):
+        gtkstubs.reset_main_loop()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        gtkstubs.reset_main_loop()
+        shutil.rmtree(self.tmpdir)
+
+    def checkInvariants(self, loader):
+        requests = loader._request_queue.items()
+        for (key, request) in requests:
+            self.assertEqual(request.key, key)
+        for (key, request) in loader._load_queue.iteritems():
+            self.assert_(loader._request_queue.get(key) is request)
+            self.assert_(not request.is_finished())
+        self.assertEqual(
+            loader._unfinished_requests.items(),
+            [(key, request) for (key, request) in requests
+             if not request.is_finished()])
+        path_to_requests = {}
+        for (key, request) in requests:
+            path_to_requests.setdefault(key[0], set()).add(request)
+        self.assertEqual(loader._path_to_requests, path_to_requests)
+        resident_bytes = sum(
+            [request.get_number_of_resident_bytes()
+             for (key, request) in requests])
+        self.assertEqual(loader._bytes_in_cache, resident_bytes)
+
+    def test_randomOperations(self):
+        rng = random.Random(4711)
+        loader, paths = makeLoader(self.tmpdir, 30, 300000)
+        loader._decoder = RandomDecoder(2, rng)
+        sizes = [(100, 100), (200, 200), (2000, 2000)]
+        calls = {} # Handle number --> number of callback calls.
+        handles = [] # List of (handle number, handle).
+        exempt = set() # Handle numbers that may lack a callback call.
+
+        def makeCallbacks(number):
+            def loaded(pixbuf, original_size):
+                self.assertEqual(original_size, IMAGE_SIZE)
+                calls[number] += 1
+            def failed():
+                calls[number] += 1
+            return (loaded, failed)
+
+        for i in xrange(5000):
+            op = rng.random()
+            path = rng.choice(paths)
+            size = rng.choice(sizes)
+            if op < 0.35:
+                calls[i] = 0
+                handle = loader.load(path, size, *makeCallbacks(i))
+                handles.append((i, handle))
+            elif op < 0.6:
+                loader.preload(path, size)
+            elif op < 0.7 and handles:
+                (number, handle) = rng.choice(handles)
+                loader.cancel_load(handle)
+                # Cancelling converts all loads of the pixbuf to
+                # preloads.
+                for (number, other) in handles:
+                    if other[:2] == handle[:2]:
+                        exempt.add(number)
+            elif op < 0.8:
+                loader.unload(path, size)
+            elif op < 0.85:
+                loader.unload_all(path)
+            gtkstubs.iterate_main_loop(rng.randrange(5))
+            self.checkInvariants(loader)
+            for number in calls:
+                self.assert_(calls[number] <= 1)
+
+        gtkstubs.run_main_loop()
+        self.checkInvariants(loader)
+        self.assertEqual(len(loader._load_queue), 0)
+        self.assertEqual(len(loader._unfinished_requests), 0)
+        self.assertEqual(loader._decoder.get_number_of_jobs(), 0)
+        for number in calls:
+            if number in exempt:
+                self.assert_(calls[number] <= 1)
+            else:
+                self.assertEqual(calls[number], 1)
+        statistics = loader.get_statistics()
+        self.assert_(0 < statistics["evictions"])
+        self.assert_(
+            0 <= statistics["resident_bytes"] <= statistics["byte_limit"])
+
+
+if __name__ == "__main__":
+    unittest.main()
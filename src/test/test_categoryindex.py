@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+from kofoto.categoryindex import CategoryIndex
+
+class TestCategoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = CategoryIndex([
+            (1, u"stockholm", u"Stockholm"),
+            (2, u"holmen", u"The island Holmen"),
+            (3, u"berlin", u"Berlin"),
+            (4, u"holm", u"Holm"),
+            (5, u"xy", u"Unholmish"),
+            ])
+
+    def tearDown(self):
+        del self.index
+
+    def test_len_and_contains(self):
+        assert len(self.index) == 5
+        assert 3 in self.index
+        assert 6 not in self.index
+
+    def test_search(self):
+        assert self.index.search(u"HOLM") == [4, 2, 1, 5]
+        assert self.index.search(u"holme") == [2]
+        assert self.index.search(u"lin") == [3]
+        assert self.index.search(u"nonexistent") == []
+
+    def test_shortText(self):
+        assert self.index.search(u"xy") == [5]
+        assert self.index.search(u"b") == [3]
+        assert self.index.search(u"") == [3, 4, 1, 2, 5]
+
+    def test_incrementalSearch(self):
+        assert self.index.search(u"h") == [4, 2, 1, 5]
+        assert self.index.search(u"ho") == [4, 2, 1, 5]
+        assert self.index.search(u"hol") == [4, 2, 1, 5]
+        assert self.index.search(u"holmi") == [5]
+        assert self.index.search(u"holm") == [4, 2, 1, 5]
+
+    def test_add(self):
+        self.index.search(u"holm")
+        self.index.add(6, u"holmia", u"Holmia")
+        assert self.index.search(u"holmi") == [6, 5]
+        assert self.index.get(6) == (u"holmia", u"Holmia")
+
+    def test_remove(self):
+        self.index.search(u"holm")
+        self.index.remove(2)
+        assert self.index.search(u"holm") == [4, 1, 5]
+        assert 2 not in self.index
+
+    def test_update(self):
+        self.index.update(3, u"berlin", u"Holmberlin")
+        assert self.index.search(u"holm") == [4, 3, 2, 1, 5]
+        assert self.index.search(u"lin") == [3]
+        assert self.index.search(u"berl") == [3]
+
+if __name__ == "__main__":
+    unittest.main()
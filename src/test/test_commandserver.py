@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+from kofoto.commandline.server import \
+    CommandServer, ServerNotRunningError, getSocketLocation, sendCommand
+
+
+class TestCommandServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.location = getSocketLocation(os.path.join(self.tmpdir, "db"))
+        self.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def handler(self, cwd, args, stdin, stdout, stderr):
+        self.requests.append((cwd, args))
+        self.input = stdin.read()
+        stdout.write(u"out: %s\n" % u" ".join(args))
+        stderr.write("err\n")
+        return len(args)
+
+    def startServer(self):
+        server = CommandServer(self.location, self.handler)
+        thread = threading.Thread(target=server.serveForever)
+        thread.setDaemon(True)
+        thread.start()
+        for unused in range(100):
+            if os.path.exists(self.location):
+                break
+            time.sleep(0.01)
+
+    def test_sendCommand(self):
+        self.startServer()
+        for args in [[u"get-attribute", u"title", u"f\xf6\xf6"], []]:
+            stdin = StringIO(u"line 1\nl\xefne 2\n")
+            stdout = StringIO()
+            stderr = StringIO()
+            status = sendCommand(
+                self.location, u"/t\xe4mp", args, stdin, stdout, stderr)
+            assert status == len(args)
+            assert self.input == u"line 1\nl\xefne 2\n"
+            assert stdout.getvalue() == u"out: %s\n" % u" ".join(args)
+            assert stderr.getvalue() == u"err\n"
+        assert self.requests == [
+            (u"/t\xe4mp", [u"get-attribute", u"title", u"f\xf6\xf6"]),
+            (u"/t\xe4mp", [])]
+
+    def test_serverNotRunning(self):
+        try:
+            sendCommand(
+                self.location, u"/", [], StringIO(), StringIO(), StringIO())
+        except ServerNotRunningError:
+            pass
+        else:
+            assert False
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+
+import glob
+import os
+import re
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+from kofoto import EXIF
+from kofoto.exifreader import readExifTags
+
+PICDIR = unicode(os.path.realpath(
+    os.path.join("..", "reference_pictures", "working")))
+
+def readWithEXIF(path):
+    fp = open(path, "rb")
+    try:
+        return EXIF.process_file(fp, details=False)
+    finally:
+        fp.close()
+
+def readWithExifReader(path, tagNames=None):
+    fp = open(path, "rb")
+    try:
+        return readExifTags(fp, tagNames)
+    finally:
+        fp.close()
+
+class TestExifReader(unittest.TestCase):
+    def setUp(self):
+        self.paths = sorted(glob.glob(os.path.join(PICDIR, "*")))
+
+    def tearDown(self):
+        del self.paths
+
+    def test_sameAsEXIF(self):
+        for path in self.paths:
+            expected = readWithEXIF(path)
+            expected.pop("TIFFThumbnail", None)
+            tags = readWithExifReader(path)
+            assert sorted(tags.keys()) == sorted(expected.keys()), path
+            assert tags.get("JPEGThumbnail") == expected.get("JPEGThumbnail")
+            expected.pop("JPEGThumbnail", None)
+            for name in expected:
+                # EXIF prints some unknown values as longs.
+                expectedText = re.sub(r"(\d)L\b", r"\1", str(expected[name]))
+                assert str(tags[name]) == expectedText, (path, name)
+
+    def test_tagNames(self):
+        path = os.path.join(PICDIR, "Canon_Digital_IXUS.jpg")
+        expected = readWithEXIF(path)
+        tagNames = ["Image Model", "EXIF FNumber", "JPEGThumbnail", "X"]
+        tags = readWithExifReader(path, tagNames)
+        assert sorted(tags.keys()) == sorted(tagNames[:-1]), tags.keys()
+        assert str(tags["Image Model"]) == str(expected["Image Model"])
+        assert str(tags["EXIF FNumber"]) == str(expected["EXIF FNumber"])
+        assert tags["JPEGThumbnail"] == expected["JPEGThumbnail"]
+
+    def test_noExif(self):
+        for name in ["arlaharen.png", "bob-apostrophe.gif"]:
+            assert readWithExifReader(os.path.join(PICDIR, name)) == {}
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+from kofoto.imagecache import ImageCache
+
+def touch(path):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, "w").close()
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.imagedir = os.path.join(self.tmpdir, "images")
+        self.cache = ImageCache(os.path.join(self.tmpdir, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def cachedPath(self, filename, mtime):
+        return os.path.join(
+            self.cache.cacheLocation + self.imagedir,
+            "%s-10x10-up-%d.jpg" % (filename, mtime))
+
+    def test_cleanup(self):
+        original = os.path.join(self.imagedir, "a.jpg")
+        touch(original)
+        mtime = 1000000000
+        os.utime(original, (mtime, mtime))
+        kept = self.cachedPath("a.jpg", mtime)
+        stale = self.cachedPath("a.jpg", mtime - 1)
+        removed = self.cachedPath("b.jpg", mtime)
+        emptydir = os.path.join(self.cache.cacheLocation, "empty")
+        for path in [kept, stale, removed]:
+            touch(path)
+        os.mkdir(emptydir)
+        self.cache.cleanup()
+        assert os.path.exists(kept)
+        assert not os.path.exists(stale)
+        assert not os.path.exists(removed)
+        assert not os.path.exists(emptydir)
+
+    def test_cleanupKeepsPixbufCache(self):
+        pixbufs = [
+            os.path.join(self.cache.pixbufCacheLocation, "0123abcd.jpg"),
+            os.path.join(
+                self.cache.pixbufCacheLocation, "ab", "c-1x1-up-2.jpg"),
+            ]
+        for path in pixbufs:
+            touch(path)
+        os.mkdir(os.path.join(self.cache.pixbufCacheLocation, "empty"))
+        self.cache.cleanup()
+        for path in pixbufs:
+            assert os.path.exists(path)
+        assert os.path.isdir(
+            os.path.join(self.cache.pixbufCacheLocation, "empty"))
+
+        for path in pixbufs:
+            os.unlink(path)
+        os.rmdir(os.path.dirname(pixbufs[1]))
+        os.rmdir(os.path.join(self.cache.pixbufCacheLocation, "empty"))
+        self.cache.cleanup()
+        assert os.path.isdir(self.cache.pixbufCacheLocation)
+
+
+if __name__ == "__main__":
+    unittest.main()
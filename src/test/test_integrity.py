@@ -0,0 +1,179 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+import sqlite3 as sql
+from kofoto.integrity import findViolations, findViolationsInParallel
+from kofoto.shelf import Shelf
+
+def checkNames(result):
+    return [check.name for (check, violations) in result]
+
+class TestIntegrity(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tmpdir, "shelf.db")
+        self.shelf = Shelf(self.location)
+        self.shelf.create()
+        self.shelf.begin()
+        alpha = self.shelf.createAlbum(u"alpha")
+        self.images = [self.shelf.createImage() for x in range(3)]
+        alpha.setChildren(self.images)
+        self.images[0].setAttribute(u"title", u"R\xc4ksm\xd6rg\xc5s")
+        cursor = self.shelf._getConnection().cursor()
+        for ivid, image in enumerate(self.images):
+            cursor.execute(
+                " insert into image_version"
+                "     (id, image, type, comment, hash, directory, filename,"
+                "      mtime, width, height)"
+                " values (?, ?, 'original', '', ?, '/tmp', ?, 0, 1, 1)",
+                (ivid, image.getId(), "%032d" % ivid, "%d.jpg" % ivid))
+            cursor.execute(
+                " update image set primary_version = ? where id = ?",
+                (ivid, image.getId()))
+        cat_a = self.shelf.createCategory(u"a", u"A")
+        cat_b = self.shelf.createCategory(u"b", u"B")
+        cat_c = self.shelf.createCategory(u"c", u"C")
+        cat_a.connectChild(cat_b)
+        cat_b.connectChild(cat_c)
+        self.albumid = alpha.getId()
+        self.catids = [x.getId() for x in [cat_a, cat_b, cat_c]]
+        self.shelf.commit()
+        self.shelf.begin()
+
+    def tearDown(self):
+        if self.shelf.inTransaction:
+            self.shelf.rollback()
+        shutil.rmtree(self.tmpdir)
+
+    def corrupt(self, statements):
+        cursor = self.shelf._getConnection().cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        self.shelf.commit()
+        self.shelf.begin()
+
+    def test_intactShelf(self):
+        assert self.shelf.checkIntegrity() == []
+        assert self.shelf.checkIntegrity(0) == []
+        assert self.shelf.repairIntegrity() == []
+        assert not self.shelf.isModified()
+
+    def test_checkIntegrity(self):
+        imageids = [x.getId() for x in self.images]
+        self.corrupt([
+            "insert into object (id) values (4711)",
+            "update image set primary_version = 2 where id = %d" % imageids[1],
+            "delete from member where position = 1",
+            "update attribute set lcvalue = value where object = %d" % (
+                imageids[0]),
+            "insert into category_child (parent, child) values (%d, %d)" % (
+                self.catids[2], self.catids[0]),
+            ])
+        result = self.shelf.checkIntegrity()
+        assert checkNames(result) == [
+            "orphaned-object",
+            "primary-version",
+            "category-cycles",
+            "member-positions",
+            "attribute-lcvalue",
+            ], checkNames(result)
+        assert result[0][1] == [(4711,)]
+        assert result[1][1] == [(imageids[1], 2)]
+        assert result[3][0].formatViolation(result[3][1][0]) == (
+            "Album %d has gaps in its member positions." % self.albumid)
+        assert checkNames(self.shelf.checkIntegrity(0)) == checkNames(result)
+
+        # The shelf is still locked and usable after checking.
+        self.shelf.createAlbum(u"beta")
+        assert self.shelf.isModified()
+        assert checkNames(self.shelf.checkIntegrity()) == checkNames(result)
+
+    def test_repairIntegrity(self):
+        imageids = [x.getId() for x in self.images]
+        self.corrupt([
+            "delete from object where id = %d" % self.albumid,
+            "delete from image where id = %d" % imageids[0],
+            "update image set primary_version = 17 where id = %d" % (
+                imageids[1]),
+            "update image set primary_version = null where id = %d" % (
+                imageids[2]),
+            "insert into member (album, position, object)"
+            " values (%d, 7, 4711)" % self.albumid,
+            "insert into category_child (parent, child) values (%d, %d)" % (
+                self.catids[2], self.catids[0]),
+            "insert into object_category (object, category)"
+            " values (%d, 4711)" % imageids[1],
+            ])
+        result = self.shelf.repairIntegrity()
+        assert checkNames(result) == [
+            "album-object",
+            "image-version-image",
+            "primary-version",
+            "member-object",
+            "object-category-category",
+            "category-cycles",
+            ], checkNames(result)
+        assert self.shelf.isModified()
+        assert self.shelf.checkIntegrity() == []
+        self.shelf.commit()
+
+        self.shelf.begin()
+        assert self.shelf.checkIntegrity() == []
+        album = self.shelf.getAlbum(self.albumid)
+        assert [x.getId() for x in album.getChildren()] == imageids
+        for ivid, image in enumerate(album.getChildren()):
+            assert image.getPrimaryVersion().getId() == ivid
+        # The connection closing the cycle is removed.
+        cat_a = self.shelf.getCategory(self.catids[0])
+        assert list(cat_a.getParents()) == []
+        assert [x.getId() for x in cat_a.getChildren()] == self.catids[1:2]
+
+    def test_findViolations(self):
+        self.corrupt([
+            "update attribute set lcvalue = 'x' where object = %d" % (
+                self.images[0].getId())])
+        self.shelf.rollback()
+        result = findViolationsInParallel(self.location, 2)
+        assert checkNames(result) == ["attribute-lcvalue"]
+        assert result[0][0].formatViolation(result[0][1][0]) == (
+            u"Lowercased value of attribute \"title\" of object %d is"
+            u" stale." % self.images[0].getId())
+        assert checkNames(findViolationsInParallel(self.location, 0)) == (
+            checkNames(result))
+        self.shelf.begin()
+        assert checkNames(findViolations(self.shelf._getConnection())) == (
+            checkNames(result))
+
+    def test_findViolationsInUnopenableShelf(self):
+        # Each worker must report the failure instead of leaving the
+        # caller waiting for results.
+        location = os.path.join(self.tmpdir, "nonexistent", "shelf.db")
+        for nthreads in [0, 2]:
+            self.assertRaises(
+                sql.OperationalError,
+                findViolationsInParallel, location, nthreads)
+
+    def test_findViolationsInCorruptShelf(self):
+        location = os.path.join(self.tmpdir, "corrupt.db")
+        f = open(location, "wb")
+        f.write("garbage" * 1000)
+        f.close()
+        for nthreads in [0, 2]:
+            self.assertRaises(
+                sql.DatabaseError,
+                findViolationsInParallel, location, nthreads)
+
+
+if __name__ == "__main__":
+    unittest.main()
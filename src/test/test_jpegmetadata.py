@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+
+import os
+import struct
+import sys
+import unittest
+from StringIO import StringIO
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+from kofoto.exifreader import readExifTags
+from kofoto.jpegmetadata import \
+    IPTC_CAPTION, IPTC_HEADLINE, makeExifSegment, makeIptcSegment, \
+    readMetadataSegments, replaceMetadataSegments
+
+PICDIR = unicode(os.path.realpath(
+    os.path.join("..", "reference_pictures", "working")))
+
+def parseIptcSegment(segment):
+    """Parse an APP13 segment into a list of (record, dataset, value)
+    tuples."""
+    data = segment[4:]
+    assert data.startswith("Photoshop 3.0\x008BIM\x04\x04\x00\x00")
+    size = struct.unpack(">L", data[22:26])[0]
+    iim = data[26:26 + size]
+    datasets = []
+    while iim:
+        tag, record, dataset, length = struct.unpack(">BBBH", iim[:5])
+        assert tag == 0x1C
+        datasets.append((record, dataset, iim[5:5 + length]))
+        iim = iim[5 + length:]
+    return datasets
+
+class TestJpegMetadata(unittest.TestCase):
+    def setUp(self):
+        fp = open(os.path.join(PICDIR, "Canon_Digital_IXUS.jpg"), "rb")
+        try:
+            self.data = fp.read()
+        finally:
+            fp.close()
+
+    def tearDown(self):
+        del self.data
+
+    def test_makeExifSegment(self):
+        segment = makeExifSegment("2005:02:10 12:34:56")
+        tags = readExifTags(StringIO("\xFF\xD8" + segment + "\xFF\xD9"))
+        assert tags.keys() == ["Image DateTime"], tags.keys()
+        assert str(tags["Image DateTime"]) == "2005:02:10 12:34:56"
+
+    def test_makeIptcSegment(self):
+        segment = makeIptcSegment(
+            [(IPTC_CAPTION, u"R\xe4ksm\xf6rg\xe5s"), (IPTC_HEADLINE, u"17")])
+        assert struct.unpack(">H", segment[2:4])[0] == len(segment) - 2
+        assert parseIptcSegment(segment) == [
+            (1, 90, "\x1B%G"),
+            (2, 0, "\x00\x04"),
+            (2, 120, "R\xc3\xa4ksm\xc3\xb6rg\xc3\xa5s"),
+            (2, 105, "17")]
+
+    def test_replaceMetadataSegments(self):
+        assert readMetadataSegments(StringIO(self.data))
+        segments = [
+            makeExifSegment("2005:02:10 12:34:56"),
+            makeIptcSegment([(IPTC_CAPTION, u"Caption")])]
+        data = replaceMetadataSegments(self.data, segments)
+        assert readMetadataSegments(StringIO(data)) == segments
+        tags = readExifTags(StringIO(data))
+        assert tags.keys() == ["Image DateTime"], tags.keys()
+        assert replaceMetadataSegments(data, segments) == data
+        sos = data.index("\xFF\xDA")
+        assert self.data.endswith(data[sos:])
+        data = replaceMetadataSegments(data, [])
+        assert readMetadataSegments(StringIO(data)) == []
+
+    def test_notJpeg(self):
+        assert readMetadataSegments(StringIO("GIF89a")) == []
+        self.assertRaises(ValueError, replaceMetadataSegments, "GIF89a", [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+from kofoto.manifest import \
+    LocalDirectoryTransport, MANIFEST_FILENAME, RsyncTransport, \
+    compareManifests, formatManifest, getTransport, parseManifest, \
+    scanDirectory, syncDirectory, updateManifest
+
+def writeFile(path, data):
+    f = open(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def readFile(path):
+    f = open(path, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+class RecordingTransport(LocalDirectoryTransport):
+    def __init__(self, directory):
+        LocalDirectoryTransport.__init__(self, directory)
+        self.put = []
+
+    def putFiles(self, source, entries):
+        self.put.extend([x for (x, _) in entries])
+        LocalDirectoryTransport.putFiles(self, source, entries)
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, "source")
+        self.target = os.path.join(self.tmpdir, "target")
+        self.outside = os.path.join(self.tmpdir, "outside.jpg")
+        os.makedirs(os.path.join(self.source, "@images", "2005"))
+        writeFile(os.path.join(self.source, "a.html"), "alpha")
+        writeFile(os.path.join(self.source, "b.html"), "beta")
+        writeFile(self.outside, "image")
+        for path in ["a.html", "b.html"]:
+            os.utime(os.path.join(self.source, path), (1000000000, 1000000000))
+        os.utime(self.outside, (1000000000, 1000000000))
+        os.symlink(
+            self.outside,
+            os.path.join(self.source, "@images", "2005", "1.jpg"))
+        os.symlink("a.html", os.path.join(self.source, "index.html"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_scanDirectory(self):
+        manifest = scanDirectory(self.source)
+        assert sorted(manifest) == [
+            "@images/2005/1.jpg", "a.html", "b.html", "index.html"]
+        assert manifest["a.html"] == (
+            "f", "2c1743a391305fbf367df8e4f069f9f9", 5, 1000000000)
+        assert manifest["@images/2005/1.jpg"][:3] == (
+            "f", "78805a221a988e79ef3f42d7c5bfd418", 5)
+        assert manifest["index.html"] == ("l", "a.html")
+        assert parseManifest(formatManifest(manifest)) == manifest
+
+    def test_reuseHashes(self):
+        manifest = scanDirectory(self.source)
+        previous = manifest.copy()
+        entry = previous["b.html"]
+        previous["b.html"] = ("f", "x") + entry[2:]
+        previous["a.html"] = ("f", "y", 17, 0)
+        manifest = scanDirectory(
+            self.source,
+            previous,
+            {os.path.join("@images", "2005", "1.jpg"): "z"})
+        assert manifest["b.html"][1] == "x"
+        writeFile(os.path.join(self.source, "b.html"), "BETA")
+        manifest = scanDirectory(self.source, manifest)
+        assert manifest["b.html"][1] == "36b84f8e3fba5bf993e3ba352d62d146"
+        assert manifest["b.html"][3] == -1
+        assert manifest["a.html"][1] == "2c1743a391305fbf367df8e4f069f9f9"
+        assert manifest["@images/2005/1.jpg"][1] == "z"
+
+    def test_updateManifest(self):
+        manifest = updateManifest(self.source)
+        assert parseManifest(
+            readFile(os.path.join(self.source, MANIFEST_FILENAME))) == manifest
+        assert MANIFEST_FILENAME not in updateManifest(self.source)
+
+    def test_compareManifests(self):
+        manifest = {
+            "a": ("f", "1", 1, 2),
+            "b": ("f", "2", 1, 2),
+            "c": ("l", "a"),
+            "d": ("l", "b"),
+            }
+        synced = {
+            "a": ("f", "1", 1, 1),
+            "b": ("f", "3", 1, 2),
+            "c": ("l", "a"),
+            "e": ("f", "4", 1, 2),
+            }
+        assert compareManifests(manifest, synced) == (["b", "d"], ["e"])
+
+    def test_syncDirectory(self):
+        transport = RecordingTransport(self.target)
+        syncDirectory(self.source, transport)
+        assert sorted(transport.put) == [
+            "@images/2005/1.jpg", "a.html", "b.html", "index.html"]
+        assert readFile(
+            os.path.join(self.target, "@images", "2005", "1.jpg")) == "image"
+        assert os.readlink(os.path.join(self.target, "index.html")) == "a.html"
+
+        # Only changed files are transferred.
+        transport.put = []
+        writeFile(os.path.join(self.source, "b.html"), "BETA")
+        writeFile(os.path.join(self.source, "a.html"), "alpha")
+        os.unlink(os.path.join(self.source, "index.html"))
+        manifest, changed, removed = syncDirectory(self.source, transport)
+        assert transport.put == ["b.html"]
+        assert changed == ["b.html"] and removed == ["index.html"]
+        assert readFile(os.path.join(self.target, "b.html")) == "BETA"
+        assert os.path.lexists(os.path.join(self.target, "index.html"))
+
+        # Removed files are deleted on request.
+        syncDirectory(self.source, transport, delete=True)
+        assert transport.put == ["b.html"]
+        assert not os.path.lexists(os.path.join(self.target, "index.html"))
+        manifest, changed, removed = syncDirectory(self.source, transport)
+        assert changed == [] and removed == []
+
+    def test_dryRun(self):
+        manifest, changed, removed = syncDirectory(
+            self.source, LocalDirectoryTransport(self.target), dryRun=True)
+        assert len(changed) == 4
+        assert not os.path.exists(self.target)
+
+    def test_getTransport(self):
+        assert isinstance(getTransport("host:dir"), RsyncTransport)
+        assert isinstance(getTransport("dir"), LocalDirectoryTransport)
+        assert isinstance(getTransport("./a:b"), LocalDirectoryTransport)
+
+
+if __name__ == "__main__":
+    unittest.main()
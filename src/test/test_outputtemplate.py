@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+from kofoto.outputtemplate import OutputTemplate
+
+
+class TestOutputTemplate(unittest.TestCase):
+    def setUp(self):
+        self.text = u'<a href="%(ref)s">%(title)s</a> 100%% %(n)3d %(ref)s'
+        self.template = OutputTemplate(self.text)
+        self.values = {"ref": u"x.html", "title": u"T", "n": 7}
+
+    def tearDown(self):
+        del self.template
+
+    def test_render(self):
+        self.assertEqual(
+            self.template.render(self.values), self.text % self.values)
+
+    def test_getFields(self):
+        self.assertEqual(self.template.getFields(), set(["ref", "title", "n"]))
+
+    def test_bind(self):
+        bound = self.template.bind(ref=u"x.html")
+        self.assertEqual(bound.getFields(), set(["title", "n"]))
+        self.assertEqual(
+            bound.render({"title": u"T", "n": 7}), self.text % self.values)
+        self.assertEqual(self.template.getFields(), set(["ref", "title", "n"]))
+
+    def test_bindPercentValue(self):
+        bound = self.template.bind({"title": u"50%(n)s"})
+        self.assertEqual(
+            bound.render({"ref": u"x.html", "n": 7}),
+            u'<a href="x.html">50%(n)s</a> 100% ' + u"  7 x.html")
+
+    def test_bindAll(self):
+        bound = self.template.bind(self.values)
+        self.assertEqual(bound.getFields(), set())
+        self.assertEqual(bound.render({}), self.text % self.values)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+from kofoto.gkofoto.preloadscheduler import PreloadScheduler
+
+
+class FakePixbufLoader:
+    def __init__(self):
+        self.calls = []
+
+    def preload(self, path, size_limit, persistence_size_limit=None):
+        self.calls.append(("preload", path, size_limit))
+
+    def unload(self, path, size_limit):
+        self.calls.append(("unload", path, size_limit))
+
+
+class TestPreloadScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = PreloadScheduler(2, 6)
+
+    def tearDown(self):
+        del self.scheduler
+
+    def navigate(self, indexes, interval):
+        t = 0.0
+        for index in indexes:
+            self.scheduler.navigated_to(index, t)
+            t += interval
+
+    def test_unknown_direction(self):
+        self.scheduler.navigated_to(5, 0.0)
+        self.assertEqual(self.scheduler.get_direction(), 0)
+        self.assertEqual(self.scheduler.get_indexes(5, 10), [3, 7, 4, 6])
+        self.assertEqual(self.scheduler.get_indexes(0, 10), [2, 1])
+
+    def test_slow_forward(self):
+        self.navigate([3, 4, 5], 2.0)
+        self.assertEqual(self.scheduler.get_direction(), 1)
+        self.assertEqual(self.scheduler.get_window_size(), 2)
+        self.assertEqual(self.scheduler.get_indexes(5, 10), [4, 7, 6])
+
+    def test_fast_backward(self):
+        self.navigate(range(50, 40, -1), 0.1)
+        self.assertEqual(self.scheduler.get_direction(), -1)
+        self.assertEqual(self.scheduler.get_window_size(), 6)
+        self.assertEqual(
+            self.scheduler.get_indexes(41, 100),
+            [42, 35, 36, 37, 38, 39, 40])
+        self.assertEqual(self.scheduler.get_indexes(2, 100), [3, 0, 1])
+
+    def test_speed_adapts(self):
+        self.navigate(range(10), 0.1)
+        self.assertEqual(self.scheduler.get_window_size(), 6)
+        self.scheduler.navigated_to(10, 1.5)
+        self.scheduler.navigated_to(11, 2.5)
+        self.assertEqual(self.scheduler.get_window_size(), 2)
+
+    def test_jump_and_pause_reset_direction(self):
+        self.navigate([0, 1, 2], 0.2)
+        self.scheduler.navigated_to(99, 0.6)
+        self.assertEqual(self.scheduler.get_direction(), 0)
+        self.navigate([10, 11, 12], 0.2)
+        self.scheduler.navigated_to(13, 100.0)
+        self.assertEqual(self.scheduler.get_direction(), 0)
+
+    def test_turning_around(self):
+        self.navigate([0, 1, 2, 3, 4, 5], 0.1)
+        self.scheduler.navigated_to(4, 1.0)
+        self.assertEqual(self.scheduler.get_direction(), -1)
+        self.assertEqual(self.scheduler.get_indexes(4, 10), [5, 2, 3])
+
+    def test_record_load(self):
+        self.scheduler.record_load(True)
+        self.scheduler.navigated_to(0, 0.0)
+        self.scheduler.navigated_to(1, 1.0)
+        self.scheduler.record_load(False)
+        self.scheduler.record_load(True) # Same step; ignored.
+        self.scheduler.navigated_to(2, 2.0)
+        self.scheduler.record_load(True)
+        statistics = self.scheduler.get_statistics()
+        self.assertEqual(statistics["steps"], 2)
+        self.assertEqual(statistics["hits"], 1)
+        self.assertEqual(statistics["hit_rate"], 0.5)
+
+    def test_update_preloads(self):
+        loader = FakePixbufLoader()
+        self.scheduler.update_preloads(loader, ["a", "b"], (10, 10))
+        self.assertEqual(
+            loader.calls,
+            [("preload", "a", (10, 10)), ("preload", "b", (10, 10))])
+        loader.calls = []
+        self.scheduler.update_preloads(loader, ["b", "c"], (10, 10))
+        self.assertEqual(
+            loader.calls,
+            [("unload", "a", (10, 10)),
+             ("preload", "b", (10, 10)),
+             ("preload", "c", (10, 10))])
+        loader.calls = []
+        self.scheduler.update_preloads(loader, ["c"], (20, 20))
+        self.assertEqual(
+            loader.calls,
+            [("unload", "b", (10, 10)),
+             ("unload", "c", (10, 10)),
+             ("preload", "c", (20, 20))])
+        loader.calls = []
+        self.scheduler.unload_all(loader)
+        self.assertEqual(loader.calls, [("unload", "c", (20, 20))])
+
+    def test_update_preloads_keeps_current_location(self):
+        loader = FakePixbufLoader()
+        self.scheduler.update_preloads(loader, ["a", "b"], (10, 10))
+        loader.calls = []
+        self.scheduler.update_preloads(
+            loader, ["c"], (10, 10), current_location="b")
+        self.assertEqual(
+            loader.calls,
+            [("unload", "a", (10, 10)), ("preload", "c", (10, 10))])
+
+
+if __name__ == "__main__":
+    unittest.main()
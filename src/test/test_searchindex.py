@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+from kofoto.searchindex import generateSearchIndex, toJSON
+
+
+class FakeCategory:
+    def __init__(self, catid, tag):
+        self.catid = catid
+        self.tag = tag
+        self.children = []
+        self.parents = []
+
+    def getId(self):
+        return self.catid
+
+    def getTag(self):
+        return self.tag
+
+    def getDescription(self):
+        return self.tag.upper()
+
+    def getChildren(self):
+        return iter(self.children)
+
+    def getParents(self):
+        return iter(self.parents)
+
+
+class FakeShelf:
+    def __init__(self, entries, rootcategories):
+        self.entries = entries
+        self.rootcategories = rootcategories
+
+    def getImageIndexEntries(self):
+        return iter(self.entries)
+
+    def getRootCategories(self):
+        return iter(self.rootcategories)
+
+
+class TestToJSON(unittest.TestCase):
+    def test_values(self):
+        self.assertEqual(toJSON(None), u"null")
+        self.assertEqual(toJSON([True, False, -17, 2**40]),
+                         u"[true,false,-17,1099511627776]")
+        self.assertEqual(toJSON((u"a", "b")), u'["a","b"]')
+        self.assertEqual(toJSON({2: [], u"1": {}}), u'{"1":{},"2":[]}')
+
+    def test_escaping(self):
+        self.assertEqual(toJSON(u'\\"\n\x7f'), u'"\\\\\\"\\u000a\\u007f"')
+        self.assertEqual(toJSON(u"\xe5\u263a"), u'"\\u00e5\\u263a"')
+
+    def test_badValue(self):
+        self.assertRaises(TypeError, toJSON, 1.5)
+
+
+class TestGenerateSearchIndex(unittest.TestCase):
+    def setUp(self):
+        parent = FakeCategory(1, u"parent")
+        child = FakeCategory(2, u"child")
+        parent.children.append(child)
+        child.parents.append(parent)
+        entries = [(i, u"2004-01-%02d" % i, None, [2]) for i in range(1, 8)]
+        self.shelf = FakeShelf(entries, [parent])
+        self.files = {}
+
+    def tearDown(self):
+        del self.shelf
+        del self.files
+
+    def writeFile(self, filename, text):
+        assert isinstance(text, unicode)
+        self.files[filename] = text
+
+    def test_generateSearchIndex(self):
+        pages = dict([(i, u"%d.html" % i) for i in [1, 2, 3, 5, 7]])
+        n = generateSearchIndex(self.shelf, pages, self.writeFile, 2)
+        self.assertEqual(n, 5)
+        self.assertEqual(
+            sorted(self.files.keys()),
+            ["images-0.json", "images-1.json", "images-2.json",
+             "index.json", "search.html", "search.js"])
+        self.assertEqual(
+            self.files["images-2.json"],
+            u'[[7,"2004-01-07",null,[2],"7.html"]]')
+        self.assertEqual(
+            self.files["index.json"],
+            u'{"categories":{"1":["parent","PARENT",[]],'
+            u'"2":["child","CHILD",[1]]},'
+            u'"shards":[{"count":2,"file":"images-0.json","first":1,"last":2},'
+            u'{"count":2,"file":"images-1.json","first":3,"last":5},'
+            u'{"count":1,"file":"images-2.json","first":7,"last":7}],'
+            u'"version":1}')
+
+    def test_empty(self):
+        n = generateSearchIndex(self.shelf, {}, self.writeFile)
+        self.assertEqual(n, 0)
+        self.assert_(u'"shards":[]' in self.files["index.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
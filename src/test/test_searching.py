@@ -10,6 +10,7 @@ if __name__ == "__main__":
         os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
     os.chdir(libdir)
     sys.path.insert(0, libdir)
+from kofoto.imageversiontype import ImageVersionType
 from kofoto.search import Parser, BadTokenError, UnterminatedStringError
 
 PICDIR = unicode(os.path.realpath(
@@ -78,6 +79,45 @@ class TestSearch(TestShelfFixture):
                 self.shelf.search(parseTree), key=lambda x: x.getId())
             assert result == expectedResult, (expression, expectedResult, result)
 
+    def test_searchImageIds(self):
+        parser = Parser(self.shelf)
+        parseTree = parser.parse(u"/alpha and a")
+        ids = [x.getId() for x in self.images[:2]]
+        assert list(self.shelf.searchImageIds(parseTree, True)) == ids
+        assert list(self.shelf.searchImageIds(parseTree, True, 1)) == ids[:1]
+        assert self.shelf.countImageIds(parseTree) == 2
+        assert self.shelf.countImageIds(parseTree, 1) == 1
+
+    def test_searchImageVersionLocations(self):
+        ivs = [list(x.getImageVersions())[0] for x in self.images[:3]]
+        locations = [x.getLocation() for x in ivs]
+        ivs[0].setType(ImageVersionType.Important)
+        ivs[1].setType(ImageVersionType.Other)
+        ivs[2].setImage(self.images[0])
+        parser = Parser(self.shelf)
+        parseTree = parser.parse(u"a")
+        tests = [
+            (None, False, locations),
+            ([], True, locations[:2]),
+            ([ImageVersionType.Original], False, locations[2:]),
+            ([ImageVersionType.Other], True, locations[:2]),
+            ([ImageVersionType.Important, ImageVersionType.Other], False,
+             locations[:2]),
+            ([], False, []),
+            ]
+        for ivtypes, includePrimary, expectedResult in tests:
+            result = list(self.shelf.searchImageVersionLocations(
+                parseTree, ivtypes, includePrimary, True))
+            assert result == sorted(expectedResult), (ivtypes, result)
+            count = self.shelf.countImageVersionLocations(
+                parseTree, ivtypes, includePrimary)
+            assert count == len(expectedResult), (ivtypes, count)
+        result = list(self.shelf.searchImageVersionLocations(
+            parseTree, None, False, True, 2))
+        assert result == sorted(locations)[:2], result
+        assert self.shelf.countImageVersionLocations(
+            parseTree, None, False, 2) == 2
+
     def test_parseErrors(self):
         tests = [
             (u"+", BadTokenError),
@@ -35,6 +35,7 @@ from kofoto.shelfexceptions import \
     ImageDoesNotExistError, \
     ImageVersionDoesNotExistError, \
     ImageVersionExistsError, \
+    ObjectDoesNotExistError, \
     ShelfLockedError, \
     ShelfNotFoundError, \
     UndeletableAlbumError, \
@@ -228,6 +229,52 @@ class TestShelfTransactions(unittest.TestCase):
         assert s.getAlbumByTag(u"foo")
         s.rollback()
 
+    def test_checkpoint(self):
+        s = Shelf(db)
+        s.create()
+        s.begin()
+        album = s.createAlbum(u"foo")
+        s.checkpoint()
+        assert not s.isModified()
+        assert s.getAlbumByTag(u"foo") is album
+        s.createAlbum(u"bar")
+        s.rollback()
+        s.begin()
+        assert s.getAlbumByTag(u"foo")
+        try:
+            s.getAlbumByTag(u"bar")
+        except AlbumDoesNotExistError:
+            pass
+        else:
+            assert False
+        s.rollback()
+
+    def test_suspendAndResume(self):
+        s = Shelf(db)
+        s.create()
+        s.begin()
+        album = s.createAlbum(u"foo")
+        s.suspend()
+        t = Shelf(db)
+        t.begin()
+        try:
+            s.resume()
+        except ShelfLockedError:
+            pass
+        else:
+            assert False
+        t.rollback()
+        s.resume()
+        assert s.getAlbumByTag(u"foo") is album
+        s.suspend()
+        t.begin()
+        t.getAlbumByTag(u"foo").setAttribute(u"title", u"bar")
+        t.commit()
+        s.resume()
+        album = s.getAlbumByTag(u"foo")
+        assert album.getAttribute(u"title") == u"bar"
+        s.rollback()
+
     def test_rollback(self):
         s = Shelf(db)
         s.create()
@@ -386,10 +433,33 @@ class TestShelfMethods(TestShelfFixture):
         albums = list(self.shelf.getAllAlbums())
         assert len(albums) == 6
 
+    def test_getAllAlbumIds(self):
+        albumIds = sorted(self.shelf.getAllAlbumIds())
+        assert albumIds == sorted(
+            [x.getId() for x in self.shelf.getAllAlbums()])
+
     def test_getAllImageVersions(self):
         imageversions = list(self.shelf.getAllImageVersions())
         assert len(imageversions) == 11
 
+    def test_getImageIndexEntries(self):
+        image = self.shelf.getImageVersionByLocation(
+            os.path.join(PICDIR, "Canon_Digital_IXUS.jpg")).getImage()
+        image.setAttribute(u"title", u"Ixus")
+        cat_b = self.shelf.getCategoryByTag(u"b")
+        cat_c = self.shelf.getCategoryByTag(u"c")
+        image.addCategory(cat_c)
+        image.addCategory(cat_b)
+        entries = list(self.shelf.getImageIndexEntries())
+        assert len(entries) == 11
+        assert [x[0] for x in entries] == sorted([x[0] for x in entries])
+        entry = [x for x in entries if x[0] == image.getId()][0]
+        assert entry == (
+            image.getId(),
+            u"2002-02-02 22:20:51",
+            u"Ixus",
+            sorted([cat_b.getId(), cat_c.getId()]))
+
     def test_getImageVersionsInDirectory(self):
         self.shelf.flushImageVersionCache()
 
@@ -537,6 +607,99 @@ class TestShelfMethods(TestShelfFixture):
         album = self.shelf.getObject(rootalbum.getId())
         assert album == rootalbum
 
+    def test_getObjects(self):
+        alpha = self.shelf.getAlbumByTag(u"alpha")
+        children = list(alpha.getChildren())
+        self.shelf.flushObjectCache()
+        objids = [x.getId() for x in children]
+        objids.reverse()
+        objects = self.shelf.getObjects(objids)
+        assert [x.getId() for x in objects] == objids
+        assert objects[-1].isAlbum()
+        assert not objects[0].isAlbum()
+        assert self.shelf.getObjects([]) == []
+
+    def test_negativeGetObjects(self):
+        try:
+            self.shelf.getObjects([0, 12345678])
+        except ObjectDoesNotExistError:
+            pass
+        else:
+            assert False
+
+    def test_getCategoryCounts(self):
+        images = list(self.shelf.getAllImages())
+        cat_a = self.shelf.getCategoryByTag(u"a")
+        cat_b = self.shelf.getCategoryByTag(u"b")
+        images[0].addCategory(cat_a)
+        images[1].addCategory(cat_a)
+        images[1].addCategory(cat_b)
+        images[2].addCategory(cat_b)
+        counts = self.shelf.getCategoryCounts(
+            [x.getId() for x in images[:2]])
+        assert counts == {cat_a.getId(): 2, cat_b.getId(): 1}, counts
+        assert self.shelf.getCategoryCounts([]) == {}
+
+    def test_getImageVersionCounts(self):
+        images = list(self.shelf.getAllImages())
+        image = images[0]
+        self.shelf.deleteImageVersion(image.getPrimaryVersion().getId())
+        counts = self.shelf.getImageVersionCounts(images)
+        assert len(counts) == len(images)
+        assert counts[image.getId()] == 0
+        assert counts[images[1].getId()] == 1
+
+    def test_getAttributeValues(self):
+        images = list(self.shelf.getAllImages())
+        images[0].setAttribute(u"description", u"foo")
+        images[1].deleteAttribute(u"description")
+        values = self.shelf.getAttributeValues(
+            u"description", [x.getId() for x in images])
+        assert len(values) == len(images)
+        assert values[images[0].getId()] == u"foo"
+        assert values[images[1].getId()] is None
+
+    def test_importExifTags(self):
+        exifAttributes = [u"captured", u"cameramake", u"cameramodel",
+                          u"orientation", u"exposuretime", u"fnumber"]
+        imageversions = list(self.shelf.getAllImageVersions())
+        for iv in imageversions:
+            iv.importExifTags(True)
+        images = list(self.shelf.getAllImages())
+        expected = [dict(x.getAttributeMap()) for x in images]
+        for image in images:
+            for name in exifAttributes:
+                image.deleteAttribute(name)
+        for nthreads in [0, 2]:
+            failed = self.shelf.importExifTags(None, True, nthreads=nthreads)
+            assert failed == []
+            for image, amap in zip(images, expected):
+                assert image.getAttributeMap() == amap
+        failed = self.shelf.importExifTags(
+            imageversions[:1] + [imageversions[0]], False)
+        assert failed == []
+        images[0].setAttribute(u"captured", u"foo")
+        self.shelf.importExifTags(None, True, onlyMissing=True)
+        assert images[0].getAttribute(u"captured") == u"foo"
+
+    def test_preloadAttributes(self):
+        images = list(self.shelf.getAllImages())
+        expected = [dict(x.getAttributeMap()) for x in images]
+        self.shelf.flushObjectCache()
+        images = self.shelf.getObjects([x.getId() for x in images])
+        self.shelf.preloadAttributes(images)
+        for image, amap in zip(images, expected):
+            assert image.allAttributesFetched
+            assert image.getAttributeMap() == amap
+
+    def test_preloadPrimaryVersions(self):
+        images = list(self.shelf.getAllImages())
+        self.shelf.flushImageVersionCache()
+        self.shelf.preloadPrimaryVersions(images)
+        for image in images:
+            assert image.primary_version_id in self.shelf.imageversioncache
+            assert image.getPrimaryVersion().getImage() == image
+
     def test_deleteObject(self):
         albumid = self.shelf.getAlbumByTag(u"beta").getId()
         imageversion = self.shelf.getImageVersionByLocation(
@@ -593,6 +756,22 @@ class TestShelfMethods(TestShelfFixture):
         else:
             assert False
 
+    def test_getCategoriesContainingText(self):
+        cat_a = self.shelf.getCategoryByTag(u"a")
+        cat_foo = self.shelf.createCategory(u"foo", u"Fooish")
+        cat_bar = self.shelf.createCategory(u"bar", u"Some foo")
+        categories = self.shelf.getCategoriesContainingText(u"FOO")
+        assert categories == [cat_foo, cat_bar], categories
+        cat_foo.setDescription(u"Baz")
+        cat_bar.setTag(u"xfoo")
+        categories = self.shelf.getCategoriesContainingText(u"foo")
+        assert categories == [cat_foo, cat_bar], categories
+        self.shelf.deleteCategory(cat_foo.getId())
+        categories = self.shelf.getCategoriesContainingText(u"foo")
+        assert categories == [cat_bar], categories
+        categories = self.shelf.getCategoriesContainingText(u"a")
+        assert categories[0] == cat_a, categories
+
     def test_getRootCategories(self):
         categories = sorted(
             self.shelf.getRootCategories(), key=lambda x: x.getTag())
@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+
+import os
+import random
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+import gtkstubs
+gtkstubs.install()
+import gtk
+from kofoto.gkofoto.lazyobjectmodel import LazyObjectModel
+from kofoto.gkofoto.sortedobjectmodel import SortedObjectModel, make_sort_key
+
+KEY_COLUMN = 0
+VALUE_COLUMN = 1
+
+class ViewMirror:
+    """Keeps a list of the keys of a model's rows up to date using
+    only the model's signals, like a view does."""
+
+    def __init__(self, model):
+        self.model = model
+        self.keys = [model.get_value(model.get_iter((x,)), KEY_COLUMN)
+                     for x in range(len(model))]
+        model.connect("row-changed", self._on_row_changed)
+        model.connect("row-deleted", self._on_row_deleted)
+        model.connect("row-inserted", self._on_row_inserted)
+        model.connect("rows-reordered", self._on_rows_reordered)
+
+    def _on_row_changed(self, model, path, iterator):
+        self.keys[path[0]] = model.get_value(iterator, KEY_COLUMN)
+
+    def _on_row_deleted(self, model, path):
+        del self.keys[path[0]]
+
+    def _on_row_inserted(self, model, path, iterator):
+        self.keys.insert(path[0], model.get_value(iterator, KEY_COLUMN))
+
+    def _on_rows_reordered(self, model, path, iterator, new_order):
+        self.keys = [self.keys[x] for x in new_order]
+
+
+class TestSortedObjectModel(unittest.TestCase):
+    def setUp(self):
+        # Key --> value.
+        self.values = {1: u"c", 2: None, 3: u"10", 4: u"a", 5: u"9"}
+        self.child = LazyObjectModel(
+            [int, str], KEY_COLUMN, [1, 2, 3, 4, 5], self.loadRows)
+        self.model = SortedObjectModel(self.child)
+        self.view = ViewMirror(self.model)
+
+    def tearDown(self):
+        self.model.detach()
+
+    def loadRows(self, keys):
+        return dict([(x, [x, self.values.get(x)]) for x in keys])
+
+    def childKeys(self):
+        return list(self.child.get_keys())
+
+    def expectedKeys(self):
+        (column, order) = self.model.get_sort_column_id()
+        keys = self.childKeys()
+        if column is not None:
+            keys.sort(key=lambda x: (make_sort_key(self.values.get(x)), x))
+        if order == gtk.SORT_DESCENDING:
+            keys.reverse()
+        return keys
+
+    def modelKeys(self):
+        return [self.model.get_value(self.model.get_iter((x,)), KEY_COLUMN)
+                for x in range(len(self.model))]
+
+    def checkModel(self):
+        keys = self.expectedKeys()
+        self.assertEqual(self.modelKeys(), keys)
+        self.assertEqual(self.view.keys, keys)
+        childkeys = self.childKeys()
+        for path in range(len(keys)):
+            child_path = self.model.convert_path_to_child_path((path,))
+            self.assertEqual(childkeys[child_path[0]], keys[path])
+            self.assertEqual(
+                self.model.convert_child_path_to_path(child_path), (path,))
+        self.assertRaises(
+            IndexError, self.model.convert_path_to_child_path, (len(keys),))
+        self.assertRaises(
+            IndexError, self.model.convert_child_path_to_path, (len(keys),))
+
+    def setValue(self, key, value):
+        self.values[key] = value
+        rownr = self.childKeys().index(key)
+        self.child.set_value(
+            self.child.get_iter((rownr,)), VALUE_COLUMN, value)
+
+    def test_set_sort_column_id(self):
+        self.checkModel()
+        self.model.set_sort_column_id(VALUE_COLUMN, gtk.SORT_ASCENDING)
+        self.assertEqual(self.modelKeys(), [2, 5, 3, 4, 1])
+        self.checkModel()
+        self.model.set_sort_column_id(VALUE_COLUMN, gtk.SORT_DESCENDING)
+        self.assertEqual(self.modelKeys(), [1, 4, 3, 5, 2])
+        self.checkModel()
+        self.model.set_sort_column_id(None, gtk.SORT_DESCENDING)
+        self.assertEqual(self.modelKeys(), [5, 4, 3, 2, 1])
+        self.checkModel()
+        self.model.set_sort_column_id(None, gtk.SORT_ASCENDING)
+        self.assertEqual(self.modelKeys(), [1, 2, 3, 4, 5])
+        self.checkModel()
+        del self.model.signals[:]
+        self.model.set_sort_column_id(None, gtk.SORT_ASCENDING)
+        self.assertEqual(self.model.signals, [])
+
+    def test_on_row_changed(self):
+        for order in [gtk.SORT_ASCENDING, gtk.SORT_DESCENDING]:
+            self.model.set_sort_column_id(VALUE_COLUMN, order)
+            del self.model.signals[:]
+            self.setValue(2, u"b")
+            self.assertEqual(
+                [x[0] for x in self.model.signals],
+                ["rows-reordered", "row-changed"])
+            self.checkModel()
+            del self.model.signals[:]
+            self.setValue(2, u"bb")
+            path = self.model.convert_child_path_to_path((1,))
+            self.assertEqual(self.model.signals, [("row-changed", path)])
+            self.checkModel()
+            self.setValue(2, None)
+            self.checkModel()
+
+    def test_on_row_inserted(self):
+        self.values.update({6: u"b", 7: u"1", 8: u"z", 9: None})
+        for order in [gtk.SORT_ASCENDING, gtk.SORT_DESCENDING]:
+            self.model.set_sort_column_id(VALUE_COLUMN, order)
+            self.child.insert_keys(2, [6, 7])
+            self.checkModel()
+            self.child.insert_keys(None, [8, 9])
+            self.checkModel()
+            self.child.insert_keys(0, [6])
+            self.checkModel()
+        self.model.set_sort_column_id(None, gtk.SORT_ASCENDING)
+        del self.model.signals[:]
+        self.child.insert_keys(1, [7, 8])
+        self.assertEqual(
+            self.model.signals,
+            [("row-inserted", (1,)), ("row-inserted", (2,))])
+        self.checkModel()
+
+    def test_on_row_deleted(self):
+        for order in [gtk.SORT_ASCENDING, gtk.SORT_DESCENDING]:
+            self.model.set_sort_column_id(VALUE_COLUMN, order)
+            path = self.model.convert_child_path_to_path((1,))
+            del self.model.signals[:]
+            del self.child[(1,)]
+            self.assertEqual(self.model.signals, [("row-deleted", path)])
+            self.checkModel()
+        del self.model[(0,)]
+        self.checkModel()
+        self.assertEqual(len(self.child), 2)
+
+    def test_randomOperations(self):
+        rng = random.Random(4711)
+        for i in xrange(1000):
+            op = rng.random()
+            nrows = len(self.child)
+            if op < 0.3 or nrows == 0:
+                keys = [10 * i + x for x in range(rng.randrange(1, 4))]
+                for key in keys:
+                    self.values[key] = rng.choice(
+                        [None, u"x", u"y", u"5", u"17"])
+                self.child.insert_keys(rng.randrange(nrows + 1), keys)
+            elif op < 0.5:
+                del self.child[(rng.randrange(nrows),)]
+            elif op < 0.9:
+                self.setValue(
+                    rng.choice(self.childKeys()),
+                    rng.choice([None, u"x", u"y", u"z", u"5", u"17"]))
+            else:
+                self.model.set_sort_column_id(
+                    rng.choice([None, VALUE_COLUMN]),
+                    rng.choice([gtk.SORT_ASCENDING, gtk.SORT_DESCENDING]))
+            self.checkModel()
+
+
+if __name__ == "__main__":
+    unittest.main()
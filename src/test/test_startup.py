@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+
+import os
+import subprocess
+import sys
+import unittest
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+
+import kofoto
+
+PACKAGES = os.path.dirname(os.path.dirname(os.path.realpath(kofoto.__file__)))
+
+# Modules that commands which don't read images or generate output
+# shouldn't pay for.
+HEAVY_MODULES = [
+    "Image",
+    "PIL",
+    "kofoto.EXIF",
+    "kofoto.exifthumbsupport",
+    "kofoto.generate",
+    "kofoto.outputengine",
+    "socket",
+    ]
+
+
+def getImportedModules(module):
+    """Get the modules imported when importing a module in a new
+    interpreter."""
+    program = (
+        "import sys\n"
+        "sys.path.insert(0, %r)\n"
+        "import %s\n"
+        "print '\\n'.join(sys.modules)\n" % (PACKAGES, module))
+    process = subprocess.Popen(
+        [sys.executable, "-c", program], stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    assert process.returncode == 0
+    return output.split()
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazyImports(self):
+        modules = getImportedModules("kofoto.commandline.main")
+        assert "kofoto.shelf" in modules
+        for module in HEAVY_MODULES:
+            assert module not in modules, module
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib2
+from StringIO import StringIO
+from wsgiref.util import setup_testing_defaults
+
+if __name__ == "__main__":
+    cwd = os.getcwd()
+    libdir = unicode(os.path.realpath(
+        os.path.join(os.path.dirname(sys.argv[0]), "..", "packages")))
+    os.chdir(libdir)
+    sys.path.insert(0, libdir)
+from kofoto.imagecache import ImageCache
+from kofoto.shelf import Shelf
+from kofoto.web.application import WebApplication
+from kofoto.web.server import ThreadPoolWSGIServer
+
+def writeFile(path, data):
+    f = open(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = dict(headers)
+        self.body = body
+
+def request(application, path, query="", headers=None, method="GET",
+            body=""):
+    """Call a WSGI application like a server would and return a
+    Response."""
+    environ = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": StringIO(body),
+        }
+    if headers:
+        environ.update(headers)
+    setup_testing_defaults(environ)
+    result = []
+    def start_response(status, headers):
+        result.extend([status, headers])
+    chunks = application(environ, start_response)
+    try:
+        body = "".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return Response(result[0], result[1], body)
+
+class TestWebApplication(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tmpdir, "shelf.db")
+        self.imagepath = os.path.join(self.tmpdir, "image.jpg")
+        self.staticdir = os.path.join(self.tmpdir, "static")
+        os.mkdir(self.staticdir)
+        writeFile(os.path.join(self.staticdir, "webkofoto.css"), "body {}")
+        shelf = Shelf(self.location)
+        shelf.create()
+        shelf.begin()
+        alpha = shelf.createAlbum(u"alpha")
+        image = shelf.createImage()
+        alpha.setChildren([image])
+        shelf.getRootAlbum().setChildren([alpha])
+        shelf.getRootAlbum().setAttribute(u"title", u"R\xe4ksm\xf6rg\xe5s")
+        image.setAttribute(u"description", u"<b>")
+        cursor = shelf._getConnection().cursor()
+        cursor.execute(
+            " insert into image_version"
+            "     (id, image, type, comment, hash, directory, filename,"
+            "      mtime, width, height)"
+            " values (17, ?, 'original', '', ?, ?, 'image.jpg', 1000000000,"
+            "         100, 50)",
+            (image.getId(), "c" * 32, self.tmpdir))
+        cursor.execute(
+            " update image set primary_version = 17 where id = ?",
+            (image.getId(),))
+        shelf.commit()
+        self.albumid = alpha.getId()
+        self.imageid = image.getId()
+
+        # Put a scaled version in the cache so that it doesn't need to
+        # be created.
+        self.imageCache = ImageCache(os.path.join(self.tmpdir, "cache"))
+        cachedpath = self.imageCache.getCachedImagePath(
+            self.imagepath, 1000000000, 100, 50, "up")
+        os.makedirs(os.path.dirname(cachedpath))
+        writeFile(cachedpath, "JPEG data")
+        self.application = WebApplication(
+            self.location, self.imageCache, staticLocation=self.staticdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pages(self):
+        response = request(self.application, "/")
+        assert response.status == "200 OK"
+        assert "<frameset" in response.body
+        response = request(self.application, "/treeframe")
+        assert response.status == "200 OK"
+        assert response.headers["Content-Type"].startswith(
+            "application/xhtml+xml")
+        assert "R\xc3\xa4ksm\xc3\xb6rg\xc3\xa5s" in response.body
+        assert ">alpha</a>" in response.body
+        response = request(
+            self.application, "/album", "albumid=%d" % self.albumid)
+        assert response.status == "200 OK"
+        assert "imageid=%d&amp;" % self.imageid in response.body
+        assert ">&lt;b&gt;</textarea>" in response.body
+
+    def test_errors(self):
+        assert request(self.application, "/foo").status == "404 Not Found"
+        assert request(
+            self.application, "/album").status == "400 Bad Request"
+        assert request(
+            self.application, "/album", "albumid=x").status == (
+            "400 Bad Request")
+        assert request(
+            self.application, "/album", "albumid=4711").status == (
+            "404 Not Found")
+        assert request(
+            self.application, "/static/../shelf.db").status == (
+            "404 Not Found")
+        assert request(
+            self.application, "/submitAlbum").status == (
+            "405 Method Not Allowed")
+
+    def test_image(self):
+        query = "imageid=%d&widthlimit=128&heightlimit=128" % self.imageid
+        response = request(self.application, "/image", query)
+        assert response.status == "200 OK"
+        assert response.body == "JPEG data"
+        assert response.headers["Content-Type"] == "image/jpeg"
+        assert response.headers["Content-Length"] == "9"
+        etag = response.headers["ETag"]
+        assert etag == '"%s-1000000000-128x128-up"' % ("c" * 32), etag
+        lastModified = response.headers["Last-Modified"]
+        assert lastModified == "Sun, 09 Sep 2001 01:46:40 GMT"
+
+        response = request(
+            self.application, "/image", query,
+            {"HTTP_IF_NONE_MATCH": '"x", %s' % etag})
+        assert response.status == "304 Not Modified"
+        assert response.body == ""
+        assert response.headers["ETag"] == etag
+        response = request(
+            self.application, "/image", query, {"HTTP_IF_NONE_MATCH": '"x"'})
+        assert response.status == "200 OK"
+        response = request(
+            self.application, "/image", query,
+            {"HTTP_IF_MODIFIED_SINCE": lastModified})
+        assert response.status == "304 Not Modified"
+
+        response = request(self.application, "/image", query, method="HEAD")
+        assert response.status == "200 OK"
+        assert response.body == ""
+
+    def test_static(self):
+        response = request(self.application, "/static/webkofoto.css")
+        assert response.status == "200 OK"
+        assert response.body == "body {}"
+        assert response.headers["Content-Type"] == "text/css"
+        response = request(
+            self.application, "/static/webkofoto.css", headers={
+                "HTTP_IF_NONE_MATCH": response.headers["ETag"]})
+        assert response.status == "304 Not Modified"
+
+    def test_submitAlbum(self):
+        response = request(
+            self.application, "/submitAlbum", method="POST",
+            body="origin=%%2Falbum%%3Falbumid%%3D%d&description-%d=%s" % (
+                self.albumid, self.imageid, "R%C3%A4ka"))
+        assert response.status == "303 See Other"
+        assert response.headers["Location"] == (
+            "/album?albumid=%d" % self.albumid)
+        shelf = Shelf(self.location)
+        shelf.begin(readOnly=True)
+        try:
+            description = shelf.getImage(self.imageid).getAttribute(
+                u"description")
+            assert description == u"R\xe4ka", description
+        finally:
+            shelf.rollback()
+
+    def test_readersDoNotBlockEachOther(self):
+        shelf = Shelf(self.location)
+        shelf.begin(readOnly=True)
+        try:
+            response = request(self.application, "/treeframe")
+            assert response.status == "200 OK"
+        finally:
+            shelf.rollback()
+
+    def test_server(self):
+        server = ThreadPoolWSGIServer(("127.0.0.1", 0), self.application, 2)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+            assert urllib2.urlopen(
+                url + "/static/webkofoto.css").read() == "body {}"
+            assert "alpha" in urllib2.urlopen(url + "/treeframe").read()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()